@@ -0,0 +1,69 @@
+"""
+Measure how many frames per second the length-prefixed string receivers in
+L{twisted.protocols.basic} can parse, for frames from 16 bytes to 64KB
+arriving in 64KB reads.
+"""
+
+import time
+
+from twisted.protocols import basic
+
+class CountingInt32Receiver(basic.Int32StringReceiver):
+    MAX_LENGTH = 2 ** 20
+    count = 0
+    def stringReceived(self, string):
+        self.count += 1
+        self.last = string
+
+class CountingInt16Receiver(basic.Int16StringReceiver):
+    MAX_LENGTH = 2 ** 16
+    count = 0
+    def stringReceived(self, string):
+        self.count += 1
+        self.last = string
+
+class CountingNetstringReceiver(basic.NetstringReceiver):
+    MAX_LENGTH = 2 ** 20
+    count = 0
+    def stringReceived(self, string):
+        self.count += 1
+        self.last = string
+
+def encode(factory, string):
+    if issubclass(factory, basic.NetstringReceiver):
+        return '%d:%s,' % (len(string), string)
+    return basic.struct.pack(factory.structFormat, len(string)) + string
+
+def benchmark(factory, frameSize, totalBytes=2 ** 23, chunkSize=65536):
+    string = 'x' * frameSize
+    numFrames = max(totalBytes / frameSize, 1)
+    bytes = encode(factory, string) * numFrames
+    chunks = []
+    for n in xrange(0, len(bytes), chunkSize):
+        chunks.append(bytes[n:n + chunkSize])
+    p = factory()
+
+    before = time.clock()
+    map(p.dataReceived, chunks)
+    after = time.clock()
+
+    assert p.count == numFrames, (p.count, numFrames)
+    assert p.last == string
+
+    elapsed = after - before
+    print factory.__name__,
+    print 'frameSize:', frameSize,
+    print 'frames:', numFrames,
+    print 'CPU Time:', elapsed,
+    print 'frames/sec:', int(numFrames / max(elapsed, 1e-6))
+
+
+
+def main():
+    for factory in (CountingInt32Receiver, CountingInt16Receiver,
+                    CountingNetstringReceiver):
+        for frameSize in (16, 64, 256, 1024, 4096, 16384, 65535):
+            benchmark(factory, frameSize)
+
+if __name__ == '__main__':
+    main()
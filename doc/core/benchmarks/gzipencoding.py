@@ -0,0 +1,71 @@
+"""
+Measure the cost and the savings of compressing responses with
+L{twisted.web.server.GzipEncoderFactory}: a generated page written in
+several parts, and a static file whose compressed contents are cached by
+L{twisted.web.static.FileCache}.
+"""
+
+import sys, os, tempfile, shutil, time
+
+from twisted.web import server, resource, static
+from twisted.test.proto_helpers import StringTransport
+
+text = ''.join(['<tr><td>%d</td><td>item number %d</td></tr>\n' % (i, i)
+                for i in xrange(1000)])
+
+class Page(resource.Resource):
+    isLeaf = True
+
+    def render_GET(self, request):
+        for i in xrange(0, len(text), 4096):
+            request.write(text[i:i + 4096])
+        request.finish()
+        return server.NOT_DONE_YET
+
+def benchmark(name, root, count, acceptEncoding, path):
+    if acceptEncoding:
+        root = resource.EncodingResourceWrapper(
+            root, [server.GzipEncoderFactory()])
+    site = server.Site(root)
+    channel = site.buildProtocol(None)
+    transport = StringTransport()
+    channel.makeConnection(transport)
+    request = "GET %s HTTP/1.1\r\n" % (path,)
+    if acceptEncoding:
+        request += "Accept-Encoding: gzip\r\n"
+    request += "\r\n"
+
+    sent = 0
+    before = time.time()
+    for i in xrange(count):
+        channel.dataReceived(request)
+        sent += len(transport.value())
+        transport.clear()
+    after = time.time()
+
+    print name, 'gzip:', acceptEncoding,
+    print 'requests/sec:', int(count / (after - before)),
+    print 'bytes/response:', sent / count
+
+def main():
+    count = 2000
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    for acceptEncoding in False, True:
+        benchmark('page', Page(), count, acceptEncoding, '/')
+
+    directory = tempfile.mkdtemp()
+    try:
+        f = open(os.path.join(directory, 'table.html'), 'w')
+        f.write(text)
+        f.close()
+        for acceptEncoding in False, True:
+            root = static.File(directory)
+            root.cache = static.FileCache()
+            benchmark('cached file', root, count, acceptEncoding,
+                      '/table.html')
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    main()
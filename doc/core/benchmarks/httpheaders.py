@@ -0,0 +1,62 @@
+"""
+Measure how many small pipelined GET requests per second
+L{twisted.web.http.HTTPChannel} parses, with header blocks parsed whole
+and line by line.
+"""
+
+import sys, time
+
+from twisted.web import http
+from twisted.test.proto_helpers import StringTransport
+
+REQUEST = (
+    "GET /index.html?q=1 HTTP/1.1\r\n"
+    "Host: www.example.com\r\n"
+    "User-Agent: Mozilla/5.0 (X11; Linux x86_64) Gecko/20100101 Firefox/3.5\r\n"
+    "Accept: text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8\r\n"
+    "Accept-Language: en-us,en;q=0.5\r\n"
+    "Accept-Encoding: gzip,deflate\r\n"
+    "Accept-Charset: ISO-8859-1,utf-8;q=0.7,*;q=0.7\r\n"
+    "Keep-Alive: 300\r\n"
+    "Connection: keep-alive\r\n"
+    "Cookie: session=0123456789abcdef\r\n"
+    "\r\n")
+
+class NullRequest(http.Request):
+    """
+    A request which is finished as soon as it is received, without writing
+    a response.
+    """
+    def process(self):
+        self.channel.requestDone(self)
+
+class LineByLineChannel(http.HTTPChannel):
+    linesReceived = None
+
+def benchmark(channelClass, count, perRead):
+    channel = channelClass()
+    channel.requestFactory = NullRequest
+    channel.makeConnection(StringTransport())
+    channel.setTimeout(None)
+    data = REQUEST * perRead
+    reads = count / perRead
+
+    before = time.clock()
+    for i in xrange(reads):
+        channel.dataReceived(data)
+    after = time.clock()
+
+    print channelClass.__name__,
+    print 'requests per read:', perRead,
+    print 'requests/sec:', int(reads * perRead / (after - before))
+
+def main():
+    count = 20000
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    for perRead in (1, 10):
+        for channelClass in (LineByLineChannel, http.HTTPChannel):
+            benchmark(channelClass, count, perRead)
+
+if __name__ == '__main__':
+    main()
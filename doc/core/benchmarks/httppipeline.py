@@ -0,0 +1,64 @@
+"""
+Measure how much of the responses to pipelined requests L{http.HTTPChannel}
+holds in memory while the first request is slow to finish, with and without
+limits on pipelining and on queued response size.
+"""
+
+import sys, time
+
+from twisted.web import http
+from twisted.test.proto_helpers import StringTransport
+
+class Held(http.Request):
+    """
+    Respond at once to every request but the first, which is finished by
+    the benchmark.
+    """
+    responseSize = 2 ** 20
+
+    def process(self):
+        if getattr(self.channel, 'first', None) is None:
+            self.channel.first = self
+        else:
+            self.write('x' * self.responseSize)
+            self.finish()
+
+def inMemory(channel):
+    total = 0
+    for request in channel.requests:
+        if request.queued and request.transport.file is None:
+            total += len(request.transport.getvalue())
+    return total
+
+def benchmark(count, maxPipelinedRequests, queuedMemoryLimit):
+    Held.queuedMemoryLimit = queuedMemoryLimit
+    channel = http.HTTPChannel()
+    channel.requestFactory = Held
+    channel.maxPipelinedRequests = maxPipelinedRequests
+    transport = StringTransport()
+    channel.makeConnection(transport)
+
+    before = time.time()
+    channel.dataReceived("GET / HTTP/1.1\r\n\r\n" * count)
+    parsed = len(channel.requests)
+    held = inMemory(channel)
+    channel.first.finish()
+    after = time.time()
+    assert not channel.requests
+
+    print 'maxPipelinedRequests:', maxPipelinedRequests,
+    print 'queuedMemoryLimit:', queuedMemoryLimit,
+    print 'requests waiting:', parsed,
+    print 'MB held in memory:', held / 2 ** 20,
+    print 'requests/sec:', int(count / (after - before))
+
+def main():
+    count = 200
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    benchmark(count, None, 2 ** 40)
+    benchmark(count, 16, 2 ** 40)
+    benchmark(count, 16, 2 ** 20)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""
+Measure how many small dynamic responses per second L{twisted.web.http}
+can serialize: a status line, a few headers including Date, and a short
+body.
+"""
+
+import sys, time
+from cStringIO import StringIO
+
+from twisted.web import http
+
+class NullTransport:
+    def write(self, data):
+        pass
+
+    def writeSequence(self, data):
+        pass
+
+class NullChannel:
+    def __init__(self):
+        self.transport = NullTransport()
+
+    def requestDone(self, request):
+        pass
+
+BODY = '<html><body>Hello, world!</body></html>'
+
+def respond(channel):
+    request = http.Request(channel, False)
+    request.content = StringIO()
+    request.method = 'GET'
+    request.clientproto = 'HTTP/1.1'
+    request.setHeader('date', http.datetimeToString())
+    request.setHeader('server', 'TwistedWeb')
+    request.setHeader('content-type', 'text/html')
+    request.setHeader('content-length', str(len(BODY)))
+    request.write(BODY)
+    request.finish()
+
+def benchmark(count):
+    channel = NullChannel()
+    before = time.clock()
+    for i in xrange(count):
+        respond(channel)
+    after = time.clock()
+    print 'responses/sec:', int(count / (after - before))
+
+def main():
+    count = 50000
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    benchmark(count)
+
+if __name__ == '__main__':
+    main()
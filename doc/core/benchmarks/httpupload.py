@@ -0,0 +1,70 @@
+"""
+Measure the throughput of L{twisted.web.server} receiving a large upload,
+buffered in the request's C{content} and streamed to a resource providing
+L{twisted.web.iweb.IStreamingRequestBody}.
+"""
+
+import sys, time
+
+from zope.interface import implements
+
+from twisted.web import server, resource, iweb
+from twisted.test.proto_helpers import StringTransport
+
+class Discard(resource.Resource):
+    """
+    Count the bytes of the bodies posted to it, either as they arrive or once
+    they have been buffered.
+    """
+    implements(iweb.IStreamingRequestBody)
+    isLeaf = True
+    received = 0
+
+    def getBodyConsumer(self, request):
+        return self
+
+    def registerProducer(self, producer, streaming):
+        pass
+
+    def unregisterProducer(self):
+        pass
+
+    def write(self, data):
+        self.received += len(data)
+
+    def render_POST(self, request):
+        while True:
+            data = request.content.read(2 ** 16)
+            if not data:
+                break
+            self.received += len(data)
+        return ''
+
+def benchmark(total, chunkSize, stream):
+    root = Discard()
+    site = server.Site(root)
+    site.streamRequestBodies = stream
+    channel = site.buildProtocol(None)
+    channel.makeConnection(StringTransport())
+    chunk = 'x' * chunkSize
+
+    before = time.time()
+    channel.dataReceived(
+        "POST / HTTP/1.1\r\nContent-Length: %d\r\n\r\n" % (total,))
+    for i in xrange(total / chunkSize):
+        channel.dataReceived(chunk)
+    after = time.time()
+    assert root.received == total, (root.received, total)
+
+    print 'streamed:', stream,
+    print 'MB/sec:', int(total / (after - before) / 2 ** 20)
+
+def main():
+    total = 2 ** 28
+    if len(sys.argv) > 1:
+        total = int(sys.argv[1])
+    for stream in False, True:
+        benchmark(total, 2 ** 16, stream)
+
+if __name__ == '__main__':
+    main()
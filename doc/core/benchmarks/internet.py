@@ -0,0 +1,594 @@
+# Copyright (c) 2009 Twisted Matrix Laboratories.
+# See LICENSE for details.
+
+"""
+Cross-reactor benchmarks for the hot paths of L{twisted.internet}.
+
+Each selected reactor is installed in a fresh child process which runs every
+selected benchmark and writes its results to a file.  The parent process
+collects them and reports one result per line, tab separated::
+
+    <reactor> <benchmark> <value> <unit>
+
+Lines beginning with C{#} are comments describing the run.  Two result files
+can be compared with C{--compare}::
+
+    python internet.py --output before.txt
+    (apply a change)
+    python internet.py --output after.txt
+    python internet.py --compare before.txt after.txt
+"""
+
+import os, sys, time, struct, tempfile, threading
+
+from twisted.python import usage
+from twisted.internet import defer, protocol
+
+
+benchmarkFuncs = []
+
+def benchmarkFunc(name):
+    """
+    A decorator for benchmark functions.  Registers the function under the
+    given name in the global benchmarkFuncs list.
+
+    A benchmark function is called with the running reactor and a scale
+    factor for its iteration counts.  It returns a list of C{(metric, value,
+    unit)} tuples, or a L{Deferred} which fires with one.
+    """
+    def decorator(func):
+        benchmarkFuncs.append((name, func))
+        return func
+    return decorator
+
+
+# Units for which a smaller value is an improvement.
+LOWER_IS_BETTER = ['usec']
+
+# Reactors measured when none are given on the command line.
+DEFAULT_REACTORS = ['select', 'poll', 'epoll']
+
+
+def rate(count, elapsed):
+    """
+    Return C{count / elapsed}, guarding against a zero elapsed time.
+    """
+    return count / max(elapsed, 1e-9)
+
+
+
+class Echo(protocol.Protocol):
+    """
+    Write everything received straight back to the peer.
+    """
+    def dataReceived(self, data):
+        self.transport.write(data)
+
+
+
+class ThroughputClient(protocol.Protocol):
+    """
+    Write C{total} bytes as a pull producer and fire C{done} once all of them
+    have been echoed back.
+    """
+    chunk = 'x' * 2 ** 16
+
+    def connectionMade(self):
+        self.sent = 0
+        self.received = 0
+        self.start = time.time()
+        self.transport.registerProducer(self, False)
+
+
+    def resumeProducing(self):
+        if self.sent < self.factory.total:
+            self.sent += len(self.chunk)
+            self.transport.write(self.chunk)
+        else:
+            self.transport.unregisterProducer()
+
+
+    def stopProducing(self):
+        pass
+
+
+    def dataReceived(self, data):
+        self.received += len(data)
+        if self.received >= self.sent >= self.factory.total:
+            elapsed = time.time() - self.start
+            self.transport.loseConnection()
+            self.factory.done.callback(
+                [('throughput', rate(self.received, elapsed) / 2 ** 20,
+                  'MB/s')])
+
+
+
+class LatencyClient(protocol.Protocol):
+    """
+    Send one small message at a time and wait for its echo before sending the
+    next one.
+    """
+    message = 'x' * 32
+
+    def connectionMade(self):
+        self.remaining = self.factory.count
+        self.buffered = 0
+        self.start = time.time()
+        self.transport.write(self.message)
+
+
+    def dataReceived(self, data):
+        self.buffered += len(data)
+        if self.buffered < len(self.message):
+            return
+        self.buffered = 0
+        self.remaining -= 1
+        if self.remaining:
+            self.transport.write(self.message)
+        else:
+            elapsed = time.time() - self.start
+            self.transport.loseConnection()
+            self.factory.done.callback(
+                [('latency', elapsed / self.factory.count * 1e6, 'usec')])
+
+
+
+def _tcpRun(reactor, clientProtocol, **attrs):
+    """
+    Listen with an L{Echo} server, connect a single C{clientProtocol} to it
+    and return a L{Deferred} firing with the client's results once the
+    listening port has been closed.
+    """
+    serverFactory = protocol.ServerFactory()
+    serverFactory.protocol = Echo
+    port = reactor.listenTCP(0, serverFactory, interface='127.0.0.1')
+    clientFactory = protocol.ClientFactory()
+    clientFactory.protocol = clientProtocol
+    clientFactory.done = defer.Deferred()
+    for name, value in attrs.items():
+        setattr(clientFactory, name, value)
+    reactor.connectTCP('127.0.0.1', port.getHost().port, clientFactory)
+    def cbDone(results):
+        return defer.maybeDeferred(port.stopListening).addCallback(
+            lambda ignored: results)
+    return clientFactory.done.addCallback(cbDone)
+
+
+
+def tcpThroughput(reactor, scale):
+    return _tcpRun(reactor, ThroughputClient, total=int(2 ** 28 * scale))
+tcpThroughput = benchmarkFunc('tcp.echo')(tcpThroughput)
+
+
+
+def tcpLatency(reactor, scale):
+    return _tcpRun(reactor, LatencyClient, count=int(20000 * scale))
+tcpLatency = benchmarkFunc('tcp.roundtrip')(tcpLatency)
+
+
+
+class ConnectingFactory(protocol.ClientFactory):
+    """
+    Open C{count} connections, C{concurrency} at a time, dropping each one as
+    soon as it is established.
+    """
+    protocol = protocol.Protocol
+    concurrency = 20
+
+    def __init__(self, reactor, port, count):
+        self.reactor = reactor
+        self.port = port
+        self.remaining = count
+        self.pending = 0
+        self.done = defer.Deferred()
+
+
+    def start(self):
+        for i in range(min(self.concurrency, self.remaining)):
+            self.connect()
+
+
+    def connect(self):
+        self.remaining -= 1
+        self.pending += 1
+        self.reactor.connectTCP('127.0.0.1', self.port, self)
+
+
+    def buildProtocol(self, addr):
+        p = protocol.ClientFactory.buildProtocol(self, addr)
+        self.reactor.callLater(0, self.disconnect, p)
+        return p
+
+
+    def disconnect(self, p):
+        p.transport.loseConnection()
+
+
+    def clientConnectionLost(self, connector, reason):
+        self.pending -= 1
+        if self.remaining:
+            self.connect()
+        elif not self.pending:
+            self.done.callback(None)
+    clientConnectionFailed = clientConnectionLost
+
+
+
+def tcpConnect(reactor, scale):
+    serverFactory = protocol.ServerFactory()
+    serverFactory.protocol = protocol.Protocol
+    port = reactor.listenTCP(0, serverFactory, interface='127.0.0.1')
+    count = int(2000 * scale)
+    factory = ConnectingFactory(reactor, port.getHost().port, count)
+    start = time.time()
+    factory.start()
+    def cbDone(ignored):
+        elapsed = time.time() - start
+        d = defer.maybeDeferred(port.stopListening)
+        return d.addCallback(
+            lambda ignored: [('setup', rate(count, elapsed), 'conn/s')])
+    return factory.done.addCallback(cbDone)
+tcpConnect = benchmarkFunc('tcp.connect')(tcpConnect)
+
+
+
+class UDPEcho(protocol.DatagramProtocol):
+    def datagramReceived(self, data, addr):
+        self.transport.write(data, addr)
+
+
+
+class UDPPinger(protocol.DatagramProtocol):
+    """
+    Keep C{window} datagrams in flight against a L{UDPEcho} server until
+    C{count} of them have come back.  A loss of every in-flight datagram ends
+    the run early rather than stalling it.
+    """
+    window = 32
+    message = 'x' * 64
+
+    def __init__(self, reactor, address, count):
+        self.reactor = reactor
+        self.address = address
+        self.count = count
+        self.received = 0
+        self.done = defer.Deferred()
+
+
+    def startProtocol(self):
+        self.start = time.time()
+        self.lastReceived = self.start
+        for i in range(self.window):
+            self.transport.write(self.message, self.address)
+        self.stall = self.reactor.callLater(0.5, self.checkStall)
+
+
+    def checkStall(self):
+        if time.time() - self.lastReceived > 0.5:
+            self.finish(self.lastReceived)
+        else:
+            self.stall = self.reactor.callLater(0.5, self.checkStall)
+
+
+    def datagramReceived(self, data, addr):
+        if self.done.called:
+            return
+        self.received += 1
+        self.lastReceived = time.time()
+        if self.received == self.count:
+            self.stall.cancel()
+            self.finish(self.lastReceived)
+        else:
+            self.transport.write(self.message, self.address)
+
+
+    def finish(self, end):
+        if not self.done.called:
+            self.done.callback(rate(self.received, end - self.start))
+
+
+
+def udpRate(reactor, scale):
+    server = reactor.listenUDP(0, UDPEcho(), interface='127.0.0.1')
+    pinger = UDPPinger(
+        reactor, ('127.0.0.1', server.getHost().port), int(100000 * scale))
+    client = reactor.listenUDP(0, pinger, interface='127.0.0.1')
+    def cbDone(packetsPerSecond):
+        d = defer.gatherResults([
+                defer.maybeDeferred(server.stopListening),
+                defer.maybeDeferred(client.stopListening)])
+        return d.addCallback(
+            lambda ignored: [('rate', packetsPerSecond, 'pkt/s')])
+    return pinger.done.addCallback(cbDone)
+udpRate = benchmarkFunc('udp.echo')(udpRate)
+
+
+
+def callLater(reactor, scale):
+    count = int(100000 * scale)
+    f = lambda: None
+    start = time.time()
+    calls = [reactor.callLater(1000, f) for i in xrange(count)]
+    scheduled = time.time()
+    for call in calls:
+        call.reset(2000)
+    reset = time.time()
+    for call in calls:
+        call.cancel()
+    cancelled = time.time()
+
+    fired = []
+    d = defer.Deferred()
+    def fire():
+        fired.append(None)
+        if len(fired) == count:
+            d.callback(time.time())
+    firing = time.time()
+    for i in xrange(count):
+        reactor.callLater(0, fire)
+    def cbFired(end):
+        return [('schedule', rate(count, scheduled - start), 'calls/s'),
+                ('reset', rate(count, reset - scheduled), 'calls/s'),
+                ('cancel', rate(count, cancelled - reset), 'calls/s'),
+                ('fire', rate(count, end - firing), 'calls/s')]
+    return d.addCallback(cbFired)
+callLater = benchmarkFunc('reactor.callLater')(callLater)
+
+
+
+def callFromThread(reactor, scale):
+    from twisted.internet.threads import blockingCallFromThread
+    count = int(10000 * scale)
+    d = defer.Deferred()
+    f = lambda: None
+    def inThread():
+        start = time.time()
+        for i in xrange(count):
+            blockingCallFromThread(reactor, f)
+        elapsed = time.time() - start
+        reactor.callFromThread(
+            d.callback, [('roundtrip', rate(count, elapsed), 'calls/s')])
+    t = threading.Thread(target=inThread)
+    t.setDaemon(True)
+    t.start()
+    return d
+callFromThread = benchmarkFunc('reactor.callFromThread')(callFromThread)
+
+
+
+def deferredChain(reactor, scale):
+    count = int(20000 * scale)
+    f = lambda result: result
+
+    start = time.time()
+    for i in xrange(count):
+        d = defer.Deferred()
+        for j in xrange(10):
+            d.addCallback(f)
+        d.callback(None)
+    flat = time.time()
+
+    for i in xrange(count):
+        outer = defer.Deferred()
+        inner = defer.Deferred()
+        outer.addCallback(lambda ignored: inner)
+        outer.addCallback(f)
+        outer.callback(None)
+        inner.callback(None)
+    nested = time.time()
+    return [('flat10', rate(count, flat - start), 'chains/s'),
+            ('nested', rate(count, nested - flat), 'chains/s')]
+deferredChain = benchmarkFunc('defer.chain')(deferredChain)
+
+
+
+def _chunked(data, size):
+    """
+    Split C{data} into a list of strings of at most C{size} bytes.
+    """
+    return [data[i:i + size] for i in xrange(0, len(data), size)]
+
+
+
+def lineReceiver(reactor, scale):
+    from twisted.protocols.basic import LineReceiver
+    count = int(200000 * scale)
+    chunks = _chunked(('x' * 30 + '\r\n') * count, 2 ** 16)
+    proto = LineReceiver()
+    proto.lineReceived = lambda line: None
+    start = time.time()
+    for chunk in chunks:
+        proto.dataReceived(chunk)
+    return [('parse', rate(count, time.time() - start), 'lines/s')]
+lineReceiver = benchmarkFunc('basic.LineReceiver')(lineReceiver)
+
+
+
+def int32StringReceiver(reactor, scale):
+    from twisted.protocols.basic import Int32StringReceiver
+    count = int(200000 * scale)
+    chunks = _chunked((struct.pack('!i', 30) + 'x' * 30) * count, 2 ** 16)
+    proto = Int32StringReceiver()
+    proto.stringReceived = lambda string: None
+    start = time.time()
+    for chunk in chunks:
+        proto.dataReceived(chunk)
+    return [('parse', rate(count, time.time() - start), 'frames/s')]
+int32StringReceiver = benchmarkFunc(
+    'basic.Int32StringReceiver')(int32StringReceiver)
+
+
+
+def runBenchmarks(reactor, reactorName, names, scale, output):
+    """
+    Run the named benchmarks one after another with C{reactor} running,
+    writing each result to the file C{output} as it becomes available.
+    """
+    def report(results, name):
+        for metric, value, unit in results:
+            output.write('%s\t%s.%s\t%.6g\t%s\n' % (
+                    reactorName, name, metric, value, unit))
+        output.flush()
+
+    def failed(reason, name):
+        output.write('# %s failed: %s\n' % (
+                name, reason.getErrorMessage()))
+
+    d = defer.succeed(None)
+    for name, func in benchmarkFuncs:
+        if name in names:
+            d.addCallback(lambda ignored, func=func:
+                              defer.maybeDeferred(func, reactor, scale))
+            d.addCallbacks(report, failed,
+                           callbackArgs=(name,), errbackArgs=(name,))
+    d.addBoth(lambda ignored: reactor.stop())
+
+
+
+def child(reactorName, names, scale, outputPath):
+    """
+    Install the named reactor and run the benchmarks in this process.
+    """
+    from twisted.application.reactors import installReactor
+    try:
+        installReactor(reactorName)
+    except Exception, e:
+        open(outputPath, 'w').write(
+            '# %s unavailable: %s\n' % (reactorName, e))
+        return
+    from twisted.internet import reactor
+    output = open(outputPath, 'w')
+    reactor.callWhenRunning(
+        runBenchmarks, reactor, reactorName, names, scale, output)
+    reactor.run()
+    output.close()
+
+
+
+def loadResults(path):
+    """
+    Read a result file into a dictionary mapping C{(reactor, benchmark)} to
+    C{(value, unit)}.
+    """
+    results = {}
+    for line in open(path):
+        if line.startswith('#') or not line.strip():
+            continue
+        reactorName, name, value, unit = line.rstrip('\n').split('\t')
+        results[reactorName, name] = (float(value), unit)
+    return results
+
+
+
+def compare(oldPath, newPath, out=sys.stdout):
+    """
+    Report the relative change of every benchmark present in both result
+    files, marking changes of more than five percent.
+    """
+    old = loadResults(oldPath)
+    new = loadResults(newPath)
+    keys = [key for key in old if key in new]
+    keys.sort()
+    for key in keys:
+        oldValue, unit = old[key]
+        newValue = new[key][0]
+        change = rate(newValue - oldValue, oldValue) * 100
+        if unit in LOWER_IS_BETTER:
+            change = -change
+        if change > 5:
+            verdict = 'better'
+        elif change < -5:
+            verdict = 'WORSE'
+        else:
+            verdict = ''
+        out.write('%s\t%s\t%.6g\t%.6g\t%s\t%+.1f%%\t%s\n' % (
+                key[0], key[1], oldValue, newValue, unit, change, verdict))
+
+
+
+class Options(usage.Options):
+    synopsis = "internet.py [options]"
+
+    optParameters = [
+        ['reactors', 'r', ','.join(DEFAULT_REACTORS),
+         "Comma separated list of reactors to measure."],
+        ['benchmarks', 'b', None,
+         "Comma separated list of benchmarks to run (default: all)."],
+        ['scale', 's', 1.0,
+         "Multiplier applied to every iteration count.", float],
+        ['output', 'o', None, "Write results to this file too."],
+        ['child', None, None, "Internal: run as the child for a reactor."],
+        ['child-output', None, None, "Internal: child result file."]]
+
+    optFlags = [['list', 'l', "List the available benchmarks."]]
+
+    def __init__(self):
+        usage.Options.__init__(self)
+        self['compare'] = None
+
+
+    def opt_compare(self):
+        """
+        Compare two result files given as the remaining arguments.
+        """
+        self['compare'] = True
+
+
+    def parseArgs(self, *args):
+        if self['compare']:
+            if len(args) != 2:
+                raise usage.UsageError("--compare needs two result files")
+            self['compare'] = args
+        elif args:
+            raise usage.UsageError("Unexpected arguments: %r" % (args,))
+
+
+    def postOptions(self):
+        if self['benchmarks'] is None:
+            self['benchmarks'] = [name for name, func in benchmarkFuncs]
+        else:
+            self['benchmarks'] = self['benchmarks'].split(',')
+
+
+
+def main(args=None):
+    options = Options()
+    try:
+        options.parseOptions(args)
+    except usage.UsageError, e:
+        raise SystemExit("%s\n%s" % (options, e))
+
+    if options['list']:
+        for name, func in benchmarkFuncs:
+            print name
+        return
+    if options['compare']:
+        compare(*options['compare'])
+        return
+    if options['child']:
+        child(options['child'], options['benchmarks'], options['scale'],
+              options['child-output'])
+        return
+
+    lines = ['# python %s on %s\n' % (sys.version.split()[0], sys.platform),
+             '# scale %s, %s\n' % (options['scale'], time.ctime())]
+    for reactorName in options['reactors'].split(','):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            os.spawnv(os.P_WAIT, sys.executable, [
+                    sys.executable, os.path.abspath(__file__),
+                    '--child', reactorName,
+                    '--child-output', path,
+                    '--benchmarks', ','.join(options['benchmarks']),
+                    '--scale', str(options['scale'])])
+            lines.extend(open(path).readlines())
+        finally:
+            os.remove(path)
+
+    sys.stdout.writelines(lines)
+    if options['output'] is not None:
+        open(options['output'], 'w').writelines(lines)
+
+if __name__ == '__main__':
+    main()
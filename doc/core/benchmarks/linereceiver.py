@@ -7,17 +7,22 @@ class CollectingLineReceiver(basic.LineReceiver):
         self.lines = []
         self.lineReceived = self.lines.append
 
+class BatchingLineReceiver(basic.LineReceiver):
+    def __init__(self):
+        self.lines = []
+        self.linesReceived = self.lines.extend
+
 def deliver(proto, chunks):
     map(proto.dataReceived, chunks)
 
-def benchmark(chunkSize, lineLength, numLines):
+def benchmark(chunkSize, lineLength, numLines, factory=CollectingLineReceiver):
     bytes = ('x' * lineLength + '\r\n') * numLines
     chunkCount = len(bytes) / chunkSize + 1
     chunks = []
     for n in xrange(chunkCount):
         chunks.append(bytes[n*chunkSize:(n+1)*chunkSize])
     assert ''.join(chunks) == bytes, (chunks, bytes)
-    p = CollectingLineReceiver()
+    p = factory()
 
     before = time.clock()
     deliver(p, chunks)
@@ -25,6 +30,7 @@ def benchmark(chunkSize, lineLength, numLines):
 
     assert bytes.splitlines() == p.lines, (bytes.splitlines(), p.lines)
 
+    print factory.__name__,
     print 'chunkSize:', chunkSize,
     print 'lineLength:', lineLength,
     print 'numLines:', numLines,
@@ -43,5 +49,11 @@ def main():
             for chunkSize in (51, 500, 5000):
                 benchmark(chunkSize, lineLength, numLines)
 
+    # Pipelined short lines arriving in large reads, as for memcache or IRC
+    # traffic.
+    for factory in CollectingLineReceiver, BatchingLineReceiver:
+        for lineLength in (8, 32):
+            benchmark(65536, lineLength, 200000, factory)
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,118 @@
+"""
+Measure how many memcache commands per second a single L{MemCacheProtocol}
+connection can complete against an in-process stand-in for memcached over
+the loopback interface, with and without write coalescing.
+
+Commands are issued in pipelined batches: each batch is issued at once, and
+the next one when all of its answers have arrived.
+"""
+
+import sys, time
+
+from twisted.internet import reactor, protocol, defer
+from twisted.protocols.basic import LineReceiver
+from twisted.protocols.memcache import MemCacheProtocol
+
+class StandInServer(LineReceiver):
+    """
+    Just enough of memcached: get, set and delete.
+    """
+    _pending = None
+
+    def connectionMade(self):
+        self.values = self.factory.values
+
+    def lineReceived(self, line):
+        parts = line.split()
+        command = parts[0]
+        if command == 'get':
+            out = []
+            for key in parts[1:]:
+                value = self.values.get(key)
+                if value is not None:
+                    out.append('VALUE %s 0 %d\r\n%s\r\n' % (
+                        key, len(value), value))
+            out.append('END\r\n')
+            self.transport.writeSequence(out)
+        elif command == 'set':
+            self._pending = parts[1], int(parts[4]), parts[-1] == 'noreply'
+            self.setRawMode()
+        elif command == 'delete':
+            self.values.pop(parts[1], None)
+            if parts[-1] != 'noreply':
+                self.transport.write('DELETED\r\n')
+        else:
+            self.transport.write('ERROR\r\n')
+
+    def rawDataReceived(self, data):
+        key, length, noreply = self._pending
+        self._buffer = getattr(self, '_buffer', '') + data
+        if len(self._buffer) >= length + 2:
+            self.values[key] = self._buffer[:length]
+            rest = self._buffer[length + 2:]
+            self._buffer = ''
+            if not noreply:
+                self.transport.write('STORED\r\n')
+            self.setLineMode(rest)
+
+
+
+def runBatches(client, makeBatch, batches):
+    """
+    Issue C{batches} batches of commands made by C{makeBatch}, one after the
+    other, and fire with the time taken.
+    """
+    result = defer.Deferred()
+    started = time.time()
+    remaining = [batches]
+    def nextBatch(ignored=None):
+        if not remaining[0]:
+            result.callback(time.time() - started)
+            return
+        remaining[0] -= 1
+        defer.gatherResults(makeBatch(client)).addCallback(nextBatch)
+    nextBatch()
+    return result
+
+
+
+def benchmarks(value):
+    def sets(client):
+        return [client.set('key%d' % (i,), value) for i in xrange(100)]
+    def gets(client):
+        return [client.get('key%d' % (i,)) for i in xrange(100)]
+    def getMultiple(client):
+        return [client.getMultiple(['key%d' % (i,) for i in xrange(100)])]
+    return [('set', sets, 100), ('get', gets, 100),
+            ('getMultiple', getMultiple, 100)]
+
+
+
+def main():
+    serverFactory = protocol.ServerFactory()
+    serverFactory.protocol = StandInServer
+    serverFactory.values = {}
+    port = reactor.listenTCP(0, serverFactory, interface='127.0.0.1')
+    creator = protocol.ClientCreator(reactor, MemCacheProtocol)
+
+    @defer.inlineCallbacks
+    def run():
+        for valueSize in (16, 1024, 65536):
+            value = 'x' * valueSize
+            for coalesce in (False, True):
+                client = yield creator.connectTCP(
+                    '127.0.0.1', port.getHost().port)
+                client.coalesceWrites = coalesce
+                for name, makeBatch, perBatch in benchmarks(value):
+                    batches = max(2 ** 20 / (valueSize * perBatch), 20)
+                    elapsed = yield runBatches(client, makeBatch, batches)
+                    print 'value: %5d coalesce: %-5s %-11s %8d ops/sec' % (
+                        valueSize, coalesce, name,
+                        batches * perBatch / elapsed)
+                client.transport.loseConnection()
+        reactor.stop()
+    reactor.callWhenRunning(run)
+    reactor.run()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Measure the throughput of L{twisted.protocols.portforward} relaying a bulk
+transfer over loopback, with and without C{splice(2)}.
+"""
+
+import sys, time
+
+from twisted.internet import reactor, protocol
+from twisted.protocols import portforward
+
+class Sink(protocol.Protocol):
+    def connectionMade(self):
+        self.received = 0
+
+    def dataReceived(self, data):
+        self.received += len(data)
+        if self.received >= self.factory.total:
+            self.factory.finished(self.received)
+
+class Source(protocol.Protocol):
+    chunk = 'x' * 2 ** 16
+
+    def connectionMade(self):
+        self.remaining = self.factory.total
+        self.transport.registerProducer(self, False)
+
+    def resumeProducing(self):
+        if self.remaining > 0:
+            self.transport.write(self.chunk)
+            self.remaining -= len(self.chunk)
+        else:
+            self.transport.unregisterProducer()
+
+    def stopProducing(self):
+        pass
+
+def benchmark(total, useSplice):
+    sinkFactory = protocol.ServerFactory()
+    sinkFactory.protocol = Sink
+    sinkFactory.total = total
+    sinkPort = reactor.listenTCP(0, sinkFactory, interface='127.0.0.1')
+
+    proxyFactory = portforward.ProxyFactory(
+        '127.0.0.1', sinkPort.getHost().port)
+    proxyFactory.useSplice = useSplice
+    proxyPort = reactor.listenTCP(0, proxyFactory, interface='127.0.0.1')
+
+    sourceFactory = protocol.ClientFactory()
+    sourceFactory.protocol = Source
+    sourceFactory.total = total
+
+    def finished(received):
+        elapsed = time.time() - start
+        print 'useSplice:', useSplice,
+        print 'bytes:', received,
+        print 'seconds:', elapsed,
+        print 'MB/sec:', int(received / elapsed / 2 ** 20)
+        sinkPort.stopListening()
+        proxyPort.stopListening()
+        reactor.stop()
+    sinkFactory.finished = finished
+
+    start = time.time()
+    reactor.connectTCP('127.0.0.1', proxyPort.getHost().port, sourceFactory)
+    reactor.run()
+
+def main():
+    benchmark(2 ** 30, sys.argv[1:] == ['splice'])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+"""
+Measure the cost of creating and using many L{twisted.web.server.Session}s,
+each with its own expiry timer in a plain C{dict}, and in a
+L{twisted.web.server.MemorySessionStore}.
+"""
+
+import sys, time
+
+from twisted.internet import reactor
+from twisted.web import server, resource
+
+def benchmark(count, store):
+    site = server.Site(resource.Resource())
+    if store:
+        site.sessions = server.MemorySessionStore()
+
+    before = time.time()
+    sessions = [site.makeSession() for i in xrange(count)]
+    created = time.time()
+    for session in sessions:
+        site.getSession(session.uid).touch()
+    touched = time.time()
+    pending = len(reactor.getDelayedCalls())
+
+    for session in sessions:
+        session.expire()
+    assert not reactor.getDelayedCalls()
+
+    print 'store:', store, 'sessions:', count,
+    print 'created/sec:', int(count / (created - before)),
+    print 'touched/sec:', int(count / (touched - created)),
+    print 'timers:', pending
+
+def main():
+    count = 100000
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    for store in False, True:
+        benchmark(count, store)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Measure how many SSL connections per second a client can make to a local
+server, closing each before making the next, with and without a
+L{twisted.internet.ssl.ClientSessionCache}.
+"""
+
+import sys, time
+
+from OpenSSL.SSL import TLSv1_METHOD
+
+from twisted.internet import reactor, protocol
+from twisted.internet.ssl import ClientContextFactory, ClientSessionCache
+from twisted.internet.ssl import DefaultOpenSSLContextFactory
+from twisted.test.test_ssl import certPath
+
+class Greeter(protocol.Protocol):
+    def connectionMade(self):
+        self.transport.write('hello\r\n')
+
+class Leaver(protocol.Protocol):
+    def dataReceived(self, data):
+        self.transport.loseConnection()
+
+    def connectionLost(self, reason):
+        self.factory.connectionDone()
+
+class Reconnector(protocol.ClientFactory):
+    protocol = Leaver
+
+    def __init__(self, port, contextFactory, count):
+        self.port = port
+        self.contextFactory = contextFactory
+        self.remaining = count
+
+    def connect(self):
+        reactor.connectSSL('127.0.0.1', self.port, self, self.contextFactory)
+
+    def connectionDone(self):
+        self.remaining -= 1
+        if self.remaining:
+            self.connect()
+        else:
+            reactor.stop()
+
+def benchmark(count, useCache):
+    serverContextFactory = DefaultOpenSSLContextFactory(certPath, certPath)
+    serverFactory = protocol.ServerFactory()
+    serverFactory.protocol = Greeter
+    port = reactor.listenSSL(
+        0, serverFactory, serverContextFactory, interface='127.0.0.1')
+
+    clientContextFactory = ClientContextFactory()
+    clientContextFactory.method = TLSv1_METHOD
+    if useCache:
+        clientContextFactory.sessionCache = ClientSessionCache()
+
+    factory = Reconnector(port.getHost().port, clientContextFactory, count)
+    reactor.callWhenRunning(factory.connect)
+    before = time.time()
+    reactor.run()
+    after = time.time()
+    port.stopListening()
+
+    print 'sessionCache:', useCache,
+    print 'connections/sec:', int(count / (after - before)),
+    print 'handshakes (full, resumed):',
+    print serverContextFactory.getHandshakeCounts()
+
+def main():
+    count = 500
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    benchmark(count, '--cache' in sys.argv)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""
+Measure how many fixed-size records per second L{StatefulProtocol} can
+parse, for records from 4 bytes to 4KB arriving in reads of various sizes.
+"""
+
+import time
+
+from twisted.protocols.stateful import StatefulProtocol
+from twisted.test.proto_helpers import StringTransport
+
+class RecordCounter(StatefulProtocol):
+    count = 0
+    def __init__(self, recordSize):
+        self.recordSize = recordSize
+
+    def getInitialState(self):
+        return self.recordReceived, self.recordSize
+
+    def recordReceived(self, record):
+        self.count += 1
+        self.last = record
+
+def benchmark(recordSize, chunkSize, totalBytes=2 ** 22):
+    record = 'x' * recordSize
+    numRecords = totalBytes / recordSize
+    bytes = record * numRecords
+    chunks = []
+    for n in xrange(0, len(bytes), chunkSize):
+        chunks.append(bytes[n:n + chunkSize])
+    p = RecordCounter(recordSize)
+    p.makeConnection(StringTransport())
+
+    before = time.clock()
+    map(p.dataReceived, chunks)
+    after = time.clock()
+
+    assert p.count == numRecords, (p.count, numRecords)
+    assert p.last == record
+
+    elapsed = after - before
+    print 'recordSize:', recordSize,
+    print 'chunkSize:', chunkSize,
+    print 'records:', numRecords,
+    print 'CPU Time:', elapsed,
+    print 'records/sec:', int(numRecords / max(elapsed, 1e-6))
+
+
+
+def main():
+    for recordSize in (4, 16, 64, 1024, 4096):
+        for chunkSize in (1000, 65536):
+            benchmark(recordSize, chunkSize)
+    # A large record arriving in small reads.
+    benchmark(2 ** 20, 4096)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""
+Measure how many requests per second L{twisted.web.static.File} answers for
+a small file, with and without a L{twisted.web.static.FileCache}.
+"""
+
+import sys, os, tempfile, shutil, time
+
+from twisted.web import server, static
+from twisted.test.proto_helpers import StringTransport
+
+class PullingTransport(StringTransport):
+    """
+    A transport which asks a pull producer for data until it is
+    unregistered, as a transport with an empty write buffer would.
+    """
+    def registerProducer(self, producer, streaming):
+        StringTransport.registerProducer(self, producer, streaming)
+        if not streaming:
+            while self.producer is not None:
+                producer.resumeProducing()
+
+def benchmark(directory, count, cache):
+    root = static.File(directory)
+    if cache:
+        root.cache = static.FileCache()
+    site = server.Site(root)
+    channel = site.buildProtocol(None)
+    transport = PullingTransport()
+    channel.makeConnection(transport)
+    requests = "GET /style.css HTTP/1.1\r\n\r\n"
+
+    before = time.time()
+    for i in xrange(count):
+        channel.dataReceived(requests)
+        transport.clear()
+    after = time.time()
+
+    print 'cache:', cache,
+    print 'requests/sec:', int(count / (after - before))
+    if cache:
+        print 'hits:', root.cache.hits, 'misses:', root.cache.misses
+
+def main():
+    count = 10000
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    directory = tempfile.mkdtemp()
+    try:
+        f = open(os.path.join(directory, 'style.css'), 'w')
+        f.write('body { margin: 0 }\n' * 100)
+        f.close()
+        for cache in False, True:
+            benchmark(directory, count, cache)
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    main()
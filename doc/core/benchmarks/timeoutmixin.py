@@ -0,0 +1,42 @@
+"""
+Measure the cost of L{TimeoutMixin.resetTimeout} across many connections,
+each of which keeps a pending idle timeout in the reactor.
+"""
+
+import time
+
+from twisted.internet.protocol import Protocol
+from twisted.protocols.policies import TimeoutMixin
+
+class IdleProtocol(Protocol, TimeoutMixin):
+    def timeoutConnection(self):
+        pass
+
+def benchmark(connections, resetsPerConnection):
+    protocols = [IdleProtocol() for i in xrange(connections)]
+    for p in protocols:
+        p.setTimeout(600)
+    resets = [p.resetTimeout for p in protocols] * resetsPerConnection
+
+    before = time.clock()
+    for reset in resets:
+        reset()
+    after = time.clock()
+
+    for p in protocols:
+        p.setTimeout(None)
+
+    elapsed = after - before
+    print 'connections:', connections,
+    print 'resets:', len(resets),
+    print 'CPU Time:', elapsed,
+    print 'resets/sec:', int(len(resets) / max(elapsed, 1e-6))
+
+
+
+def main():
+    for connections in (10, 1000, 10000):
+        benchmark(connections, 1000000 / connections)
+
+if __name__ == '__main__':
+    main()
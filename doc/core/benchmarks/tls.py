@@ -0,0 +1,84 @@
+"""
+Measure the throughput of L{twisted.protocols.tls} over loopback TCP when
+the application makes many small writes in each reactor iteration, with and
+without C{coalesceWrites}.
+"""
+
+import sys, time
+
+from OpenSSL.SSL import TLSv1_METHOD
+
+from twisted.internet import reactor, protocol
+from twisted.internet.ssl import ClientContextFactory
+from twisted.internet.ssl import DefaultOpenSSLContextFactory
+from twisted.protocols.tls import TLSMemoryBIOFactory
+from twisted.test.test_ssl import certPath
+
+class Sink(protocol.Protocol):
+    def connectionMade(self):
+        self.received = 0
+
+    def dataReceived(self, data):
+        self.received += len(data)
+        if self.received >= self.factory.total:
+            self.factory.finished(self.received)
+
+class Source(protocol.Protocol):
+    """
+    Write C{self.factory.total} bytes as C{writes} small strings each time the
+    reactor comes around.
+    """
+    writes = 100
+    message = 'x' * 100
+
+    def connectionMade(self):
+        self.remaining = self.factory.total
+        self.transport.registerProducer(self, False)
+
+    def resumeProducing(self):
+        for i in xrange(self.writes):
+            if self.remaining <= 0:
+                return
+            self.transport.write(self.message)
+            self.remaining -= len(self.message)
+
+    def stopProducing(self):
+        pass
+
+def benchmark(total, coalesceWrites):
+    sinkFactory = protocol.ServerFactory()
+    sinkFactory.protocol = Sink
+    sinkFactory.total = total
+    tlsSinkFactory = TLSMemoryBIOFactory(
+        DefaultOpenSSLContextFactory(certPath, certPath), False, sinkFactory)
+    sinkPort = reactor.listenTCP(0, tlsSinkFactory, interface='127.0.0.1')
+
+    sourceFactory = protocol.ClientFactory()
+    sourceFactory.protocol = Source
+    sourceFactory.total = total
+    contextFactory = ClientContextFactory()
+    contextFactory.method = TLSv1_METHOD
+    tlsSourceFactory = TLSMemoryBIOFactory(
+        contextFactory, True, sourceFactory)
+    tlsSourceFactory.coalesceWrites = coalesceWrites
+
+    def finished(received):
+        elapsed = time.time() - start
+        print 'coalesceWrites:', coalesceWrites,
+        print 'bytes:', received,
+        print 'seconds:', elapsed,
+        print 'MB/sec:', round(received / elapsed / 2 ** 20, 1)
+        sinkPort.stopListening()
+        reactor.stop()
+    sinkFactory.finished = finished
+
+    start = time.time()
+    reactor.connectTCP(
+        '127.0.0.1', sinkPort.getHost().port, tlsSourceFactory)
+    reactor.run()
+
+def main():
+    benchmark(2 ** 26, sys.argv[1:] == ['coalesce'])
+
+if __name__ == '__main__':
+    main()
@@ -14,6 +14,14 @@ if not hasattr(sys, "version_info") or sys.version_info < (2,3):
     raise RuntimeError("Twisted requires Python 2.3 or later.")
 del sys
 
+# Profile the imports of the rest of the process if requested.
+import os
+if os.environ.get('TWISTED_IMPORT_PROFILE'):
+    from twisted.python import importprofile
+    importprofile.install(os.environ['TWISTED_IMPORT_PROFILE'])
+    del importprofile
+del os
+
 # Ensure compat gets imported
 from twisted.python import compat
 del compat
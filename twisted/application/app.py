@@ -2,7 +2,7 @@
 # Copyright (c) 2001-2008 Twisted Matrix Laboratories.
 # See LICENSE for details.
 
-import sys, os, pdb, getpass, traceback, signal, warnings
+import sys, os, traceback, signal, warnings
 
 from twisted.python import runtime, log, usage, failure, util, logfile
 from twisted.python.versions import Version
@@ -285,6 +285,7 @@ class AppLogger(object):
 
 
 def fixPdb():
+    import pdb
     def do_stop(self, arg):
         self.clear_all_breaks()
         self.set_continue()
@@ -337,6 +338,7 @@ def runReactorWithLogging(config, oldstdout, oldstderr, profiler=None, reactor=N
                 else:
                     runWithProfiler(reactor, config)
         elif config['debug']:
+            import pdb
             sys.stdout = oldstdout
             sys.stderr = oldstderr
             if runtime.platformType == 'posix':
@@ -358,6 +360,7 @@ def runReactorWithLogging(config, oldstdout, oldstderr, profiler=None, reactor=N
 
 def getPassphrase(needed):
     if needed:
+        import getpass
         return getpass.getpass('Passphrase: ')
     else:
         return None
@@ -68,14 +68,33 @@ def getReactorTypes():
 
 
 
+def _getBuiltinReactorTypes():
+    """
+    Return a list of the L{Reactor}s shipped with Twisted.
+
+    Unlike L{getReactorTypes}, this only imports the module defining them and
+    does not have to scan every plugin module first.
+    """
+    from twisted.plugins import twisted_reactors
+    return [installer for installer in vars(twisted_reactors).itervalues()
+            if isinstance(installer, Reactor)]
+
+
+
 def installReactor(shortName):
     """
     Install the reactor with the given C{shortName} attribute.
 
+    The reactors shipped with Twisted are looked up first, so that selecting
+    one of them does not require loading the plugin cache.
+
     @raise NoSuchReactor: If no reactor is found with a matching C{shortName}.
 
     @raise: anything that the specified reactor can raise when installed.
     """
+    for installer in _getBuiltinReactorTypes():
+        if installer.shortName == shortName:
+            return installer.install()
     for installer in getReactorTypes():
         if installer.shortName == shortName:
             return installer.install()
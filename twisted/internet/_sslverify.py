@@ -16,6 +16,86 @@ from twisted.internet.error import VerifyError, CertificateError
 # a unique session id for each context
 _sessionCounter = itertools.count().next
 
+# pyOpenSSL has no API for setting the size of a context's session cache, for
+# finding out whether a handshake resumed a session, or for reading the
+# cache's statistics.  Versions of it built on cffi keep OpenSSL's functions,
+# and the SSL_CTX and SSL pointers of contexts and connections, in private
+# attributes.  They are only used if they are all there and have the expected
+# types; otherwise the features which need them are left out.
+_lib = getattr(SSL, '_lib', None)
+_ffi = getattr(SSL, '_ffi', None)
+
+
+
+def _callOpenSSL(name, pointer, pointerType, *args):
+    """
+    Call the OpenSSL function C{name} with C{pointer} and C{args}, if
+    pyOpenSSL's bindings make it available.
+
+    @param pointer: The private C{_context} of an L{SSL.Context} or C{_ssl}
+        of an L{SSL.Connection}, or C{None}.
+    @param pointerType: The C type C{pointer} must have, C{"SSL_CTX *"} or
+        C{"SSL *"}.
+
+    @return: The result of the function, or C{None} if it cannot be called.
+    """
+    function = getattr(_lib, name, None)
+    if function is None or _ffi is None or pointer is None:
+        return None
+    try:
+        if _ffi.typeof(pointer) != _ffi.typeof(pointerType):
+            return None
+    except (TypeError, _ffi.error):
+        return None
+    return function(pointer, *args)
+
+
+
+def _setSessionCacheSize(context, size):
+    """
+    Set the maximum number of sessions in the cache of the L{SSL.Context}
+    C{context}.
+
+    @return: C{True} if it was set, or C{False} if this version of pyOpenSSL
+        cannot set it.
+    """
+    return _callOpenSSL(
+        'SSL_CTX_sess_set_cache_size', getattr(context, '_context', None),
+        'SSL_CTX *', size) is not None
+
+
+
+def _handshakeCounts(context):
+    """
+    Count the handshakes accepted by servers using the L{SSL.Context}
+    C{context}.
+
+    @return: A tuple of the number of full handshakes and the number of
+        handshakes which resumed a session, or C{None} if this version of
+        pyOpenSSL cannot tell.
+    """
+    pointer = getattr(context, '_context', None)
+    accepted = _callOpenSSL('SSL_CTX_sess_accept_good', pointer, 'SSL_CTX *')
+    resumed = _callOpenSSL('SSL_CTX_sess_hits', pointer, 'SSL_CTX *')
+    if accepted is None or resumed is None:
+        return None
+    return (accepted - resumed, resumed)
+
+
+
+def _sessionReused(connection):
+    """
+    Did the handshake on the L{SSL.Connection} C{connection} resume a
+    session?
+
+    @return: C{True} or C{False}, or C{None} if it cannot be told.
+    """
+    reused = _callOpenSSL(
+        'SSL_session_reused', getattr(connection, '_ssl', None), 'SSL *')
+    if reused is None:
+        return None
+    return bool(reused)
+
 _x509names = {
     'CN': 'commonName',
     'commonName': 'commonName',
@@ -589,6 +669,10 @@ class KeyPair(PublicKey):
 class OpenSSLCertificateOptions(object):
     """
     A factory for SSL context objects for both SSL servers and clients.
+
+    @ivar sessionCacheSize: The maximum number of sessions the context
+        caches, or C{None} to use OpenSSL's default.  It is only set with
+        versions of pyOpenSSL which make this possible.
     """
 
     _context = None
@@ -611,7 +695,8 @@ class OpenSSLCertificateOptions(object):
                  enableSingleUseKeys=True,
                  enableSessions=True,
                  fixBrokenPeers=False,
-                 enableSessionTickets=False):
+                 enableSessionTickets=False,
+                 sessionCacheSize=None):
         """
         Create an OpenSSL context SSL connection context factory.
 
@@ -658,6 +743,8 @@ class OpenSSLCertificateOptions(object):
         controlling session tickets. This option is off by default, as some
         server implementations don't correctly process incoming empty session
         ticket extensions in the hello.
+
+        @param sessionCacheSize: See L{sessionCacheSize}.
         """
 
         assert (privateKey is None) == (certificate is None), "Specify neither or both of privateKey and certificate"
@@ -678,6 +765,7 @@ class OpenSSLCertificateOptions(object):
         self.enableSessions = enableSessions
         self.fixBrokenPeers = fixBrokenPeers
         self.enableSessionTickets = enableSessionTickets
+        self.sessionCacheSize = sessionCacheSize
 
 
     def __getstate__(self):
@@ -701,6 +789,18 @@ class OpenSSLCertificateOptions(object):
         return self._context
 
 
+    def getHandshakeCounts(self):
+        """
+        Count the handshakes completed by servers using this factory's
+        context.
+
+        @return: A tuple of the number of full handshakes and the number of
+            handshakes which resumed a session, or C{None} if this version of
+            pyOpenSSL cannot tell.
+        """
+        return _handshakeCounts(self.getContext())
+
+
     def _makeContext(self):
         ctx = SSL.Context(self.method)
 
@@ -741,6 +841,8 @@ class OpenSSLCertificateOptions(object):
         if self.enableSessions:
             sessionName = md5("%s-%d" % (reflect.qual(self.__class__), _sessionCounter())).hexdigest()
             ctx.set_session_id(sessionName)
+            if self.sessionCacheSize is not None:
+                _setSessionCacheSize(ctx, self.sessionCacheSize)
 
         if not self.enableSessionTickets:
             ctx.set_options(self._OP_NO_TICKET)
@@ -13,6 +13,7 @@ import sys
 import warnings
 import operator
 from heapq import heappush, heappop, heapify
+from collections import deque
 
 import traceback
 
@@ -272,6 +273,137 @@ class BlockingResolver:
             return defer.succeed(address)
 
 
+
+class CachingResolver(object):
+    """
+    L{CachingResolver} wraps another L{IResolverSimple} provider and remembers
+    the outcome of its lookups, so that repeated lookups of the same name are
+    answered without consulting the wrapped resolver.  Concurrent lookups of
+    a name which is not cached share a single lookup in the wrapped resolver.
+
+    Install it in front of a reactor's current resolver with::
+
+        reactor.installResolver(CachingResolver(reactor, reactor.resolver))
+
+    @ivar reactor: An L{IReactorTime} provider used to expire cache entries.
+    @ivar resolver: The L{IResolverSimple} provider lookups are delegated to.
+    @ivar positiveTTL: The number of seconds a successful lookup is cached.
+    @ivar negativeTTL: The number of seconds a failed lookup is cached.  If
+        C{0}, failures are not cached.
+    @ivar maxSize: The maximum number of names cached.  When the cache is full
+        the least recently used name is discarded.
+
+    @ivar hits: The number of lookups answered from the cache.
+    @ivar misses: The number of lookups delegated to C{resolver}.
+    @ivar merged: The number of lookups which waited for a lookup of the same
+        name already in progress.
+
+    @ivar _cache: A C{dict} mapping names to C{[expires, result, serial]}
+        lists, where C{result} is an address or a L{failure.Failure} and
+        C{serial} orders the entries by last use.
+    @ivar _order: A C{deque} of C{(serial, name)} tuples, least recently used
+        first.  It may contain stale tuples for names which have since been
+        used again or removed; they are skipped on eviction.
+    @ivar _pending: A C{dict} mapping names being looked up to the list of
+        L{Deferred}s waiting for the result.
+    """
+    implements(IResolverSimple)
+
+    def __init__(self, reactor, resolver, positiveTTL=300, negativeTTL=30,
+                 maxSize=1000):
+        self.reactor = reactor
+        self.resolver = resolver
+        self.positiveTTL = positiveTTL
+        self.negativeTTL = negativeTTL
+        self.maxSize = maxSize
+        self.hits = self.misses = self.merged = 0
+        self._cache = {}
+        self._order = deque()
+        self._serial = 0
+        self._pending = {}
+
+
+    def _use(self, name, entry):
+        """
+        Mark the cache entry C{entry} for C{name} as the most recently used.
+        """
+        self._serial += 1
+        entry[2] = self._serial
+        self._order.append((self._serial, name))
+        if len(self._order) > 2 * self.maxSize + 16:
+            # Drop the stale tuples so that a long run of hits does not grow
+            # the queue without bound.
+            order = [(e[2], n) for (n, e) in self._cache.iteritems()]
+            order.sort()
+            self._order = deque(order)
+
+
+    def _store(self, name, result, ttl):
+        """
+        Cache C{result} for C{name} for C{ttl} seconds, evicting the least
+        recently used names if the cache is full.
+        """
+        while len(self._cache) >= self.maxSize and self._order:
+            serial, oldName = self._order.popleft()
+            entry = self._cache.get(oldName)
+            if entry is not None and entry[2] == serial:
+                del self._cache[oldName]
+        entry = [self.reactor.seconds() + ttl, result, None]
+        self._cache[name] = entry
+        self._use(name, entry)
+
+
+    def _resolved(self, result, name):
+        """
+        Cache the outcome of a lookup of C{name} in the wrapped resolver and
+        deliver it to everyone waiting for it.
+        """
+        waiting = self._pending.pop(name)
+        if isinstance(result, failure.Failure):
+            ttl = self.negativeTTL
+        else:
+            ttl = self.positiveTTL
+        if ttl > 0 and self.maxSize > 0:
+            self._store(name, result, ttl)
+        for d in waiting:
+            if isinstance(result, failure.Failure):
+                d.errback(result)
+            else:
+                d.callback(result)
+
+
+    def getHostByName(self, name, timeout = (1, 3, 11, 45)):
+        """
+        See L{twisted.internet.interfaces.IResolverSimple.getHostByName}.
+
+        C{timeout} is passed on to the wrapped resolver by the lookup which
+        actually consults it.
+        """
+        entry = self._cache.get(name)
+        if entry is not None:
+            if entry[0] > self.reactor.seconds():
+                self.hits += 1
+                self._use(name, entry)
+                if isinstance(entry[1], failure.Failure):
+                    return defer.fail(entry[1])
+                return defer.succeed(entry[1])
+            del self._cache[name]
+
+        d = defer.Deferred()
+        if name in self._pending:
+            self.merged += 1
+            self._pending[name].append(d)
+            return d
+
+        self.misses += 1
+        self._pending[name] = [d]
+        lookup = defer.maybeDeferred(
+            self.resolver.getHostByName, name, timeout)
+        lookup.addBoth(self._resolved, name)
+        return d
+
+
+
 class _ThreePhaseEvent(object):
     """
     Collection of callables (with arguments) which can be invoked as a group in
@@ -48,6 +48,13 @@ from zope.interface import implements, implementsOnly, implementedBy
 
 # Twisted imports
 from twisted.internet import tcp, interfaces, base, address
+from twisted.internet._sslverify import _setSessionCacheSize, _handshakeCounts
+from twisted.internet._sslverify import _sessionReused
+from twisted.python import reflect
+from twisted.python.hashlib import md5
+
+_OP_NO_TICKET = getattr(SSL, 'OP_NO_TICKET', 0x00004000)
+
 
 
 class ContextFactory:
@@ -66,22 +73,38 @@ class DefaultOpenSSLContextFactory(ContextFactory):
     objects.  These objects define certain parameters related to SSL
     handshakes and the subsequent connection.
 
+    The context keeps a cache of sessions, so clients which reconnect can
+    resume their session with an abbreviated handshake instead of doing the
+    public key operations of a full one again.
+
+    @ivar sessionCacheSize: The maximum number of sessions the context
+        caches, or C{None} to use OpenSSL's default.  It is only set with
+        versions of pyOpenSSL which make this possible.
+    @ivar enableSessionTickets: If true, clients may also resume sessions
+        with RFC 5077 session tickets, which keep the session state on the
+        client instead of in the cache.
+
     @ivar _contextFactory: A callable which will be used to create new
         context objects.  This is typically L{SSL.Context}.
     """
     _context = None
 
     def __init__(self, privateKeyFileName, certificateFileName,
-                 sslmethod=SSL.SSLv23_METHOD, _contextFactory=SSL.Context):
+                 sslmethod=SSL.SSLv23_METHOD, _contextFactory=SSL.Context,
+                 sessionCacheSize=None, enableSessionTickets=False):
         """
         @param privateKeyFileName: Name of a file containing a private key
         @param certificateFileName: Name of a file containing a certificate
         @param sslmethod: The SSL method to use
+        @param sessionCacheSize: See L{sessionCacheSize}.
+        @param enableSessionTickets: See L{enableSessionTickets}.
         """
         self.privateKeyFileName = privateKeyFileName
         self.certificateFileName = certificateFileName
         self.sslmethod = sslmethod
         self._contextFactory = _contextFactory
+        self.sessionCacheSize = sessionCacheSize
+        self.enableSessionTickets = enableSessionTickets
 
         # Create a context object right now.  This is to force validation of
         # the given parameters so that errors are detected earlier rather
@@ -97,9 +120,38 @@ class DefaultOpenSSLContextFactory(ContextFactory):
             ctx.set_options(SSL.OP_NO_SSLv2)
             ctx.use_certificate_file(self.certificateFileName)
             ctx.use_privatekey_file(self.privateKeyFileName)
+            self._enableSessions(ctx)
             self._context = ctx
 
 
+    def _enableSessions(self, ctx):
+        """
+        Set up the server-side session cache of C{ctx}.
+        """
+        # OpenSSL only resumes sessions for contexts with a session id.
+        ctx.set_session_id(md5("%s-%s" % (
+                    reflect.qual(self.__class__),
+                    self.certificateFileName)).hexdigest())
+        if hasattr(ctx, 'set_session_cache_mode'):
+            ctx.set_session_cache_mode(SSL.SESS_CACHE_SERVER)
+        if self.sessionCacheSize is not None:
+            _setSessionCacheSize(ctx, self.sessionCacheSize)
+        if not self.enableSessionTickets:
+            ctx.set_options(_OP_NO_TICKET)
+
+
+    def getHandshakeCounts(self):
+        """
+        Count the handshakes completed by connections using this factory's
+        context.
+
+        @return: A tuple of the number of full handshakes and the number of
+            handshakes which resumed a session, or C{None} if this version of
+            pyOpenSSL cannot tell.
+        """
+        return _handshakeCounts(self._context)
+
+
     def __getstate__(self):
         d = self.__dict__.copy()
         del d['_context']
@@ -117,10 +169,82 @@ class DefaultOpenSSLContextFactory(ContextFactory):
         return self._context
 
 
+class ClientSessionCache:
+    """
+    Remember the TLS session of connections to each server, so that the next
+    connection to it can resume the session with an abbreviated handshake.
+
+    Set it as the C{sessionCache} of a client context factory to use it.
+
+    @ivar sessions: A C{dict} mapping C{(host, port)} tuples to the
+        L{SSL.Session} last used with that address.
+    @ivar maxSize: The maximum number of sessions kept.  Once there are that
+        many, an arbitrary one is forgotten to make room for a new one.
+    @ivar fullHandshakes: The number of connections which did a full
+        handshake.
+    @ivar resumedHandshakes: The number of connections which resumed a
+        session.
+    """
+
+    def __init__(self, maxSize=1000):
+        self.maxSize = maxSize
+        self.sessions = {}
+        self.fullHandshakes = 0
+        self.resumedHandshakes = 0
+
+
+    def resume(self, connection, key):
+        """
+        Offer the session last used with C{key} on the L{SSL.Connection}
+        C{connection}, if there is one.  This must be done before the
+        handshake starts.
+        """
+        session = self.sessions.get(key)
+        if session is not None:
+            connection.set_session(session)
+
+
+    def save(self, connection, key):
+        """
+        Remember the session of the L{SSL.Connection} C{connection} for
+        C{key} and count its handshake.  Connections which never completed a
+        handshake are ignored.
+        """
+        if not hasattr(connection, 'get_session'):
+            return
+        # Without get_peer_finished, only the session itself shows whether
+        # there was a handshake.
+        getPeerFinished = getattr(connection, 'get_peer_finished', None)
+        if getPeerFinished is not None:
+            try:
+                if getPeerFinished() is None:
+                    return
+            except SSL.Error:
+                return
+        reused = _sessionReused(connection)
+        if reused:
+            self.resumedHandshakes += 1
+        elif reused is not None:
+            self.fullHandshakes += 1
+        session = connection.get_session()
+        if session is None:
+            return
+        if key not in self.sessions and len(self.sessions) >= self.maxSize:
+            self.sessions.popitem()
+        self.sessions[key] = session
+
+
+
 class ClientContextFactory:
-    """A context factory for SSL clients."""
+    """
+    A context factory for SSL clients.
+
+    @ivar sessionCache: A L{ClientSessionCache} used to resume sessions when
+        reconnecting to a server, or C{None} to always do a full handshake.
+    """
 
     isClient = 1
+    sessionCache = None
 
     # SSLv23_METHOD allows SSLv2, SSLv3, and TLSv1.  We disable SSLv2 below,
     # though.
@@ -158,9 +282,20 @@ class Client(tcp.Client):
 
     def _connectDone(self):
         self.startTLS(self.ctxFactory)
+        cache = getattr(self.ctxFactory, 'sessionCache', None)
+        if cache is not None:
+            cache.resume(self.socket, self.addr)
         self.startWriting()
         tcp.Client._connectDone(self)
 
+    def connectionLost(self, reason):
+        # By now any session ticket the server sent has been read, so this is
+        # the best time to remember the session.
+        cache = getattr(self.ctxFactory, 'sessionCache', None)
+        if cache is not None:
+            cache.save(self.socket, self.addr)
+        tcp.Client.connectionLost(self, reason)
+
 
 class Server(tcp.Server):
     """I am an SSL server.
@@ -223,6 +358,7 @@ from twisted.internet._sslverify import OpenSSLCertificateOptions as Certificate
 
 __all__ = [
     "ContextFactory", "DefaultOpenSSLContextFactory", "ClientContextFactory",
+    "ClientSessionCache",
 
     'DistinguishedName', 'DN',
     'Certificate', 'CertificateRequest', 'PrivateCertificate',
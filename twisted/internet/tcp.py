@@ -136,6 +136,13 @@ class _TLSMixin:
         try:
             return Connection.doRead(self)
         except SSL.ZeroReturnError:
+            # The peer sent a close alert.  Answer it with our own, as TLS
+            # asks us to; OpenSSL also discards the session of a connection
+            # which is closed without one, and it could not be resumed.
+            try:
+                self.socket.shutdown()
+            except SSL.Error:
+                pass
             return main.CONNECTION_DONE
         except SSL.WantReadError:
             return
@@ -13,8 +13,11 @@ from zope.interface import implements
 from twisted.python.threadpool import ThreadPool
 from twisted.python.util import setIDFunction
 from twisted.internet.interfaces import IReactorTime, IReactorThreads
+from twisted.internet.interfaces import IResolverSimple
 from twisted.internet.error import DNSLookupError
-from twisted.internet.base import ThreadedResolver, DelayedCall
+from twisted.internet.base import ThreadedResolver, CachingResolver
+from twisted.internet.base import DelayedCall
+from twisted.internet.defer import Deferred
 from twisted.internet.task import Clock
 from twisted.trial.unittest import TestCase
 
@@ -154,6 +157,145 @@ class ThreadedResolverTests(TestCase):
 
 
 
+class ControlledResolver(object):
+    """
+    An L{IResolverSimple} provider which records each lookup and lets the
+    test decide when and how it completes.
+
+    @ivar lookups: A list of C{(name, Deferred)} tuples, one per lookup.
+    """
+    implements(IResolverSimple)
+
+    def __init__(self):
+        self.lookups = []
+
+
+    def getHostByName(self, name, timeout=(1, 3, 11, 45)):
+        d = Deferred()
+        self.lookups.append((name, d))
+        return d
+
+
+
+class CachingResolverTests(TestCase):
+    """
+    Tests for L{CachingResolver}.
+    """
+    def setUp(self):
+        self.clock = Clock()
+        self.wrapped = ControlledResolver()
+        self.resolver = CachingResolver(
+            self.clock, self.wrapped, positiveTTL=60, negativeTTL=5,
+            maxSize=2)
+
+
+    def test_interface(self):
+        """
+        L{CachingResolver} provides L{IResolverSimple}.
+        """
+        self.assertTrue(IResolverSimple.providedBy(self.resolver))
+
+
+    def test_positiveCaching(self):
+        """
+        A successful lookup is answered from the cache, without consulting the
+        wrapped resolver, until C{positiveTTL} seconds have passed.
+        """
+        results = []
+        self.resolver.getHostByName("example.com").addCallback(
+            results.append)
+        self.wrapped.lookups[0][1].callback("10.0.0.1")
+        self.clock.advance(59)
+        self.resolver.getHostByName("example.com").addCallback(
+            results.append)
+        self.assertEqual(results, ["10.0.0.1", "10.0.0.1"])
+        self.assertEqual(len(self.wrapped.lookups), 1)
+        self.assertEqual((self.resolver.hits, self.resolver.misses), (1, 1))
+
+        self.clock.advance(1)
+        self.resolver.getHostByName("example.com")
+        self.assertEqual(len(self.wrapped.lookups), 2)
+        self.assertEqual(self.resolver.misses, 2)
+
+
+    def test_negativeCaching(self):
+        """
+        A failed lookup is answered from the cache with the same failure until
+        C{negativeTTL} seconds have passed.
+        """
+        self.resolver.getHostByName("example.com").addErrback(lambda f: None)
+        self.wrapped.lookups[0][1].errback(DNSLookupError("example.com"))
+        d = self.resolver.getHostByName("example.com")
+        self.assertFailure(d, DNSLookupError)
+        self.assertEqual(len(self.wrapped.lookups), 1)
+        self.assertEqual(self.resolver.hits, 1)
+
+        self.clock.advance(5)
+        self.resolver.getHostByName("example.com")
+        self.assertEqual(len(self.wrapped.lookups), 2)
+        return d
+
+
+    def test_noNegativeCaching(self):
+        """
+        If C{negativeTTL} is C{0}, failed lookups are not cached.
+        """
+        self.resolver.negativeTTL = 0
+        self.resolver.getHostByName("example.com").addErrback(lambda f: None)
+        self.wrapped.lookups[0][1].errback(DNSLookupError("example.com"))
+        self.resolver.getHostByName("example.com")
+        self.assertEqual(len(self.wrapped.lookups), 2)
+
+
+    def test_mergeConcurrentLookups(self):
+        """
+        Lookups of a name for which a lookup is already in progress wait for
+        that lookup instead of starting their own.
+        """
+        results = []
+        for i in range(3):
+            self.resolver.getHostByName("example.com").addCallback(
+                results.append)
+        self.assertEqual(len(self.wrapped.lookups), 1)
+        self.assertEqual(self.resolver.merged, 2)
+        self.wrapped.lookups[0][1].callback("10.0.0.1")
+        self.assertEqual(results, ["10.0.0.1"] * 3)
+
+
+    def test_leastRecentlyUsedEviction(self):
+        """
+        When more than C{maxSize} names have been looked up, the least
+        recently used one is removed from the cache.
+        """
+        for name in ["a", "b"]:
+            self.resolver.getHostByName(name)
+            self.wrapped.lookups[-1][1].callback("10.0.0.1")
+        self.resolver.getHostByName("a")
+        self.resolver.getHostByName("c")
+        self.wrapped.lookups[-1][1].callback("10.0.0.2")
+        self.assertEqual(len(self.wrapped.lookups), 3)
+
+        self.resolver.getHostByName("a")
+        self.resolver.getHostByName("c")
+        self.assertEqual(len(self.wrapped.lookups), 3)
+        self.resolver.getHostByName("b")
+        self.assertEqual(self.wrapped.lookups[-1][0], "b")
+
+
+    def test_orderCompaction(self):
+        """
+        Repeated cache hits do not grow the internal usage order without
+        bound.
+        """
+        self.resolver.getHostByName("a")
+        self.wrapped.lookups[-1][1].callback("10.0.0.1")
+        for i in range(1000):
+            self.resolver.getHostByName("a")
+        self.assertTrue(len(self.resolver._order) <= 2 * 2 + 16)
+        self.assertEqual(self.resolver.hits, 1000)
+
+
+
 class DelayedCallTests(TestCase):
     """
     Tests for L{DelayedCall}.
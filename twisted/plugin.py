@@ -12,6 +12,7 @@ Plugin system for Twisted.
 
 import os
 import sys
+import imp
 
 from zope.interface import Interface, providedBy
 
@@ -30,8 +31,8 @@ pickle = _determinePickleModule()
 
 from twisted.python.components import getAdapterFactory
 from twisted.python.reflect import namedAny
+from twisted.python.hashlib import md5
 from twisted.python import log
-from twisted.python.modules import getModule
 
 
 
@@ -46,7 +47,29 @@ class IPlugin(Interface):
 
 
 
+def _qualifiedName(interface):
+    """
+    Return the fully qualified Python name of C{interface}.
+    """
+    return interface.__module__ + '.' + interface.__name__
+
+
+
 class CachedPlugin(object):
+    """
+    A plugin as described by a plugin index, which can be matched against an
+    interface without importing the module defining it.
+
+    @ivar provided: The interfaces the plugin directly provides.  For a
+        plugin read from an index, looking them up imports the modules
+        defining them.
+    @ivar providedNames: The fully qualified names of the interfaces the
+        plugin directly provides.
+    @ivar _ancestry: A C{dict} with the fully qualified names of the provided
+        interfaces and all the interfaces they extend as keys.
+    """
+    _provided = None
+
     def __init__(self, dropin, name, description, provided):
         self.dropin = dropin
         self.name = name
@@ -54,18 +77,53 @@ class CachedPlugin(object):
         self.provided = provided
         self.dropin.plugins.append(self)
 
+    def _fromIndex(cls, dropin, name, description, providedNames, ancestry):
+        """
+        Create a L{CachedPlugin} from the names recorded in an index entry,
+        without importing the interfaces they refer to.
+        """
+        self = cls.__new__(cls)
+        self.dropin = dropin
+        self.name = name
+        self.description = description
+        self.providedNames = providedNames
+        self._ancestry = fromkeys(ancestry)
+        dropin.plugins.append(self)
+        return self
+    _fromIndex = classmethod(_fromIndex)
+
     def __repr__(self):
         return '<CachedPlugin %r/%r (provides %r)>' % (
             self.name, self.dropin.moduleName,
-            ', '.join([i.__name__ for i in self.provided]))
+            ', '.join([n.split('.')[-1] for n in self.providedNames]))
+
+    def _getProvided(self):
+        if self._provided is None:
+            self._provided = [namedAny(name) for name in self.providedNames]
+        return self._provided
+
+    def _setProvided(self, provided):
+        self._provided = provided
+        self.providedNames = [_qualifiedName(i) for i in provided]
+        self._ancestry = {}
+        for interface in provided:
+            for base in interface.__iro__:
+                self._ancestry[_qualifiedName(base)] = None
+
+    provided = property(_getProvided, _setProvided)
 
     def load(self):
         return namedAny(self.dropin.moduleName + '.' + self.name)
 
     def __conform__(self, interface, registry=None, default=None):
-        for providedInterface in self.provided:
-            if providedInterface.isOrExtends(interface):
-                return self.load()
+        if _qualifiedName(interface) in self._ancestry:
+            return self.load()
+        for name in self.providedNames:
+            # An adapter can only have been registered for a provided
+            # interface if the module defining it has been imported.
+            if '.'.join(name.split('.')[:-1]) not in sys.modules:
+                continue
+            providedInterface = namedAny(name)
             if getAdapterFactory(providedInterface, interface, None) is not None:
                 return interface(self.load(), default)
         return default
@@ -99,15 +157,6 @@ class CachedDropin(object):
 
 
 
-def _generateCacheEntry(provider):
-    dropin = CachedDropin(provider.__name__,
-                          provider.__doc__)
-    for k, v in provider.__dict__.iteritems():
-        plugin = IPlugin(v, None)
-        if plugin is not None:
-            cachedPlugin = CachedPlugin(dropin, k, v.__doc__, list(providedBy(plugin)))
-    return dropin
-
 try:
     fromkeys = dict.fromkeys
 except AttributeError:
@@ -117,69 +166,292 @@ except AttributeError:
             d[k] = value
         return d
 
+
+# The version of the format of the plugin index files.  An index in any other
+# format (including the pickled L{CachedDropin}s of earlier releases) is
+# ignored and rewritten, in the user's cache directory if it cannot be
+# replaced.
+_INDEX_VERSION = 2
+
+if __doc__ is None:
+    _PYTHON_EXTENSIONS = ['.py', '.pyo']
+else:
+    _PYTHON_EXTENSIONS = ['.py', '.pyc']
+
+# The suffixes of the files a module can be imported from, in the order
+# import tries them, except that a .py file is preferred over compiled ones.
+_MODULE_SUFFIXES = [
+    suffix for (suffix, mode, kind) in imp.get_suffixes()
+    if kind == imp.C_EXTENSION] + _PYTHON_EXTENSIONS
+
+
+
+def _isPythonIdentifier(string):
+    """
+    Cheap test for whether C{string} can be the name of a module.
+    """
+    return ' ' not in string and '.' not in string and '-' not in string
+
+
+
+def _moduleFiles(directory):
+    """
+    Find the modules in a plugin directory.
+
+    @return: A list of C{(name, path)} tuples, giving for each module in
+        C{directory} the file whose modification time decides whether it
+        needs to be indexed again.  That is the file import would use, except
+        that a C{.py} file is preferred over compiled ones; for a package it
+        is its C{__init__} file.
+    """
+    try:
+        children = os.listdir(directory)
+    except OSError:
+        return []
+    found = {}
+    for child in children:
+        path = os.path.join(directory, child)
+        for preference, suffix in enumerate(_MODULE_SUFFIXES):
+            if child.endswith(suffix):
+                name = child[:-len(suffix)]
+                break
+        else:
+            if '.' in child or not os.path.isdir(path):
+                continue
+            for ext in _PYTHON_EXTENSIONS:
+                init = os.path.join(path, '__init__' + ext)
+                if os.path.exists(init):
+                    path = init
+                    break
+            else:
+                continue
+            # Packages come before modules of the same name.
+            name, preference = child, -1
+        if name == '__init__' or not _isPythonIdentifier(name):
+            continue
+        if name not in found or preference < found[name][0]:
+            found[name] = (preference, path)
+    names = found.keys()
+    names.sort()
+    return [(name, found[name][1]) for name in names]
+
+
+
+def _inArchive(entry):
+    """
+    Is the C{__path__} entry C{entry} a directory inside an archive, such as
+    a zip file or an egg, rather than a directory?
+    """
+    path = entry
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            return False
+        path = parent
+    return path != entry and os.path.isfile(path)
+
+
+
+def _archivedModuleFiles(package, entry):
+    """
+    Find the modules of C{package} in the archived C{__path__} entry
+    C{entry} with L{twisted.python.modules}.
+
+    @return: A list of C{(name, path)} tuples like L{_moduleFiles}, with
+        the paths as L{twisted.python.zippath.ZipPath}s.
+    """
+    # twisted.python.modules is expensive to import, and most processes only
+    # ever look at plugins in directories, so it is only imported here.
+    from twisted.python.modules import getModule
+    result = []
+    for pluginModule in getModule(package.__name__).iterModules():
+        entryPath = pluginModule.filePath.parent()
+        if pluginModule.isPackage():
+            entryPath = entryPath.parent()
+        if entryPath.path == entry:
+            result.append((pluginModule.name.split('.')[-1],
+                           pluginModule.filePath))
+    return result
+
+
+
+def _userIndexPath(directory):
+    """
+    Return the path of the index of the plugin directory C{directory} kept in
+    the user's cache directory, for when its C{dropin.cache} cannot be
+    written.  The cache directory is C{$XDG_CACHE_HOME}, or C{~/.cache}.
+    """
+    cache = os.environ.get('XDG_CACHE_HOME')
+    if not cache:
+        cache = os.path.join(os.path.expanduser('~'), '.cache')
+    name = md5(os.path.abspath(directory)).hexdigest() + '.cache'
+    return os.path.join(cache, 'twisted', 'plugins', name)
+
+
+
+def _readIndex(path):
+    """
+    Read the plugin index at C{path}.
+
+    @return: A C{dict} mapping module names to index entries, empty if there
+        is no usable index.
+    """
+    try:
+        indexFile = open(path, 'rb')
+    except IOError:
+        return {}
+    try:
+        try:
+            index = pickle.load(indexFile)
+        except:
+            return {}
+    finally:
+        indexFile.close()
+    if not isinstance(index, dict) or index.get('version') != _INDEX_VERSION:
+        return {}
+    return index['modules']
+
+
+
+def _writeIndex(path, modules):
+    """
+    Replace the plugin index at C{path}, creating the directory it is in if
+    necessary.
+    """
+    from twisted.python.filepath import FilePath
+    index = FilePath(path)
+    if not index.parent().isdir():
+        index.parent().makedirs()
+    index.setContent(
+        pickle.dumps({'version': _INDEX_VERSION, 'modules': modules},
+                     pickle.HIGHEST_PROTOCOL))
+
+
+
+def _isCurrent(entry, path, mtime):
+    """
+    Does the index entry C{entry} describe the module file C{path} as it was
+    when last modified at C{mtime}?
+    """
+    return entry is not None and entry[0] == path and entry[1] == mtime
+
+
+
+def _generateIndexEntry(path, mtime, provider):
+    """
+    Describe the plugins of the module C{provider}, loaded from C{path}, in
+    the format of a C{dropin.cache} index entry.
+
+    Only plain strings, numbers and containers are used so that loading the
+    index does not import the modules defining the interfaces.
+    """
+    plugins = []
+    for k, v in provider.__dict__.iteritems():
+        plugin = IPlugin(v, None)
+        if plugin is not None:
+            provided = list(providedBy(plugin))
+            ancestry = {}
+            for interface in provided:
+                for base in interface.__iro__:
+                    ancestry[_qualifiedName(base)] = None
+            plugins.append((k, v.__doc__,
+                            [_qualifiedName(i) for i in provided],
+                            ancestry.keys()))
+    return (path, mtime, provider.__doc__, plugins)
+
+
+
 def getCache(module):
     """
     Compute all the possible loadable plugins, while loading as few as
     possible and hitting the filesystem as little as possible.
 
+    Each directory of the package keeps an index of the plugins of its
+    modules in a C{dropin.cache} file, recording the modification time of
+    each module.  Only the modules which are new or have changed since they
+    were indexed are imported, and the index is rewritten to include them.
+    If it cannot be written, for example because the plugins were installed
+    system-wide, the index is kept in the user's cache directory instead
+    (see L{_userIndexPath}), and that one is read for the modules the
+    directory's own index does not describe.  No index can be kept for
+    C{__path__} entries inside archives such as eggs, so their modules are
+    always imported.
+
     @param module: a Python module object.  This represents a package to search
     for plugins.
 
     @return: a dictionary mapping module names to CachedDropin instances.
     """
     allCachesCombined = {}
-    mod = getModule(module.__name__)
-    # don't want to walk deep, only immediate children.
-    lastPath = None
-    buckets = {}
-    # Fill buckets with modules by related entry on the given package's
-    # __path__.  There's an abstraction inversion going on here, because this
-    # information is already represented internally in twisted.python.modules,
-    # but it's simple enough that I'm willing to live with it.  If anyone else
-    # wants to fix up this iteration so that it's one path segment at a time,
-    # be my guest.  --glyph
-    for plugmod in mod.iterModules():
-        fpp = plugmod.filePath.parent()
-        if fpp not in buckets:
-            buckets[fpp] = []
-        bucket = buckets[fpp]
-        bucket.append(plugmod)
-    for pseudoPackagePath, bucket in buckets.iteritems():
-        dropinPath = pseudoPackagePath.child('dropin.cache')
-        try:
-            lastCached = dropinPath.getModificationTime()
-            dropinDotCache = pickle.load(dropinPath.open('rb'))
-        except:
-            dropinDotCache = {}
-            lastCached = 0
-
+    seen = {}
+    for directory in module.__path__:
+        archived = _inArchive(directory)
+        if archived:
+            indexed = {}
+            moduleFiles = _archivedModuleFiles(module, directory)
+        else:
+            indexPath = os.path.join(directory, 'dropin.cache')
+            indexed = _readIndex(indexPath)
+            moduleFiles = _moduleFiles(directory)
+        # The index in the user's cache directory, once it has been read.
+        userIndexed = None
+        modules = {}
         needsWrite = False
-        existingKeys = {}
-        for pluginModule in bucket:
-            pluginKey = pluginModule.name.split('.')[-1]
-            existingKeys[pluginKey] = True
-            if ((pluginKey not in dropinDotCache) or
-                (pluginModule.filePath.getModificationTime() >= lastCached)):
+        for name, path in moduleFiles:
+            if name in seen:
+                # Obscured by a module of the same name in an earlier
+                # directory, as it is for import.
+                continue
+            seen[name] = True
+            try:
+                if archived:
+                    mtime = path.getModificationTime()
+                    path = path.path
+                else:
+                    mtime = os.path.getmtime(path)
+            except OSError:
+                continue
+            entry = indexed.get(name)
+            if not _isCurrent(entry, path, mtime) and not archived:
                 needsWrite = True
+                if userIndexed is None:
+                    userIndexed = _readIndex(_userIndexPath(directory))
+                entry = userIndexed.get(name)
+            if not _isCurrent(entry, path, mtime):
                 try:
-                    provider = pluginModule.load()
+                    provider = namedAny(module.__name__ + '.' + name)
                 except:
-                    # dropinDotCache.pop(pluginKey, None)
                     log.err()
-                else:
-                    entry = _generateCacheEntry(provider)
-                    dropinDotCache[pluginKey] = entry
-        # Make sure that the cache doesn't contain any stale plugins.
-        for pluginKey in dropinDotCache.keys():
-            if pluginKey not in existingKeys:
-                del dropinDotCache[pluginKey]
-                needsWrite = True
-        if needsWrite:
+                    continue
+                entry = _generateIndexEntry(path, mtime, provider)
+            modules[name] = entry
+
+            dropin = CachedDropin(module.__name__ + '.' + name, entry[2])
+            for (pluginName, description, provided, ancestry) in entry[3]:
+                CachedPlugin._fromIndex(
+                    dropin, pluginName, description, provided, ancestry)
+            allCachesCombined[name] = dropin
+
+        if archived:
+            continue
+        # Also rewrite the index if modules have disappeared from it.
+        if not needsWrite and len(modules) == len(indexed):
+            continue
+        try:
+            _writeIndex(indexPath, modules)
+        except (IOError, OSError):
+            # Only rewrite the index in the user's cache directory if it
+            # does not already describe exactly these modules.
+            if userIndexed is None:
+                userIndexed = _readIndex(_userIndexPath(directory))
+            if userIndexed == modules:
+                continue
             try:
-                dropinPath.setContent(pickle.dumps(dropinDotCache))
+                _writeIndex(_userIndexPath(directory), modules)
             except:
                 log.err()
-        allCachesCombined.update(dropinDotCache)
+        except:
+            log.err()
     return allCachesCombined
 
 
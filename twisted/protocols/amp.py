@@ -135,7 +135,10 @@ be generated and any ordering must be accepted.  This applies to the
 command-related keys I{_command} and I{_ask} as well as any other keys.
 
 Values are limited to the maximum encodable size in a 16-bit length, 65535
-bytes.
+bytes.  Longer byte strings can be passed to commands as L{ByteStream}
+arguments, which are transferred in boxes with a I{_stream} key, separately
+from the box which carries the rest of the command, and interleaved with
+other traffic.
 
 Keys are limited to the maximum encodable size in a 8-bit length, 255 bytes.
 Note that we still use 2-byte lengths to encode keys.  This small redundancy
@@ -160,10 +163,11 @@ has several features:
 
 __metaclass__ = type
 
-import types, warnings
+import types, warnings, time
 
 from cStringIO import StringIO
 from struct import pack
+from bisect import bisect_left
 
 from zope.interface import Interface, implements
 
@@ -177,7 +181,9 @@ from twisted.internet.main import CONNECTION_LOST
 from twisted.internet.error import PeerVerifyError, ConnectionLost
 from twisted.internet.error import ConnectionClosed
 from twisted.internet.defer import Deferred, maybeDeferred, fail
+from twisted.internet.interfaces import IConsumer, IPushProducer
 from twisted.protocols.basic import Int16StringReceiver, StatefulStringProtocol
+from twisted.protocols.basic import _getUnpacker, FileSender
 
 try:
     from twisted.internet import ssl
@@ -196,12 +202,26 @@ COMMAND = '_command'
 ERROR = '_error'
 ERROR_CODE = '_error_code'
 ERROR_DESCRIPTION = '_error_description'
+STREAM = '_stream'
+STREAM_CHUNK = '_chunk'
+STREAM_END = '_end'
+STREAM_ACK = '_ack'
+STREAM_CANCEL = '_cancel'
 UNKNOWN_ERROR_CODE = 'UNKNOWN'
 UNHANDLED_ERROR_CODE = 'UNHANDLED'
 
 MAX_KEY_LENGTH = 0xff
 MAX_VALUE_LENGTH = 0xffff
 
+# The length-prefixed wire encodings of keys which are used over and over:
+# the protocol's own keys and the argument names of every Command.  See
+# _ArgumentSchema.
+_keyPrefixes = {}
+for _key in [ASK, ANSWER, COMMAND, ERROR, ERROR_CODE, ERROR_DESCRIPTION,
+             STREAM, STREAM_CHUNK, STREAM_END, STREAM_ACK, STREAM_CANCEL]:
+    _keyPrefixes[_key] = pack("!H", len(_key)) + _key
+del _key
+
 
 class IArgumentType(Interface):
     """
@@ -492,6 +512,14 @@ class UnhandledCommand(AmpError):
 
 
 
+class StreamAborted(AmpError):
+    """
+    A L{ByteStream} was not transferred completely, because its source failed
+    or its receiver stopped it.
+    """
+
+
+
 class IncompatibleVersions(AmpError):
     """
     It was impossible to negotiate a compatible version of the protocol with
@@ -523,21 +551,23 @@ class AmpBox(dict):
         Convert me into a wire-encoded string.
 
         @return: a str encoded according to the rules described in the module
-        docstring.
+        docstring.  The keys are in no particular order.
         """
-        i = self.items()
-        i.sort()
         L = []
         w = L.append
-        for k, v in i:
-            if len(k) > MAX_KEY_LENGTH:
-                raise TooLong(True, True, k, None)
+        prefixes = _keyPrefixes
+        for k, v in self.iteritems():
+            prefix = prefixes.get(k)
+            if prefix is None:
+                if len(k) > MAX_KEY_LENGTH:
+                    raise TooLong(True, True, k, None)
+                prefix = pack("!H", len(k)) + k
             if len(v) > MAX_VALUE_LENGTH:
                 raise TooLong(False, True, v, k)
-            for kv in k, v:
-                w(pack("!H", len(kv)))
-                w(kv)
-        w(pack("!H", 0))
+            w(prefix)
+            w(pack("!H", len(v)))
+            w(v)
+        w('\x00\x00')
         return ''.join(L)
 
 
@@ -580,6 +610,9 @@ class QuitBox(AmpBox):
         Immediately call loseConnection after sending.
         """
         super(QuitBox, self)._sendTo(proto)
+        flushBoxes = getattr(proto, 'flushBoxes', None)
+        if flushBoxes is not None:
+            flushBoxes()
         proto.transport.loseConnection()
 
 
@@ -619,6 +652,114 @@ class _SwitchBox(AmpBox):
 
 
 
+class CommandStatistics:
+    """
+    Counters and a latency histogram for one kind of command, kept by a
+    L{BoxDispatcher}.
+
+    Latencies are counted in buckets: C{histogram[i]} is the number of
+    latencies no longer than C{buckets[i]} seconds (and longer than the bucket
+    before it), and the last element of C{histogram} counts those longer than
+    every bucket.
+
+    @ivar name: the name of the command.
+
+    @ivar calls: the number of times the command was issued (for outgoing
+        calls) or dispatched to a responder (for incoming ones).
+
+    @ivar answers: the number of calls which succeeded.
+
+    @ivar errors: the number of calls which failed.
+
+    @ivar totalLatency: the sum of the latencies of all finished calls, in
+        seconds.
+
+    @ivar maxLatency: the longest latency of any finished call, in seconds.
+
+    @ivar buckets: a sorted sequence of the upper bounds of the histogram
+        buckets, in seconds.
+
+    @ivar histogram: a list of C{len(buckets) + 1} counts.
+    """
+
+    buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+               0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.answers = 0
+        self.errors = 0
+        self.totalLatency = 0.0
+        self.maxLatency = 0.0
+        self.histogram = [0] * (len(self.buckets) + 1)
+
+
+    def __repr__(self):
+        return '<CommandStatistics %s calls=%d answers=%d errors=%d>' % (
+            self.name, self.calls, self.answers, self.errors)
+
+
+    def record(self, latency, succeeded=True):
+        """
+        Count a finished call.
+
+        @param latency: the time the call took, in seconds.
+
+        @param succeeded: whether the call succeeded.
+        """
+        if succeeded:
+            self.answers += 1
+        else:
+            self.errors += 1
+        self.totalLatency += latency
+        if latency > self.maxLatency:
+            self.maxLatency = latency
+        self.histogram[bisect_left(self.buckets, latency)] += 1
+
+
+    def finished(self):
+        """
+        @return: the number of calls which have finished.
+        """
+        return self.answers + self.errors
+
+
+    def averageLatency(self):
+        """
+        @return: the mean latency of the finished calls in seconds, or C{None}
+            if none have finished.
+        """
+        finished = self.finished()
+        if not finished:
+            return None
+        return self.totalLatency / finished
+
+
+    def percentile(self, fraction):
+        """
+        Estimate a latency percentile from the histogram.
+
+        @param fraction: a number between 0 and 1; for example, C{0.99} for
+            the 99th percentile.
+
+        @return: the upper bound of the bucket holding that percentile, which
+            is L{maxLatency} for the last bucket, or C{None} if no calls have
+            finished.
+        """
+        finished = self.finished()
+        if not finished:
+            return None
+        wanted = fraction * finished
+        seen = 0
+        for bound, count in zip(self.buckets, self.histogram):
+            seen += count
+            if seen >= wanted and seen:
+                return bound
+        return self.maxLatency
+
+
+
 class BoxDispatcher:
     """
     A L{BoxDispatcher} dispatches '_ask', '_answer', and '_error' L{AmpBox}es,
@@ -635,6 +776,39 @@ class BoxDispatcher:
     @ivar _outstandingRequests: a dictionary mapping request IDs to
     L{Deferred}s which were returned for those requests.
 
+    @ivar _waitingRequests: a list of C{(command, box, requiresAnswer,
+    deferred, streams)} tuples for commands which have been issued but not
+    yet sent because L{maxOutstandingRequests} answers were already awaited.
+
+    @ivar _outgoingStreams: a dictionary mapping stream identifiers to the
+    L{_StreamSender}s of the L{ByteStream}s being sent.
+
+    @ivar _incomingStreams: a dictionary mapping stream identifiers to the
+    L{IncomingStream}s being received.
+
+    @ivar _receivedStreams: the L{IncomingStream}s received in the box being
+    parsed, which are cancelled unless they are being delivered once the
+    box has been handled.
+
+    @ivar _newStreams: the L{_StreamSender}s started since the last command
+    was issued, which are those of its arguments when it is.
+
+    @ivar _commandStreams: a dictionary mapping request IDs to the
+    L{_StreamSender}s of the arguments of those requests.
+
+    @ivar maxOutstandingRequests: the largest number of commands to have sent
+    without having received their answers, or C{None} for no limit.  Further
+    commands are held, in the order they were issued, until answers arrive.
+
+    @ivar callStatistics: a dictionary mapping command names to
+    L{CommandStatistics} for the commands issued on this connection; their
+    latencies include any time spent waiting to be sent.
+
+    @ivar responderStatistics: a dictionary mapping command names to
+    L{CommandStatistics} for the commands received on this connection and
+    dispatched to a responder; their latencies are the time taken to produce
+    an answer.
+
     @ivar locator: an object with a L{locateResponder} method that locates a
     responder function that takes a Box and returns a result (either a Box or a
     Deferred which fires one).
@@ -649,10 +823,20 @@ class BoxDispatcher:
     _failAllReason = None
     _outstandingRequests = None
     _counter = 0L
+    _streamCounter = 0L
     boxSender = None
+    maxOutstandingRequests = None
 
     def __init__(self, locator):
         self._outstandingRequests = {}
+        self._waitingRequests = []
+        self.callStatistics = {}
+        self.responderStatistics = {}
+        self._outgoingStreams = {}
+        self._incomingStreams = {}
+        self._receivedStreams = []
+        self._newStreams = []
+        self._commandStreams = {}
         self.locator = locator
 
 
@@ -669,9 +853,18 @@ class BoxDispatcher:
     def stopReceivingBoxes(self, reason):
         """
         No further boxes will be received here.  Terminate all currently
-        oustanding command deferreds with the given reason.
+        oustanding command deferreds and streams with the given reason.
         """
         self.failAllOutgoing(reason)
+        for sender in self._outgoingStreams.values():
+            sender._stop()
+        for stream in self._incomingStreams.values():
+            stream._endReceived(reason)
+        self._outgoingStreams.clear()
+        self._incomingStreams.clear()
+        self._receivedStreams = []
+        self._commandStreams.clear()
+        self._newStreams = []
 
 
     def failAllOutgoing(self, reason):
@@ -683,8 +876,13 @@ class BoxDispatcher:
         self._failAllReason = reason
         OR = self._outstandingRequests.items()
         self._outstandingRequests = None # we can never send another request
+        waiting = self._waitingRequests
+        self._waitingRequests = []
         for key, value in OR:
             value.errback(reason)
+        for command, box, requiresAnswer, result, streams in waiting:
+            if result is not None:
+                result.errback(reason)
 
 
     def _nextTag(self):
@@ -719,6 +917,10 @@ class BoxDispatcher:
         Deferred which will fire when the other side responds to this command.
         If False, return None and do not ask the other side for acknowledgement.
 
+        If L{maxOutstandingRequests} answers are already awaited, or other
+        commands are already waiting, the box is not sent until answers
+        arrive.
+
         @return: a Deferred which fires the AmpBox that holds the response to
         this command, or None, as specified by requiresAnswer.
 
@@ -726,15 +928,96 @@ class BoxDispatcher:
         """
         if self._failAllReason is not None:
             return fail(self._failAllReason)
+        # Any streams which were started for this command's arguments were
+        # started since the last one was sent.
+        streams, self._newStreams = self._newStreams, []
+        stats = self._getStatistics(self.callStatistics, command)
+        stats.calls += 1
+        if requiresAnswer:
+            result = Deferred()
+            result.addBoth(self._callFinished, stats, self._now())
+        else:
+            result = None
+        if self._waitingRequests or (
+            requiresAnswer and self.maxOutstandingRequests is not None and
+            len(self._outstandingRequests) >= self.maxOutstandingRequests):
+            self._waitingRequests.append(
+                (command, box, requiresAnswer, result, streams))
+        else:
+            self._issueBoxCommand(
+                command, box, requiresAnswer, result, streams)
+        return result
+
+
+    def _issueBoxCommand(self, command, box, requiresAnswer, result,
+                         streams=()):
+        """
+        Actually send a command issued with L{_sendBoxCommand}.
+
+        @param result: the L{Deferred} to fire with the answer, or C{None} if
+            no answer is wanted.
+
+        @param streams: the L{_StreamSender}s for the L{ByteStream}s among
+            the command's arguments.
+        """
         box[COMMAND] = command
         tag = self._nextTag()
         if requiresAnswer:
             box[ASK] = tag
         box._sendTo(self.boxSender)
         if requiresAnswer:
-            result = self._outstandingRequests[tag] = Deferred()
-        else:
-            result = None
+            self._outstandingRequests[tag] = result
+            if streams:
+                self._commandStreams[tag] = streams
+
+
+    def _sendWaitingRequests(self):
+        """
+        Send as many of the commands held back by L{maxOutstandingRequests}
+        as the limit now allows.  A command which cannot be sent fails its
+        L{Deferred}.
+        """
+        waiting = self._waitingRequests
+        limit = self.maxOutstandingRequests
+        while waiting and self._failAllReason is None:
+            command, box, requiresAnswer, result, streams = waiting[0]
+            if (requiresAnswer and limit is not None and
+                len(self._outstandingRequests) >= limit):
+                break
+            del waiting[0]
+            try:
+                self._issueBoxCommand(
+                    command, box, requiresAnswer, result, streams)
+            except:
+                if result is None:
+                    log.err()
+                else:
+                    result.errback()
+
+
+    def _now(self):
+        """
+        @return: the current time, in seconds, for L{CommandStatistics}.
+        """
+        return time.time()
+
+
+    def _getStatistics(self, statistics, command):
+        """
+        Find or create the L{CommandStatistics} for C{command} in the
+        dictionary C{statistics}.
+        """
+        stats = statistics.get(command)
+        if stats is None:
+            stats = statistics[command] = CommandStatistics(command)
+        return stats
+
+
+    def _callFinished(self, result, stats, started):
+        """
+        Record the outcome of a command in C{stats} and pass C{result} on.
+        """
+        stats.record(self._now() - started, not isinstance(result, Failure))
         return result
 
 
@@ -818,8 +1101,18 @@ class BoxDispatcher:
         @param box: an AmpBox with a value for its L{ANSWER} key.
         """
         question = self._outstandingRequests.pop(box[ANSWER])
+        self._commandAnswered(box[ANSWER])
+        if self._waitingRequests:
+            self._sendWaitingRequests()
         question.addErrback(self.unhandledError)
-        question.callback(box)
+        # The streams in the response must be delivered by the callbacks it
+        # is passed to.
+        received, self._receivedStreams = self._receivedStreams, []
+        try:
+            question.callback(box)
+        finally:
+            received, self._receivedStreams = self._receivedStreams, received
+            self._cancelUndelivered(None, received)
 
 
     def _errorReceived(self, box):
@@ -831,6 +1124,9 @@ class BoxDispatcher:
         and L{ERROR_DESCRIPTION} keys.
         """
         question = self._outstandingRequests.pop(box[ERROR])
+        self._commandAnswered(box[ERROR])
+        if self._waitingRequests:
+            self._sendWaitingRequests()
         question.addErrback(self.unhandledError)
         errorCode = box[ERROR_CODE]
         description = box[ERROR_DESCRIPTION]
@@ -841,6 +1137,18 @@ class BoxDispatcher:
         question.errback(Failure(exc))
 
 
+    def _commandAnswered(self, tag):
+        """
+        The answer or error for the command sent with C{tag} was received.
+        The peer asks for the L{ByteStream}s among a command's arguments when
+        it parses the command, before it answers it, so any of them which it
+        has not asked for by now never will be: forget about them.
+        """
+        for sender in self._commandStreams.pop(tag, ()):
+            if not sender.started:
+                sender._stop()
+
+
     def _commandReceived(self, box):
         """
         @param box: an L{AmpBox} with a value for its L{COMMAND} and L{ASK}
@@ -848,9 +1156,12 @@ class BoxDispatcher:
         """
         cmd = box[COMMAND]
         def formatAnswer(answerBox):
+            # Streams in the answer are not those of the next command.
+            self._newStreams = []
             answerBox[ANSWER] = box[ASK]
             return answerBox
         def formatError(error):
+            self._newStreams = []
             if error.check(RemoteAmpError):
                 code = error.value.errorCode
                 desc = error.value.description
@@ -893,10 +1204,106 @@ class BoxDispatcher:
             self._errorReceived(box)
         elif COMMAND in box:
             self._commandReceived(box)
+        elif STREAM in box:
+            self._streamBoxReceived(box)
         else:
             raise NoEmptyBoxes(box)
 
 
+    def _sendStream(self, source, chunkSize):
+        """
+        Start sending a L{ByteStream}.  Nothing is sent until the peer asks
+        for data, after receiving the box which includes the stream's
+        identifier.
+
+        @param source: the value of the L{ByteStream} argument.
+
+        @param chunkSize: the largest number of bytes to send in one box.
+
+        @return: the identifier of the stream, to be sent to the peer.
+        """
+        self._streamCounter += 1
+        streamID = '%x' % (self._streamCounter,)
+        sender = _StreamSender(self, streamID, source, chunkSize)
+        self._outgoingStreams[streamID] = sender
+        self._newStreams.append(sender)
+        return streamID
+
+
+    def _receiveStream(self, streamID, window):
+        """
+        Start receiving a L{ByteStream} from the peer.
+
+        @param streamID: the identifier of the stream sent by the peer.
+
+        @param window: the largest number of bytes to let the peer send
+            before they are delivered.
+
+        @return: an L{IncomingStream}.
+        """
+        stream = IncomingStream(self, streamID)
+        self._incomingStreams[streamID] = stream
+        self._receivedStreams.append(stream)
+        stream._grant(window)
+        return stream
+
+
+    def _cancelUndelivered(self, result, streams):
+        """
+        Cancel those of C{streams} which are not being delivered, and pass
+        C{result} on.
+        """
+        for stream in streams:
+            if stream.consumer is None:
+                stream._cancel("Stream was not delivered")
+        return result
+
+
+    def _sendStreamBox(self, box):
+        """
+        Send a box belonging to a L{ByteStream}.
+        """
+        self.boxSender.sendBox(box)
+
+
+    def _streamBoxReceived(self, box):
+        """
+        A box with a L{STREAM} key was received: data for or the end of one of
+        the peer's streams, or a request for more data or cancellation of one
+        of ours.  Boxes for streams which are unknown, perhaps because they
+        have already been finished here, are ignored.
+        """
+        streamID = box[STREAM]
+        if STREAM_CHUNK in box:
+            stream = self._incomingStreams.get(streamID)
+            if stream is not None:
+                stream._chunkReceived(box[STREAM_CHUNK])
+        elif STREAM_END in box:
+            stream = self._incomingStreams.get(streamID)
+            if stream is not None:
+                if ERROR_DESCRIPTION in box:
+                    stream._endReceived(
+                        Failure(StreamAborted(box[ERROR_DESCRIPTION])))
+                else:
+                    stream._endReceived(None)
+        elif STREAM_ACK in box:
+            try:
+                amount = int(box[STREAM_ACK])
+            except ValueError:
+                raise MalformedAmpBox(box)
+            if amount < 0:
+                raise MalformedAmpBox(box)
+            sender = self._outgoingStreams.get(streamID)
+            if sender is not None:
+                sender._acknowledged(amount)
+        elif STREAM_CANCEL in box:
+            sender = self._outgoingStreams.get(streamID)
+            if sender is not None:
+                sender._stop()
+        else:
+            raise MalformedAmpBox(box)
+
+
     def _safeEmit(self, aBox):
         """
         Emit a box, ignoring L{ProtocolSwitched} and L{ConnectionLost} errors
@@ -925,7 +1332,19 @@ class BoxDispatcher:
                     "Unhandled Command: %r" % (cmd,),
                     False,
                     local=Failure(UnhandledCommand())))
-        return maybeDeferred(responder, box)
+        stats = self._getStatistics(self.responderStatistics, cmd)
+        stats.calls += 1
+        started = self._now()
+        # The streams among the arguments must be delivered by the time the
+        # responder's result is ready.
+        received, self._receivedStreams = self._receivedStreams, []
+        try:
+            result = maybeDeferred(responder, box)
+        finally:
+            received, self._receivedStreams = self._receivedStreams, received
+        result.addBoth(self._cancelUndelivered, received)
+        result.addBoth(self._callFinished, stats, started)
+        return result
 
 
 
@@ -1381,20 +1800,553 @@ class AmpList(Argument):
         omitted in the protocol.
         """
         self.subargs = subargs
+        self._schema = _ArgumentSchema(subargs)
         Argument.__init__(self, optional)
 
 
     def fromStringProto(self, inString, proto):
         boxes = parseString(inString)
-        values = [_stringsToObjects(box, self.subargs, proto)
-                  for box in boxes]
+        fromBox = self._schema.fromBox
+        values = [fromBox(box, proto) for box in boxes]
         return values
 
 
     def toStringProto(self, inObject, proto):
-        return ''.join([_objectsToStrings(
-                    objects, self.subargs, Box(), proto
-                    ).serialize() for objects in inObject])
+        serialize = self._schema.serialize
+        return ''.join([serialize(objects, proto) for objects in inObject])
+
+
+
+class ByteStream(Argument):
+    """
+    Transfer any number of bytes, which may not all be available yet, without
+    holding up other commands on the same connection.
+
+    The value to send may be a C{str}, a file-like object, which will be read
+    with a L{FileSender}, or an object with a C{startProducing} method.  That
+    method is called with an L{IConsumer} to write the bytes to and must
+    return a L{Deferred} which fires when all of them have been written.  The
+    object must also provide L{IPushProducer}, so that it can be paused while
+    the receiver is not ready for more.
+
+    The value received is an L{IncomingStream}.  A responder must start
+    delivering the streams among its arguments before its result is ready,
+    and the callbacks of L{callRemote} those in the response before they
+    return; streams which are not being delivered by then are cancelled.
+
+    Only the identifier of the stream is put in the command's box.  The bytes
+    themselves follow in separate boxes, once the peer has parsed the command
+    and asked for them.  The receiver allows at most C{window} bytes which it
+    has not passed on yet to be sent to it.  Streams can only be sent over
+    and received from an L{AMP} connection.
+
+    @ivar chunkSize: The largest number of bytes to send in one box.
+    @ivar window: The largest number of bytes the receiver will buffer.
+    """
+    chunkSize = 2 ** 15
+    window = 2 ** 18
+
+    def __init__(self, optional=False, chunkSize=None, window=None):
+        Argument.__init__(self, optional)
+        if chunkSize is not None:
+            self.chunkSize = chunkSize
+        if window is not None:
+            self.window = window
+
+
+    def toStringProto(self, inObject, proto):
+        return proto._sendStream(inObject, self.chunkSize)
+
+
+    def fromStringProto(self, inString, proto):
+        return proto._receiveStream(inString, self.window)
+
+
+
+class _StreamSender:
+    """
+    The sending end of a L{ByteStream}: an L{IConsumer} for the source of the
+    bytes, which sends them to the peer in chunks as the peer allows.
+
+    @ivar credit: The number of bytes the peer is ready to receive.
+    @ivar producer: The producer registered with this consumer, or C{None}.
+    """
+    implements(IConsumer)
+
+    producer = None
+    streaming = False
+    started = False
+    finished = False
+    done = False
+    credit = 0
+
+    _producerPaused = False
+    _pulling = False
+    _error = None
+
+    def __init__(self, dispatcher, streamID, source, chunkSize):
+        self.dispatcher = dispatcher
+        self.streamID = streamID
+        self.source = source
+        self.chunkSize = chunkSize
+        self._buffer = []
+        self._buffered = 0
+        self._written = 0
+
+
+    def registerProducer(self, producer, streaming):
+        self.producer = producer
+        self.streaming = streaming
+        self._updateProducer()
+
+
+    def unregisterProducer(self):
+        self.producer = None
+
+
+    def write(self, data):
+        if self.done or not data:
+            return
+        self._buffer.append(data)
+        self._buffered += len(data)
+        self._written += len(data)
+        self._flush()
+
+
+    def _start(self):
+        """
+        Start reading from the source, the first time the peer asks for data.
+        """
+        self.started = True
+        source = self.source
+        if isinstance(source, str):
+            self.write(source)
+            self._finish(None)
+            return
+        if getattr(source, 'startProducing', None) is not None:
+            self.registerProducer(source, True)
+            d = source.startProducing(self)
+        else:
+            d = FileSender().beginFileTransfer(source, self)
+        d.addCallbacks(lambda ignored: self._finish(None), self._finish)
+
+
+    def _finish(self, reason):
+        """
+        The source has written everything it is going to, or failed.
+        """
+        if self.done:
+            return
+        if reason is not None:
+            log.err(reason, "Source of AMP stream failed")
+            self._error = reason.getErrorMessage() or reason.type.__name__
+        self.finished = True
+        self.producer = None
+        self._flush()
+
+
+    def _flush(self):
+        """
+        Send as much of the buffered data as the peer is ready for, then the
+        end of the stream if the source has finished.
+        """
+        if self._buffered and self.credit > 0:
+            data = ''.join(self._buffer)
+            offset = 0
+            while offset < len(data) and self.credit > 0:
+                size = min(self.chunkSize, self.credit, len(data) - offset)
+                self._send(STREAM_CHUNK, data[offset:offset + size])
+                if self.done:
+                    return
+                offset += size
+                self.credit -= size
+            data = data[offset:]
+            self._buffer = [data]
+            self._buffered = len(data)
+        if self.finished:
+            if not self._buffered:
+                self._close()
+                box = AmpBox({STREAM: self.streamID, STREAM_END: ''})
+                if self._error is not None:
+                    box[ERROR_DESCRIPTION] = self._error
+                self.dispatcher._sendStreamBox(box)
+        else:
+            self._updateProducer()
+
+
+    def _updateProducer(self):
+        """
+        Pause the producer while there is data the peer is not ready for, and
+        resume it, or ask a non-streaming producer for more, when there is
+        not.
+        """
+        producer = self.producer
+        if producer is None or not self.started:
+            return
+        if self._buffered or self.credit <= 0:
+            if self.streaming and not self._producerPaused:
+                self._producerPaused = True
+                producer.pauseProducing()
+        elif self.streaming:
+            if self._producerPaused:
+                self._producerPaused = False
+                producer.resumeProducing()
+        elif not self._pulling:
+            self._pulling = True
+            try:
+                while (self.producer is not None and not self._buffered
+                       and self.credit > 0 and not self.done):
+                    written = self._written
+                    self.producer.resumeProducing()
+                    if self._written == written:
+                        break
+            finally:
+                self._pulling = False
+
+
+    def _send(self, key, value):
+        box = AmpBox({STREAM: self.streamID, key: value})
+        try:
+            self.dispatcher._sendStreamBox(box)
+        except (ProtocolSwitched, ConnectionLost):
+            self._stop()
+
+
+    def _close(self):
+        """
+        Forget about this stream.
+        """
+        self.done = True
+        self._buffer = []
+        self._buffered = 0
+        self.dispatcher._outgoingStreams.pop(self.streamID, None)
+
+
+    def _stop(self):
+        """
+        Stop sending the stream and tell the source to stop producing.
+        """
+        if self.done:
+            return
+        self._close()
+        producer = self.producer
+        self.producer = None
+        if producer is not None:
+            producer.stopProducing()
+
+
+    def _acknowledged(self, amount):
+        """
+        The peer is ready for C{amount} more bytes.
+        """
+        self.credit += amount
+        if not self.started:
+            self._start()
+        else:
+            self._flush()
+
+
+
+class IncomingStream:
+    """
+    The receiving end of a L{ByteStream}.
+
+    Bytes received before L{deliverTo} is called are buffered, and the peer
+    stops sending them when the buffer holds as many as the argument's
+    C{window}.  If the peer sends more than that, the stream is aborted.
+
+    @ivar consumer: The L{IConsumer} the bytes are being delivered to, or
+        C{None}.
+    @ivar credit: The number of bytes the peer may still send.
+    """
+    implements(IPushProducer)
+
+    consumer = None
+    paused = False
+    credit = 0
+
+    _ended = False
+    _closed = False
+    _deferred = None
+    _reason = None
+
+    def __init__(self, dispatcher, streamID):
+        self.dispatcher = dispatcher
+        self.streamID = streamID
+        self._buffer = []
+
+
+    def deliverTo(self, consumer):
+        """
+        Write the bytes of this stream to C{consumer} as they arrive.  This
+        stream is registered with it as a streaming producer, and unregistered
+        when all the bytes have been written.
+
+        @param consumer: an L{IConsumer} provider.
+
+        @return: a L{Deferred} which fires with C{None} when the whole stream
+            has been written to the consumer, or fails with L{StreamAborted}
+            or the reason the connection was lost if it is not completely
+            received.
+        """
+        if self.consumer is not None:
+            raise RuntimeError("%r is already being delivered to %r" % (
+                    self, self.consumer))
+        if self._closed:
+            return fail(self._reason)
+        self.consumer = consumer
+        self._deferred = Deferred()
+        consumer.registerProducer(self, True)
+        self._deliver()
+        return self._deferred
+
+
+    def pauseProducing(self):
+        """
+        Stop writing to the consumer and stop the peer sending more once the
+        buffer is full.
+        """
+        self.paused = True
+
+
+    def resumeProducing(self):
+        """
+        Write buffered bytes to the consumer and let the peer send more.
+        """
+        self.paused = False
+        self._deliver()
+
+
+    def stopProducing(self):
+        """
+        Discard the rest of the stream and tell the peer to stop sending it.
+        """
+        self._cancel("Stream stopped by its consumer")
+
+
+    def _cancel(self, description):
+        """
+        Discard the rest of the stream, tell the peer to stop sending it and
+        fail it with L{StreamAborted}.
+        """
+        if self._closed:
+            return
+        if not self._ended:
+            self._send(STREAM_CANCEL, '')
+        self._buffer = []
+        self._end(Failure(StreamAborted(description)))
+
+
+    def _grant(self, amount):
+        """
+        Let the peer send another C{amount} bytes.
+        """
+        self.credit += amount
+        self._send(STREAM_ACK, str(amount))
+
+
+    def _send(self, key, value):
+        try:
+            self.dispatcher._sendStreamBox(
+                AmpBox({STREAM: self.streamID, key: value}))
+        except (ProtocolSwitched, ConnectionLost):
+            pass
+
+
+    def _chunkReceived(self, data):
+        if self._closed:
+            return
+        self.credit -= len(data)
+        if self.credit < 0:
+            self._cancel("Peer sent more of the stream than it was allowed")
+            return
+        self._buffer.append(data)
+        self._deliver()
+
+
+    def _endReceived(self, reason):
+        """
+        The peer has sent all of the stream, or has given up on it, or the
+        connection has been lost.
+
+        @param reason: C{None} or a L{Failure}.
+        """
+        if self._ended:
+            return
+        self._ended = True
+        if reason is not None:
+            self._buffer = []
+            self._end(reason)
+        else:
+            self._deliver()
+
+
+    def _deliver(self):
+        """
+        Write as much of the buffer to the consumer as it will accept, and
+        finish the stream if it has all been received.
+        """
+        if self.consumer is None or self._closed:
+            return
+        delivered = 0
+        while self._buffer and not self.paused:
+            data = self._buffer.pop(0)
+            delivered += len(data)
+            self.consumer.write(data)
+        if self._closed:
+            return
+        if not self._buffer and self._ended:
+            self._end(None)
+        elif delivered:
+            self._grant(delivered)
+
+
+    def _end(self, reason):
+        """
+        Forget about this stream and report C{reason}, C{None} if the whole
+        stream was delivered, to the caller of L{deliverTo}.  If it has not
+        been called yet, it will return a failure with C{reason}.
+        """
+        self._closed = True
+        self._reason = reason
+        self.dispatcher._incomingStreams.pop(self.streamID, None)
+        if self.consumer is not None:
+            self.consumer.unregisterProducer()
+        if self._deferred is not None:
+            if reason is None:
+                self._deferred.callback(None)
+            else:
+                self._deferred.errback(reason)
+
+
+
+def _hasDefaultBoxing(argument):
+    """
+    Determine whether C{argument} converts values to and from boxes with the
+    implementations of C{toBox}, C{fromBox} and C{retrieve} that
+    L{Argument} provides, so that only its C{toStringProto} and
+    C{fromStringProto} methods need to be called.
+    """
+    for name in ['toBox', 'fromBox', 'retrieve']:
+        method = getattr(argument, name, None)
+        if getattr(method, 'im_func', None) is not getattr(
+            Argument, name).im_func:
+            return False
+    return True
+
+
+
+class _ArgumentSchema:
+    """
+    A list of arguments, as found in L{Command.arguments}, L{Command.response}
+    and L{AmpList}, compiled into a form which can convert between boxes and
+    dictionaries of objects quickly.
+
+    The names of the arguments are translated to Python identifiers and
+    length prefixed for the wire once, here, rather than for every box.
+    Arguments which override C{toBox} or C{fromBox} might depend on seeing
+    every key of the box or dictionary being converted, so if there are any
+    the conversions are done by L{_objectsToStrings} and L{_stringsToObjects}
+    instead.
+
+    @ivar arglist: The list of 2-tuples of names and L{IArgumentType}
+        providers which was compiled.
+
+    @ivar pythonNames: A C{set} of the Python identifiers of the arguments.
+    """
+
+    def __init__(self, arglist):
+        self.arglist = arglist
+        self.pythonNames = set()
+        self._fields = []
+        self._compiled = True
+        for name, argument in arglist:
+            pythonName = _wireNameToPythonIdentifier(name)
+            self.pythonNames.add(pythonName)
+            if not _hasDefaultBoxing(argument):
+                self._compiled = False
+                continue
+            if len(name) > MAX_KEY_LENGTH:
+                prefix = None
+            else:
+                prefix = _keyPrefixes.setdefault(
+                    name, pack("!H", len(name)) + name)
+            self._fields.append((
+                    name, pythonName, prefix, argument.optional,
+                    argument.toStringProto, argument.fromStringProto))
+
+
+    def toBox(self, objects, strings, proto):
+        """
+        Equivalent to L{_objectsToStrings}C{(objects, self.arglist, strings,
+        proto)}.
+        """
+        if not self._compiled:
+            return _objectsToStrings(objects, self.arglist, strings, proto)
+        if not isinstance(objects, dict):
+            objects = dict(objects.items())
+        for (name, pythonName, prefix, optional,
+             toStringProto, fromStringProto) in self._fields:
+            obj = objects.get(pythonName)
+            if obj is None:
+                if optional:
+                    continue
+                obj = objects[pythonName]
+            strings[name] = toStringProto(obj, proto)
+        return strings
+
+
+    def fromBox(self, strings, proto):
+        """
+        Equivalent to L{_stringsToObjects}C{(strings, self.arglist, proto)}.
+        """
+        if not self._compiled:
+            return _stringsToObjects(strings, self.arglist, proto)
+        objects = {}
+        for (name, pythonName, prefix, optional,
+             toStringProto, fromStringProto) in self._fields:
+            if optional:
+                value = strings.get(name)
+                if value is None:
+                    objects[pythonName] = None
+                    continue
+            else:
+                value = strings[name]
+            objects[pythonName] = fromStringProto(value, proto)
+        return objects
+
+
+    def serialize(self, objects, proto):
+        """
+        Convert a dictionary of objects directly to the wire encoding of the
+        box which L{toBox} would have converted it to, with the keys in the
+        order of L{arglist}.
+        """
+        if not self._compiled:
+            return self.toBox(objects, Box(), proto).serialize()
+        if not isinstance(objects, dict):
+            objects = dict(objects.items())
+        L = []
+        w = L.append
+        for (name, pythonName, prefix, optional,
+             toStringProto, fromStringProto) in self._fields:
+            obj = objects.get(pythonName)
+            if obj is None:
+                if optional:
+                    continue
+                obj = objects[pythonName]
+            value = toStringProto(obj, proto)
+            if prefix is None:
+                raise TooLong(True, True, name, None)
+            if len(value) > MAX_VALUE_LENGTH:
+                raise TooLong(False, True, value, name)
+            w(prefix)
+            w(pack("!H", len(value)))
+            w(value)
+        w('\x00\x00')
+        return ''.join(L)
+
+
 
 class Command:
     """
@@ -1440,7 +2392,8 @@ class Command:
     class __metaclass__(type):
         """
         Metaclass hack to establish reverse-mappings for 'errors' and
-        'fatalErrors' as class vars.
+        'fatalErrors' as class vars, and to compile the 'arguments' and
+        'response' schemas.
         """
         def __new__(cls, name, bases, attrs):
             re = attrs['reverseErrors'] = {}
@@ -1448,6 +2401,8 @@ class Command:
             if 'commandName' not in attrs:
                 attrs['commandName'] = name
             newtype = type.__new__(cls, name, bases, attrs)
+            newtype._argumentSchema = _ArgumentSchema(newtype.arguments)
+            newtype._responseSchema = _ArgumentSchema(newtype.response)
             errors = {}
             fatalErrors = {}
             accumulateClassDict(newtype, 'errors', errors)
@@ -1512,7 +2467,7 @@ class Command:
             responseType = cls.responseType()
         except:
             return fail()
-        return _objectsToStrings(objects, cls.response, responseType, proto)
+        return cls._getSchema('response').toBox(objects, responseType, proto)
     makeResponse = classmethod(makeResponse)
 
 
@@ -1529,16 +2484,13 @@ class Command:
 
         @return: An instance of this L{Command}'s C{commandType}.
         """
-        allowedNames = set()
-        for (argName, ignored) in cls.arguments:
-            allowedNames.add(_wireNameToPythonIdentifier(argName))
-
+        schema = cls._getSchema('arguments')
+        allowedNames = schema.pythonNames
         for intendedArg in objects:
             if intendedArg not in allowedNames:
                 raise InvalidSignature(
                     "%s is not a valid argument" % (intendedArg,))
-        return _objectsToStrings(objects, cls.arguments, cls.commandType(),
-                                 proto)
+        return schema.toBox(objects, cls.commandType(), proto)
     makeArguments = classmethod(makeArguments)
 
 
@@ -1554,7 +2506,7 @@ class Command:
         @return: A mapping of response-argument names to the parsed
         forms.
         """
-        return _stringsToObjects(box, cls.response, protocol)
+        return cls._getSchema('response').fromBox(box, protocol)
     parseResponse = classmethod(parseResponse)
 
 
@@ -1569,10 +2521,33 @@ class Command:
 
         @return: A mapping of argument names to the parsed forms.
         """
-        return _stringsToObjects(box, cls.arguments, protocol)
+        return cls._getSchema('arguments').fromBox(box, protocol)
     parseArguments = classmethod(parseArguments)
 
 
+    def _getSchema(cls, which):
+        """
+        Get the compiled form of the C{arguments} or C{response} list.  The
+        schemas are compiled when the class is created, and again if the
+        list has been replaced since.
+
+        @param which: C{'arguments'} or C{'response'}.
+
+        @return: an L{_ArgumentSchema}.
+        """
+        if which == 'arguments':
+            attribute = '_argumentSchema'
+        else:
+            attribute = '_responseSchema'
+        schema = getattr(cls, attribute)
+        arglist = getattr(cls, which)
+        if schema.arglist is not arglist:
+            schema = _ArgumentSchema(arglist)
+            setattr(cls, attribute, schema)
+        return schema
+    _getSchema = classmethod(_getSchema)
+
+
     def responder(cls, methodfunc):
         """
         Declare a method to be a responder for a particular command.
@@ -1882,10 +2857,24 @@ class BinaryBoxProtocol(StatefulStringProtocol, Int16StringReceiver):
 
     @ivar boxReceiver: an L{IBoxReceiver} provider, whose L{ampBoxReceived}
     method will be invoked for each L{Box} that is received.
+
+    @ivar coalesceWrites: if true, boxes sent during one iteration of the
+    reactor are held and written with a single call to the transport's
+    C{writeSequence} once the reactor gets around to it, instead of being
+    written one by one.  L{flushBoxes} writes them immediately.
+
+    @ivar _pendingWrites: the serialized boxes held by L{coalesceWrites}, or
+    C{None} if there are none.
+
+    @ivar _flushCall: the delayed call which will write L{_pendingWrites}.
     """
 
     implements(IBoxSender)
 
+    coalesceWrites = False
+    _pendingWrites = None
+    _flushCall = None
+
     _justStartedTLS = False
     _startingTLSBuffer = None
     _locked = False
@@ -1916,13 +2905,17 @@ class BinaryBoxProtocol(StatefulStringProtocol, Int16StringReceiver):
         """
         # All the data that Int16Receiver has not yet dealt with belongs to our
         # new protocol: luckily it's keeping that in a handy (although
-        # ostensibly internal) variable for us:
-        newProtoData = self.recvd
+        # ostensibly internal) variable for us, after what it has already
+        # parsed:
+        newProtoData = self._unparsed()
         # We're quite possibly in the middle of a 'dataReceived' loop in
         # Int16StringReceiver: let's make sure that the next iteration, the
         # loop will break and not attempt to look at something that isn't a
         # length prefix.
         self.recvd = ''
+        # Boxes sent before the switch must reach the transport before
+        # anything the new protocol writes.
+        self.flushBoxes()
         # Finally, do the actual work of setting up the protocol and delivering
         # its first chunk of data, if one is available.
         self.innerProtocol = newProto
@@ -1950,10 +2943,76 @@ class BinaryBoxProtocol(StatefulStringProtocol, Int16StringReceiver):
             raise ConnectionLost()
         if self._startingTLSBuffer is not None:
             self._startingTLSBuffer.append(box)
+        elif self.coalesceWrites:
+            self._holdWrites([box.serialize()])
         else:
             self.transport.write(box.serialize())
 
 
+    def sendBoxes(self, boxes):
+        """
+        Send several amp.Boxes to my peer with one call to my transport's
+        C{writeSequence}, rather than one call to C{write} for each.  Each
+        box is sent as L{sendBox} would send it.  If any of them cannot be
+        serialized, none of them is sent.
+
+        @param boxes: a sequence of AmpBoxes.
+
+        @raise ProtocolSwitched: if the protocol has previously been switched.
+
+        @raise ConnectionLost: if the connection has previously been lost.
+        """
+        if self._locked:
+            raise ProtocolSwitched(
+                "This connection has switched: no AMP traffic allowed.")
+        if self.transport is None:
+            raise ConnectionLost()
+        if self._startingTLSBuffer is not None:
+            self._startingTLSBuffer.extend(boxes)
+        elif self.coalesceWrites:
+            self._holdWrites([box.serialize() for box in boxes])
+        else:
+            self.transport.writeSequence([box.serialize() for box in boxes])
+
+
+    def _holdWrites(self, data):
+        """
+        Add serialized boxes to those waiting to be written by L{flushBoxes},
+        arranging for it to be called if it has not already been.
+
+        @param data: a list of strings.
+        """
+        if self._pendingWrites is None:
+            self._pendingWrites = data
+            self._flushCall = self.callLater(0, self.flushBoxes)
+        else:
+            self._pendingWrites.extend(data)
+
+
+    def flushBoxes(self):
+        """
+        Write any boxes held back by L{coalesceWrites} now.
+        """
+        if self._flushCall is not None:
+            if self._flushCall.active():
+                self._flushCall.cancel()
+            self._flushCall = None
+        pending = self._pendingWrites
+        if pending is not None:
+            self._pendingWrites = None
+            if self.transport is not None:
+                self.transport.writeSequence(pending)
+
+
+    def callLater(self, delay, f, *args, **kw):
+        """
+        Schedule a call with the global reactor; used by L{coalesceWrites}.
+        Override this to use a different scheduler.
+        """
+        from twisted.internet import reactor
+        return reactor.callLater(delay, f, *args, **kw)
+
+
     def makeConnection(self, transport):
         """
         Notify L{boxReceiver} that it is about to receive boxes from this
@@ -1976,13 +3035,93 @@ class BinaryBoxProtocol(StatefulStringProtocol, Int16StringReceiver):
         if self.innerProtocol is not None:
             self.innerProtocol.dataReceived(data)
             return
-        return Int16StringReceiver.dataReceived(self, data)
+        self._parseBoxes(data)
+
+
+    def _parseBoxes(self, data):
+        """
+        Parse as many boxes as possible out of the data received so far and
+        deliver each complete one to L{boxReceiver}.
+
+        This is equivalent to passing each length-prefixed string to
+        L{proto_init}, L{proto_key} and L{proto_value} in turn, and it leaves
+        the same parser state behind for a box which is not complete yet, but
+        it does all the work in one loop over the buffer.  It follows the
+        conventions of L{Int16StringReceiver.dataReceived} for C{recvd} while
+        a box is being delivered, so that L{_switchTo} can hand the rest of
+        the buffer to another protocol.
+        """
+        recvd = self._unparsed()
+        if recvd:
+            recvd = recvd + data
+        else:
+            recvd = data
+        self.recvd = self._parsing = recvd
+        self._recvdOffset = 0
+        unpackFrom = _getUnpacker(self.structFormat)
+        maxKeyLength = self._MAX_KEY_LENGTH
+        state = self.state
+        box = self._currentBox
+        key = self._currentKey
+        offset = 0
+        while len(recvd) - offset >= 2 and not self.paused:
+            length, = unpackFrom(recvd, offset)
+            if state != 'value' and length > maxKeyLength:
+                self._parsing = None
+                self._recvdOffset = 0
+                self.recvd = recvd[offset:]
+                self.state = state
+                self._currentBox = box
+                self._currentKey = key
+                self.lengthLimitExceeded(length)
+                return
+            start = offset + 2
+            if len(recvd) < start + length:
+                break
+            offset = start + length
+            if state == 'value':
+                box[key] = recvd[start:offset]
+                key = None
+                state = 'key'
+                continue
+            if state == 'init':
+                box = AmpBox()
+            if length:
+                key = recvd[start:offset]
+                state = 'value'
+                continue
+            self.state = state = 'init'
+            self._currentBox = None
+            self._currentKey = None
+            self._recvdOffset = offset
+            self.boxReceiver.ampBoxReceived(box)
+            box = None
+            if self.recvd is not recvd:
+                # The box receiver switched protocols, or received more data
+                # itself; carry on from wherever that left the parser.
+                recvd = self._parsing = self.recvd
+                offset = self._recvdOffset = 0
+                state = self.state
+                box = self._currentBox
+                key = self._currentKey
+        self.state = state
+        self._currentBox = box
+        self._currentKey = key
+        self._parsing = None
+        self._recvdOffset = 0
+        if offset:
+            self.recvd = recvd[offset:]
 
 
     def connectionLost(self, reason):
         """
         The connection was lost; notify any nested protocol.
         """
+        if self._flushCall is not None:
+            if self._flushCall.active():
+                self._flushCall.cancel()
+            self._flushCall = None
+        self._pendingWrites = None
         if self.innerProtocol is not None:
             self.innerProtocol.connectionLost(reason)
             if self.innerProtocolClientFactory is not None:
@@ -2104,6 +3243,8 @@ class BinaryBoxProtocol(StatefulStringProtocol, Int16StringReceiver):
         self._justStartedTLS = True
         if verifyAuthorities is None:
             verifyAuthorities = ()
+        # The box which asked for TLS must go out in the clear.
+        self.flushBoxes()
         self.transport.startTLS(certificate.options(*verifyAuthorities))
         stlsb = self._startingTLSBuffer
         if stlsb is not None:
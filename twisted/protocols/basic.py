@@ -53,32 +53,39 @@ class NetstringReceiver(protocol.Protocol):
         raise NotImplementedError
 
     def doData(self):
-        buffer,self.__data = self.__data[:int(self._readerLength)],self.__data[int(self._readerLength):]
-        self._readerLength = self._readerLength - len(buffer)
-        self.__buffer = self.__buffer + buffer
+        data = self.__data
+        offset = self.__offset
+        chunk = data[offset:offset + int(self._readerLength)]
+        self.__offset = offset + len(chunk)
+        self._readerLength = self._readerLength - len(chunk)
         if self._readerLength != 0:
+            self.__buffer.append(chunk)
             return
-        self.stringReceived(self.__buffer)
+        if self.__buffer:
+            self.__buffer.append(chunk)
+            chunk = ''.join(self.__buffer)
+            self.__buffer = []
+        self.stringReceived(chunk)
         self._readerState = COMMA
 
     def doComma(self):
         self._readerState = LENGTH
-        if self.__data[0] != ',':
+        if self.__data[self.__offset] != ',':
             if DEBUG:
-                raise NetstringParseError(repr(self.__data))
+                raise NetstringParseError(repr(self.__data[self.__offset:]))
             else:
                 raise NetstringParseError
-        self.__data = self.__data[1:]
+        self.__offset += 1
 
 
     def doLength(self):
-        m = NUMBER.match(self.__data)
-        if not m.end():
+        m = NUMBER.match(self.__data, self.__offset)
+        if m.end() == self.__offset:
             if DEBUG:
-                raise NetstringParseError(repr(self.__data))
+                raise NetstringParseError(repr(self.__data[self.__offset:]))
             else:
                 raise NetstringParseError
-        self.__data = self.__data[m.end():]
+        self.__offset = m.end()
         if m.group(1):
             try:
                 self._readerLength = self._readerLength * (10**len(m.group(1))) + long(m.group(1))
@@ -87,13 +94,17 @@ class NetstringReceiver(protocol.Protocol):
             if self._readerLength > self.MAX_LENGTH:
                 raise NetstringParseError, "netstring too long"
         if m.group(2):
-            self.__buffer = ''
+            self.__buffer = []
             self._readerState = DATA
 
     def dataReceived(self, data):
+        # Rather than slicing off each part of data as it is parsed, keep an
+        # offset into it; the string itself is only copied to pass netstrings
+        # to stringReceived.
         self.__data = data
+        self.__offset = 0
         try:
-            while self.__data:
+            while self.__offset < len(self.__data):
                 if self._readerState == DATA:
                     self.doData()
                 elif self._readerState == COMMA:
@@ -126,15 +137,32 @@ class LineOnlyReceiver(protocol.Protocol):
     @cvar MAX_LENGTH: The maximum length of a line to allow (If a
                       sent line is longer than this, the connection is dropped).
                       Default is 16384.
+    @cvar linesReceived: If not C{None}, a callable which is called with a
+        list of all the complete lines found in each chunk of data, instead
+        of calling L{lineReceived} once per line.
     """
     _buffer = ''
     delimiter = '\r\n'
     MAX_LENGTH = 16384
+    linesReceived = None
 
     def dataReceived(self, data):
         """Translates bytes into lines, and calls lineReceived."""
-        lines  = (self._buffer+data).split(self.delimiter)
+        if self._buffer:
+            data = self._buffer + data
+        lines = data.split(self.delimiter)
         self._buffer = lines.pop(-1)
+        if self.linesReceived is not None and lines:
+            good = lines
+            if max(map(len, lines)) > self.MAX_LENGTH:
+                for i in xrange(len(lines)):
+                    if len(lines[i]) > self.MAX_LENGTH:
+                        good, lines = lines[:i], lines[i:]
+                        break
+            else:
+                lines = ()
+            if good:
+                self.linesReceived(good)
         for line in lines:
             if self.transport.disconnecting:
                 # this is necessary because the transport may be told to lose
@@ -198,11 +226,22 @@ class LineReceiver(protocol.Protocol, _PauseableMixin):
     @cvar MAX_LENGTH: The maximum length of a line to allow (If a
                       sent line is longer than this, the connection is dropped).
                       Default is 16384.
+    @cvar linesReceived: If not C{None}, a callable which is called with a
+        list of all the complete lines available, instead of calling
+        L{lineReceived} once per line.  It may return the number of lines of
+        the list it actually consumed, for instance because it switched to
+        raw mode or paused after one of them; the lines which follow are then
+        handled according to the new mode.  Returning C{None} means all of
+        them were consumed.  Returning C{0} without having switched to raw
+        mode or paused would have the same lines delivered again forever, so
+        it raises C{RuntimeError} instead.
     """
     line_mode = 1
     __buffer = ''
+    __offset = 0
     delimiter = '\r\n'
     MAX_LENGTH = 16384
+    linesReceived = None
 
     def clearLineBuffer(self):
         """
@@ -211,8 +250,9 @@ class LineReceiver(protocol.Protocol, _PauseableMixin):
         @return: All of the cleared buffered data.
         @rtype: C{str}
         """
-        b = self.__buffer
+        b = self.__buffer[self.__offset:]
         self.__buffer = ""
+        self.__offset = 0
         return b
 
     def dataReceived(self, data):
@@ -220,31 +260,86 @@ class LineReceiver(protocol.Protocol, _PauseableMixin):
         Translates bytes into lines, and calls lineReceived (or
         rawDataReceived, depending on mode.)
         """
-        self.__buffer = self.__buffer+data
+        # Lines are sliced out of the buffer as an offset moves through it,
+        # so that the unconsumed data is only copied once per call, not once
+        # per line.  The buffer and offset are kept on self while calling out
+        # as the callbacks may change them (clearLineBuffer, or a nested
+        # dataReceived from setLineMode).
+        if self.__offset:
+            self.__buffer = self.__buffer[self.__offset:] + data
+            self.__offset = 0
+        else:
+            self.__buffer = self.__buffer + data
         while self.line_mode and not self.paused:
-            try:
-                line, self.__buffer = self.__buffer.split(self.delimiter, 1)
-            except ValueError:
-                if len(self.__buffer) > self.MAX_LENGTH:
-                    line, self.__buffer = self.__buffer, ''
+            buffer = self.__buffer
+            offset = self.__offset
+            delimiter = self.delimiter
+            end = buffer.find(delimiter, offset)
+            if end == -1:
+                if len(buffer) - offset > self.MAX_LENGTH:
+                    line = buffer[offset:]
+                    self.__buffer = ''
+                    self.__offset = 0
                     return self.lineLengthExceeded(line)
+                if offset:
+                    self.__buffer = buffer[offset:]
+                    self.__offset = 0
                 break
-            else:
-                linelength = len(line)
-                if linelength > self.MAX_LENGTH:
-                    exceeded = line + self.__buffer
-                    self.__buffer = ''
-                    return self.lineLengthExceeded(exceeded)
-                why = self.lineReceived(line)
-                if why or self.transport and self.transport.disconnecting:
-                    return why
+            if end - offset > self.MAX_LENGTH:
+                exceeded = buffer[offset:end] + buffer[end + len(delimiter):]
+                self.__buffer = ''
+                self.__offset = 0
+                return self.lineLengthExceeded(exceeded)
+            if self.linesReceived is not None:
+                self._deliverLines(buffer, offset, end, delimiter)
+                if self.transport and self.transport.disconnecting:
+                    return
+                continue
+            self.__offset = end + len(delimiter)
+            why = self.lineReceived(buffer[offset:end])
+            if why or self.transport and self.transport.disconnecting:
+                return why
         else:
             if not self.paused:
-                data=self.__buffer
-                self.__buffer=''
+                data = self.__buffer[self.__offset:]
+                self.__buffer = ''
+                self.__offset = 0
                 if data:
                     return self.rawDataReceived(data)
 
+    def _deliverLines(self, buffer, offset, end, delimiter):
+        """
+        Pass all the complete lines of C{buffer}, starting with the one
+        between C{offset} and C{end}, to L{linesReceived} in one call, and
+        consume as many of them as it reports having handled.
+
+        A line longer than L{MAX_LENGTH} ends the batch before it; it is
+        handled by L{dataReceived} in the same way as if lines were delivered
+        one by one.
+        """
+        maxLength = self.MAX_LENGTH
+        delimiterLength = len(delimiter)
+        start = offset
+        lines = []
+        ends = []
+        while end != -1 and end - offset <= maxLength:
+            lines.append(buffer[offset:end])
+            offset = end + delimiterLength
+            ends.append(offset)
+            end = buffer.find(delimiter, offset)
+        self.__offset = offset
+        consumed = self.linesReceived(lines)
+        if (consumed is not None and consumed < len(lines)
+            and self.__buffer is buffer):
+            if consumed:
+                self.__offset = ends[consumed - 1]
+            elif self.line_mode and not self.paused:
+                raise RuntimeError(
+                    "%r.linesReceived consumed no lines, but neither "
+                    "switched to raw mode nor paused" % (self,))
+            else:
+                self.__offset = start
+
     def setLineMode(self, extra=''):
         """Sets the line-mode of this receiver.
 
@@ -301,13 +396,50 @@ class StringTooLongError(AssertionError):
     """
 
 
+_unpackers = {}
+
+def _getUnpacker(structFormat):
+    """
+    Return a callable which takes a string and an offset into it and unpacks
+    a value in C{structFormat} found at that offset, without copying it out of
+    the string first.  A precompiled C{struct.Struct} is used where the
+    C{struct} module provides one.
+    """
+    try:
+        return _unpackers[structFormat]
+    except KeyError:
+        if getattr(struct, 'Struct', None) is not None:
+            unpackFrom = struct.Struct(structFormat).unpack_from
+        else:
+            size = struct.calcsize(structFormat)
+            def unpackFrom(data, offset=0):
+                return struct.unpack(structFormat, data[offset:offset + size])
+        _unpackers[structFormat] = unpackFrom
+        return unpackFrom
+
+
+
 class IntNStringReceiver(protocol.Protocol, _PauseableMixin):
     """
     Generic class for length prefixed protocols.
 
-    @ivar recvd: buffer holding received data when splitted.
+    @ivar recvd: buffer holding received data when splitted.  While
+        C{stringReceived} is running it holds the whole buffer being parsed,
+        of which the first C{_recvdOffset} bytes have been delivered already;
+        L{_unparsed} returns the rest.  Assigning to it from
+        C{stringReceived} replaces all of the data which has not been parsed
+        yet.
     @type recvd: C{str}
 
+    @ivar _parsing: The buffer L{dataReceived} is walking through while it
+        delivers strings, or C{None}.  As long as C{recvd} is this buffer,
+        its first C{_recvdOffset} bytes have been parsed already.
+    @type _parsing: C{str} or C{NoneType}
+
+    @ivar _recvdOffset: The offset into C{_parsing} of the first byte which
+        has not been parsed yet.
+    @type _recvdOffset: C{int}
+
     @ivar structFormat: format used for struct packing/unpacking. Define it in
         subclass.
     @type structFormat: C{str}
@@ -318,6 +450,17 @@ class IntNStringReceiver(protocol.Protocol, _PauseableMixin):
     """
     MAX_LENGTH = 99999
     recvd = ""
+    _parsing = None
+    _recvdOffset = 0
+
+    def _unparsed(self):
+        """
+        Return the received data which has not been parsed yet.
+        """
+        if self._recvdOffset and self.recvd is self._parsing:
+            return self.recvd[self._recvdOffset:]
+        return self.recvd
+
 
     def stringReceived(self, msg):
         """
@@ -342,18 +485,41 @@ class IntNStringReceiver(protocol.Protocol, _PauseableMixin):
         """
         Convert int prefixed strings into calls to stringReceived.
         """
-        self.recvd = self.recvd + recd
-        while len(self.recvd) >= self.prefixLength and not self.paused:
-            length ,= struct.unpack(
-                self.structFormat, self.recvd[:self.prefixLength])
+        # Parse the buffer by moving an offset through it, rather than slicing
+        # off each string as it is delivered, so that what remains of it is
+        # copied only once per call instead of once per string.
+        recvd = self._unparsed()
+        if recvd:
+            recvd = recvd + recd
+        else:
+            recvd = recd
+        self.recvd = self._parsing = recvd
+        unpackFrom = _getUnpacker(self.structFormat)
+        prefixLength = self.prefixLength
+        offset = self._recvdOffset = 0
+        while len(recvd) - offset >= prefixLength and not self.paused:
+            length, = unpackFrom(recvd, offset)
             if length > self.MAX_LENGTH:
+                self._parsing = None
+                self._recvdOffset = 0
+                self.recvd = recvd[offset:]
                 self.lengthLimitExceeded(length)
                 return
-            if len(self.recvd) < length + self.prefixLength:
+            start = offset + prefixLength
+            if len(recvd) < start + length:
                 break
-            packet = self.recvd[self.prefixLength:length + self.prefixLength]
-            self.recvd = self.recvd[length + self.prefixLength:]
-            self.stringReceived(packet)
+            offset = self._recvdOffset = start + length
+            self.stringReceived(recvd[start:offset])
+            if self.recvd is not recvd:
+                # stringReceived replaced the buffer, perhaps to hand what
+                # is left of it to another protocol, or received more data
+                # itself; carry on with whatever it holds now.
+                recvd = self._parsing = self.recvd
+                offset = self._recvdOffset = 0
+        self._parsing = None
+        self._recvdOffset = 0
+        if offset:
+            self.recvd = recvd[offset:]
 
     def sendString(self, data):
         """
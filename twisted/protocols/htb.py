@@ -25,6 +25,13 @@ __version__ = '$Revision: 1.5 $'[11:-2]
 # time.time.  time.time, it has been pointed out, can go backwards.  Is
 # the same true of os.times?
 from time import time
+try:
+    from collections import deque
+except ImportError:
+    class deque(list):
+        def popleft(self):
+            return self.pop(0)
+
 from zope.interface import implements, Interface
 
 from twisted.protocols import pcp
@@ -73,6 +80,39 @@ class Bucket:
         self.content += allowable
         return allowable
 
+    def charge(self, amount):
+        """Add tokens to me and my parents, whether they fit or not.
+
+        Unlike L{add}, this never refuses tokens: a bucket may be left
+        holding more than C{maxburst}, and L{delay} then says how long
+        it will take to drain back down.
+
+        @param amount: A quantity of tokens to add.
+        @type amount: int
+        """
+        self.drip()
+        bucket = self
+        while bucket is not None:
+            bucket.content += amount
+            bucket = bucket.parentBucket
+
+    def delay(self):
+        """How long until neither I nor any of my parents is overfull?
+
+        @returns: The number of seconds, or 0 if there is room now.
+        @returntype: float
+        """
+        self.drip()
+        delay = 0
+        bucket = self
+        while bucket is not None:
+            if (bucket.maxburst is not None and bucket.rate
+                and bucket.content > bucket.maxburst):
+                delay = max(delay, float(bucket.content - bucket.maxburst)
+                            / bucket.rate)
+            bucket = bucket.parentBucket
+        return delay
+
     def drip(self):
         """Let some of the bucket drain.
 
@@ -93,7 +133,7 @@ class Bucket:
             deltaT = now - self.lastDrip
             self.content = long(max(0, self.content - deltaT * self.rate))
             self.lastDrip = now
-            return False
+            return self.content == 0
 
 
 class IBucketFilter(Interface):
@@ -108,8 +148,15 @@ class HierarchicalBucketFilter:
 
     @cvar bucketFactory: Class of buckets to make.
     @type bucketFactory: L{Bucket} class
-    @cvar sweepInterval: Seconds between sweeping out the bucket cache.
+    @cvar sweepInterval: Seconds a bucket is kept after it was made, or
+        last found to be in use, before it may be thrown away.  If None,
+        buckets are kept forever.
     @type sweepInterval: int
+
+    @ivar _expiries: C{(deadline, key)} pairs, one for each cached bucket,
+        in deadline order.  Only the entries which have come due are
+        looked at, so keeping the cache small costs nothing per call when
+        there is nothing to expire.
     """
 
     implements(IBucketFilter)
@@ -121,6 +168,7 @@ class HierarchicalBucketFilter:
         self.buckets = {}
         self.parentFilter = parentFilter
         self.lastSweep = time()
+        self._expiries = deque()
 
     def getBucketFor(self, *a, **kw):
         """You want a bucket for that?  I'll give you a bucket.
@@ -130,9 +178,11 @@ class HierarchicalBucketFilter:
 
         @returntype: L{Bucket}
         """
-        if ((self.sweepInterval is not None)
-            and ((time() - self.lastSweep) > self.sweepInterval)):
-            self.sweep()
+        if self.sweepInterval is not None:
+            now = time()
+            expiries = self._expiries
+            if expiries and expiries[0][0] <= now:
+                self._expire(now)
 
         if self.parentFilter:
             parentBucket = self.parentFilter.getBucketFor(self, *a, **kw)
@@ -144,6 +194,8 @@ class HierarchicalBucketFilter:
         if bucket is None:
             bucket = self.bucketFactory(parentBucket)
             self.buckets[key] = bucket
+            if self.sweepInterval is not None:
+                self._expiries.append((now + self.sweepInterval, key))
         return bucket
 
     def getBucketKey(self, *a, **kw):
@@ -155,12 +207,33 @@ class HierarchicalBucketFilter:
         """
         return None
 
+    def _expire(self, now):
+        """Throw away the buckets whose deadline has passed if they are
+        empty and unreferenced, and give the others a new deadline."""
+        expiries = self._expiries
+        buckets = self.buckets
+        while expiries and expiries[0][0] <= now:
+            key = expiries.popleft()[1]
+            bucket = buckets.get(key)
+            if bucket is None:
+                continue
+            if (bucket._refcount == 0) and bucket.drip():
+                del buckets[key]
+            else:
+                expiries.append((now + self.sweepInterval, key))
+        self.lastSweep = now
+
     def sweep(self):
-        """I throw away references to empty buckets."""
+        """I throw away references to empty buckets.
+
+        This looks at every bucket; L{getBucketFor} only looks at the
+        ones which are due to expire.
+        """
         for key, bucket in self.buckets.items():
             if (bucket._refcount == 0) and bucket.drip():
                 del self.buckets[key]
-
+        self._expiries = deque([entry for entry in self._expiries
+                                if entry[1] in self.buckets])
         self.lastSweep = time()
 
 
@@ -170,7 +243,7 @@ class FilterByHost(HierarchicalBucketFilter):
     sweepInterval = 60 * 20
 
     def getBucketKey(self, transport):
-        return transport.getPeer()[1]
+        return transport.getPeer().host
 
 
 class FilterByServer(HierarchicalBucketFilter):
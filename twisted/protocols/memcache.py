@@ -21,10 +21,23 @@ To connect to a server, create a factory for L{MemCacheProtocol}::
 All the operations of the memcache protocol are present, but
 L{MemCacheProtocol.set} and L{MemCacheProtocol.get} are the more important.
 
+To spread keys over several servers, use L{MemCacheCluster}, which keeps a
+pool of connections to each of them::
+
+    from twisted.protocols.memcache import MemCacheCluster
+    cluster = MemCacheCluster([("cache1", DEFAULT_PORT),
+                               ("cache2", DEFAULT_PORT)])
+    cluster.connect()
+    d = cluster.set("mykey", "a lot of data")
+
 See U{http://code.sixapart.com/svn/memcached/trunk/server/doc/protocol.txt} for
 more information about the protocol.
 """
 
+import time
+from bisect import bisect_left
+from struct import unpack
+
 try:
     from collections import deque
 except ImportError:
@@ -35,8 +48,12 @@ except ImportError:
 
 from twisted.protocols.basic import LineReceiver
 from twisted.protocols.policies import TimeoutMixin
-from twisted.internet.defer import Deferred, fail, TimeoutError
+from twisted.internet.defer import Deferred, DeferredList, FirstError
+from twisted.internet.defer import fail, succeed, TimeoutError
+from twisted.internet.protocol import ReconnectingClientFactory
 from twisted.python import log
+from twisted.python.failure import Failure
+from twisted.python.hashlib import md5
 
 
 
@@ -65,6 +82,13 @@ class ServerError(Exception):
 
 
 
+class NoServersAvailable(Exception):
+    """
+    Raised by L{MemCacheCluster} when every server has been ejected.
+    """
+
+
+
 class Command(object):
     """
     Wrap a client action into an object, that holds the values used in the
@@ -90,8 +114,7 @@ class Command(object):
         """
         self.command = command
         self._deferred = Deferred()
-        for k, v in kwargs.items():
-            setattr(self, k, v)
+        self.__dict__.update(kwargs)
 
 
     def success(self, value):
@@ -113,6 +136,11 @@ class MemCacheProtocol(LineReceiver, TimeoutMixin):
     """
     MemCache protocol: connect to a memcached server to store/retrieve values.
 
+    The commands which store or delete values accept a C{noreply} flag, which
+    tells the server not to answer them.  The server still reports malformed
+    commands, and such an error would be taken as the answer to the next
+    command, so only use it for commands known to be well-formed.
+
     @ivar persistentTimeOut: the timeout period used to wait for a response.
     @type persistentTimeOut: C{int}
 
@@ -130,8 +158,27 @@ class MemCacheProtocol(LineReceiver, TimeoutMixin):
 
     @ivar _bufferLength: the total amount of bytes in C{_getBuffer}.
     @type _bufferLength: C{int}
+
+    @ivar coalesceWrites: if true, the commands issued during one iteration
+        of the reactor are held and written with a single call to the
+        transport's C{writeSequence} once the reactor gets around to it.
+        L{flushWrites} writes them immediately.
+    @type coalesceWrites: C{bool}
+
+    @ivar _pendingWrites: the strings held by L{coalesceWrites}, or C{None}.
+    @type _pendingWrites: C{list} of C{str}
+
+    @ivar _flushCall: the delayed call which will write C{_pendingWrites}.
+
+    @ivar _lineBuffer: the beginning of a line whose end has not been
+        received yet.
+    @type _lineBuffer: C{str}
     """
     MAX_KEY_LENGTH = 250
+    coalesceWrites = False
+    _pendingWrites = None
+    _flushCall = None
+    _lineBuffer = ""
 
     def __init__(self, timeOut=60):
         """
@@ -148,22 +195,138 @@ class MemCacheProtocol(LineReceiver, TimeoutMixin):
         self.persistentTimeOut = self.timeOut = timeOut
 
 
+    def _cancelCommands(self, reason):
+        """
+        Cancel all the outstanding commands, making them fail with C{reason}.
+        """
+        while self._current:
+            cmd = self._current.popleft()
+            cmd.fail(reason)
+
+
     def timeoutConnection(self):
         """
         Close the connection in case of timeout.
         """
-        for cmd in self._current:
-            cmd.fail(TimeoutError("Connection timeout"))
+        self._cancelCommands(TimeoutError("Connection timeout"))
         self.transport.loseConnection()
 
 
+    def connectionLost(self, reason):
+        """
+        Cause any outstanding commands to fail.
+        """
+        self.setTimeout(None)
+        if self._flushCall is not None:
+            if self._flushCall.active():
+                self._flushCall.cancel()
+            self._flushCall = None
+        self._pendingWrites = None
+        self._cancelCommands(reason)
+        LineReceiver.connectionLost(self, reason)
+
+
     def sendLine(self, line):
         """
         Override sendLine to add a timeout to response.
         """
-        if not self._current:
-           self.setTimeout(self.persistentTimeOut)
-        LineReceiver.sendLine(self, line)
+        self._send([line, self.delimiter])
+
+
+    def _send(self, data, expectReply=True):
+        """
+        Write a command, holding it back if L{coalesceWrites} is set.
+
+        @param data: the strings making up the command.
+        @type data: C{list} of C{str}
+
+        @param expectReply: whether the server will answer the command, in
+            which case the response timeout is started if it is not already
+            running.
+        @type expectReply: C{bool}
+        """
+        if expectReply and not self._current:
+            self.setTimeout(self.persistentTimeOut)
+        if not self.coalesceWrites:
+            self.transport.writeSequence(data)
+        elif self._pendingWrites is None:
+            self._pendingWrites = data
+            self._flushCall = self.callLater(0, self.flushWrites)
+        else:
+            self._pendingWrites.extend(data)
+
+
+    def flushWrites(self):
+        """
+        Write the commands held back by L{coalesceWrites} now.
+        """
+        if self._flushCall is not None:
+            if self._flushCall.active():
+                self._flushCall.cancel()
+            self._flushCall = None
+        pending = self._pendingWrites
+        if pending is not None:
+            self._pendingWrites = None
+            self.transport.writeSequence(pending)
+
+
+    def dataReceived(self, data):
+        """
+        Parse the responses of the server.
+
+        Lines are sliced out of the data by moving an offset through it, and
+        a value which has been received in full is sliced out of it directly,
+        so that whatever follows it is not copied again for each value.  Only
+        values split across several calls are collected by
+        L{rawDataReceived}.
+        """
+        if self._lenExpected is not None:
+            return self.rawDataReceived(data)
+        buffer = self._lineBuffer
+        if buffer:
+            self._lineBuffer = ""
+            buffer = buffer + data
+        else:
+            buffer = data
+        delimiter = self.delimiter
+        offset = 0
+        while 1:
+            end = buffer.find(delimiter, offset)
+            if end == -1:
+                break
+            if end - offset > self.MAX_LENGTH:
+                return self.lineLengthExceeded(buffer[offset:])
+            line = buffer[offset:end]
+            offset = end + 2
+            self.lineReceived(line)
+            if self.transport.disconnecting:
+                return
+            length = self._lenExpected
+            if length is not None:
+                if len(buffer) - offset < length + 2:
+                    return self.rawDataReceived(buffer[offset:])
+                self._valueReceived(buffer[offset:offset + length])
+                offset += length + 2
+        if offset:
+            buffer = buffer[offset:]
+        if len(buffer) > self.MAX_LENGTH:
+            return self.lineLengthExceeded(buffer)
+        self._lineBuffer = buffer
+
+
+    def _valueReceived(self, val):
+        """
+        Store a value received for the current get command.
+        """
+        self._lenExpected = None
+        self._getBuffer = None
+        self._bufferLength = None
+        cmd = self._current[0]
+        if cmd.multiple:
+            flags, cas = cmd.values[cmd.currentKey]
+            cmd.values[cmd.currentKey] = (flags, cas, val)
+        else:
+            cmd.value = val
 
 
     def rawDataReceived(self, data):
@@ -174,20 +337,23 @@ class MemCacheProtocol(LineReceiver, TimeoutMixin):
         self._getBuffer.append(data)
         self._bufferLength += len(data)
         if self._bufferLength >= self._lenExpected + 2:
-            data = "".join(self._getBuffer)
-            buf = data[:self._lenExpected]
-            rem = data[self._lenExpected + 2:]
-            val = buf
-            self._lenExpected = None
-            self._getBuffer = None
-            self._bufferLength = None
-            cmd = self._current[0]
-            if cmd.multiple:
-                flags, cas = cmd.values[cmd.currentKey]
-                cmd.values[cmd.currentKey] = (flags, cas, val)
+            # Copy exactly the advertised length of the value out of the
+            # chunks received: only the last one is split, between the end of
+            # the value and whatever follows its trailing delimiter.
+            chunks = self._getBuffer
+            last = chunks.pop()
+            inLast = self._lenExpected - (self._bufferLength - len(last))
+            if inLast >= 0:
+                chunks.append(last[:inLast])
+                if len(chunks) == 1:
+                    val = chunks[0]
+                else:
+                    val = "".join(chunks)
             else:
-                cmd.value = val
-            self.setLineMode(rem)
+                # The trailing delimiter started in an earlier chunk.
+                val = "".join(chunks)[:self._lenExpected]
+            self._valueReceived(val)
+            self.setLineMode(last[inLast + 2:])
 
 
     def cmd_STORED(self):
@@ -256,7 +422,6 @@ class MemCacheProtocol(LineReceiver, TimeoutMixin):
                 raise RuntimeError("Unexpected commands answer.")
             cmd.flags = int(flags)
             cmd.cas = cas
-        self.setRawMode()
 
 
     def cmd_STAT(self, line):
@@ -328,13 +493,12 @@ class MemCacheProtocol(LineReceiver, TimeoutMixin):
         Receive line commands from the server.
         """
         self.resetTimeout()
-        token = line.split(" ", 1)[0]
+        parts = line.split(" ", 1)
         # First manage standard commands without space
-        cmd = getattr(self, "cmd_%s" % (token,), None)
+        cmd = getattr(self, "cmd_" + parts[0], None)
         if cmd is not None:
-            args = line.split(" ", 1)[1:]
-            if args:
-                cmd(args[0])
+            if len(parts) == 2:
+                cmd(parts[1])
             else:
                 cmd()
         else:
@@ -399,14 +563,14 @@ class MemCacheProtocol(LineReceiver, TimeoutMixin):
                 "Invalid type for key: %s, expecting a string" % (type(key),)))
         if len(key) > self.MAX_KEY_LENGTH:
             return fail(ClientError("Key too long"))
-        fullcmd = "%s %s %d" % (cmd, key, int(val))
-        self.sendLine(fullcmd)
+        fullcmd = "%s %s %d\r\n" % (cmd, key, int(val))
+        self._send([fullcmd])
         cmdObj = Command(cmd, key=key)
         self._current.append(cmdObj)
         return cmdObj._deferred
 
 
-    def replace(self, key, val, flags=0, expireTime=0):
+    def replace(self, key, val, flags=0, expireTime=0, noreply=False):
         """
         Replace the given C{key}. It must already exist in the server.
 
@@ -423,14 +587,18 @@ class MemCacheProtocol(LineReceiver, TimeoutMixin):
             when the key will be deleted from the store.
         @type expireTime: C{int}
 
+        @param noreply: if C{True}, the server does not answer and the
+            result is C{None}.
+        @type noreply: C{bool}
+
         @return: a deferred that will fire with C{True} if the operation has
             succeeded, and C{False} with the key didn't previously exist.
         @rtype: L{Deferred}
         """
-        return self._set("replace", key, val, flags, expireTime, "")
+        return self._set("replace", key, val, flags, expireTime, "", noreply)
 
 
-    def add(self, key, val, flags=0, expireTime=0):
+    def add(self, key, val, flags=0, expireTime=0, noreply=False):
         """
         Add the given C{key}. It must not exist in the server.
 
@@ -447,14 +615,18 @@ class MemCacheProtocol(LineReceiver, TimeoutMixin):
             when the key will be deleted from the store.
         @type expireTime: C{int}
 
+        @param noreply: if C{True}, the server does not answer and the
+            result is C{None}.
+        @type noreply: C{bool}
+
         @return: a deferred that will fire with C{True} if the operation has
             succeeded, and C{False} with the key already exists.
         @rtype: L{Deferred}
         """
-        return self._set("add", key, val, flags, expireTime, "")
+        return self._set("add", key, val, flags, expireTime, "", noreply)
 
 
-    def set(self, key, val, flags=0, expireTime=0):
+    def set(self, key, val, flags=0, expireTime=0, noreply=False):
         """
         Set the given C{key}.
 
@@ -471,14 +643,19 @@ class MemCacheProtocol(LineReceiver, TimeoutMixin):
             when the key will be deleted from the store.
         @type expireTime: C{int}
 
+        @param noreply: if C{True}, the server does not answer and the
+            result is C{None}.
+        @type noreply: C{bool}
+
         @return: a deferred that will fire with C{True} if the operation has
             succeeded.
         @rtype: L{Deferred}
         """
-        return self._set("set", key, val, flags, expireTime, "")
+        return self._set("set", key, val, flags, expireTime, "", noreply)
 
 
-    def checkAndSet(self, key, val, cas, flags=0, expireTime=0):
+    def checkAndSet(self, key, val, cas, flags=0, expireTime=0,
+                    noreply=False):
         """
         Change the content of C{key} only if the C{cas} value matches the
         current one associated with the key. Use this to store a value which
@@ -500,14 +677,18 @@ class MemCacheProtocol(LineReceiver, TimeoutMixin):
             when the key will be deleted from the store.
         @type expireTime: C{int}
 
+        @param noreply: if C{True}, the server does not answer and the
+            result is C{None}.
+        @type noreply: C{bool}
+
         @return: A deferred that will fire with C{True} if the operation has
             succeeded, C{False} otherwise.
         @rtype: L{Deferred}
         """
-        return self._set("cas", key, val, flags, expireTime, cas)
+        return self._set("cas", key, val, flags, expireTime, cas, noreply)
 
 
-    def _set(self, cmd, key, val, flags, expireTime, cas):
+    def _set(self, cmd, key, val, flags, expireTime, cas, noreply=False):
         """
         Internal wrapper for setting values.
         """
@@ -523,16 +704,20 @@ class MemCacheProtocol(LineReceiver, TimeoutMixin):
         if cas:
             cas = " " + cas
         length = len(val)
-        fullcmd = "%s %s %d %d %d%s" % (
+        if noreply:
+            fullcmd = "%s %s %d %d %d%s noreply\r\n" % (
+                cmd, key, flags, expireTime, length, cas)
+            self._send([fullcmd, val, "\r\n"], False)
+            return succeed(None)
+        fullcmd = "%s %s %d %d %d%s\r\n" % (
             cmd, key, flags, expireTime, length, cas)
-        self.sendLine(fullcmd)
-        self.sendLine(val)
+        self._send([fullcmd, val, "\r\n"])
         cmdObj = Command(cmd, key=key, flags=flags, length=length)
         self._current.append(cmdObj)
         return cmdObj._deferred
 
 
-    def append(self, key, val):
+    def append(self, key, val, noreply=False):
         """
         Append given data to the value of an existing key.
 
@@ -543,15 +728,19 @@ class MemCacheProtocol(LineReceiver, TimeoutMixin):
             the key.
         @type val: C{str}
 
+        @param noreply: if C{True}, the server does not answer and the
+            result is C{None}.
+        @type noreply: C{bool}
+
         @return: A deferred that will fire with C{True} if the operation has
             succeeded, C{False} otherwise.
         @rtype: L{Deferred}
         """
         # Even if flags and expTime values are ignored, we have to pass them
-        return self._set("append", key, val, 0, 0, "")
+        return self._set("append", key, val, 0, 0, "", noreply)
 
 
-    def prepend(self, key, val):
+    def prepend(self, key, val, noreply=False):
         """
         Prepend given data to the value of an existing key.
 
@@ -562,12 +751,16 @@ class MemCacheProtocol(LineReceiver, TimeoutMixin):
             the key.
         @type val: C{str}
 
+        @param noreply: if C{True}, the server does not answer and the
+            result is C{None}.
+        @type noreply: C{bool}
+
         @return: A deferred that will fire with C{True} if the operation has
             succeeded, C{False} otherwise.
         @rtype: L{Deferred}
         """
         # Even if flags and expTime values are ignored, we have to pass them
-        return self._set("prepend", key, val, 0, 0, "")
+        return self._set("prepend", key, val, 0, 0, "", noreply)
 
 
     def get(self, key, withIdentifier=False):
@@ -635,8 +828,8 @@ class MemCacheProtocol(LineReceiver, TimeoutMixin):
             cmd = "gets"
         else:
             cmd = "get"
-        fullcmd = "%s %s" % (cmd, " ".join(keys))
-        self.sendLine(fullcmd)
+        fullcmd = "%s %s\r\n" % (cmd, " ".join(keys))
+        self._send([fullcmd])
         if multiple:
             values = dict([(key, (0, "", None)) for key in keys])
             cmdObj = Command(cmd, keys=keys, values=values, multiple=True)
@@ -683,13 +876,17 @@ class MemCacheProtocol(LineReceiver, TimeoutMixin):
         return cmdObj._deferred
 
 
-    def delete(self, key):
+    def delete(self, key, noreply=False):
         """
         Delete an existing C{key}.
 
         @param key: the key to delete.
         @type key: C{str}
 
+        @param noreply: if C{True}, the server does not answer and the
+            result is C{None}.
+        @type noreply: C{bool}
+
         @return: a deferred that will be called back with C{True} if the key
             was successfully deleted, or C{False} if not.
         @rtype: L{Deferred}
@@ -697,7 +894,10 @@ class MemCacheProtocol(LineReceiver, TimeoutMixin):
         if not isinstance(key, str):
             return fail(ClientError(
                 "Invalid type for key: %s, expecting a string" % (type(key),)))
-        self.sendLine("delete %s" % key)
+        if noreply:
+            self._send(["delete %s noreply\r\n" % (key,)], False)
+            return succeed(None)
+        self._send(["delete %s\r\n" % (key,)])
         cmdObj = Command("delete", key=key)
         self._current.append(cmdObj)
         return cmdObj._deferred
@@ -718,6 +918,571 @@ class MemCacheProtocol(LineReceiver, TimeoutMixin):
 
 
 
+def _ketamaPoints(name, count):
+    """
+    Compute the points of a server on a ketama continuum.
+
+    @param name: a string identifying the server, such as C{"host:port"}.
+
+    @param count: the number of MD5 hashes to compute; each gives four
+        points.
+
+    @return: a C{list} of C{int}s.
+    """
+    points = []
+    for i in xrange(count):
+        points.extend(unpack("<4I", md5("%s-%d" % (name, i)).digest()))
+    return points
+
+
+
+def _hashKey(key):
+    """
+    Compute the position of C{key} on a ketama continuum.
+    """
+    return unpack("<I", md5(key).digest()[:4])[0]
+
+
+
+class _ClusterMemCacheProtocol(MemCacheProtocol):
+    """
+    A L{MemCacheProtocol} which tells the L{MemCacheServer} it belongs to
+    when it is connected and disconnected.
+    """
+
+    def connectionMade(self):
+        self.factory.server._connectionMade(self)
+
+
+    def connectionLost(self, reason):
+        self.factory.server._connectionLost(self)
+        MemCacheProtocol.connectionLost(self, reason)
+
+
+
+class _MemCacheConnectionFactory(ReconnectingClientFactory):
+    """
+    Maintain one of the connections to a L{MemCacheServer}, reconnecting
+    with an exponential backoff.
+    """
+    protocol = _ClusterMemCacheProtocol
+    noisy = False
+
+    def __init__(self, server):
+        self.server = server
+
+
+    def buildProtocol(self, addr):
+        self.resetDelay()
+        p = self.protocol(self.server.cluster.timeOut)
+        p.factory = self
+        p.coalesceWrites = self.server.cluster.coalesceWrites
+        if self.clock is not None:
+            p.callLater = self.clock.callLater
+        return p
+
+
+    def clientConnectionFailed(self, connector, reason):
+        self.server._connectionFailed()
+        ReconnectingClientFactory.clientConnectionFailed(
+            self, connector, reason)
+
+
+
+class MemCacheServer(object):
+    """
+    One of the servers of a L{MemCacheCluster}, with its pool of
+    connections and statistics about the commands sent to it.
+
+    Commands are sent over the connected connection with the fewest
+    outstanding commands.  Until a connection is made, they are queued.  When
+    the last connection is lost or a connection attempt fails while none is
+    up, the server is ejected: the keys it held are redistributed among the
+    other servers, along with the commands queued for it, until it can be
+    connected to again.  Commands already sent on a lost connection fail with
+    the reason the connection was lost.
+
+    @ivar cluster: the L{MemCacheCluster} this server belongs to.
+
+    @ivar host: the host name of the server.
+
+    @ivar port: the port number of the server.
+
+    @ivar weight: the share of the keys given to this server, relative to the
+        weights of the other servers.
+
+    @ivar ejected: whether the server is currently out of the cluster.
+
+    @ivar requests: the number of commands answered or failed.
+
+    @ivar errors: the number of commands which failed.
+
+    @ivar hits: the number of values found by C{get} and C{getMultiple}.
+
+    @ivar misses: the number of values not found by C{get} and
+        C{getMultiple}.
+
+    @ivar totalLatency: the sum of the time taken by all the commands, in
+        seconds.
+
+    @ivar maxLatency: the longest time taken by a command, in seconds.
+
+    @ivar _factories: the L{_MemCacheConnectionFactory} for each connection.
+
+    @ivar _connected: the currently connected L{MemCacheProtocol}s.
+
+    @ivar _waiting: a list of C{(methodName, args, deferred)} for the
+        commands waiting for a connection.
+    """
+
+    def __init__(self, cluster, host, port, weight=1, connections=1):
+        self.cluster = cluster
+        self.host = host
+        self.port = port
+        self.weight = weight
+        self.ejected = False
+        self.requests = self.errors = self.hits = self.misses = 0
+        self.totalLatency = self.maxLatency = 0.0
+        self._factories = [_MemCacheConnectionFactory(self)
+                           for i in xrange(connections)]
+        self._connected = []
+        self._waiting = []
+
+
+    def __repr__(self):
+        return "<MemCacheServer %s:%d%s>" % (
+            self.host, self.port, self.ejected and " ejected" or "")
+
+
+    def averageLatency(self):
+        """
+        @return: the mean time taken by the commands sent to this server in
+            seconds, or C{None} if none have finished.
+        """
+        if not self.requests:
+            return None
+        return self.totalLatency / self.requests
+
+
+    def connect(self, reactor):
+        """
+        Start connecting each of the connections in the pool.
+        """
+        for factory in self._factories:
+            factory.clock = reactor
+            factory.maxDelay = self.cluster.retryMaxDelay
+            reactor.connectTCP(self.host, self.port, factory)
+
+
+    def disconnect(self):
+        """
+        Stop reconnecting and close the connections in the pool.
+        """
+        for factory in self._factories:
+            factory.stopTrying()
+        for proto in self._connected[:]:
+            proto.transport.loseConnection()
+
+
+    def execute(self, methodName, *args):
+        """
+        Call a method of the least busy connection, or queue the call until
+        a connection is made.
+
+        @param methodName: the name of a L{MemCacheProtocol} method.
+
+        @param args: the arguments to pass to it.
+
+        @return: a L{Deferred} firing with the result of the method.
+        """
+        connected = self._connected
+        if not connected:
+            d = Deferred()
+            self._waiting.append((methodName, args, d))
+            return d
+        proto = connected[0]
+        if len(connected) > 1:
+            for other in connected:
+                if len(other._current) < len(proto._current):
+                    proto = other
+        d = getattr(proto, methodName)(*args)
+        d.addBoth(self._record, methodName, self.cluster._seconds())
+        return d
+
+
+    def _record(self, result, methodName, started):
+        """
+        Update the statistics with the outcome of a command.
+        """
+        latency = self.cluster._seconds() - started
+        self.requests += 1
+        self.totalLatency += latency
+        if latency > self.maxLatency:
+            self.maxLatency = latency
+        if isinstance(result, Failure):
+            self.errors += 1
+        elif methodName == "get":
+            if result[-1] is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        elif methodName == "getMultiple":
+            for value in result.itervalues():
+                if value[-1] is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+        return result
+
+
+    def _connectionMade(self, proto):
+        """
+        One of the connections was made: send it any queued commands and, if
+        the server was ejected, put it back in the cluster.
+        """
+        self._connected.append(proto)
+        if self.ejected:
+            self.ejected = False
+            self.cluster._serverChanged(self)
+        waiting = self._waiting
+        self._waiting = []
+        for methodName, args, d in waiting:
+            self.execute(methodName, *args).chainDeferred(d)
+
+
+    def _connectionLost(self, proto):
+        """
+        One of the connections was lost; eject the server if it was the last
+        one.
+        """
+        self._connected.remove(proto)
+        if not self._connected:
+            self._eject()
+
+
+    def _connectionFailed(self):
+        """
+        A connection attempt failed; eject the server if no other connection
+        is up.
+        """
+        if not self._connected:
+            self._eject()
+
+
+    def _eject(self):
+        """
+        Take the server out of the cluster and hand its queued commands to
+        the cluster to be sent elsewhere.
+        """
+        if self.ejected:
+            return
+        self.ejected = True
+        self.cluster._serverChanged(self)
+        waiting = self._waiting
+        self._waiting = []
+        for methodName, args, d in waiting:
+            if methodName in ("flushAll", "stats"):
+                # These were meant for this server in particular.
+                d.errback(NoServersAvailable())
+            else:
+                getattr(self.cluster, methodName)(*args).chainDeferred(d)
+
+
+
+class MemCacheCluster(object):
+    """
+    A memcache client for several servers.
+
+    Keys are spread among the servers by ketama consistent hashing, so that
+    adding, removing or ejecting a server only moves the keys that server
+    held.  Each server has a pool of connections (see L{MemCacheServer}),
+    reconnected with an exponential backoff when they are lost.
+
+    The methods which take a key have the same signatures and results as
+    those of L{MemCacheProtocol}, and fail with L{NoServersAvailable} when
+    every server is ejected.
+
+    @ivar servers: the L{MemCacheServer}s of the cluster.
+
+    @ivar timeOut: the timeout of each connection, in seconds.
+
+    @ivar coalesceWrites: the value of L{MemCacheProtocol.coalesceWrites}
+        for each connection.
+
+    @ivar retryMaxDelay: the longest time to wait between attempts to
+        reconnect to a server, in seconds.
+
+    @ivar pointsPerServer: the number of points each server of weight 1 has
+        on the continuum.
+
+    @ivar _points: the sorted points of the continuum of the servers which
+        are not ejected.
+
+    @ivar _owners: the L{MemCacheServer} owning each of L{_points}.
+    """
+    pointsPerServer = 160
+    coalesceWrites = False
+
+    def __init__(self, servers, connectionsPerServer=1, timeOut=60,
+                 retryMaxDelay=30, reactor=None):
+        """
+        @param servers: a sequence of C{(host, port)} or
+            C{(host, port, weight)} tuples.
+
+        @param connectionsPerServer: the size of the connection pool of each
+            server.
+
+        @param reactor: the reactor to connect with, or C{None} for the
+            global reactor.
+        """
+        if reactor is None:
+            from twisted.internet import reactor
+        self._reactor = reactor
+        self._seconds = time.time
+        self.timeOut = timeOut
+        self.retryMaxDelay = retryMaxDelay
+        self.servers = []
+        self._serverPoints = {}
+        for spec in servers:
+            host, port = spec[:2]
+            if len(spec) > 2:
+                weight = spec[2]
+            else:
+                weight = 1
+            server = MemCacheServer(
+                self, host, port, weight, connectionsPerServer)
+            self.servers.append(server)
+            self._serverPoints[server] = _ketamaPoints(
+                "%s:%d" % (server.host, server.port),
+                int(self.pointsPerServer * server.weight) // 4)
+        self._buildContinuum()
+
+
+    def _buildContinuum(self):
+        """
+        Compute the continuum of the servers which are not ejected.
+        """
+        continuum = []
+        for index, server in enumerate(self.servers):
+            if not server.ejected:
+                for point in self._serverPoints[server]:
+                    continuum.append((point, index))
+        continuum.sort()
+        self._points = [point for (point, index) in continuum]
+        self._owners = [self.servers[index] for (point, index) in continuum]
+
+
+    def _serverChanged(self, server):
+        """
+        A server was ejected or put back in the cluster.
+        """
+        if server.ejected:
+            log.msg("Ejecting memcache server %s:%d" % (
+                    server.host, server.port))
+        else:
+            log.msg("Memcache server %s:%d is back" % (
+                    server.host, server.port))
+        self._buildContinuum()
+
+
+    def connect(self):
+        """
+        Start connecting to all the servers.
+        """
+        for server in self.servers:
+            server.connect(self._reactor)
+
+
+    def disconnect(self):
+        """
+        Close all the connections and stop reconnecting.
+        """
+        for server in self.servers:
+            server.disconnect()
+
+
+    def serverForKey(self, key):
+        """
+        @return: the L{MemCacheServer} which holds C{key}, or C{None} if
+            every server is ejected.
+        """
+        points = self._points
+        if not points:
+            return None
+        index = bisect_left(points, _hashKey(key))
+        if index == len(points):
+            index = 0
+        return self._owners[index]
+
+
+    def _execute(self, methodName, key, *args):
+        """
+        Call a L{MemCacheProtocol} method on the server holding C{key}.
+        """
+        if not isinstance(key, str):
+            return fail(ClientError(
+                "Invalid type for key: %s, expecting a string" % (type(key),)))
+        server = self.serverForKey(key)
+        if server is None:
+            return fail(NoServersAvailable())
+        return server.execute(methodName, key, *args)
+
+
+    def get(self, key, withIdentifier=False):
+        """
+        See L{MemCacheProtocol.get}.
+        """
+        return self._execute("get", key, withIdentifier)
+
+
+    def set(self, key, val, flags=0, expireTime=0, noreply=False):
+        """
+        See L{MemCacheProtocol.set}.
+        """
+        return self._execute("set", key, val, flags, expireTime, noreply)
+
+
+    def add(self, key, val, flags=0, expireTime=0, noreply=False):
+        """
+        See L{MemCacheProtocol.add}.
+        """
+        return self._execute("add", key, val, flags, expireTime, noreply)
+
+
+    def replace(self, key, val, flags=0, expireTime=0, noreply=False):
+        """
+        See L{MemCacheProtocol.replace}.
+        """
+        return self._execute("replace", key, val, flags, expireTime, noreply)
+
+
+    def checkAndSet(self, key, val, cas, flags=0, expireTime=0,
+                    noreply=False):
+        """
+        See L{MemCacheProtocol.checkAndSet}.
+        """
+        return self._execute(
+            "checkAndSet", key, val, cas, flags, expireTime, noreply)
+
+
+    def append(self, key, val, noreply=False):
+        """
+        See L{MemCacheProtocol.append}.
+        """
+        return self._execute("append", key, val, noreply)
+
+
+    def prepend(self, key, val, noreply=False):
+        """
+        See L{MemCacheProtocol.prepend}.
+        """
+        return self._execute("prepend", key, val, noreply)
+
+
+    def increment(self, key, val=1):
+        """
+        See L{MemCacheProtocol.increment}.
+        """
+        return self._execute("increment", key, val)
+
+
+    def decrement(self, key, val=1):
+        """
+        See L{MemCacheProtocol.decrement}.
+        """
+        return self._execute("decrement", key, val)
+
+
+    def delete(self, key, noreply=False):
+        """
+        See L{MemCacheProtocol.delete}.
+        """
+        return self._execute("delete", key, noreply)
+
+
+    def getMultiple(self, keys, withIdentifier=False):
+        """
+        Get the given list of C{keys}, sending one command to each of the
+        servers holding some of them, all at once.  See
+        L{MemCacheProtocol.getMultiple}.
+
+        @return: a L{Deferred} firing with the merged results, or failing
+            with the first failure of any of the servers.
+        """
+        byServer = {}
+        for key in keys:
+            if not isinstance(key, str):
+                return fail(ClientError(
+                    "Invalid type for key: %s, expecting a string" % (
+                        type(key),)))
+            server = self.serverForKey(key)
+            if server is None:
+                return fail(NoServersAvailable())
+            byServer.setdefault(server, []).append(key)
+        if len(byServer) == 1:
+            [(server, keys)] = byServer.items()
+            return server.execute("getMultiple", keys, withIdentifier)
+        return self._gather([
+                server.execute("getMultiple", serverKeys, withIdentifier)
+                for (server, serverKeys) in byServer.iteritems()],
+                self._mergeValues)
+
+
+    def _mergeValues(self, results):
+        """
+        Merge the dictionaries of values returned by several servers.
+        """
+        values = {}
+        for success, result in results:
+            values.update(result)
+        return values
+
+
+    def _gather(self, deferreds, merge):
+        """
+        Wait for all of C{deferreds} and merge their results with C{merge},
+        or fail with the first failure.
+        """
+        def unwrap(failure):
+            failure.trap(FirstError)
+            return failure.value.subFailure
+        d = DeferredList(deferreds, fireOnOneErrback=True, consumeErrors=True)
+        return d.addCallbacks(merge, unwrap)
+
+
+    def flushAll(self):
+        """
+        Flush all the values cached by the servers which are not ejected.
+
+        @return: a L{Deferred} firing with C{True} once all of them have
+            answered.
+        """
+        return self._gather([server.execute("flushAll")
+                             for server in self.servers
+                             if not server.ejected],
+                            lambda results: True)
+
+
+    def stats(self, arg=None):
+        """
+        Get the statistics of the servers which are not ejected.  See
+        L{MemCacheProtocol.stats}.
+
+        @return: a L{Deferred} firing with a C{dict} mapping C{"host:port"}
+            strings to the statistics of each server.
+        """
+        servers = [server for server in self.servers if not server.ejected]
+        def merge(results):
+            values = {}
+            for server, (success, result) in zip(servers, results):
+                values["%s:%d" % (server.host, server.port)] = result
+            return values
+        return self._gather([server.execute("stats", arg)
+                             for server in servers], merge)
+
+
+
 __all__ = ["MemCacheProtocol", "DEFAULT_PORT", "NoSuchCommand", "ClientError",
-           "ServerError"]
+           "ServerError", "NoServersAvailable", "MemCacheCluster",
+           "MemCacheServer"]
 
@@ -17,6 +17,7 @@ from zope.interface import directlyProvides, providedBy
 from twisted.internet.protocol import ServerFactory, Protocol, ClientFactory
 from twisted.internet import error
 from twisted.python import log
+from twisted.protocols import htb
 
 
 class ProtocolWrapper(Protocol):
@@ -305,6 +306,237 @@ class ThrottlingFactory(WrappingFactory):
 
 
 
+class TokenBucketThrottlingProtocol(ThrottlingProtocol):
+    """
+    Protocol for L{TokenBucketThrottlingFactory}.
+
+    Every read and write is charged to this connection's bucket and its
+    parents.  As soon as one of them is overfull the transport (for reads)
+    or the registered producer (for writes) is paused, and it is resumed
+    once the buckets have drained again.
+
+    @ivar readBucket: The L{htb.Bucket} charged for bytes read, or C{None}
+        if reads are not limited.
+    @ivar writeBucket: The L{htb.Bucket} charged for bytes written, or
+        C{None} if writes are not limited.
+    """
+    readBucket = None
+    writeBucket = None
+    _unthrottleReadsCall = None
+    _unthrottleWritesCall = None
+
+    def makeConnection(self, transport):
+        self.readBucket = self.factory.getReadBucket(transport)
+        self.writeBucket = self.factory.getWriteBucket(transport)
+        ProtocolWrapper.makeConnection(self, transport)
+
+
+    def write(self, data):
+        if self.writeBucket is not None:
+            self._chargeWrites(len(data))
+        ProtocolWrapper.write(self, data)
+
+
+    def writeSequence(self, seq):
+        if self.writeBucket is not None:
+            self._chargeWrites(sum(map(len, seq)))
+        ProtocolWrapper.writeSequence(self, seq)
+
+
+    def dataReceived(self, data):
+        bucket = self.readBucket
+        if bucket is not None:
+            bucket.charge(len(data))
+            if self._unthrottleReadsCall is None:
+                delay = bucket.delay()
+                if delay:
+                    self.throttleReads()
+                    self._unthrottleReadsCall = self.factory.callLater(
+                        delay, self._checkReads)
+        ProtocolWrapper.dataReceived(self, data)
+
+
+    def _chargeWrites(self, length):
+        """
+        Charge C{length} bytes to the write bucket and pause the producer if
+        that leaves a bucket overfull.  Without a producer there is nothing
+        to pause, so the bytes are only accounted for.
+        """
+        self.writeBucket.charge(length)
+        if self._unthrottleWritesCall is None and hasattr(self, "producer"):
+            delay = self.writeBucket.delay()
+            if delay:
+                self.throttleWrites()
+                self._unthrottleWritesCall = self.factory.callLater(
+                    delay, self._checkWrites)
+
+
+    def _checkReads(self):
+        """
+        Resume reading, unless other connections sharing a bucket have
+        filled it up again in the meantime.
+        """
+        delay = self.readBucket.delay()
+        if delay:
+            self._unthrottleReadsCall = self.factory.callLater(
+                delay, self._checkReads)
+        else:
+            self._unthrottleReadsCall = None
+            self.unthrottleReads()
+
+
+    def _checkWrites(self):
+        """
+        Resume the producer, unless the write buckets are still overfull.
+        """
+        delay = self.writeBucket.delay()
+        if delay:
+            self._unthrottleWritesCall = self.factory.callLater(
+                delay, self._checkWrites)
+        else:
+            self._unthrottleWritesCall = None
+            self.unthrottleWrites()
+
+
+    def connectionLost(self, reason):
+        if self._unthrottleReadsCall is not None:
+            self._unthrottleReadsCall.cancel()
+            self._unthrottleReadsCall = None
+        if self._unthrottleWritesCall is not None:
+            self._unthrottleWritesCall.cancel()
+            self._unthrottleWritesCall = None
+        for bucket in self.readBucket, self.writeBucket:
+            while bucket is not None:
+                bucket._refcount -= 1
+                bucket = bucket.parentBucket
+        ProtocolWrapper.connectionLost(self, reason)
+
+
+
+class _LimitedBucketFilter(htb.HierarchicalBucketFilter):
+    """
+    A bucket filter which makes buckets draining at C{rate} bytes per second
+    and holding C{burst} bytes, all sharing one bucket unless
+    L{getBucketKey} is overridden.
+    """
+    def __init__(self, rate, burst, parentFilter=None):
+        htb.HierarchicalBucketFilter.__init__(self, parentFilter)
+        self.rate = rate
+        self.burst = burst
+
+
+    def bucketFactory(self, parentBucket):
+        bucket = htb.Bucket(parentBucket)
+        bucket.rate = self.rate
+        bucket.maxburst = self.burst
+        return bucket
+
+
+
+class _HostBucketFilter(_LimitedBucketFilter):
+    """
+    A L{_LimitedBucketFilter} with a bucket for each peer host.
+    """
+    sweepInterval = 60
+
+    def getBucketKey(self, transport):
+        return transport.getPeer().host
+
+
+
+class TokenBucketThrottlingFactory(WrappingFactory):
+    """
+    Throttles bandwidth with a hierarchy of token buckets: one shared by
+    all connections, one for each peer host and one for each connection.
+
+    Unlike L{ThrottlingFactory}, which checks once a second whether the last
+    second's traffic was over the limit, connections are paused the moment
+    a read or write overflows one of their buckets and resumed as soon as it
+    has drained, so short bursts are allowed and the long-term rate is
+    held to the limit.  Each limit is in bytes per second, or C{None} to
+    not limit that level; a bucket holds C{burstTime} seconds' worth of
+    bytes.
+
+    Write bandwidth will only be throttled if there is a producer
+    registered.
+    """
+
+    protocol = TokenBucketThrottlingProtocol
+
+    def __init__(self, wrappedFactory, readLimit=None, writeLimit=None,
+                 hostReadLimit=None, hostWriteLimit=None,
+                 connectionReadLimit=None, connectionWriteLimit=None,
+                 burstTime=1.0):
+        WrappingFactory.__init__(self, wrappedFactory)
+        self.burstTime = burstTime
+        self.readFilter = self._makeFilter(readLimit, hostReadLimit)
+        self.writeFilter = self._makeFilter(writeLimit, hostWriteLimit)
+        self.connectionReadLimit = connectionReadLimit
+        self.connectionWriteLimit = connectionWriteLimit
+
+
+    def _makeFilter(self, limit, hostLimit):
+        """
+        Make the filter handing out the global and per-host buckets for one
+        direction, or return C{None} if neither is limited.
+        """
+        filter = None
+        if limit is not None:
+            filter = _LimitedBucketFilter(limit, limit * self.burstTime)
+        if hostLimit is not None:
+            filter = _HostBucketFilter(
+                hostLimit, hostLimit * self.burstTime, filter)
+        return filter
+
+
+    def _getBucket(self, filter, limit, transport):
+        """
+        Return a new bucket for one connection, under the buckets C{filter}
+        gives for C{transport}, and take a reference to all of them.
+        """
+        parent = None
+        if filter is not None:
+            parent = filter.getBucketFor(transport)
+        if limit is None:
+            bucket = parent
+        else:
+            bucket = htb.Bucket(parent)
+            bucket.rate = limit
+            bucket.maxburst = limit * self.burstTime
+        chain = bucket
+        while chain is not None:
+            chain._refcount += 1
+            chain = chain.parentBucket
+        return bucket
+
+
+    def getReadBucket(self, transport):
+        """
+        Return the bucket to charge bytes read from C{transport} to, or
+        C{None} if reads are not limited.
+        """
+        return self._getBucket(
+            self.readFilter, self.connectionReadLimit, transport)
+
+
+    def getWriteBucket(self, transport):
+        """
+        Return the bucket to charge bytes written to C{transport} to, or
+        C{None} if writes are not limited.
+        """
+        return self._getBucket(
+            self.writeFilter, self.connectionWriteLimit, transport)
+
+
+    def callLater(self, period, func):
+        """
+        Wrapper around L{reactor.callLater} for test purpose.
+        """
+        from twisted.internet import reactor
+        return reactor.callLater(period, func)
+
+
+
 class SpewingProtocol(ProtocolWrapper):
     def dataReceived(self, data):
         log.msg("Received: %r" % data)
@@ -597,11 +829,17 @@ class TrafficLoggingFactory(WrappingFactory):
 class TimeoutMixin:
     """Mixin for protocols which wish to timeout connections
 
+    Activity only records the time it happened; the pending call is not moved
+    each time.  When it fires it checks how long the connection has really
+    been idle and, if that is less than C{timeOut}, schedules itself again
+    for the remainder.
+
     @cvar timeOut: The number of seconds after which to timeout the connection.
     """
     timeOut = None
 
     __timeoutCall = None
+    __lastActivity = None
 
     def callLater(self, period, func):
         from twisted.internet import reactor
@@ -610,8 +848,9 @@ class TimeoutMixin:
 
     def resetTimeout(self):
         """Reset the timeout count down"""
-        if self.__timeoutCall is not None and self.timeOut is not None:
-            self.__timeoutCall.reset(self.timeOut)
+        call = self.__timeoutCall
+        if call is not None:
+            self.__lastActivity = call.seconds()
 
     def setTimeout(self, period):
         """Change the timeout period
@@ -629,14 +868,23 @@ class TimeoutMixin:
                 self.__timeoutCall = None
             else:
                 self.__timeoutCall.reset(period)
+                self.__lastActivity = self.__timeoutCall.seconds()
         elif period is not None:
             self.__timeoutCall = self.callLater(period, self.__timedOut)
+            self.__lastActivity = self.__timeoutCall.seconds()
 
         return prev
 
     def __timedOut(self):
-        self.__timeoutCall = None
-        self.timeoutConnection()
+        call = self.__timeoutCall
+        remaining = 0
+        if self.timeOut is not None:
+            remaining = self.__lastActivity + self.timeOut - call.seconds()
+        if remaining > 0:
+            self.__timeoutCall = self.callLater(remaining, self.__timedOut)
+        else:
+            self.__timeoutCall = None
+            self.timeoutConnection()
 
     def timeoutConnection(self):
         """Called when the connection times out.
@@ -1,25 +1,32 @@
-
-# Copyright (c) 2001-2004 Twisted Matrix Laboratories.
+# -*- test-case-name: twisted.test.test_protocols -*-
+# Copyright (c) 2001-2009 Twisted Matrix Laboratories.
 # See LICENSE for details.
 
 """
 A simple port forwarder.
 """
 
+import os, errno
+
 # Twisted imports
-from twisted.internet import protocol
-from twisted.python import log
+from twisted.internet import protocol, main, tcp
+from twisted.internet.interfaces import ISSLTransport
+from twisted.python import log, _splice
 
 class Proxy(protocol.Protocol):
     noisy = True
 
     peer = None
+    relay = None
 
     def setPeer(self, peer):
         self.peer = peer
 
     def connectionLost(self, reason):
+        if self.relay is not None:
+            self.relay.stop()
         if self.peer is not None:
+            self.peer.transport.unregisterProducer()
             self.peer.transport.loseConnection()
             self.peer = None
         elif self.noisy:
@@ -31,6 +38,14 @@ class Proxy(protocol.Protocol):
 class ProxyClient(Proxy):
     def connectionMade(self):
         self.peer.setPeer(self)
+        # Each side only reads while the other can keep up with writing, so
+        # a fast sender and a slow receiver do not fill up our memory.
+        self.transport.registerProducer(self.peer.transport, True)
+        self.peer.transport.registerProducer(self.transport, True)
+        if self.peer.factory.useSplice and _canSplice(self, self.peer):
+            self.relay = self.peer.relay = _SpliceRelay(
+                self.transport, self.peer.transport)
+            self.relay.start()
         # We're connected, everybody can read to their hearts content.
         self.peer.transport.resumeProducing()
 
@@ -67,10 +82,159 @@ class ProxyServer(Proxy):
 
 
 class ProxyFactory(protocol.Factory):
-    """Factory for port forwarder."""
+    """Factory for port forwarder.
+
+    @cvar useSplice: If true, and C{splice(2)} is available, relay the bytes
+        of plain TCP connections between two pipes inside the kernel instead
+        of reading them into strings.  Protocols which override
+        C{dataReceived} to look at the data are never spliced.
+    """
 
     protocol = ProxyServer
+    useSplice = False
 
     def __init__(self, host, port):
         self.host = host
         self.port = port
+
+
+
+def _canSplice(*proxies):
+    """
+    Can the bytes between the transports of C{proxies} be spliced?  Only
+    plain TCP connections whose data is not looked at qualify.
+    """
+    if not _splice.available:
+        return False
+    for proxy in proxies:
+        transport = proxy.transport
+        if (not isinstance(transport, tcp.Connection) or transport.TLS
+            or ISSLTransport.providedBy(transport)
+            or proxy.dataReceived.im_func is not Proxy.dataReceived.im_func):
+            return False
+    return True
+
+
+
+class _SpliceDirection:
+    """
+    Move bytes from one transport to another through a pipe.
+
+    The source is only read while the pipe is empty; if the destination
+    cannot take everything, reading stops until it can.
+
+    @ivar pending: The number of bytes in the pipe.
+    """
+    chunkSize = 2 ** 16
+
+    def __init__(self, relay, source, destination):
+        self.relay = relay
+        self.source = source
+        self.destination = destination
+        self.pipeRead, self.pipeWrite = os.pipe()
+        self.pending = 0
+
+
+    def doRead(self):
+        """
+        Replaces the source's C{doRead}.
+        """
+        try:
+            count = _splice.splice(
+                self.source.fileno(), self.pipeWrite, self.chunkSize)
+        except OSError, e:
+            if e.errno in (errno.EAGAIN, errno.EINTR):
+                return None
+            return main.CONNECTION_LOST
+        if not count:
+            return main.CONNECTION_DONE
+        self.pending += count
+        return self.flush()
+
+
+    def doWrite(self):
+        """
+        Replaces the destination's C{doWrite}.
+        """
+        destination = self.destination
+        if destination.disconnecting:
+            # Someone wants this connection closed; let the transport's own
+            # doWrite do it.
+            self.relay.stop()
+            return destination.doWrite()
+        result = self.flush()
+        if not self.pending:
+            destination.stopWriting()
+            self.source.startReading()
+        return result
+
+
+    def flush(self):
+        """
+        Move as much of the pipe's contents to the destination as it will
+        take without blocking.
+        """
+        while self.pending:
+            try:
+                count = _splice.splice(
+                    self.pipeRead, self.destination.fileno(), self.pending)
+            except OSError, e:
+                if e.errno == errno.EINTR:
+                    continue
+                if e.errno != errno.EAGAIN:
+                    return main.CONNECTION_LOST
+                self.source.stopReading()
+                self.destination.startWriting()
+                return None
+            self.pending -= count
+        return None
+
+
+    def close(self):
+        os.close(self.pipeRead)
+        os.close(self.pipeWrite)
+        self.pending = 0
+
+
+
+class _SpliceRelay:
+    """
+    Relay the bytes of two connected TCP transports to each other with
+    C{splice(2)}.
+
+    While running, the transports' C{doRead} and C{doWrite} are replaced by
+    those of a L{_SpliceDirection} for each direction, so the reactor keeps
+    watching the same selectables and the transports still handle closing
+    the connection themselves.
+    """
+    running = False
+
+    def __init__(self, first, second):
+        self.directions = [_SpliceDirection(self, first, second),
+                           _SpliceDirection(self, second, first)]
+
+
+    def start(self):
+        self.running = True
+        for direction in self.directions:
+            direction.source.doRead = direction.doRead
+            direction.destination.doWrite = direction.doWrite
+
+
+    def stop(self):
+        """
+        Give the transports their own C{doRead} and C{doWrite} back.  Bytes
+        still in the pipes are dropped, as the transports are about to be
+        disconnected anyway.
+        """
+        if not self.running:
+            return
+        self.running = False
+        for direction in self.directions:
+            del direction.source.doRead
+            del direction.destination.doWrite
+            direction.close()
+        for direction in self.directions:
+            transport = direction.source
+            if transport.connected and not transport.disconnecting:
+                transport.startReading()
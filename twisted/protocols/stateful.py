@@ -6,11 +6,6 @@
 
 from twisted.internet import protocol
 
-try:
-    from cStringIO import StringIO
-except ImportError:
-    from StringIO import StringIO
-
 class StatefulProtocol(protocol.Protocol):
     """A Protocol that stores state for you.
 
@@ -19,34 +14,46 @@ class StatefulProtocol(protocol.Protocol):
     state or None to keep same state. Initial state is returned by
     getInitialState (override it).
     """
+    # The current state, a list of the strings received but not yet consumed,
+    # and their total length.  The strings are only joined once there are
+    # enough of them for the current state, so that a large state being
+    # received a little at a time is not copied again for every read.
     _sful_data = None, None, 0
 
     def makeConnection(self, transport):
         protocol.Protocol.makeConnection(self, transport)
-        self._sful_data = self.getInitialState(), StringIO(), 0
+        self._sful_data = self.getInitialState(), [], 0
 
     def getInitialState(self):
         raise NotImplementedError
 
     def dataReceived(self, data):
-        state, buffer, offset = self._sful_data
-        buffer.seek(0, 2)
-        buffer.write(data)
-        blen = buffer.tell() # how many bytes total is in the buffer
-        buffer.seek(offset)
-        while blen - offset >= state[1]:
-            d = buffer.read(state[1])
-            offset += state[1]
-            next = state[0](d)
-            if self.transport.disconnecting: # XXX: argh stupid hack borrowed right from LineReceiver
+        state, pending, length = self._sful_data
+        pending.append(data)
+        length += len(data)
+        function, size = state
+        if length < size:
+            self._sful_data = state, pending, length
+            return
+        if len(pending) == 1:
+            buffer = data
+        else:
+            buffer = ''.join(pending)
+        offset = 0
+        transport = self.transport
+        while length - offset >= size:
+            end = offset + size
+            next = function(buffer[offset:end])
+            offset = end
+            if transport.disconnecting: # XXX: argh stupid hack borrowed right from LineReceiver
                 return # dataReceived won't be called again, so who cares about consistent state
             if next:
                 state = next
-        if offset != 0:
-            b = buffer.read()
-            buffer.seek(0)
-            buffer.truncate()
-            buffer.write(b)
-            offset = 0
-        self._sful_data = state, buffer, offset
-
+                function, size = state
+        if offset == length:
+            pending = []
+        elif offset:
+            pending = [buffer[offset:]]
+        else:
+            pending = [buffer]
+        self._sful_data = state, pending, length - offset
@@ -22,6 +22,7 @@ from twisted.python.filepath import FilePath
 from twisted.internet.interfaces import ISystemHandle, ISSLTransport
 from twisted.internet.error import ConnectionDone
 from twisted.internet.defer import Deferred, gatherResults
+from twisted.internet.task import Clock
 from twisted.internet.protocol import Protocol, ClientFactory, ServerFactory
 from twisted.protocols.loopback import loopbackAsync, collapsingPumpPolicy
 from twisted.trial.unittest import TestCase
@@ -564,3 +565,116 @@ class TLSMemoryBIOTests(TestCase):
         handshakeDeferred.addCallback(cbConnectionDone)
         return handshakeDeferred
 
+
+
+
+class WriteCoalescingTests(TestCase):
+    """
+    Tests for L{TLSMemoryBIOProtocol.coalesceWrites}.
+    """
+    def setUp(self):
+        self.clock = Clock()
+
+        self.clientProtocol = Protocol()
+        clientFactory = ClientFactory()
+        clientFactory.protocol = lambda: self.clientProtocol
+        wrapperFactory = TLSMemoryBIOFactory(
+            HandshakeCallbackContextFactory(), True, clientFactory)
+        wrapperFactory.coalesceWrites = True
+        self.client = wrapperFactory.buildProtocol(None)
+        self.client.callLater = self.clock.callLater
+
+        self.serverProtocol = AccumulatingProtocol(2 ** 30)
+        serverFactory = ServerFactory()
+        serverFactory.protocol = lambda: self.serverProtocol
+        wrapperFactory = TLSMemoryBIOFactory(
+            DefaultOpenSSLContextFactory(certPath, certPath), False,
+            serverFactory)
+        self.server = wrapperFactory.buildProtocol(None)
+
+        self.clientTransport = StringTransport()
+        self.serverTransport = StringTransport()
+        self.client.makeConnection(self.clientTransport)
+        self.server.makeConnection(self.serverTransport)
+        self.pump()
+        self.clientTransport.writes = 0
+        self.clientTransport.write = self.countingWrite
+
+
+    def countingWrite(self, bytes):
+        """
+        Count the writes of the client's underlying transport.
+        """
+        self.clientTransport.writes += 1
+        StringTransport.write(self.clientTransport, bytes)
+
+
+    def pump(self):
+        """
+        Move bytes between the client and the server until there are none
+        left to move.
+        """
+        while self.clientTransport.value() or self.serverTransport.value():
+            bytes = self.clientTransport.value()
+            if bytes:
+                self.clientTransport.clear()
+                self.server.dataReceived(bytes)
+            bytes = self.serverTransport.value()
+            if bytes:
+                self.serverTransport.clear()
+                self.client.dataReceived(bytes)
+
+
+    def test_coalesced(self):
+        """
+        Writes made during one reactor iteration are held until it ends and
+        then encrypted and written to the underlying transport together.
+        """
+        for i in range(10):
+            self.clientProtocol.transport.write(str(i))
+        self.clientProtocol.transport.writeSequence(["a", "b"])
+        self.assertEquals(self.clientTransport.value(), "")
+
+        self.clock.advance(0)
+        self.assertEquals(self.clientTransport.writes, 1)
+        self.pump()
+        self.assertEquals("".join(self.serverProtocol.received),
+                          "0123456789ab")
+
+
+    def test_flushWrites(self):
+        """
+        L{TLSMemoryBIOProtocol.flushWrites} writes the held bytes immediately
+        and cancels the pending call.
+        """
+        self.clientProtocol.transport.write("hello")
+        self.client.flushWrites()
+        self.assertEquals(self.clientTransport.writes, 1)
+        self.assertEquals(self.clock.calls, [])
+        self.pump()
+        self.assertEquals("".join(self.serverProtocol.received), "hello")
+
+
+    def test_largeWrite(self):
+        """
+        Bytes larger than a TLS record are encrypted a record at a time and
+        still sent with a single write.
+        """
+        bytes = "x" * (2 ** 14 * 5 + 17)
+        self.clientProtocol.transport.write(bytes)
+        self.clock.advance(0)
+        self.assertEquals(self.clientTransport.writes, 1)
+        self.pump()
+        self.assertEquals("".join(self.serverProtocol.received), bytes)
+
+
+    def test_loseConnectionFlushes(self):
+        """
+        Held bytes are sent before the TLS close alert when the connection is
+        closed.
+        """
+        self.clientProtocol.transport.write("goodbye")
+        self.clientProtocol.transport.loseConnection()
+        self.assertEquals(self.clock.calls, [])
+        self.pump()
+        self.assertEquals("".join(self.serverProtocol.received), "goodbye")
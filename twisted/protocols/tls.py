@@ -97,6 +97,18 @@ class TLSMemoryBIOProtocol(ProtocolWrapper):
         the connection to be lost, it is saved here.  If appropriate, this may
         be used as the reason passed to the application protocol's
         C{connectionLost} method.
+
+    @ivar coalesceWrites: If true, application bytes written during one
+        iteration of the reactor are held and encrypted together once the
+        reactor gets around to it, so that they go out as full-size TLS
+        records in a single write to the underlying transport.
+        L{flushWrites} encrypts and sends them immediately.  This is set
+        from the factory's C{coalesceWrites} when the connection is made.
+
+    @ivar _pendingWrites: A C{list} of C{str} of application bytes held by
+        C{coalesceWrites}, or C{None} if there are none.
+
+    @ivar _flushCall: The delayed call which will write C{_pendingWrites}.
     """
     implements(ISystemHandle, ISSLTransport)
 
@@ -105,6 +117,13 @@ class TLSMemoryBIOProtocol(ProtocolWrapper):
     _lostConnection = False
     _writeBlockedOnRead = False
 
+    coalesceWrites = False
+    _pendingWrites = None
+    _flushCall = None
+
+    # The most cleartext which fits in one TLS record.
+    _recordSize = 2 ** 14
+
     def __init__(self, factory, wrappedProtocol, _connectWrapped=True):
         ProtocolWrapper.__init__(self, factory, wrappedProtocol)
         self._connectWrapped = _connectWrapped
@@ -135,6 +154,8 @@ class TLSMemoryBIOProtocol(ProtocolWrapper):
         else:
             self._tlsConnection.set_accept_state()
         self._appSendBuffer = []
+        if self.factory.coalesceWrites:
+            self.coalesceWrites = True
 
         # Intentionally skip ProtocolWrapper.makeConnection - it might call
         # wrappedProtocol.makeConnection, which we want to make conditional.
@@ -161,16 +182,24 @@ class TLSMemoryBIOProtocol(ProtocolWrapper):
 
     def _flushSendBIO(self):
         """
-        Read any bytes out of the send BIO and write them to the underlying
-        transport.
+        Read all the bytes out of the send BIO and write them to the
+        underlying transport in one call.
         """
-        try:
-            bytes = self._tlsConnection.bio_read(2 ** 15)
-        except WantReadError:
-            # There may be nothing in the send BIO right now.
-            pass
-        else:
-            self.transport.write(bytes)
+        chunks = []
+        while True:
+            try:
+                bytes = self._tlsConnection.bio_read(2 ** 15)
+            except WantReadError:
+                # There is nothing (more) in the send BIO right now.
+                break
+            chunks.append(bytes)
+            if len(bytes) < 2 ** 15:
+                # A short read means the BIO is empty; don't ask again.
+                break
+        if len(chunks) == 1:
+            self.transport.write(chunks[0])
+        elif chunks:
+            self.transport.write("".join(chunks))
 
 
     def _flushReceiveBIO(self):
@@ -247,8 +276,7 @@ class TLSMemoryBIOProtocol(ProtocolWrapper):
             self._writeBlockedOnRead = False
             appSendBuffer = self._appSendBuffer
             self._appSendBuffer = []
-            for bytes in appSendBuffer:
-                self.write(bytes)
+            self._write("".join(appSendBuffer))
             if not self._writeBlockedOnRead and self.disconnecting:
                 self.loseConnection()
 
@@ -261,6 +289,11 @@ class TLSMemoryBIOProtocol(ProtocolWrapper):
         the underlying transport going away or due to an error at the TLS
         layer) and make sure the base implementation only gets invoked once.
         """
+        if self._flushCall is not None:
+            if self._flushCall.active():
+                self._flushCall.cancel()
+            self._flushCall = None
+        self._pendingWrites = None
         if not self._lostConnection:
             # Tell the TLS connection that it's not going to get any more data
             # and give it a chance to finish reading.
@@ -272,6 +305,7 @@ class TLSMemoryBIOProtocol(ProtocolWrapper):
         """
         Send a TLS close alert and close the underlying connection.
         """
+        self.flushWrites()
         self.disconnecting = True
         if not self._writeBlockedOnRead:
             self._tlsConnection.shutdown()
@@ -286,14 +320,27 @@ class TLSMemoryBIOProtocol(ProtocolWrapper):
         """
         if self._lostConnection:
             return
+        if self.coalesceWrites:
+            self._holdWrites([bytes])
+        else:
+            self._write(bytes)
+
 
-        leftToSend = bytes
-        while leftToSend:
+    def _write(self, bytes):
+        """
+        Encrypt C{bytes} a record at a time, then send all the resulting TLS
+        traffic with one write to the underlying transport.
+        """
+        offset = 0
+        length = len(bytes)
+        recordSize = self._recordSize
+        while offset < length:
             try:
-                sent = self._tlsConnection.send(leftToSend)
+                sent = self._tlsConnection.send(
+                    bytes[offset:offset + recordSize])
             except WantReadError:
                 self._writeBlockedOnRead = True
-                self._appSendBuffer.append(leftToSend)
+                self._appSendBuffer.append(bytes[offset:])
                 break
             except Error, e:
                 # Just drop the connection.  This has two useful consequences.
@@ -305,13 +352,13 @@ class TLSMemoryBIOProtocol(ProtocolWrapper):
                 # non-reentrantly, which is always a nice feature.
                 self._reason = Failure()
                 self.transport.loseConnection()
-                break
+                return
             else:
                 # If we sent some bytes, the handshake must be done.  Keep
                 # track of this to control error reporting behavior.
                 self._handshakeDone = True
-                self._flushSendBIO()
-                leftToSend = leftToSend[sent:]
+                offset += sent
+        self._flushSendBIO()
 
 
     def writeSequence(self, iovec):
@@ -319,7 +366,52 @@ class TLSMemoryBIOProtocol(ProtocolWrapper):
         Write a sequence of application bytes by joining them into one string
         and passing them to L{write}.
         """
-        self.write("".join(iovec))
+        if self._lostConnection:
+            return
+        if self.coalesceWrites:
+            self._holdWrites(list(iovec))
+        else:
+            self._write("".join(iovec))
+
+
+    def _holdWrites(self, data):
+        """
+        Add application bytes to those waiting to be written by
+        L{flushWrites}, arranging for it to be called if it has not already
+        been.
+
+        @param data: a list of strings.
+        """
+        if self._pendingWrites is None:
+            self._pendingWrites = data
+            self._flushCall = self.callLater(0, self.flushWrites)
+        else:
+            self._pendingWrites.extend(data)
+
+
+    def flushWrites(self):
+        """
+        Encrypt and send any application bytes held back by
+        C{coalesceWrites} now.
+        """
+        if self._flushCall is not None:
+            if self._flushCall.active():
+                self._flushCall.cancel()
+            self._flushCall = None
+        pending = self._pendingWrites
+        if pending is not None:
+            self._pendingWrites = None
+            if not self._lostConnection:
+                self._write("".join(pending))
+
+
+    def callLater(self, delay, f, *args, **kw):
+        """
+        Schedule a call with the global reactor; used by C{coalesceWrites}.
+        Override this to use a different scheduler.
+        """
+        from twisted.internet import reactor
+        return reactor.callLater(delay, f, *args, **kw)
 
 
     def getPeerCertificate(self):
@@ -336,8 +428,13 @@ class TLSMemoryBIOFactory(WrappingFactory):
 
     @ivar _isClient: A flag which is C{True} if this is a client TLS
         connection, C{False} if it is a server TLS connection.
+
+    @ivar coalesceWrites: If true, the protocols this factory builds hold
+        application writes until the end of the reactor iteration; see
+        L{TLSMemoryBIOProtocol}.
     """
     protocol = TLSMemoryBIOProtocol
+    coalesceWrites = False
 
     def __init__(self, contextFactory, isClient, wrappedFactory):
         WrappingFactory.__init__(self, wrappedFactory)
@@ -0,0 +1,55 @@
+# -*- test-case-name: twisted.test.test_protocols -*-
+# Copyright (c) 2009 Twisted Matrix Laboratories.
+# See LICENSE for details.
+
+"""
+Access to the Linux C{splice(2)} system call, which moves data between a
+pipe and another file descriptor without copying it through user space.
+
+@var available: C{True} if L{splice} can be used on this platform.
+"""
+
+import sys, os
+
+try:
+    import ctypes
+except ImportError:
+    ctypes = None
+
+SPLICE_F_MOVE = 1
+SPLICE_F_NONBLOCK = 2
+SPLICE_F_MORE = 4
+
+available = False
+_splice = None
+
+if ctypes is not None and sys.platform.startswith('linux'):
+    try:
+        _libc = ctypes.CDLL(None, use_errno=True)
+        _splice = _libc.splice
+    except (OSError, AttributeError, TypeError):
+        pass
+    else:
+        _splice.argtypes = [ctypes.c_int, ctypes.c_void_p,
+                            ctypes.c_int, ctypes.c_void_p,
+                            ctypes.c_size_t, ctypes.c_uint]
+        _splice.restype = ctypes.c_ssize_t
+        available = True
+
+
+
+def splice(fdIn, fdOut, length, flags=SPLICE_F_MOVE | SPLICE_F_NONBLOCK):
+    """
+    Move up to C{length} bytes from C{fdIn} to C{fdOut}, one of which must
+    be a pipe.
+
+    @return: The number of bytes moved; C{0} means C{fdIn} is at end of
+        file.
+    @raise OSError: If the system call fails, for example with C{EAGAIN}
+        when the call would block.
+    """
+    result = _splice(fdIn, None, fdOut, None, length, flags)
+    if result < 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+    return result
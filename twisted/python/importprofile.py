@@ -0,0 +1,129 @@
+# -*- test-case-name: twisted.python.test.test_importprofile -*-
+# Copyright (c) 2009 Twisted Matrix Laboratories.
+# See LICENSE for details.
+
+"""
+Measure how long it takes to import each module.
+
+Setting the C{TWISTED_IMPORT_PROFILE} environment variable makes importing
+the C{twisted} package install an L{ImportProfiler} for the rest of the
+process.  When the process exits a report is written to the file named by the
+variable, or to standard error if it is set to C{-}::
+
+    $ TWISTED_IMPORT_PROFILE=- twistd --help
+"""
+
+import sys, time, __builtin__
+
+
+class ImportProfiler(object):
+    """
+    Wrap the builtin C{__import__} to record the time spent importing each
+    module.
+
+    @ivar times: A C{dict} mapping module names to C{[cumulative, own]}
+        lists.  C{cumulative} is the time spent importing the module,
+        including the modules it imported in turn; C{own} excludes them.
+    @ivar timer: A no-argument callable returning the current time.
+    """
+
+    def __init__(self, timer=time.time):
+        self.timer = timer
+        self.times = {}
+        self._children = []
+        self._original = None
+
+
+    def install(self):
+        """
+        Start recording imports.
+        """
+        self._original = __builtin__.__import__
+        __builtin__.__import__ = self._import
+
+
+    def uninstall(self):
+        """
+        Stop recording imports.
+        """
+        __builtin__.__import__ = self._original
+        self._original = None
+
+
+    def _moduleName(self, name, globals):
+        """
+        Figure out the name under which the import of C{name} from a module
+        with the given globals ended up in C{sys.modules}, preferring a
+        sibling module as the implicit relative import does.
+        """
+        if globals:
+            package = globals.get('__name__')
+            if package is not None:
+                if '__path__' not in globals:
+                    package = '.'.join(package.split('.')[:-1])
+                if package:
+                    qualified = package + '.' + name
+                    if sys.modules.get(qualified) is not None:
+                        return qualified
+        return name
+
+
+    def _import(self, name, globals=None, *args):
+        if name in sys.modules:
+            # Fast path for the overwhelmingly common case of a module which
+            # has already been imported.
+            return self._original(name, globals, *args)
+        start = self.timer()
+        self._children.append(0.0)
+        try:
+            return self._original(name, globals, *args)
+        finally:
+            elapsed = self.timer() - start
+            children = self._children.pop()
+            if self._children:
+                self._children[-1] += elapsed
+            entry = self.times.setdefault(
+                self._moduleName(name, globals), [0.0, 0.0])
+            entry[0] += elapsed
+            entry[1] += elapsed - children
+
+
+    def report(self, out, limit=40):
+        """
+        Write the C{limit} modules which took longest to import to the file
+        C{out}, one per line, slowest first.
+        """
+        entries = [(cumulative, own, name)
+                   for (name, (cumulative, own)) in self.times.iteritems()]
+        entries.sort()
+        entries.reverse()
+        out.write("%10s %10s  %s\n" % ("cumul (ms)", "own (ms)", "module"))
+        for cumulative, own, name in entries[:limit]:
+            out.write("%10.2f %10.2f  %s\n" % (
+                    cumulative * 1000, own * 1000, name))
+
+
+
+def install(destination):
+    """
+    Install an L{ImportProfiler} which writes its report to the file named
+    C{destination}, or to standard error if C{destination} is C{'-'}, when
+    the process exits.
+
+    @return: The installed L{ImportProfiler}.
+    """
+    import atexit
+    profiler = ImportProfiler()
+    def report():
+        profiler.uninstall()
+        if destination == '-':
+            profiler.report(sys.stderr)
+        else:
+            out = file(destination, 'w')
+            try:
+                profiler.report(out)
+            finally:
+                out.close()
+    atexit.register(report)
+    profiler.install()
+    return profiler
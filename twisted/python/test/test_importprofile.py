@@ -0,0 +1,99 @@
+# Copyright (c) 2009 Twisted Matrix Laboratories.
+# See LICENSE for details.
+
+"""
+Tests for L{twisted.python.importprofile}.
+"""
+
+import sys, __builtin__
+from StringIO import StringIO
+
+from twisted.trial.unittest import TestCase
+from twisted.python.filepath import FilePath
+from twisted.python.importprofile import ImportProfiler
+
+
+
+class ImportProfilerTests(TestCase):
+    """
+    Tests for L{ImportProfiler}.
+    """
+    def setUp(self):
+        self.now = 0.0
+        self.profiler = ImportProfiler(lambda: self.now)
+        self.package = FilePath(self.mktemp())
+        self.package.makedirs()
+        sys.path.insert(0, self.package.path)
+        self.addCleanup(sys.path.remove, self.package.path)
+        self.modules = []
+
+
+    def makeModule(self, name, source):
+        """
+        Write a module named C{name} with the given source and arrange for it
+        to be removed from C{sys.modules} after the test.
+        """
+        self.package.child(name + '.py').setContent(source)
+        self.addCleanup(sys.modules.pop, name, None)
+
+
+    def advance(self, amount):
+        """
+        Move the profiler's clock forward; called from the test modules.
+        """
+        self.now += amount
+
+
+    def test_installAndUninstall(self):
+        """
+        L{ImportProfiler.install} replaces the builtin C{__import__} and
+        L{ImportProfiler.uninstall} restores the original.
+        """
+        original = __builtin__.__import__
+        self.profiler.install()
+        try:
+            self.assertNotIdentical(__builtin__.__import__, original)
+        finally:
+            self.profiler.uninstall()
+        self.assertIdentical(__builtin__.__import__, original)
+
+
+    def test_cumulativeAndOwnTime(self):
+        """
+        The time spent importing a module is recorded both including and
+        excluding the time spent importing the modules it imports.
+        """
+        sys.modules['_importprofile_test'] = self
+        self.addCleanup(sys.modules.pop, '_importprofile_test')
+        self.makeModule(
+            'importprofile_inner',
+            'import _importprofile_test\n'
+            '_importprofile_test.advance(2)\n')
+        self.makeModule(
+            'importprofile_outer',
+            'import _importprofile_test\n'
+            '_importprofile_test.advance(1)\n'
+            'import importprofile_inner\n')
+        self.profiler.install()
+        try:
+            import importprofile_outer
+        finally:
+            self.profiler.uninstall()
+        self.assertEqual(self.profiler.times['importprofile_outer'], [3, 1])
+        self.assertEqual(self.profiler.times['importprofile_inner'], [2, 2])
+        self.assertNotIn('_importprofile_test', self.profiler.times)
+
+
+    def test_report(self):
+        """
+        L{ImportProfiler.report} writes the slowest modules first, with times
+        in milliseconds, up to the given limit.
+        """
+        self.profiler.times = {
+            'fast': [0.001, 0.001], 'slow': [0.5, 0.25], 'medium': [0.1, 0]}
+        out = StringIO()
+        self.profiler.report(out, limit=2)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(lines[1].split(), ['500.00', '250.00', 'slow'])
+        self.assertEqual(lines[2].split(), ['100.00', '0.00', 'medium'])
@@ -218,12 +218,16 @@ class Options(dict):
             else:
                 self._dispatch[optMangled](optMangled, arg)
 
-        if (getattr(self, 'subCommands', None)
-            and (args or self.defaultSubCommand is not None)):
+        # Only look at subCommands, once, if there is something to dispatch:
+        # it may be expensive to compute (twistd loads every service plugin).
+        subCommands = None
+        if args or self.defaultSubCommand is not None:
+            subCommands = getattr(self, 'subCommands', None)
+        if subCommands:
             if not args:
                 args = [self.defaultSubCommand]
             sub, rest = args[0], args[1:]
-            for (cmd, short, parser, doc) in self.subCommands:
+            for (cmd, short, parser, doc) in subCommands:
                 if sub == cmd or sub == short:
                     self.subCommand = cmd
                     self.subOptions = parser()
@@ -6,6 +6,9 @@
 Tests for L{twisted.protocols.amp}.
 """
 
+from cStringIO import StringIO
+
+from zope.interface import implements
 from zope.interface.verify import verifyObject
 
 from twisted.python.util import setIDFunction
@@ -14,6 +17,7 @@ from twisted.python.failure import Failure
 from twisted.protocols import amp
 from twisted.trial import unittest
 from twisted.internet import protocol, defer, error, reactor, interfaces
+from twisted.internet import task
 from twisted.test import iosim
 from twisted.test.proto_helpers import StringTransport
 
@@ -588,6 +592,173 @@ class CommandDispatchTests(unittest.TestCase):
                                          Print=u"ignored")])
 
 
+    def answer(self, tag):
+        """
+        Deliver an answer to the command with the given tag.
+        """
+        self.dispatcher.ampBoxReceived(
+            amp.AmpBox({'hello': "yay", '_answer': tag}))
+
+
+    def test_maxOutstandingRequests(self):
+        """
+        When L{amp.BoxDispatcher.maxOutstandingRequests} answers are awaited,
+        further commands are not sent until answers arrive, and are then sent
+        in the order they were issued.
+        """
+        self.dispatcher.maxOutstandingRequests = 2
+        answers = []
+        for i in range(5):
+            self.dispatcher.callRemote(
+                Hello, hello=str(i)).addCallback(answers.append)
+        sent = lambda: [box['hello'] for box in self.sender.sentBoxes]
+        self.assertEquals(sent(), ['0', '1'])
+        self.answer('2')
+        self.assertEquals(sent(), ['0', '1', '2'])
+        self.answer('1')
+        self.assertEquals(sent(), ['0', '1', '2', '3'])
+        self.assertEquals(len(answers), 2)
+        self.dispatcher.maxOutstandingRequests = None
+        self.answer('3')
+        self.assertEquals(sent(), ['0', '1', '2', '3', '4'])
+
+
+    def test_noAnswerCommandsKeepOrder(self):
+        """
+        A command which requires no answer does not wait for
+        L{amp.BoxDispatcher.maxOutstandingRequests} answers, unless commands
+        issued before it are waiting.
+        """
+        self.dispatcher.maxOutstandingRequests = 1
+        self.dispatcher.callRemote(Hello, hello='0')
+        self.dispatcher.callRemote(NoAnswerHello, hello='1')
+        self.assertEquals(len(self.sender.sentBoxes), 2)
+        self.dispatcher.callRemote(Hello, hello='2')
+        self.dispatcher.callRemote(NoAnswerHello, hello='3')
+        self.assertEquals(len(self.sender.sentBoxes), 2)
+        self.answer('1')
+        self.assertEquals(
+            [box['hello'] for box in self.sender.sentBoxes],
+            ['0', '1', '2', '3'])
+
+
+    def test_waitingRequestsFailed(self):
+        """
+        Commands waiting to be sent fail with the reason passed to
+        L{amp.BoxDispatcher.failAllOutgoing}.
+        """
+        self.dispatcher.maxOutstandingRequests = 1
+        first = self.dispatcher.callRemote(Hello, hello='0')
+        second = self.dispatcher.callRemote(Hello, hello='1')
+        self.dispatcher.failAllOutgoing(Failure(error.ConnectionDone()))
+        self.assertEquals(len(self.sender.sentBoxes), 1)
+        self.assertFailure(first, error.ConnectionDone)
+        return self.assertFailure(second, error.ConnectionDone)
+
+
+    def test_callStatistics(self):
+        """
+        L{amp.BoxDispatcher.callStatistics} counts the commands issued and
+        how they finished, and the time they took to finish.
+        """
+        now = [100.0]
+        self.dispatcher._now = lambda: now[0]
+        self.dispatcher.callRemote(Hello, hello='0')
+        failed = self.dispatcher.callRemote(Hello, hello='1')
+        failed.addErrback(lambda err: None)
+        now[0] += 0.003
+        self.answer('1')
+        now[0] += 0.5
+        self.dispatcher.ampBoxReceived(amp.AmpBox(
+                _error='2', _error_code='BAD', _error_description='no'))
+        stats = self.dispatcher.callStatistics['hello']
+        self.assertEquals(
+            (stats.calls, stats.answers, stats.errors), (2, 1, 1))
+        self.assertAlmostEqual(stats.maxLatency, 0.503)
+        self.assertAlmostEqual(stats.averageLatency(), 0.253)
+        self.assertEquals(sum(stats.histogram), 2)
+        self.assertEquals(stats.percentile(0.5), 0.005)
+        self.assertEquals(stats.percentile(1), 1.0)
+
+
+    def test_responderStatistics(self):
+        """
+        L{amp.BoxDispatcher.responderStatistics} counts the commands received
+        for which a responder was found, and the time they took to answer.
+        """
+        now = [100.0]
+        self.dispatcher._now = lambda: now[0]
+        answer = defer.Deferred()
+        self.locator.commands['hello'] = lambda box: answer
+        self.dispatcher.ampBoxReceived(
+            amp.Box(_command="hello", _ask="1", hello="world"))
+        stats = self.dispatcher.responderStatistics['hello']
+        self.assertEquals((stats.calls, stats.finished()), (1, 0))
+        now[0] += 2
+        answer.callback(amp.Box(hello="world"))
+        self.assertEquals((stats.answers, stats.totalLatency), (1, 2))
+
+
+    def test_synchronousResponderStatistics(self):
+        """
+        The time taken by a responder which answers synchronously is recorded
+        in L{amp.BoxDispatcher.responderStatistics}.
+        """
+        now = [100.0]
+        self.dispatcher._now = lambda: now[0]
+        def responder(box):
+            now[0] += 3
+            return amp.Box(hello="world")
+        self.locator.commands['hello'] = responder
+        self.dispatcher.ampBoxReceived(
+            amp.Box(_command="hello", _ask="1", hello="world"))
+        stats = self.dispatcher.responderStatistics['hello']
+        self.assertEquals((stats.answers, stats.totalLatency), (1, 3))
+
+
+
+class CommandStatisticsTests(unittest.TestCase):
+    """
+    Tests for L{amp.CommandStatistics}.
+    """
+
+    def test_histogram(self):
+        """
+        Each latency recorded is counted in the first bucket whose bound is
+        no smaller than it, or in the last element of the histogram if it is
+        longer than all of them.
+        """
+        stats = amp.CommandStatistics('test')
+        for latency in 0, 0.001, 0.0011, 11:
+            stats.record(latency)
+        self.assertEquals(stats.histogram[:3], [1, 1, 1])
+        self.assertEquals(stats.histogram[-1], 1)
+        self.assertEquals(sum(stats.histogram), 4)
+
+
+    def test_percentileWithoutCalls(self):
+        """
+        With no calls finished there is no percentile or average latency.
+        """
+        stats = amp.CommandStatistics('test')
+        self.assertIdentical(stats.percentile(0.99), None)
+        self.assertIdentical(stats.averageLatency(), None)
+
+
+    def test_percentileBeyondBuckets(self):
+        """
+        A percentile which falls in the last element of the histogram is
+        reported as the longest latency recorded.
+        """
+        stats = amp.CommandStatistics('test')
+        stats.record(0.0001)
+        stats.record(30, False)
+        self.assertEquals(stats.percentile(0.5), stats.buckets[0])
+        self.assertEquals(stats.percentile(0.99), 30)
+        self.assertEquals((stats.answers, stats.errors), (1, 1))
+
+
+
 class SimpleGreeting(amp.Command):
     """
     A very simple greeting command that uses a few basic argument types.
@@ -889,6 +1060,49 @@ class BinaryProtocolTests(unittest.TestCase):
         self.assertFalse(transport.disconnecting)
 
 
+    def test_receiveManyBoxes(self):
+        """
+        All of the boxes in data received at once are delivered to the box
+        receiver, in order.
+        """
+        boxes = [amp.Box({'n': str(i), 'data': 'x' * i}) for i in range(50)]
+        boxes.append(amp.Box())
+        a = amp.BinaryBoxProtocol(self)
+        a.dataReceived(''.join([box.serialize() for box in boxes]))
+        self.assertEquals(self.boxes, boxes)
+
+
+    def test_receiveBoxesInPieces(self):
+        """
+        Boxes split across calls to C{dataReceived} at any point are delivered
+        once they are complete.
+        """
+        boxes = [amp.Box({'hello': 'world', 'goodbye': 'world'}),
+                 amp.Box({'key': ''})]
+        data = ''.join([box.serialize() for box in boxes])
+        for size in range(1, 8):
+            del self.boxes[:]
+            a = amp.BinaryBoxProtocol(self)
+            for i in range(0, len(data), size):
+                a.dataReceived(data[i:i + size])
+            self.assertEquals(self.boxes, boxes)
+            self.assertEquals(a.recvd, '')
+
+
+    def test_excessiveKeyLengthAfterBoxes(self):
+        """
+        The boxes which precede a key length prefix larger than 255 in the
+        same data are delivered before the connection is dropped.
+        """
+        transport = StringTransport()
+        protocol = amp.BinaryBoxProtocol(self)
+        protocol.makeConnection(transport)
+        box = amp.Box({'k': 'v'})
+        protocol.dataReceived(box.serialize() + '\x00\x01k\x00\x01v\x01\x00')
+        self.assertEquals(self.boxes, [box])
+        self.assertTrue(transport.disconnecting)
+
+
     def test_sendBox(self):
         """
         When a binary box protocol sends a box, it should emit the serialized
@@ -903,6 +1117,114 @@ class BinaryProtocolTests(unittest.TestCase):
         self.assertEquals(''.join(self.data), aBox.serialize())
 
 
+    def test_sendBoxes(self):
+        """
+        L{amp.BinaryBoxProtocol.sendBoxes} writes the serialized forms of all
+        of the boxes it is given to its transport in one call to
+        C{writeSequence}.
+        """
+        writes = []
+        transport = StringTransport()
+        transport.writeSequence = writes.append
+        a = amp.BinaryBoxProtocol(self)
+        a.makeConnection(transport)
+        boxes = [amp.Box({"testKey": "valueTest", "n": str(i)})
+                 for i in range(3)]
+        a.sendBoxes(boxes)
+        self.assertEquals(writes, [[box.serialize() for box in boxes]])
+        self.assertEquals(transport.value(), '')
+
+
+    def test_sendBoxesTooLong(self):
+        """
+        If any of the boxes passed to L{amp.BinaryBoxProtocol.sendBoxes}
+        cannot be serialized, L{amp.TooLong} is raised and none of them is
+        sent.
+        """
+        transport = StringTransport()
+        a = amp.BinaryBoxProtocol(self)
+        a.makeConnection(transport)
+        self.assertRaises(
+            amp.TooLong, a.sendBoxes,
+            [amp.Box({"k": "v"}), amp.Box({"k": "v" * 0x10000})])
+        self.assertEquals(transport.value(), '')
+
+
+    def coalescingProtocol(self):
+        """
+        Make a L{amp.BinaryBoxProtocol} which coalesces its writes, scheduled
+        with a L{task.Clock}, connected to a L{StringTransport} which records
+        its calls to C{writeSequence}.
+
+        @return: the protocol, the clock and the list of writes.
+        """
+        writes = []
+        clock = task.Clock()
+        transport = StringTransport()
+        transport.writeSequence = writes.append
+        a = amp.BinaryBoxProtocol(self)
+        a.coalesceWrites = True
+        a.callLater = clock.callLater
+        a.makeConnection(transport)
+        return a, clock, writes
+
+
+    def test_coalesceWrites(self):
+        """
+        With L{amp.BinaryBoxProtocol.coalesceWrites} set, the boxes sent
+        before the reactor next runs its delayed calls are written in one
+        call to C{writeSequence}.
+        """
+        a, clock, writes = self.coalescingProtocol()
+        boxes = [amp.Box({"n": str(i)}) for i in range(4)]
+        a.sendBox(boxes[0])
+        a.sendBoxes(boxes[1:3])
+        a.sendBox(boxes[3])
+        self.assertEquals(writes, [])
+        clock.advance(0)
+        self.assertEquals(writes, [[box.serialize() for box in boxes]])
+        a.sendBox(boxes[0])
+        clock.advance(0)
+        self.assertEquals(writes[1:], [[boxes[0].serialize()]])
+
+
+    def test_flushBoxes(self):
+        """
+        L{amp.BinaryBoxProtocol.flushBoxes} writes the boxes held for
+        coalescing immediately, and cancels the delayed write.
+        """
+        a, clock, writes = self.coalescingProtocol()
+        box = amp.Box({"k": "v"})
+        a.sendBox(box)
+        a.flushBoxes()
+        self.assertEquals(writes, [[box.serialize()]])
+        self.assertEquals(clock.getDelayedCalls(), [])
+
+
+    def test_quitBoxFlushes(self):
+        """
+        Boxes held for coalescing are written before a L{amp.QuitBox} closes
+        the connection.
+        """
+        a, clock, writes = self.coalescingProtocol()
+        box = amp.QuitBox({"k": "v"})
+        a.sendBox(amp.Box({"k": "w"}))
+        box._sendTo(a)
+        self.assertEquals(len(writes), 1)
+        self.assertTrue(a.transport.disconnecting)
+
+
+    def test_coalescedWritesDiscardedOnConnectionLost(self):
+        """
+        Boxes held for coalescing when the connection is lost are discarded.
+        """
+        a, clock, writes = self.coalescingProtocol()
+        a.sendBox(amp.Box({"k": "v"}))
+        a.connectionLost(Failure(error.ConnectionDone()))
+        self.assertEquals(clock.getDelayedCalls(), [])
+        self.assertEquals(writes, [])
+
+
     def test_connectionLostStopSendingBoxes(self):
         """
         When a binary box protocol loses its connection, it should notify its
@@ -2440,6 +2762,509 @@ class CommandTestCase(unittest.TestCase):
             None)
 
 
+    def test_schemaRecompiled(self):
+        """
+        If the C{arguments} or C{response} list of a L{Command} is replaced
+        after the class is created, the new list is used.
+        """
+        class Replaced(amp.Command):
+            arguments = [('a', amp.Integer())]
+            response = [('b', amp.Integer())]
+        Replaced.arguments = [('c', amp.Integer()),
+                              ('d', amp.Unicode(optional=True))]
+        Replaced.response = [('e', amp.Float())]
+        self.assertEquals(Replaced.makeArguments({'c': 3}, None),
+                          amp.Box(c='3'))
+        self.assertEquals(Replaced.parseArguments(amp.Box(c='3'), None),
+                          {'c': 3, 'd': None})
+        self.assertEquals(Replaced.makeResponse({'e': 1.5}, None),
+                          amp.Box(e='1.5'))
+        self.assertEquals(Replaced.parseResponse(amp.Box(e='1.5'), None),
+                          {'e': 1.5})
+
+
+    def test_missingArgument(self):
+        """
+        L{Command.makeArguments} and L{Command.parseArguments} raise
+        C{KeyError} if a required argument is missing.
+        """
+        self.assertRaises(KeyError, Hello.makeArguments, {}, None)
+        self.assertRaises(KeyError, Hello.parseArguments, amp.Box(), None)
+        self.assertRaises(KeyError, Hello.parseResponse, amp.Box(), None)
+
+
+
+class ArgumentSchemaTests(unittest.TestCase):
+    """
+    Tests for L{amp._ArgumentSchema}.
+    """
+
+    def test_serialize(self):
+        """
+        L{amp._ArgumentSchema.serialize} produces the wire encoding of the box
+        that L{amp._ArgumentSchema.toBox} produces, with the keys in the order
+        of the argument list and without omitted optional arguments.
+        """
+        schema = amp._ArgumentSchema([
+                ('b', amp.Integer()), ('a-b', amp.Unicode()),
+                ('c', amp.String(optional=True))])
+        objects = {'b': 3, 'a_b': u'\N{SNOWMAN}'}
+        data = schema.serialize(objects, None)
+        self.assertEquals(
+            data, '\x00\x01b\x00\x013\x00\x03a-b\x00\x03\xe2\x98\x83\x00\x00')
+        self.assertEquals(amp.parseString(data),
+                          [schema.toBox(objects, amp.Box(), None)])
+
+
+    def test_serializeTooLong(self):
+        """
+        L{amp._ArgumentSchema.serialize} raises L{amp.TooLong} for keys and
+        values which are too long to encode.
+        """
+        key = 'k' * 256
+        tl = self.assertRaises(
+            amp.TooLong, amp._ArgumentSchema([(key, amp.String())]).serialize,
+            {key: 'v'}, None)
+        self.assertTrue(tl.isKey)
+        value = 'v' * 0x10000
+        tl = self.assertRaises(
+            amp.TooLong, amp._ArgumentSchema([('k', amp.String())]).serialize,
+            {'k': value}, None)
+        self.assertFalse(tl.isKey)
+        self.assertEquals(tl.keyName, 'k')
+
+
+    def test_customBoxing(self):
+        """
+        Arguments which override C{toBox} or C{fromBox} are called with the
+        whole box or dictionary being converted.
+        """
+        class Both(amp.Argument):
+            def toBox(self, name, strings, objects, proto):
+                strings[name] = '%s,%s' % (objects.pop('x'), objects.pop('y'))
+            def fromBox(self, name, strings, objects, proto):
+                objects['x'], objects['y'] = strings.pop(name).split(',')
+        schema = amp._ArgumentSchema([('xy', Both()), ('z', amp.String())])
+        objects = {'x': '1', 'y': '2', 'z': '3'}
+        box = schema.toBox(objects, amp.Box(), None)
+        self.assertEquals(box, amp.Box(xy='1,2', z='3'))
+        self.assertEquals(objects, {'x': '1', 'y': '2', 'z': '3'})
+        self.assertEquals(schema.fromBox(box, None), objects)
+        self.assertEquals(amp.parseString(schema.serialize(objects, None)),
+                          [box])
+
+
+
+
+class StreamUpload(amp.Command):
+    """
+    A command with a L{amp.ByteStream} argument, with a small chunk size and
+    window so that flow control is easy to exercise.
+    """
+    arguments = [('name', amp.String()),
+                 ('data', amp.ByteStream(chunkSize=5, window=16))]
+    response = [('name', amp.String())]
+
+
+
+class UnhandledStreamUpload(amp.Command):
+    """
+    A command with a L{amp.ByteStream} argument which L{StreamingProtocol}
+    has no responder for.
+    """
+    arguments = [('data', amp.ByteStream())]
+
+
+
+class StreamDownload(amp.Command):
+    """
+    A command with a L{amp.ByteStream} in its response.
+    """
+    response = [('data', amp.ByteStream(chunkSize=5, window=16))]
+
+
+
+class StreamingProtocol(SimpleSymmetricProtocol):
+    """
+    An AMP protocol which records the streams uploaded to it, answering the
+    uploads only when L{answerUploads} is called, and answers downloads with
+    C{downloadSource}.
+    """
+    downloadSource = None
+
+    def __init__(self):
+        SimpleSymmetricProtocol.__init__(self)
+        self.uploads = []
+        self._unanswered = []
+
+
+    def upload(self, name, data):
+        self.uploads.append(data)
+        answer = defer.Deferred()
+        self._unanswered.append((answer, name))
+        return answer
+    StreamUpload.responder(upload)
+
+
+    def answerUploads(self):
+        """
+        Answer the uploads received so far.
+        """
+        unanswered, self._unanswered = self._unanswered, []
+        for answer, name in unanswered:
+            answer.callback({'name': name})
+
+
+    def download(self):
+        return {'data': self.downloadSource}
+    StreamDownload.responder(download)
+
+
+
+class CollectingConsumer:
+    """
+    An L{interfaces.IConsumer} which records what is written to it.
+    """
+    implements(interfaces.IConsumer)
+
+    producer = None
+    unregistered = False
+
+    def __init__(self):
+        self.data = []
+
+
+    def registerProducer(self, producer, streaming):
+        self.producer = producer
+
+
+    def unregisterProducer(self):
+        self.producer = None
+        self.unregistered = True
+
+
+    def write(self, data):
+        self.data.append(data)
+
+
+
+class StreamSource:
+    """
+    A source for a L{amp.ByteStream} which records how it is controlled.
+    """
+    implements(interfaces.IPushProducer)
+
+    consumer = None
+    stopped = False
+
+    def __init__(self):
+        self.deferred = defer.Deferred()
+        self.pauses = 0
+        self.resumes = 0
+
+
+    def startProducing(self, consumer):
+        self.consumer = consumer
+        return self.deferred
+
+
+    def pauseProducing(self):
+        self.pauses += 1
+
+
+    def resumeProducing(self):
+        self.resumes += 1
+
+
+    def stopProducing(self):
+        self.stopped = True
+
+
+
+class ByteStreamTests(unittest.TestCase):
+    """
+    Tests for L{amp.ByteStream}.
+    """
+
+    def setUp(self):
+        self.client, self.server, self.pump = connectedServerAndClient(
+            ServerClass=StreamingProtocol, ClientClass=StreamingProtocol)
+        self.responses = []
+
+
+    def upload(self, source):
+        """
+        Send C{source} to the server and return the L{amp.IncomingStream} it
+        receives.  The upload is not answered yet, so the stream can still be
+        delivered; the result of the command is appended to
+        C{self.responses}.
+        """
+        self.client.callRemote(
+            StreamUpload, name='test', data=source).addBoth(
+            self.responses.append)
+        self.pump.flush()
+        return self.server.uploads[-1]
+
+
+    def answer(self):
+        """
+        Answer the uploads received by the server.
+        """
+        self.server.answerUploads()
+        self.pump.flush()
+
+
+    def buffered(self, stream):
+        """
+        Return the number of bytes which have been received for C{stream}
+        but not delivered.
+        """
+        return sum([len(data) for data in stream._buffer])
+
+
+    def test_string(self):
+        """
+        A C{str} sent as a L{amp.ByteStream} is delivered in full to the
+        consumer passed to L{amp.IncomingStream.deliverTo}.  Until the
+        receiver delivers them, it is sent no more bytes than its window.
+        """
+        data = ''.join([chr(i) for i in range(256)]) * 10
+        stream = self.upload(data)
+        self.assertEquals(self.buffered(stream), 16)
+        consumer = CollectingConsumer()
+        done = []
+        stream.deliverTo(consumer).addCallback(done.append)
+        self.assertIdentical(consumer.producer, stream)
+        self.pump.flush()
+        self.assertEquals(''.join(consumer.data), data)
+        self.assertTrue(consumer.unregistered)
+        self.assertEquals(done, [None])
+        self.assertEquals(self.client._outgoingStreams, {})
+        self.assertEquals(self.server._incomingStreams, {})
+
+
+    def test_fileInResponse(self):
+        """
+        A L{amp.ByteStream} can be part of a response, and its value can be a
+        file-like object.
+        """
+        data = 'x' * 100 + 'y' * 100
+        self.server.downloadSource = StringIO(data)
+        consumer = CollectingConsumer()
+        self.client.callRemote(StreamDownload).addCallback(
+            lambda response: response['data'].deliverTo(consumer))
+        self.pump.flush()
+        self.assertEquals(''.join(consumer.data), data)
+        self.assertTrue(consumer.unregistered)
+
+
+    def test_flowControl(self):
+        """
+        The producer of a L{amp.ByteStream} is paused while the receiver has
+        no room for more data, and resumed when it has, and the receiving
+        L{amp.IncomingStream} can be paused by its consumer.
+        """
+        source = StreamSource()
+        stream = self.upload(source)
+        source.consumer.write('a' * 40)
+        self.pump.flush()
+        self.assertEquals(self.buffered(stream), 16)
+        self.assertEquals((source.pauses, source.resumes), (1, 0))
+
+        consumer = CollectingConsumer()
+        done = []
+        stream.deliverTo(consumer).addCallback(done.append)
+        stream.pauseProducing()
+        self.pump.flush()
+        self.assertEquals(''.join(consumer.data), 'a' * 16)
+        self.assertEquals(self.buffered(stream), 16)
+        self.assertEquals((source.pauses, source.resumes), (1, 0))
+
+        stream.resumeProducing()
+        self.pump.flush()
+        self.assertEquals(''.join(consumer.data), 'a' * 40)
+        self.assertEquals((source.pauses, source.resumes), (1, 1))
+
+        source.consumer.write('b')
+        source.deferred.callback(None)
+        self.pump.flush()
+        self.assertEquals(''.join(consumer.data), 'a' * 40 + 'b')
+        self.assertEquals(done, [None])
+
+
+    def test_windowExceeded(self):
+        """
+        If the peer sends more bytes than the receiver allowed it to, the
+        L{amp.IncomingStream} is aborted with L{amp.StreamAborted} and the
+        source is told to stop.
+        """
+        source = StreamSource()
+        stream = self.upload(source)
+        self.server.ampBoxReceived(amp.AmpBox({
+                    amp.STREAM: stream.streamID, amp.STREAM_CHUNK: 'x' * 17}))
+        self.pump.flush()
+        self.assertTrue(source.stopped)
+        self.assertEquals(self.server._incomingStreams, {})
+        return self.assertFailure(
+            stream.deliverTo(CollectingConsumer()), amp.StreamAborted)
+
+
+    def test_malformedAcknowledgement(self):
+        """
+        A box acknowledging bytes of a stream with a value which is not a
+        non-negative integer is malformed.
+        """
+        for amount in ['x', '', '-1']:
+            self.assertRaises(
+                amp.MalformedAmpBox, self.client.ampBoxReceived,
+                amp.AmpBox({amp.STREAM: '1', amp.STREAM_ACK: amount}))
+
+
+    def test_unrequestedStreamForgotten(self):
+        """
+        A stream which is an argument of a command is forgotten if the answer
+        or error for the command arrives without the peer having asked for
+        any of it.
+        """
+        errors = []
+        self.client.callRemote(
+            UnhandledStreamUpload, data=StringIO('x')).addErrback(
+            errors.append)
+        self.pump.flush()
+        errors[0].trap(amp.UnhandledCommand)
+        self.assertEquals(self.client._outgoingStreams, {})
+        self.assertEquals(self.client._commandStreams, {})
+
+        stream = self.upload('abc')
+        consumer = CollectingConsumer()
+        stream.deliverTo(consumer)
+        self.answer()
+        self.assertEquals(self.client._commandStreams, {})
+        self.assertEquals(''.join(consumer.data), 'abc')
+
+
+    def test_undeliveredStreamCancelled(self):
+        """
+        An L{amp.IncomingStream} among the arguments of a command which is
+        not being delivered when the responder's result is ready is cancelled:
+        its source is told to stop and delivering it fails with
+        L{amp.StreamAborted}.
+        """
+        source = StreamSource()
+        stream = self.upload(source)
+        self.answer()
+        self.assertEquals(self.responses, [{'name': 'test'}])
+        self.assertEquals(self.server._incomingStreams, {})
+        self.assertTrue(source.stopped)
+        self.assertEquals(self.client._outgoingStreams, {})
+        return self.assertFailure(
+            stream.deliverTo(CollectingConsumer()), amp.StreamAborted)
+
+
+    def test_undeliveredResponseStreamCancelled(self):
+        """
+        An L{amp.IncomingStream} in a response which the callbacks of
+        L{amp.BoxDispatcher.callRemote} do not deliver is cancelled.
+        """
+        source = StreamSource()
+        self.server.downloadSource = source
+        responses = []
+        self.client.callRemote(StreamDownload).addCallback(responses.append)
+        self.pump.flush()
+        self.assertTrue(source.stopped)
+        self.assertEquals(self.client._incomingStreams, {})
+        self.assertEquals(self.server._outgoingStreams, {})
+        return self.assertFailure(
+            responses[0]['data'].deliverTo(CollectingConsumer()),
+            amp.StreamAborted)
+
+
+    def test_deliveredStreamContinues(self):
+        """
+        An L{amp.IncomingStream} which is being delivered when the responder's
+        result is ready carries on being received.
+        """
+        source = StreamSource()
+        stream = self.upload(source)
+        consumer = CollectingConsumer()
+        done = []
+        stream.deliverTo(consumer).addCallback(done.append)
+        self.answer()
+        source.consumer.write('abc')
+        source.deferred.callback(None)
+        self.pump.flush()
+        self.assertFalse(source.stopped)
+        self.assertEquals(''.join(consumer.data), 'abc')
+        self.assertEquals(done, [None])
+        self.assertEquals(self.server._incomingStreams, {})
+
+
+    def test_interleaving(self):
+        """
+        Other commands are answered while a L{amp.ByteStream} is waiting for
+        its receiver to make room for more data.
+        """
+        stream = self.upload('x' * 100)
+        answers = []
+        self.client.sendHello('hello').addCallback(answers.append)
+        self.pump.flush()
+        self.assertEquals(answers[0]['hello'], 'hello')
+        self.assertEquals(self.buffered(stream), 16)
+
+
+    def test_stopProducing(self):
+        """
+        Stopping an L{amp.IncomingStream} stops the source of the stream and
+        fails the L{Deferred} returned by L{amp.IncomingStream.deliverTo}
+        with L{amp.StreamAborted}.
+        """
+        source = StreamSource()
+        stream = self.upload(source)
+        d = stream.deliverTo(CollectingConsumer())
+        stream.stopProducing()
+        self.pump.flush()
+        self.assertTrue(source.stopped)
+        self.assertEquals(self.client._outgoingStreams, {})
+        return self.assertFailure(d, amp.StreamAborted)
+
+
+    def test_sourceFails(self):
+        """
+        If the source of an L{amp.ByteStream} fails, the failure is logged
+        and the receiver's L{Deferred} fails with L{amp.StreamAborted}.
+        """
+        source = StreamSource()
+        stream = self.upload(source)
+        d = stream.deliverTo(CollectingConsumer())
+        source.deferred.errback(RuntimeError("source broke"))
+        self.pump.flush()
+        self.assertEquals(len(self.flushLoggedErrors(RuntimeError)), 1)
+        d = self.assertFailure(d, amp.StreamAborted)
+        d.addCallback(lambda exc: self.assertEquals(str(exc), "source broke"))
+        return d
+
+
+    def test_connectionLost(self):
+        """
+        When the connection is lost, the sources of streams being sent are
+        stopped and streams being received fail, unless they were received
+        completely, and they are all forgotten.
+        """
+        source = StreamSource()
+        stream = self.upload(source)
+        d = stream.deliverTo(CollectingConsumer())
+        undelivered = self.upload('abc')
+        self.client.transport.loseConnection()
+        self.pump.flush()
+        self.assertTrue(source.stopped)
+        self.assertEquals(self.client._outgoingStreams, {})
+        self.assertEquals(self.server._incomingStreams, {})
+        consumer = CollectingConsumer()
+        undelivered.deliverTo(consumer)
+        self.assertEquals(''.join(consumer.data), 'abc')
+        return self.assertFailure(d, error.ConnectionDone)
+
+
 
 if not interfaces.IReactorSSL.providedBy(reactor):
     skipMsg = 'This test case requires SSL support in the reactor'
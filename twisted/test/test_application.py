@@ -770,6 +770,37 @@ class PluggableReactorTestCase(unittest.TestCase):
         self.assertEqual(installed, [True])
 
 
+    def test_builtinReactorTypes(self):
+        """
+        L{reactors._getBuiltinReactorTypes} returns the reactors shipped with
+        Twisted without consulting the plugin system.
+        """
+        names = [r.shortName for r in reactors._getBuiltinReactorTypes()]
+        self.assertIn('select', names)
+        self.assertIn('poll', names)
+        self.assertEqual(self.pluginCalls, [])
+
+
+    def test_installBuiltinReactor(self):
+        """
+        L{reactors.installReactor} installs a reactor shipped with Twisted
+        without loading the plugins.
+        """
+        installed = []
+        def install():
+            installed.append(True)
+        name = 'fakereactortest'
+        original = reactors._getBuiltinReactorTypes
+        reactors._getBuiltinReactorTypes = lambda: [
+            FakeReactor(install, name, __name__, 'description')]
+        try:
+            reactors.installReactor(name)
+        finally:
+            reactors._getBuiltinReactorTypes = original
+        self.assertEqual(installed, [True])
+        self.assertEqual(self.pluginCalls, [])
+
+
     def test_installNonExistentReactor(self):
         """
         Test that L{reactors.installReactor} raises L{reactors.NoSuchReactor}
@@ -41,6 +41,24 @@ class TestBucket(TestBucketBase):
         fit = b.add(1000)
         self.failUnlessEqual(20, fit)
 
+    def testDripEmpty(self):
+        """drip reports when a rate-limited bucket has drained."""
+        b = SomeBucket()
+        b.add(10)
+        self.failIf(b.drip())
+        self.clock.set(5)
+        self.failUnless(b.drip())
+
+    def testChargeAndDelay(self):
+        """charge overfills the bucket; delay says how long it takes to
+        drain back down to maxburst."""
+        b = SomeBucket()
+        b.charge(110)
+        self.failUnlessEqual(b.content, 110)
+        self.failUnlessEqual(b.delay(), 5)
+        self.clock.set(5)
+        self.failUnlessEqual(b.delay(), 0)
+
 class TestBucketNesting(TestBucketBase):
     def setUp(self):
         TestBucketBase.setUp(self)
@@ -67,6 +85,68 @@ class TestBucketNesting(TestBucketBase):
         # application.)
         self.failUnlessEqual(10, fit)
 
+    def testChargeParentDelay(self):
+        """The delay of a bucket includes the time its parent needs."""
+        self.parent.rate = 1
+        self.child1.charge(60)
+        self.child2.charge(60)
+        self.failUnlessEqual(self.parent.content, 120)
+        self.failUnlessEqual(self.child1.delay(), 20)
+
+
+class HostFilter(htb.FilterByHost):
+    bucketFactory = SomeBucket
+    sweepInterval = 10
+
+class FakeAddress:
+    def __init__(self, host):
+        self.host = host
+
+class FakeTransport:
+    def __init__(self, host):
+        self.peer = FakeAddress(host)
+    def getPeer(self):
+        return self.peer
+
+class TestFilterExpiry(TestBucketBase):
+    def setUp(self):
+        TestBucketBase.setUp(self)
+        self.filter = HostFilter()
+
+    def testEmptyBucketExpires(self):
+        """An empty, unreferenced bucket is dropped once its interval has
+        passed, when the filter is next asked for a bucket."""
+        bucket = self.filter.getBucketFor(FakeTransport('a'))
+        bucket.add(10)
+        self.clock.set(11)
+        self.filter.getBucketFor(FakeTransport('b'))
+        self.failIf('a' in self.filter.buckets)
+        self.failIfIdentical(
+            self.filter.getBucketFor(FakeTransport('a')), bucket)
+
+    def testBusyBucketKept(self):
+        """Buckets which are still referenced or not yet empty are kept,
+        and looked at again an interval later."""
+        referenced = self.filter.getBucketFor(FakeTransport('a'))
+        referenced._refcount += 1
+        full = self.filter.getBucketFor(FakeTransport('b'))
+        full.add(100)
+        self.clock.set(11)
+        self.filter.getBucketFor(FakeTransport('c'))
+        self.failUnlessEqual(sorted(self.filter.buckets), ['a', 'b', 'c'])
+        referenced._refcount -= 1
+        self.clock.set(50)
+        self.filter.getBucketFor(FakeTransport('c'))
+        self.failUnlessEqual(sorted(self.filter.buckets), ['c'])
+
+    def testSweep(self):
+        """sweep drops every empty, unreferenced bucket at once."""
+        self.filter.getBucketFor(FakeTransport('a'))
+        self.filter.getBucketFor(FakeTransport('b')).add(10)
+        self.filter.sweep()
+        self.failUnlessEqual(self.filter.buckets.keys(), ['b'])
+        self.failUnlessEqual(len(self.filter._expiries), 1)
+
 
 # TODO: Test the Transport stuff?
 
@@ -7,11 +7,14 @@ Test the memcache client protocol.
 
 from twisted.protocols.memcache import MemCacheProtocol, NoSuchCommand
 from twisted.protocols.memcache import ClientError, ServerError
+from twisted.protocols.memcache import MemCacheCluster, NoServersAvailable
 
 from twisted.trial.unittest import TestCase
 from twisted.test.proto_helpers import StringTransportWithDisconnection
 from twisted.internet.task import Clock
 from twisted.internet.defer import Deferred, gatherResults, TimeoutError
+from twisted.internet.error import ConnectionDone, ConnectionRefusedError
+from twisted.python.failure import Failure
 
 
 
@@ -290,6 +293,19 @@ class MemCacheTestCase(TestCase):
         return gatherResults([d1, d2, d3])
 
 
+    def test_connectionLost(self):
+        """
+        When the connection is lost, the outstanding commands fail with the
+        reason it was lost.
+        """
+        d1 = self.proto.get("foo")
+        d2 = self.proto.set("bar", "egg")
+        self.transport.loseConnection()
+        self.assertEquals(len(self.clock.calls), 0)
+        return gatherResults([self.assertFailure(d1, ConnectionDone),
+                              self.assertFailure(d2, ConnectionDone)])
+
+
     def test_timeoutRemoved(self):
         """
         When a request gets a response, no pending timeout call should remain
@@ -507,6 +523,92 @@ class MemCacheTestCase(TestCase):
         return d
 
 
+    def test_getDelimiterSplit(self):
+        """
+        A value is delivered intact when the delimiter following it is split
+        across two chunks, and the response following it is parsed.
+        """
+        d = self.proto.get("foo")
+        d.addCallback(self.assertEquals, (0, "01234"))
+        self.proto.dataReceived("VALUE foo 0 5\r\n012")
+        self.proto.dataReceived("34\r")
+        self.proto.dataReceived("\nEND\r\n")
+        return d
+
+
+    def test_getMultipleValuesInOneChunk(self):
+        """
+        Several values and the end of the response arriving together are
+        each delivered.
+        """
+        d = self.proto.getMultiple(["foo", "bar"])
+        d.addCallback(self.assertEquals,
+                      {"foo": (0, "x" * 100), "bar": (2, "y" * 7)})
+        self.proto.dataReceived(
+            "VALUE foo 0 100\r\n" + "x" * 100 + "\r\n"
+            "VALUE bar 2 7\r\n" + "y" * 7 + "\r\nEND\r\n")
+        return d
+
+
+    def test_coalesceWrites(self):
+        """
+        With L{MemCacheProtocol.coalesceWrites} set, the commands issued
+        before the reactor next runs its delayed calls are written with a
+        single call to C{writeSequence}, and their answers are matched to
+        them in order.
+        """
+        writes = []
+        self.transport.writeSequence = writes.append
+        self.proto.coalesceWrites = True
+        d1 = self.proto.set("foo", "bar")
+        d2 = self.proto.get("foo")
+        self.assertEquals(writes, [])
+        self.clock.advance(0)
+        self.assertEquals(
+            ["".join(data) for data in writes],
+            ["set foo 0 0 3\r\nbar\r\nget foo\r\n"])
+        self.proto.dataReceived("STORED\r\nVALUE foo 0 3\r\nbar\r\nEND\r\n")
+        d1.addCallback(self.assertEquals, True)
+        d2.addCallback(self.assertEquals, (0, "bar"))
+        return gatherResults([d1, d2])
+
+
+    def test_flushWrites(self):
+        """
+        L{MemCacheProtocol.flushWrites} writes the held commands immediately.
+        """
+        self.proto.coalesceWrites = True
+        self.proto.delete("foo")
+        self.proto.flushWrites()
+        self.assertEquals(self.transport.value(), "delete foo\r\n")
+        self.clock.advance(self.proto.persistentTimeOut - 1)
+        self.assertEquals(len(self.clock.calls), 1)
+
+
+    def test_setNoreply(self):
+        """
+        With C{noreply}, L{MemCacheProtocol.set} sends the I{noreply} flag,
+        fires its L{Deferred} with C{None} immediately, and does not wait
+        for an answer.
+        """
+        d = self.proto.set("foo", "bar", noreply=True)
+        self.assertEquals(self.transport.value(),
+                          "set foo 0 0 3 noreply\r\nbar\r\n")
+        self.assertEquals(self.clock.calls, [])
+        d.addCallback(self.assertEquals, None)
+        return d
+
+
+    def test_deleteNoreply(self):
+        """
+        With C{noreply}, L{MemCacheProtocol.delete} sends the I{noreply} flag
+        and the answer to the next command is matched to that command.
+        """
+        self.proto.delete("foo", noreply=True)
+        return self._test(self.proto.delete("bar"),
+            "delete foo noreply\r\ndelete bar\r\n", "DELETED\r\n", True)
+
+
     def test_append(self):
         """
         L{MemCacheProtocol.append} behaves like a L{MemCacheProtocol.set}
@@ -586,3 +688,302 @@ class MemCacheTestCase(TestCase):
         """
         return self._test(self.proto.checkAndSet("foo", "bar", cas="1234"),
             "cas foo 0 0 3 1234\r\nbar\r\n", "EXISTS\r\n", False)
+
+
+
+class FakeConnector(object):
+    """
+    A connector which counts the connection attempts made with it.
+    """
+
+    def __init__(self, host, port, factory):
+        self.host = host
+        self.port = port
+        self.factory = factory
+        self.attempts = 1
+
+
+    def connect(self):
+        self.attempts += 1
+
+
+    def stopConnecting(self):
+        pass
+
+
+
+class FakeConnectingClock(Clock):
+    """
+    A L{Clock} which records its calls to C{connectTCP}.
+    """
+
+    def __init__(self):
+        Clock.__init__(self)
+        self.connectors = []
+
+
+    def connectTCP(self, host, port, factory):
+        connector = FakeConnector(host, port, factory)
+        self.connectors.append(connector)
+        return connector
+
+
+
+class MemCacheClusterTests(TestCase):
+    """
+    Tests for L{MemCacheCluster}.
+    """
+
+    def setUp(self):
+        self.clock = FakeConnectingClock()
+        self.cluster = MemCacheCluster(
+            [("a", 1), ("b", 2), ("c", 3, 2)], connectionsPerServer=2,
+            reactor=self.clock)
+        self.cluster._seconds = self.clock.seconds
+        self.cluster.connect()
+        self.transports = {}
+
+
+    def connect(self, connector):
+        """
+        Make a connection for the given connector.
+        """
+        proto = connector.factory.buildProtocol(None)
+        transport = StringTransportWithDisconnection()
+        transport.protocol = proto
+        proto.makeConnection(transport)
+        self.transports.setdefault(connector.host, []).append(transport)
+        return transport
+
+
+    def connectAll(self):
+        for connector in self.clock.connectors:
+            self.connect(connector)
+
+
+    def serverNamed(self, host):
+        for server in self.cluster.servers:
+            if server.host == host:
+                return server
+
+
+    def keysFor(self, host, count=1):
+        """
+        Find keys held by the given server.
+        """
+        keys = []
+        i = 0
+        while len(keys) < count:
+            key = "key%d" % (i,)
+            if self.cluster.serverForKey(key).host == host:
+                keys.append(key)
+            i += 1
+        return keys
+
+
+    def written(self, host):
+        return [t.value() for t in self.transports[host]]
+
+
+    def test_connect(self):
+        """
+        L{MemCacheCluster.connect} connects to every server the given number
+        of times.
+        """
+        self.assertEquals(
+            [(c.host, c.port) for c in self.clock.connectors],
+            [("a", 1), ("a", 1), ("b", 2), ("b", 2), ("c", 3), ("c", 3)])
+
+
+    def test_distribution(self):
+        """
+        Keys are spread among the servers in proportion to their weights.
+        """
+        counts = {}
+        for i in range(4000):
+            host = self.cluster.serverForKey("key%d" % (i,)).host
+            counts[host] = counts.get(host, 0) + 1
+        self.assertEquals(sorted(counts.keys()), ["a", "b", "c"])
+        for host in "a", "b":
+            self.assertTrue(700 < counts[host] < 1300, counts)
+        self.assertTrue(1500 < counts["c"] < 2500, counts)
+
+
+    def test_ejectionMovesOnlyEjectedKeys(self):
+        """
+        When a server is ejected, only the keys it held move to other
+        servers, and they move back when it returns.
+        """
+        keys = ["key%d" % (i,) for i in range(500)]
+        before = [self.cluster.serverForKey(key).host for key in keys]
+        for connector in self.clock.connectors:
+            if connector.host == "b":
+                connector.factory.clientConnectionFailed(
+                    connector, Failure(ConnectionRefusedError()))
+        self.assertTrue(self.serverNamed("b").ejected)
+        after = [self.cluster.serverForKey(key).host for key in keys]
+        for old, new in zip(before, after):
+            if old == "b":
+                self.assertNotEquals(new, "b")
+            else:
+                self.assertEquals(new, old)
+        self.connect(self.clock.connectors[2])
+        self.assertFalse(self.serverNamed("b").ejected)
+        self.assertEquals(
+            [self.cluster.serverForKey(key).host for key in keys], before)
+
+
+    def test_queuedUntilConnected(self):
+        """
+        Commands issued before the server is connected are sent when the
+        connection is made.
+        """
+        [key] = self.keysFor("a")
+        d = self.cluster.set(key, "value")
+        transport = self.connect(self.clock.connectors[0])
+        self.assertEquals(transport.value(), "set %s 0 0 5\r\nvalue\r\n" % (key,))
+        transport.protocol.dataReceived("STORED\r\n")
+        return d.addCallback(self.assertEquals, True)
+
+
+    def test_leastBusyConnection(self):
+        """
+        Commands are sent over the connection of the server with the fewest
+        outstanding commands.
+        """
+        self.connectAll()
+        key1, key2, key3 = self.keysFor("a", 3)
+        self.cluster.get(key1)
+        self.cluster.get(key2)
+        self.assertEquals(self.written("a"),
+                          ["get %s\r\n" % (key1,), "get %s\r\n" % (key2,)])
+        self.transports["a"][1].protocol.dataReceived("END\r\n")
+        self.cluster.get(key3)
+        self.assertEquals(self.written("a")[1],
+                          "get %s\r\nget %s\r\n" % (key2, key3))
+
+
+    def test_getMultiple(self):
+        """
+        L{MemCacheCluster.getMultiple} sends one command to each server
+        holding some of the keys, and merges their results.
+        """
+        self.connectAll()
+        aKeys = self.keysFor("a", 2)
+        [cKey] = self.keysFor("c")
+        d = self.cluster.getMultiple(aKeys + [cKey])
+        self.assertEquals(self.written("a")[0], "get %s\r\n" % " ".join(aKeys))
+        self.assertEquals(self.written("c")[0], "get %s\r\n" % (cKey,))
+        self.assertEquals(self.written("b"), ["", ""])
+        self.transports["c"][0].protocol.dataReceived(
+            "VALUE %s 0 1\r\nc\r\nEND\r\n" % (cKey,))
+        self.transports["a"][0].protocol.dataReceived(
+            "VALUE %s 1 1\r\na\r\nEND\r\n" % (aKeys[0],))
+        d.addCallback(self.assertEquals, {aKeys[0]: (1, "a"),
+                                          aKeys[1]: (0, None),
+                                          cKey: (0, "c")})
+        a = self.serverNamed("a")
+        self.assertEquals((a.requests, a.hits, a.misses), (1, 1, 1))
+        return d
+
+
+    def test_getMultipleFailure(self):
+        """
+        If one of the servers fails, L{MemCacheCluster.getMultiple} fails.
+        """
+        self.connectAll()
+        d = self.cluster.getMultiple(self.keysFor("a") + self.keysFor("b"))
+        self.transports["b"][0].protocol.dataReceived(
+            "SERVER_ERROR zap\r\n")
+        self.flushLoggedErrors(ServerError)
+        return self.assertFailure(d, ServerError)
+
+
+    def test_failover(self):
+        """
+        Commands queued for a server which is ejected are sent to the server
+        now holding their keys, and the ejected server is reconnected after a
+        delay.
+        """
+        [key] = self.keysFor("a")
+        d = self.cluster.get(key)
+        for connector in self.clock.connectors[2:]:
+            self.connect(connector)
+        connector = self.clock.connectors[0]
+        connector.factory.clientConnectionFailed(
+            connector, Failure(ConnectionRefusedError()))
+        host = self.cluster.serverForKey(key).host
+        self.assertNotEquals(host, "a")
+        transport = [t for t in self.transports[host] if t.value()][0]
+        self.assertEquals(transport.value(), "get %s\r\n" % (key,))
+        transport.protocol.dataReceived("END\r\n")
+        self.clock.advance(self.cluster.retryMaxDelay)
+        self.assertEquals(connector.attempts, 2)
+        return d.addCallback(self.assertEquals, (0, None))
+
+
+    def test_connectionLostEjects(self):
+        """
+        A server is ejected when its last connection is lost, failing the
+        commands which were sent over it.
+        """
+        self.connectAll()
+        [key] = self.keysFor("a")
+        d = self.cluster.get(key)
+        self.transports["a"][1].loseConnection()
+        self.assertFalse(self.serverNamed("a").ejected)
+        self.transports["a"][0].loseConnection()
+        self.assertTrue(self.serverNamed("a").ejected)
+        self.assertEquals(self.serverNamed("a").errors, 1)
+        return self.assertFailure(d, ConnectionDone)
+
+
+    def test_noServersAvailable(self):
+        """
+        When every server is ejected, commands fail with
+        L{NoServersAvailable}.
+        """
+        for connector in self.clock.connectors:
+            connector.factory.clientConnectionFailed(
+                connector, Failure(ConnectionRefusedError()))
+        self.assertIdentical(self.cluster.serverForKey("foo"), None)
+        return gatherResults([
+            self.assertFailure(self.cluster.get("foo"), NoServersAvailable),
+            self.assertFailure(self.cluster.getMultiple(["foo"]),
+                               NoServersAvailable)])
+
+
+    def test_invalidKey(self):
+        """
+        Keys which are not C{str} are rejected before being hashed.
+        """
+        return self.assertFailure(self.cluster.get(u"foo"), ClientError)
+
+
+    def test_latency(self):
+        """
+        Each server records the time taken by the commands sent to it.
+        """
+        self.connectAll()
+        [key] = self.keysFor("b")
+        self.cluster.delete(key)
+        self.clock.advance(3)
+        self.transports["b"][0].protocol.dataReceived("DELETED\r\n")
+        b = self.serverNamed("b")
+        self.assertEquals((b.requests, b.totalLatency, b.maxLatency),
+                          (1, 3, 3))
+        self.assertEquals(b.averageLatency(), 3)
+
+
+    def test_stats(self):
+        """
+        L{MemCacheCluster.stats} gathers the statistics of every server.
+        """
+        self.connectAll()
+        d = self.cluster.stats()
+        for host in "a", "b", "c":
+            self.transports[host][0].protocol.dataReceived(
+                "STAT host %s\r\nEND\r\n" % (host,))
+        return d.addCallback(self.assertEquals, {
+                "a:1": {"host": "a"}, "b:2": {"host": "b"},
+                "c:3": {"host": "c"}})
@@ -8,6 +8,7 @@ Tests for Twisted plugin system.
 
 import sys, errno, os, time
 import compileall
+import zipfile, imp, pickle
 
 from zope.interface import Interface
 
@@ -292,6 +293,192 @@ class PluginTestCase(unittest.TestCase):
     test_nonDirectoryChildEntry = _withCacheness(test_nonDirectoryChildEntry)
 
 
+    def test_unchangedModulesNotImported(self):
+        """
+        L{plugin.getCache} only imports the plugin modules which are new or
+        have changed since the index was written.
+        """
+        plugin.getCache(self.module)
+        self._unimportPythonModule(sys.modules['mypackage.testplugin'])
+        FilePath(__file__).sibling('plugin_extra1.py'
+            ).copyTo(self.package.child('pluginextra.py'))
+        try:
+            cache = plugin.getCache(self.module)
+            self.assertIn('pluginextra', cache)
+            self.assertIn(self.originalPlugin, cache)
+            self.assertIn('mypackage.pluginextra', sys.modules)
+            self.assertNotIn('mypackage.testplugin', sys.modules)
+        finally:
+            self._unimportPythonModule(
+                sys.modules['mypackage.pluginextra'], True)
+
+
+    def test_interfaceModulesNotImported(self):
+        """
+        L{plugin.getPlugins} does not import plugin modules which do not
+        provide the requested interface, nor the modules defining the
+        interfaces they do provide.
+        """
+        self.root.child('otherinterface.py').setContent(
+            "from zope.interface import Interface\n"
+            "class IOther(Interface):\n"
+            "    pass\n")
+        self.package.child('otherplugin.py').setContent(
+            "from zope.interface import classProvides\n"
+            "from twisted.plugin import IPlugin\n"
+            "from otherinterface import IOther\n"
+            "class OtherPlugin(object):\n"
+            "    classProvides(IPlugin, IOther)\n")
+        plugin.getCache(self.module)
+        del sys.modules['otherinterface']
+        self._unimportPythonModule(sys.modules['mypackage.otherplugin'])
+
+        plugins = list(plugin.getPlugins(ITestPlugin, self.module))
+        self.assertEqual([p.__name__ for p in plugins], ['TestPlugin'])
+        self.assertNotIn('otherinterface', sys.modules)
+        self.assertNotIn('mypackage.otherplugin', sys.modules)
+
+        import otherinterface
+        plugins = list(plugin.getPlugins(otherinterface.IOther, self.module))
+        self.assertEqual([p.__name__ for p in plugins], ['OtherPlugin'])
+
+
+    def _unwritableIndex(self):
+        """
+        Make writing the C{dropin.cache} index of C{self.package} fail, and
+        point the user's cache directory at a temporary one.
+
+        @return: A C{list} to which the path of each index written is
+            appended.
+        """
+        self.patch(os, 'environ',
+                   dict(os.environ, XDG_CACHE_HOME=os.path.abspath(
+                    self.mktemp())))
+        written = []
+        writeIndex = plugin._writeIndex
+        def _writeIndex(path, modules):
+            if path == self.package.child('dropin.cache').path:
+                raise IOError(errno.EACCES, "Permission denied")
+            written.append(path)
+            return writeIndex(path, modules)
+        self.patch(plugin, '_writeIndex', _writeIndex)
+        return written
+
+
+    def test_unwritableIndexKeptForUser(self):
+        """
+        When the index of a plugin directory cannot be replaced, one is kept
+        in the user's cache directory instead, so that the plugin modules are
+        not imported again.
+        """
+        self.package.child('dropin.cache').setContent(
+            pickle.dumps({'testplugin': None}))
+        written = self._unwritableIndex()
+        userIndex = plugin._userIndexPath(self.package.path)
+        plugin.getCache(self.module)
+        self.assertEqual(written, [userIndex])
+        self._unimportPythonModule(sys.modules['mypackage.testplugin'])
+
+        cache = plugin.getCache(self.module)
+        self.assertIn('testplugin', cache)
+        self.assertNotIn('mypackage.testplugin', sys.modules)
+        # It is only rewritten when it needs to change.
+        self.assertEqual(written, [userIndex])
+        self.assertEqual(self.flushLoggedErrors(), [])
+
+
+    def test_unwritableIndexUpdatedForUser(self):
+        """
+        The index kept in the user's cache directory is updated with the
+        plugin modules which were added since it was written.
+        """
+        written = self._unwritableIndex()
+        plugin.getCache(self.module)
+        self._unimportPythonModule(sys.modules['mypackage.testplugin'])
+        FilePath(__file__).sibling('plugin_extra1.py'
+            ).copyTo(self.package.child('pluginextra.py'))
+        try:
+            cache = plugin.getCache(self.module)
+            self.assertIn('pluginextra', cache)
+            self.assertNotIn('mypackage.testplugin', sys.modules)
+            self.assertEqual(len(written), 2)
+            indexed = plugin._readIndex(written[-1]).keys()
+            indexed.sort()
+            self.assertEqual(indexed, ['pluginextra', 'testplugin'])
+        finally:
+            self._unimportPythonModule(
+                sys.modules['mypackage.pluginextra'], True)
+
+
+    def test_zipPathEntry(self):
+        """
+        L{plugin.getCache} finds the plugin modules in entries of a plugin
+        package's C{__path__} which are directories inside a zip file, such
+        as an egg, without trying to write an index into it.
+        """
+        zipPath = self.root.child('plugins.zip')
+        zf = zipfile.ZipFile(zipPath.path, 'w')
+        try:
+            zf.writestr(
+                'plugins/pluginextra.py',
+                FilePath(__file__).sibling('plugin_extra1.py').getContent())
+        finally:
+            zf.close()
+        entry = zipPath.child('plugins').path
+        self.module.__path__.append(entry)
+        try:
+            cache = plugin.getCache(self.module)
+            self.assertIn('pluginextra', cache)
+            self.assertIn(self.originalPlugin, cache)
+            plugins = list(plugin.getPlugins(ITestPlugin, self.module))
+            self.assertEqual(
+                sorted([p.__name__ for p in plugins]),
+                ['FourthTestPlugin', 'TestPlugin'])
+        finally:
+            self.module.__path__.remove(entry)
+
+
+    def test_extensionModuleFiles(self):
+        """
+        L{plugin._moduleFiles} lists extension modules as well as Python
+        source and bytecode files, preferring an extension module to the
+        source of a module of the same name as import does.
+        """
+        suffixes = [suffix for (suffix, mode, kind) in imp.get_suffixes()
+                    if kind == imp.C_EXTENSION]
+        if not suffixes:
+            raise unittest.SkipTest("Extension modules are not supported.")
+        self.package.child('extension' + suffixes[0]).touch()
+        self.package.child('testplugin' + suffixes[0]).touch()
+        self.assertEqual(
+            plugin._moduleFiles(self.package.path),
+            [('extension', self.package.child('extension' + suffixes[0]).path),
+             ('testplugin',
+              self.package.child('testplugin' + suffixes[0]).path)])
+
+
+    def test_cachedPluginConstructor(self):
+        """
+        L{plugin.CachedPlugin} can be created from the interfaces the plugin
+        provides, and matches the interfaces they extend.
+        """
+        dropin = plugin.CachedDropin('mypackage.testplugin', 'A drop-in.')
+        p = plugin.CachedPlugin(dropin, 'TestPlugin', 'A plugin.',
+                                [ITestPlugin])
+        self.assertEqual(dropin.plugins, [p])
+        self.assertEqual(p.provided, [ITestPlugin])
+        self.assertEqual(
+            p.providedNames, [ITestPlugin.__module__ + '.ITestPlugin'])
+        import mypackage.testplugin as tp
+        self.assertIdentical(ITestPlugin(p, None), tp.TestPlugin)
+        self.assertIdentical(Interface(p, None), tp.TestPlugin)
+        self.assertIdentical(ITestPlugin2(p, None), None)
+
+        p.provided = [ITestPlugin2]
+        self.assertIdentical(ITestPlugin2(p, None), tp.TestPlugin)
+        self.assertIdentical(ITestPlugin(p, None), None)
+
+
     def test_deployedMode(self):
         """
         The C{dropin.cache} file may not be writable: the cache should still be
@@ -520,7 +707,8 @@ class DeveloperSetupTests(unittest.TestCase):
     def test_newPluginsOnReadOnlyPath(self):
         """
         Verify that a failure to write the dropin.cache file on a read-only
-        path will not affect the list of plugins returned.
+        path will not affect the list of plugins returned, and that the index
+        is kept in the user's cache directory instead.
 
         Note: this test should pass on both Linux and Windows, but may not
         provide useful coverage on Windows due to the different meaning of
@@ -534,11 +722,12 @@ class DeveloperSetupTests(unittest.TestCase):
         # examined.
         sys.path.remove(self.devPath.path)
 
-        # Sanity check to make sure we're only flushing the error logged
-        # below...
-        self.assertEqual(len(self.flushLoggedErrors()), 0)
+        userCache = FilePath(self.mktemp())
+        self.patch(os, 'environ',
+                   dict(os.environ, XDG_CACHE_HOME=userCache.path))
         self.assertIn('one', self.getAllPlugins())
-        self.assertEqual(len(self.flushLoggedErrors()), 1)
+        self.assertEqual(len(self.flushLoggedErrors()), 0)
+        self.assertTrue(userCache.exists())
 
 
 
@@ -14,7 +14,7 @@ from twisted.test.proto_helpers import StringTransport
 from twisted.test.proto_helpers import StringTransportWithDisconnection
 
 from twisted.internet import protocol, reactor, address, defer, task
-from twisted.protocols import policies
+from twisted.protocols import policies, htb
 
 
 
@@ -97,6 +97,25 @@ class TestableThrottlingFactory(policies.ThrottlingFactory):
 
 
 
+class TestableTokenBucketThrottlingFactory(
+    policies.TokenBucketThrottlingFactory):
+    """
+    L{policies.TokenBucketThrottlingFactory} using a L{task.Clock} for tests.
+    """
+
+    def __init__(self, clock, *args, **kwargs):
+        policies.TokenBucketThrottlingFactory.__init__(self, *args, **kwargs)
+        self.clock = clock
+
+
+    def callLater(self, period, func):
+        """
+        Forward to the testable clock.
+        """
+        return self.clock.callLater(period, func)
+
+
+
 class TestableTimeoutFactory(policies.TimeoutFactory):
     """
     L{policies.TimeoutFactory} using a L{task.Clock} for tests.
@@ -309,6 +328,134 @@ class ThrottlingTestCase(unittest.TestCase):
 
 
 
+class TokenBucketThrottlingTests(unittest.TestCase):
+    """
+    Tests for L{policies.TokenBucketThrottlingFactory}.
+    """
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.patch(htb, 'time', self.clock.seconds)
+
+
+    def connect(self, factory, host='127.0.0.1'):
+        """
+        Connect a new protocol from C{factory} to a transport whose peer is
+        C{host}.
+        """
+        peer = address.IPv4Address('TCP', host, 1234)
+        proto = factory.buildProtocol(peer)
+        transport = StringTransportWithDisconnection(peerAddress=peer)
+        transport.protocol = proto
+        proto.makeConnection(transport)
+        return proto, transport
+
+
+    def test_readLimit(self):
+        """
+        Reading is paused as soon as more than a burst has been read, and
+        resumed as soon as the excess has drained at the limiting rate.
+        """
+        factory = TestableTokenBucketThrottlingFactory(
+            self.clock, Server(), connectionReadLimit=10)
+        proto, transport = self.connect(factory)
+
+        proto.dataReceived("0123456789")
+        self.assertEquals(transport.producerState, 'producing')
+        proto.dataReceived("abcde")
+        self.assertEquals(transport.producerState, 'paused')
+        self.assertEquals(transport.value(), "0123456789abcde")
+
+        self.clock.advance(0.4)
+        self.assertEquals(transport.producerState, 'paused')
+        self.clock.advance(0.1)
+        self.assertEquals(transport.producerState, 'producing')
+
+
+    def test_writeLimit(self):
+        """
+        Writes overflowing the bucket pause the registered producer until the
+        bucket has drained.
+        """
+        factory = TestableTokenBucketThrottlingFactory(
+            self.clock, Server(), connectionWriteLimit=10)
+        proto, transport = self.connect(factory)
+        proto.registerProducer(proto.wrappedProtocol, True)
+
+        proto.dataReceived("0123456789abcdefghij")
+        self.assertTrue(proto.wrappedProtocol.paused)
+        self.clock.advance(0.9)
+        self.assertTrue(proto.wrappedProtocol.paused)
+        self.clock.advance(0.1)
+        self.assertFalse(proto.wrappedProtocol.paused)
+
+
+    def test_sharedHostBucket(self):
+        """
+        Connections from the same host share a bucket: one is not resumed
+        while the others keep it overfull, while a connection from another
+        host is not affected.
+        """
+        factory = TestableTokenBucketThrottlingFactory(
+            self.clock, Server(), hostReadLimit=10)
+        proto1, transport1 = self.connect(factory)
+        proto2, transport2 = self.connect(factory)
+        proto3, transport3 = self.connect(factory, '10.0.0.1')
+        self.assertIdentical(proto1.readBucket, proto2.readBucket)
+        self.assertNotIdentical(proto1.readBucket, proto3.readBucket)
+
+        proto1.dataReceived("x" * 15)
+        self.assertEquals(transport1.producerState, 'paused')
+        proto3.dataReceived("x" * 10)
+        self.assertEquals(transport3.producerState, 'producing')
+
+        self.clock.advance(0.25)
+        proto2.dataReceived("x" * 5)
+        self.assertEquals(transport2.producerState, 'paused')
+        self.clock.advance(0.25)
+        self.assertEquals(transport1.producerState, 'paused')
+        self.clock.advance(0.5)
+        self.assertEquals(transport1.producerState, 'producing')
+        self.assertEquals(transport2.producerState, 'producing')
+
+
+    def test_globalLimit(self):
+        """
+        The global bucket limits all connections together, on top of their
+        own limits.
+        """
+        factory = TestableTokenBucketThrottlingFactory(
+            self.clock, Server(), readLimit=10, connectionReadLimit=100)
+        proto1, transport1 = self.connect(factory)
+        proto2, transport2 = self.connect(factory, '10.0.0.1')
+
+        proto1.dataReceived("x" * 8)
+        proto2.dataReceived("x" * 8)
+        self.assertEquals(transport1.producerState, 'producing')
+        self.assertEquals(transport2.producerState, 'paused')
+        self.clock.advance(0.6)
+        self.assertEquals(transport2.producerState, 'producing')
+
+
+    def test_connectionLost(self):
+        """
+        A lost connection cancels its pending resume and releases its
+        references to the shared buckets.
+        """
+        factory = TestableTokenBucketThrottlingFactory(
+            self.clock, Server(), hostReadLimit=10)
+        proto, transport = self.connect(factory)
+        proto.dataReceived("x" * 20)
+        bucket = proto.readBucket
+        self.assertEquals(bucket._refcount, 1)
+        self.assertEquals(len(self.clock.calls), 1)
+
+        transport.loseConnection()
+        self.assertEquals(bucket._refcount, 0)
+        self.assertEquals(self.clock.calls, [])
+
+
+
 class TimeoutTestCase(unittest.TestCase):
     """
     Tests for L{policies.TimeoutFactory}.
@@ -501,6 +648,30 @@ class TestTimeout(unittest.TestCase):
         self.failUnless(self.proto.timedOut)
 
 
+    def test_activityDoesNotReschedule(self):
+        """
+        Activity leaves the pending call where it is; when it fires, it is
+        scheduled again for the time remaining since the last activity.
+        """
+        self.proto.makeConnection(StringTransport())
+        call = self.clock.calls[0]
+        self.clock.advance(1)
+        self.proto.dataReceived('hello')
+        self.clock.advance(0.5)
+        self.proto.dataReceived('there')
+        self.assertEquals(self.clock.calls, [call])
+        self.assertEquals(call.getTime(), 3)
+
+        self.clock.advance(1.5)
+        self.failIf(self.proto.timedOut)
+        self.assertEquals(self.clock.calls[0].getTime(), 4.5)
+        self.clock.advance(1.4)
+        self.failIf(self.proto.timedOut)
+        self.clock.advance(0.1)
+        self.failUnless(self.proto.timedOut)
+        self.assertEquals(self.clock.calls, [])
+
+
     def test_resetTimeout(self):
         """
         Check that setting a new value for timeout cancel the previous value
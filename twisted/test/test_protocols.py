@@ -10,6 +10,7 @@ import struct
 from twisted.trial import unittest
 from twisted.protocols import basic, wire, portforward
 from twisted.internet import reactor, protocol, defer, task, error
+from twisted.python import _splice
 from twisted.test import proto_helpers
 
 
@@ -298,6 +299,126 @@ a'''
 
 
 
+class BatchingLineTester(LineTester):
+    """
+    A L{LineTester} which receives lines through C{linesReceived}, handling
+    them one by one and reporting how many it consumed if it switched to raw
+    mode or paused.
+
+    @ivar batches: The number of lines in each call to C{linesReceived}.
+    """
+
+    def connectionMade(self):
+        LineTester.connectionMade(self)
+        self.batches = []
+
+
+    def linesReceived(self, lines):
+        self.batches.append(len(lines))
+        for i in range(len(lines)):
+            self.lineReceived(lines[i])
+            if not self.line_mode or self.paused:
+                return i + 1
+
+
+
+class LinesReceivedTestCase(unittest.TestCase):
+    """
+    Tests for L{basic.LineReceiver.linesReceived}.
+    """
+
+    def test_batch(self):
+        """
+        All the complete lines in the buffer are passed to C{linesReceived}
+        in a single call, and the incomplete one is kept for later.
+        """
+        a = BatchingLineTester()
+        a.makeConnection(proto_helpers.StringTransport())
+        a.dataReceived('foo\nbar\nbaz\nqu')
+        self.assertEqual(a.received, ['foo', 'bar', 'baz'])
+        self.assertEqual(a.batches, [3])
+        a.dataReceived('ux\n')
+        self.assertEqual(a.received, ['foo', 'bar', 'baz', 'quux'])
+        self.assertEqual(a.batches, [3, 1])
+
+
+    def test_modesAndPausing(self):
+        """
+        The lines following one after which C{linesReceived} switched to raw
+        mode or paused are handled according to the new state, giving the
+        same result as delivering lines one by one.
+        """
+        for packetSize in range(1, 10):
+            clock = task.Clock()
+            a = BatchingLineTester(clock)
+            a.makeConnection(protocol.FileWrapper(
+                    proto_helpers.StringIOWithoutClosing()))
+            buffer = LineReceiverTestCase.rawpause_buf
+            for i in range(len(buffer) / packetSize + 1):
+                a.dataReceived(buffer[i * packetSize:(i + 1) * packetSize])
+            self.assertEqual(
+                a.received, LineReceiverTestCase.rawpause_output1)
+            clock.advance(0)
+            self.assertEqual(
+                a.received, LineReceiverTestCase.rawpause_output2)
+
+
+    def test_buffer(self):
+        """
+        L{LineReceiverTestCase.buffer} is parsed in the same way as when lines
+        are delivered one by one, for any packet size.
+        """
+        for packetSize in range(1, 10):
+            a = BatchingLineTester()
+            a.makeConnection(protocol.FileWrapper(
+                    proto_helpers.StringIOWithoutClosing()))
+            buffer = LineReceiverTestCase.buffer
+            for i in range(len(buffer) / packetSize + 1):
+                a.dataReceived(buffer[i * packetSize:(i + 1) * packetSize])
+            self.assertEqual(a.received, LineReceiverTestCase.output)
+
+
+    def test_clearLineBuffer(self):
+        """
+        L{LineReceiver.clearLineBuffer} called from C{linesReceived} returns
+        the data following the batch.
+        """
+        class ClearingReceiver(basic.LineReceiver):
+            def linesReceived(self, lines):
+                self.lines = lines
+                self.rest = self.clearLineBuffer()
+
+        protocol = ClearingReceiver()
+        protocol.dataReceived('foo\r\nbar\r\nbaz')
+        self.assertEqual(protocol.lines, ['foo', 'bar'])
+        self.assertEqual(protocol.rest, 'baz')
+        protocol.dataReceived('quux\r\n')
+        self.assertEqual(protocol.lines, ['quux'])
+
+
+
+    def test_noLinesConsumed(self):
+        """
+        If C{linesReceived} reports that it consumed none of the lines, but
+        neither switched to raw mode nor paused, C{RuntimeError} is raised
+        rather than delivering the same lines again.
+        """
+        class StuckReceiver(basic.LineReceiver):
+            def connectionMade(self):
+                self.batches = []
+
+            def linesReceived(self, lines):
+                self.batches.append(lines)
+                return 0
+
+        protocol = StuckReceiver()
+        protocol.makeConnection(proto_helpers.StringTransport())
+        self.assertRaises(
+            RuntimeError, protocol.dataReceived, 'foo\r\nbar\r\n')
+        self.assertEqual(protocol.batches, [['foo', 'bar']])
+
+
+
 class LineOnlyReceiverTestCase(unittest.TestCase):
     """
     Test line only receiveer.
@@ -330,6 +451,24 @@ class LineOnlyReceiverTestCase(unittest.TestCase):
         self.assertIsInstance(res, error.ConnectionLost)
 
 
+    def test_linesReceived(self):
+        """
+        If C{linesReceived} is set, all the complete lines of each chunk of
+        data are passed to it in one call, up to a line which is too long.
+        """
+        t = proto_helpers.StringTransport()
+        a = LineOnlyTester()
+        a.makeConnection(t)
+        batches = []
+        a.linesReceived = batches.append
+        a.dataReceived('foo\nbar\nba')
+        a.dataReceived('z\n')
+        self.assertEqual(batches, [['foo', 'bar'], ['baz']])
+        res = a.dataReceived('quux\n' + 'x' * 200 + '\nnot delivered\n')
+        self.assertEqual(batches, [['foo', 'bar'], ['baz'], ['quux']])
+        self.assertIsInstance(res, error.ConnectionLost)
+
+
 
 class TestMixin:
 
@@ -407,6 +546,29 @@ class NetstringReceiverTestCase(unittest.TestCase, LPTestCaseMixin):
             self.assertEquals(a.received, self.strings)
 
 
+    def test_manyStrings(self):
+        """
+        All of the netstrings in data received at once are delivered, and a
+        netstring split across many calls to C{dataReceived} is delivered in
+        one piece.
+        """
+        t = proto_helpers.StringTransport()
+        a = TestNetstring()
+        a.MAX_LENGTH = 699
+        a.makeConnection(t)
+        for s in self.strings * 10:
+            a.sendString(s)
+        a.dataReceived(t.value())
+        self.assertEquals(a.received, self.strings * 10)
+        del a.received[:]
+        a.dataReceived('600:')
+        for i in range(99):
+            a.dataReceived('abcdef')
+        self.assertEquals(a.received, [])
+        a.dataReceived('abcdef,3:')
+        self.assertEquals(a.received, ['abcdef' * 100])
+
+
 class IntNTestCaseMixin(LPTestCaseMixin):
     """
     TestCase mixin for int-prefixed protocols.
@@ -474,6 +636,84 @@ class IntNTestCaseMixin(LPTestCaseMixin):
         self.assertEqual(r.received, [])
 
 
+    def pack(self, r, strings):
+        """
+        Return C{strings} encoded as they would be by C{r.sendString}.
+        """
+        return ''.join([struct.pack(r.structFormat, len(s)) + s
+                        for s in strings])
+
+
+    def test_manyStrings(self):
+        """
+        All of the complete strings in data received at once are delivered
+        and whatever follows them is left in C{recvd}.
+        """
+        r = self.getProtocol()
+        data = self.pack(r, self.strings * 20)
+        partial = self.pack(r, ['abcde'])
+        r.dataReceived(data + partial[:-2])
+        self.assertEqual(r.received, self.strings * 20)
+        self.assertEqual(r.recvd, partial[:-2])
+        r.dataReceived(partial[-2:] + data)
+        self.assertEqual(r.received, self.strings * 20 + ['abcde'] +
+                         self.strings * 20)
+        self.assertEqual(r.recvd, '')
+
+
+    def test_recvdDuringStringReceived(self):
+        """
+        While C{stringReceived} runs, C{_unparsed} returns the data following
+        the string being delivered, and replacing C{recvd} stops any more
+        strings being parsed from that data.
+        """
+        r = self.getProtocol()
+        rest = []
+        def stringReceived(s):
+            r.received.append(s)
+            rest.append(r._unparsed())
+            r.recvd = ''
+        r.stringReceived = stringReceived
+        r.dataReceived(self.pack(r, self.strings) + 'trailer')
+        self.assertEqual(r.received, self.strings[:1])
+        self.assertEqual(rest, [self.pack(r, self.strings[1:]) + 'trailer'])
+        self.assertEqual(r.recvd, '')
+
+
+    def test_ownGetattr(self):
+        """
+        A subclass defining C{__getattr__} receives strings as usual.
+        """
+        class Receiver(self.protocol):
+            def __getattr__(self, name):
+                raise AttributeError(name)
+        r = Receiver()
+        r.makeConnection(proto_helpers.StringTransport())
+        r.dataReceived(self.pack(r, self.strings))
+        self.assertEqual(r.received, self.strings)
+        self.assertEqual(r.recvd, '')
+
+
+    def test_pauseDuringStringReceived(self):
+        """
+        Pausing the protocol from C{stringReceived} stops strings being
+        delivered until it is resumed, including when C{dataReceived} is
+        called again from C{stringReceived}.
+        """
+        r = self.getProtocol()
+        def stringReceived(s):
+            r.received.append(s)
+            if len(r.received) == 1:
+                r.pauseProducing()
+                r.dataReceived(self.pack(r, ['more']))
+        r.stringReceived = stringReceived
+        r.dataReceived(self.pack(r, self.strings))
+        self.assertEqual(r.received, self.strings[:1])
+        r.resumeProducing()
+        self.assertEqual(r.received, self.strings + ['more'])
+        self.assertEqual(r.recvd, '')
+
+
 
 class TestInt32(TestMixin, basic.Int32StringReceiver):
     """
@@ -728,9 +968,10 @@ class Portforwarding(unittest.TestCase):
             [defer.maybeDeferred(p.stopListening) for p in self.openPorts])
 
 
-    def test_portforward(self):
+    def _forward(self, nBytes, useSplice=False):
         """
-        Test port forwarding through Echo protocol.
+        Send C{nBytes} through a port forwarder to an Echo server, and return
+        a L{defer.Deferred} which fires when they have all come back.
         """
         realServerFactory = protocol.ServerFactory()
         realServerFactory.protocol = lambda: self.serverProtocol
@@ -739,16 +980,16 @@ class Portforwarding(unittest.TestCase):
         self.openPorts.append(realServerPort)
         self.proxyServerFactory = TestableProxyFactory('127.0.0.1',
                                 realServerPort.getHost().port)
+        self.proxyServerFactory.useSplice = useSplice
         proxyServerPort = reactor.listenTCP(0, self.proxyServerFactory,
                                             interface='127.0.0.1')
         self.openPorts.append(proxyServerPort)
 
-        nBytes = 1000
         received = []
         d = defer.Deferred()
         def testDataReceived(data):
-            received.extend(data)
-            if len(received) >= nBytes:
+            received.append(data)
+            if sum(map(len, received)) >= nBytes:
                 self.assertEquals(''.join(received), 'x' * nBytes)
                 d.callback(None)
         self.clientProtocol.dataReceived = testDataReceived
@@ -766,6 +1007,62 @@ class Portforwarding(unittest.TestCase):
         return d
 
 
+    def test_portforward(self):
+        """
+        Test port forwarding through Echo protocol.
+        """
+        return self._forward(1000)
+
+
+    def test_flowControl(self):
+        """
+        The two transports of a forwarded connection are each other's
+        streaming producer, so neither reads faster than the other writes.
+        """
+        def check(ignored):
+            server = self.proxyServerFactory.protoInstance
+            client = self.proxyServerFactory.clientFactoryInstance.protoInstance
+            self.assertIdentical(server.transport.producer, client.transport)
+            self.assertIdentical(client.transport.producer, server.transport)
+            self.assertTrue(server.transport.streamingProducer)
+            self.assertIdentical(server.relay, None)
+        return self._forward(1000).addCallback(check)
+
+
+    def test_splice(self):
+        """
+        With C{useSplice} set, the bytes of plain TCP connections are moved
+        by a splice relay, in both directions.
+        """
+        def check(ignored):
+            server = self.proxyServerFactory.protoInstance
+            self.assertNotIdentical(server.relay, None)
+            self.assertTrue(server.relay.running)
+        return self._forward(2 ** 21, True).addCallback(check)
+    if not _splice.available:
+        test_splice.skip = "splice(2) is not available."
+
+
+    def test_spliceStoppedOnDisconnect(self):
+        """
+        When one side of a spliced connection goes away, the relay is
+        stopped and the other side is disconnected.
+        """
+        lost = defer.Deferred()
+        def check(ignored):
+            server = self.proxyServerFactory.protoInstance
+            client = self.proxyServerFactory.clientFactoryInstance.protoInstance
+            client.connectionLost = lambda reason: lost.callback(client)
+            self.clientProtocol.transport.loseConnection()
+            return lost.addCallback(lambda ignored: server.relay)
+        def stopped(relay):
+            self.assertFalse(relay.running)
+        return self._forward(1000, True).addCallback(check).addCallback(
+            stopped)
+    if not _splice.available:
+        test_spliceStoppedOnDisconnect.skip = "splice(2) is not available."
+
+
 
 class StringTransportTestCase(unittest.TestCase):
     """
@@ -565,12 +565,22 @@ class FakeContext:
     def __init__(self, method):
         self._method = method
         self._options = 0
+        self._sessionID = None
+        self._sessionCacheMode = None
 
 
     def set_options(self, options):
         self._options |= options
 
 
+    def set_session_id(self, sessionID):
+        self._sessionID = sessionID
+
+
+    def set_session_cache_mode(self, mode):
+        self._sessionCacheMode = mode
+
+
     def use_certificate_file(self, fileName):
         pass
 
@@ -630,6 +640,28 @@ class DefaultOpenSSLContextFactoryTests(unittest.TestCase):
             ssl.DefaultOpenSSLContextFactory, self.mktemp(), certPath)
 
 
+    def test_sessionCache(self):
+        """
+        The context returned by L{ssl.DefaultOpenSSLContextFactory.getContext}
+        has a session id and caches server-side sessions, without session
+        tickets by default.
+        """
+        self.assertNotEqual(self.context._sessionID, None)
+        self.assertEqual(self.context._sessionCacheMode, SSL.SESS_CACHE_SERVER)
+        self.assertTrue(self.context._options & ssl._OP_NO_TICKET)
+
+
+    def test_sessionTickets(self):
+        """
+        Passing C{enableSessionTickets=True} to
+        L{ssl.DefaultOpenSSLContextFactory} leaves session tickets enabled.
+        """
+        context = ssl.DefaultOpenSSLContextFactory(
+            certPath, certPath, _contextFactory=FakeContext,
+            enableSessionTickets=True).getContext()
+        self.assertFalse(context._options & ssl._OP_NO_TICKET)
+
+
 
 class ClientContextFactoryTests(unittest.TestCase):
     """
@@ -653,11 +685,185 @@ class ClientContextFactoryTests(unittest.TestCase):
 
 
 
+class FakeSession:
+    """
+    L{OpenSSL.SSL.Session} double.
+    """
+
+
+
+class FakeSSLConnection:
+    """
+    L{OpenSSL.SSL.Connection} double for L{ssl.ClientSessionCache}.
+
+    @ivar session: The session set on or produced by this connection.
+    @ivar finished: The value of C{get_peer_finished}, C{None} until the
+        handshake completes.
+    """
+    def __init__(self, session=None, finished='finished'):
+        self.session = session
+        self.finished = finished
+
+
+    def set_session(self, session):
+        self.session = session
+
+
+    def get_session(self):
+        return self.session
+
+
+    def get_peer_finished(self):
+        return self.finished
+
+
+
+class ClientSessionCacheTests(unittest.TestCase):
+    """
+    Tests for L{ssl.ClientSessionCache}.
+    """
+    def setUp(self):
+        self.cache = ssl.ClientSessionCache(maxSize=2)
+
+
+    def test_resume(self):
+        """
+        L{ssl.ClientSessionCache.resume} offers the session saved for the
+        same address, and nothing for other addresses.
+        """
+        session = FakeSession()
+        self.cache.save(FakeSSLConnection(session), ('example.com', 443))
+
+        connection = FakeSSLConnection()
+        self.cache.resume(connection, ('example.com', 443))
+        self.assertIdentical(connection.session, session)
+
+        connection = FakeSSLConnection()
+        self.cache.resume(connection, ('example.com', 8443))
+        self.assertIdentical(connection.session, None)
+
+
+    def test_unfinishedHandshake(self):
+        """
+        The session of a connection whose handshake did not complete is not
+        saved.
+        """
+        self.cache.save(
+            FakeSSLConnection(FakeSession(), None), ('example.com', 443))
+        self.assertEqual(self.cache.sessions, {})
+
+
+    def test_noPeerFinished(self):
+        """
+        The session of a connection whose handshake cannot be checked, because
+        it has no C{get_peer_finished}, is saved if there is one, and the
+        session of one whose C{get_peer_finished} fails is not.
+        """
+        connection = FakeSSLConnection(FakeSession())
+        connection.get_peer_finished = None
+        self.cache.save(connection, ('example.com', 443))
+        self.assertIn(('example.com', 443), self.cache.sessions)
+
+        connection = FakeSSLConnection(FakeSession())
+        def get_peer_finished():
+            raise SSL.Error("no handshake")
+        connection.get_peer_finished = get_peer_finished
+        self.cache.save(connection, ('example.com', 8443))
+        self.assertNotIn(('example.com', 8443), self.cache.sessions)
+
+
+    def test_maxSize(self):
+        """
+        L{ssl.ClientSessionCache} keeps no more than C{maxSize} sessions.
+        """
+        for port in range(5):
+            self.cache.save(
+                FakeSSLConnection(FakeSession()), ('example.com', port))
+        self.assertEqual(len(self.cache.sessions), 2)
+        self.assertIn(('example.com', 4), self.cache.sessions)
+
+
+
+class ClosingClientProtocol(protocol.Protocol):
+    """
+    A protocol that disconnects as soon as it receives some data.
+
+    @ivar deferred: A L{defer.Deferred} which fires when the connection is
+        lost.
+    """
+    def __init__(self):
+        self.deferred = defer.Deferred()
+
+
+    def dataReceived(self, data):
+        self.transport.loseConnection()
+
+
+    def connectionLost(self, reason):
+        self.deferred.callback(None)
+
+
+
+class SessionResumptionTests(unittest.TestCase):
+    """
+    Tests for resuming TLS sessions with L{ssl.ClientSessionCache} and
+    L{ssl.DefaultOpenSSLContextFactory}.
+    """
+    def setUp(self):
+        self.serverContextFactory = ssl.DefaultOpenSSLContextFactory(
+            certPath, certPath)
+        server = protocol.ServerFactory()
+        server.protocol = SingleLineServerProtocol
+        self.port = reactor.listenSSL(
+            0, server, self.serverContextFactory, interface='127.0.0.1')
+        self.addCleanup(self.port.stopListening)
+        self.clientContextFactory = ssl.ClientContextFactory()
+        self.clientContextFactory.method = SSL.TLSv1_METHOD
+        self.clientContextFactory.sessionCache = ssl.ClientSessionCache()
+
+
+    def connect(self, ignored=None):
+        """
+        Connect to the server, and return a L{defer.Deferred} which fires
+        once the connection is closed again.
+        """
+        client = protocol.ClientFactory()
+        clientProtocol = ClosingClientProtocol()
+        client.protocol = lambda: clientProtocol
+        reactor.connectSSL('127.0.0.1', self.port.getHost().port, client,
+                           self.clientContextFactory)
+        return clientProtocol.deferred
+
+
+    def test_resumeOnReconnect(self):
+        """
+        A client reconnecting to the same server resumes the session of its
+        previous connection, and both sides count one full and one resumed
+        handshake.
+        """
+        cache = self.clientContextFactory.sessionCache
+        d = self.connect()
+        d.addCallback(self.connect)
+        def cbConnected(ignored):
+            self.assertEqual(cache.sessions.keys(),
+                             [('127.0.0.1', self.port.getHost().port)])
+            if cache.fullHandshakes + cache.resumedHandshakes == 0:
+                raise unittest.SkipTest(
+                    "pyOpenSSL cannot tell whether a session was resumed")
+            self.assertEqual(
+                (cache.fullHandshakes, cache.resumedHandshakes), (1, 1))
+            self.assertEqual(
+                self.serverContextFactory.getHandshakeCounts(), (1, 1))
+        d.addCallback(cbConnected)
+        return d
+
+
+
 if interfaces.IReactorSSL(reactor, None) is None:
     for tCase in [StolenTCPTestCase, TLSTestCase, SpammyTLSTestCase,
                   BufferingTestCase, ConnectionLostTestCase,
                   DefaultOpenSSLContextFactoryTests,
-                  ClientContextFactoryTests]:
+                  ClientContextFactoryTests, SessionResumptionTests]:
         tCase.skip = "Reactor does not support SSL, cannot run SSL tests"
 
 # Otherwise trial will run this test here
@@ -312,6 +312,58 @@ class OpenSSLOptions(unittest.TestCase):
         self.assertEquals(0x00004000, ctx.set_options(0) & 0x00004000)
 
 
+    def test_certificateOptionsSessionCacheSize(self):
+        """
+        A context can be made with a limit on the size of its session cache,
+        whether or not this version of pyOpenSSL can apply it.
+        """
+        opts = sslverify.OpenSSLCertificateOptions(sessionCacheSize=10)
+        self.assertEquals(opts.sessionCacheSize, 10)
+        self.assertNotIdentical(opts.getContext(), None)
+
+
+    def test_certificateOptionsHandshakeCounts(self):
+        """
+        L{sslverify.OpenSSLCertificateOptions.getHandshakeCounts} counts the
+        full and resumed handshakes of servers using its context.
+        """
+        serverOpts = sslverify.OpenSSLCertificateOptions(
+            privateKey=self.sKey, certificate=self.sCert)
+        if serverOpts.getHandshakeCounts() is None:
+            raise unittest.SkipTest(
+                "pyOpenSSL cannot count the handshakes of a context")
+        self.assertEquals(serverOpts.getHandshakeCounts(), (0, 0))
+        onData = defer.Deferred()
+        self.loopback(serverOpts,
+                      sslverify.OpenSSLCertificateOptions(
+                          requireCertificate=False),
+                      onData=onData)
+        return onData.addCallback(
+            lambda result: self.assertEquals(
+                serverOpts.getHandshakeCounts(), (1, 0)))
+
+
+    def test_callOpenSSLUnavailable(self):
+        """
+        L{sslverify._callOpenSSL} returns C{None} rather than calling an
+        OpenSSL function which is not available, or with something which is
+        not a pointer of the expected type.
+        """
+        ctx = SSL.Context(SSL.TLSv1_METHOD)
+        pointer = getattr(ctx, '_context', None)
+        self.assertIdentical(
+            sslverify._callOpenSSL('SSL_session_reused', object(), 'SSL *'),
+            None)
+        self.assertIdentical(
+            sslverify._callOpenSSL('SSL_session_reused', pointer, 'SSL *'),
+            None)
+        self.assertIdentical(
+            sslverify._callOpenSSL(
+                'SSL_no_such_function', pointer, 'SSL_CTX *'),
+            None)
+        self.assertIdentical(sslverify._sessionReused(object()), None)
+
+
     def test_allowedAnonymousClientConnection(self):
         """
         Check that anonymous connections are allowed when certificates aren't
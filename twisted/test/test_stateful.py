@@ -6,7 +6,9 @@
 Test cases for twisted.protocols.stateful
 """
 
+from twisted.trial import unittest
 from twisted.test import test_protocols
+from twisted.test.proto_helpers import StringTransport
 from twisted.protocols.stateful import StatefulProtocol
 
 from struct import pack, unpack, calcsize
@@ -75,3 +77,113 @@ class Int32TestCase(test_protocols.Int32TestCase):
         r.dataReceived(big)
         self.assertEquals(r.received, self.strings * 4)
 
+
+    def test_manyStrings(self):
+        """
+        All of the complete strings in data received at once are delivered,
+        and a string split across calls is delivered once it is complete.
+        """
+        r = self.getProtocol()
+        data = self.pack(r, self.strings * 20)
+        partial = self.pack(r, ['abcde'])
+        r.dataReceived(data + partial[:-2])
+        self.assertEqual(r.received, self.strings * 20)
+        r.dataReceived(partial[-2:] + data)
+        self.assertEqual(r.received, self.strings * 20 + ['abcde'] +
+                         self.strings * 20)
+
+
+    def test_recvdDuringStringReceived(self):
+        pass
+    test_recvdDuringStringReceived.skip = (
+        "StatefulProtocol does not expose its buffer as recvd")
+
+
+    def test_ownGetattr(self):
+        pass
+    test_ownGetattr.skip = (
+        "StatefulProtocol does not expose its buffer as recvd")
+
+
+    def test_pauseDuringStringReceived(self):
+        pass
+    test_pauseDuringStringReceived.skip = (
+        "StatefulProtocol is not a producer")
+
+
+
+class RecordReceiver(StatefulProtocol):
+    """
+    A L{StatefulProtocol} which reads records, each preceded by a one byte
+    length.
+    """
+
+    def getInitialState(self):
+        self.records = []
+        return self._getLength, 1
+
+    def _getLength(self, data):
+        return self._getRecord, ord(data)
+
+    def _getRecord(self, data):
+        self.records.append(data)
+        return self._getLength, 1
+
+
+
+class StatefulProtocolTests(unittest.TestCase):
+    """
+    Tests for L{StatefulProtocol}.
+    """
+
+    def getProtocol(self):
+        p = RecordReceiver()
+        p.makeConnection(StringTransport())
+        return p
+
+
+    def test_byteByByte(self):
+        """
+        States are called with exactly the number of bytes they asked for,
+        however the data is split up as it arrives.
+        """
+        p = self.getProtocol()
+        for c in '\x03abc\x00\x02xy\x01':
+            p.dataReceived(c)
+        self.assertEqual(p.records, ['abc', '', 'xy'])
+
+
+    def test_manyRecords(self):
+        """
+        All of the records in data received at once are delivered, and a
+        record split across calls is delivered once it is complete.
+        """
+        p = self.getProtocol()
+        p.dataReceived('\x02ab' * 1000 + '\x02c')
+        self.assertEqual(p.records, ['ab'] * 1000)
+        p.dataReceived('d\x01e')
+        self.assertEqual(p.records, ['ab'] * 1000 + ['cd', 'e'])
+
+
+    def test_largeRecordInPieces(self):
+        """
+        A record larger than any single read is delivered whole.
+        """
+        p = self.getProtocol()
+        p.dataReceived('\xff')
+        for i in range(51):
+            p.dataReceived('xyzzy')
+        self.assertEqual(p.records, ['xyzzy' * 51])
+
+
+    def test_disconnectStopsParsing(self):
+        """
+        No more states are called once a state has closed the connection.
+        """
+        p = self.getProtocol()
+        def disconnect(data):
+            p.records.append(data)
+            p.transport.loseConnection()
+        p._getRecord = disconnect
+        p.dataReceived('\x01a\x01b')
+        self.assertEqual(p.records, ['a'])
@@ -313,6 +313,27 @@ class SubCommandTest(unittest.TestCase):
         self.failUnlessIdentical(oBar.subOptions.parent, oBar)
 
 
+    def test_subCommandsNotComputedWithoutArguments(self):
+        """
+        C{subCommands} is not looked at when there are no arguments left to
+        dispatch and no default sub command, since it may be expensive to
+        compute.
+        """
+        computed = []
+        class Opt(usage.Options):
+            def subCommands(self):
+                computed.append(True)
+                return [('foo', 'f', usage.Options, 'bar')]
+            subCommands = property(subCommands)
+        o = Opt()
+        o.parseOptions([])
+        self.assertEqual(computed, [])
+        self.assertIdentical(o.subCommand, None)
+        o.parseOptions(['foo'])
+        self.assertEqual(computed, [True])
+        self.assertEqual(o.subCommand, 'foo')
+
+
 class HelpStringTest(unittest.TestCase):
     def setUp(self):
         """
@@ -211,10 +211,21 @@ def parse_qs(qs, keep_blank_values=0, strict_parsing=0, unquote=unquote):
                 d[k] = [v]
     return d
 
+# The current time as an HTTP datetime string, and the second it is for:
+# every response has a Date header, and it only changes once a second.
+_currentDateTime = (None, None)
+
 def datetimeToString(msSinceEpoch=None):
     """Convert seconds since epoch to HTTP datetime string."""
+    global _currentDateTime
     if msSinceEpoch == None:
-        msSinceEpoch = time.time()
+        now = time.time()
+        second, s = _currentDateTime
+        if second == int(now):
+            return s
+        s = datetimeToString(now)
+        _currentDateTime = (int(now), s)
+        return s
     year, month, day, hh, mm, ss, wd, y, z = time.gmtime(msSinceEpoch)
     s = "%s, %02d %3s %4d %02d:%02d:%02d GMT" % (
         weekdayname[wd],
@@ -377,6 +388,102 @@ class StringTransport:
         return getattr(self.__dict__['s'], attr)
 
 
+class _QueuedResponse(StringTransport):
+    """
+    Hold the response to a pipelined request until the responses to the
+    requests before it have been sent.
+
+    The first C{memoryLimit} bytes are kept in memory; if the response grows
+    beyond that, all of it is moved to a temporary file.  A response which
+    was spooled is sent from the file by L{drain}, as the transport asks for
+    more, and more of it can be written while that happens.
+
+    @ivar file: The temporary file holding the response, or C{None} while it
+        is in memory.
+
+    @ivar stopped: A flag which is true once L{stopProducing} has been called,
+        after which anything written is discarded.
+    """
+    implements(interfaces.IPushProducer)
+
+    chunkSize = 2 ** 16
+    file = None
+    stopped = False
+
+    def __init__(self, memoryLimit):
+        StringTransport.__init__(self)
+        self.memoryLimit = memoryLimit
+        self._size = 0
+        self._readPosition = 0
+        self._consumer = None
+        self._paused = False
+
+
+    def write(self, data):
+        if self.stopped:
+            return
+        if self.file is None:
+            self.s.write(data)
+            self._size += len(data)
+            if self._size > self.memoryLimit:
+                self.file = tempfile.TemporaryFile()
+                self.file.write(self.s.getvalue())
+                self.s = None
+        else:
+            self.file.seek(0, 2)
+            self.file.write(data)
+            if self._consumer is not None and not self._paused:
+                self.resumeProducing()
+
+
+    def writeSequence(self, seq):
+        self.write(''.join(seq))
+
+
+    def drain(self, consumer, callback):
+        """
+        Write the spooled response to C{consumer}, reading the file only as
+        fast as C{consumer} takes it, and call C{callback} once everything
+        written so far has been sent.
+        """
+        self._consumer = consumer
+        self._callback = callback
+        consumer.registerProducer(self, True)
+        self.resumeProducing()
+
+
+    def pauseProducing(self):
+        self._paused = True
+
+
+    def resumeProducing(self):
+        self._paused = False
+        while not self._paused and self._consumer is not None:
+            self.file.seek(self._readPosition)
+            data = self.file.read(self.chunkSize)
+            if not data:
+                consumer, callback = self._consumer, self._callback
+                self.stopProducing()
+                consumer.unregisterProducer()
+                callback()
+                return
+            self._readPosition += len(data)
+            self._consumer.write(data)
+
+
+    def stopProducing(self):
+        """
+        Stop sending the response and discard it, including anything written
+        later.  This happens once it has all been sent, or when the
+        connection is lost before that.
+        """
+        self.stopped = True
+        self._consumer = self._callback = None
+        if self.file is not None:
+            self.file.close()
+
+
+
 class HTTPClient(basic.LineReceiver):
     """A client for HTTP 1.0
 
@@ -479,6 +586,12 @@ class HTTPClient(basic.LineReceiver):
 # response codes that must have empty bodies
 NO_BODY_CODES = (204, 304)
 
+# Status lines already formatted by Request.write, keyed by the HTTP version,
+# code and message they are made of.  The version comes from the client, so
+# the number of entries is capped.
+_statusLines = {}
+_maxStatusLines = 256
+
 class Request:
     """
     A HTTP request.
@@ -509,6 +622,10 @@ class Request:
         C{responseHeaders} instead.  C{headers} behaves mostly like a C{dict}
         and does not provide access to all header values nor does it allow
         multiple values for one header to be set.
+
+    @ivar queuedMemoryLimit: The number of bytes of the response to a
+        pipelined request which are kept in memory while the responses before
+        it are sent.  The rest is written to a temporary file.
     """
     implements(interfaces.IConsumer)
 
@@ -524,10 +641,12 @@ class Request:
     sentLength = 0 # content-length of response, or total bytes sent via chunking
     etag = None
     lastModified = None
+    queuedMemoryLimit = 2 ** 20
     args = None
     path = None
     content = None
     _forceSSL = 0
+    _bodyConsumer = None
 
     def __init__(self, channel, queued):
         """
@@ -543,7 +662,7 @@ class Request:
         self.cookies = [] # outgoing cookies
 
         if queued:
-            self.transport = StringTransport()
+            self.transport = _QueuedResponse(self.queuedMemoryLimit)
         else:
             self.transport = self.channel.transport
 
@@ -598,13 +717,26 @@ class Request:
         if not self.queued:
             raise RuntimeError, "noLongerQueued() got called unnecessarily."
 
-        self.queued = 0
+        queuedResponse = self.transport
+        if queuedResponse.file is None:
+            # send any buffered data, then switch to the real transport
+            data = queuedResponse.getvalue()
+            if data:
+                self.channel.transport.write(data)
+            self._queuedSent()
+        else:
+            # Send what was spooled first; this request stays queued, and
+            # writes more to the file, until it has been.
+            queuedResponse.drain(self.channel.transport, self._queuedSent)
+
 
-        # set transport to real one and send any buffer data
-        data = self.transport.getvalue()
+    def _queuedSent(self):
+        """
+        Called once the response buffered while this request was queued has
+        been sent; start writing directly to the transport.
+        """
+        self.queued = 0
         self.transport = self.channel.transport
-        if data:
-            self.transport.write(data)
 
         # if we have producer, register it with transport
         if (self.producer is not None) and not self.finished:
@@ -624,12 +756,35 @@ class Request:
             request headers.  C{None} if the request headers do not indicate a
             length.
         """
+        if length != 0:
+            consumer = self.getBodyConsumer()
+            if consumer is not None:
+                self._bodyConsumer = consumer
+                self.content = StringIO()
+                consumer.registerProducer(self.channel, True)
+                return
         if length is not None and length < 100000:
             self.content = StringIO()
         else:
             self.content = tempfile.TemporaryFile()
 
 
+    def getBodyConsumer(self):
+        """
+        Called when the headers of this request have been received, if it
+        has a body.  The method, URI, path and query arguments of the request
+        are already set.
+
+        Override this to consume the body as it arrives instead of having it
+        buffered in C{content}; see
+        L{twisted.web.iweb.IStreamingRequestBody.getBodyConsumer} for how the
+        consumer is used.
+
+        @return: An L{IConsumer} provider for the body, or C{None}.
+        """
+        return None
+
+
     def parseCookies(self):
         """
         Parse cookie headers.
@@ -657,7 +812,27 @@ class Request:
 
         This method is not intended for users.
         """
-        self.content.write(data)
+        if self._bodyConsumer is None:
+            self.content.write(data)
+        else:
+            self._bodyConsumer.write(data)
+
+
+    def _setRequestLine(self, command, path, version):
+        """
+        Set the method, URI and version of this request, and the path and
+        query arguments of the URI.
+        """
+        self.args = {}
+        self.method, self.uri = command, path
+        self.clientproto = version
+        x = self.uri.split('?', 1)
+
+        if len(x) == 1:
+            self.path = self.uri
+        else:
+            self.path, argstring = x
+            self.args = parse_qs(argstring, 1)
 
 
     def requestReceived(self, command, path, version):
@@ -676,19 +851,15 @@ class Request:
         @type version: C{str}
         @param version: The HTTP version of this request.
         """
+        consumer = self._bodyConsumer
+        if consumer is not None:
+            self._bodyConsumer = None
+            consumer.unregisterProducer()
+
         self.content.seek(0,0)
-        self.args = {}
         self.stack = []
-
-        self.method, self.uri = command, path
-        self.clientproto = version
-        x = self.uri.split('?', 1)
-
-        if len(x) == 1:
-            self.path = self.uri
-        else:
-            self.path, argstring = x
-            self.args = parse_qs(argstring, 1)
+        if self.path is None:
+            self._setRequestLine(command, path, version)
 
         # cache the client and server information, we'll need this later to be
         # serialized and sent with the request so CGIs will work remotely
@@ -821,9 +992,13 @@ class Request:
         if not self.startedWriting:
             self.startedWriting = 1
             version = self.clientproto
-            l = []
-            l.append('%s %s %s\r\n' % (version, self.code,
-                                       self.code_message))
+            key = (version, self.code, self.code_message)
+            statusLine = _statusLines.get(key)
+            if statusLine is None:
+                statusLine = '%s %s %s\r\n' % key
+                if len(_statusLines) < _maxStatusLines:
+                    _statusLines[key] = statusLine
+            l = [statusLine]
             # if we don't have a content length, we send data in
             # chunked mode, so that we can support pipelining in
             # persistent connections.
@@ -849,22 +1024,28 @@ class Request:
                 for value in values:
                     l.append("%s: %s\r\n" % (name, value))
 
-            for cookie in self.cookies:
-                l.append('%s: %s\r\n' % ("Set-Cookie", cookie))
+            if self.cookies:
+                l.extend(['Set-Cookie: %s\r\n' % (cookie,)
+                          for cookie in self.cookies])
 
             l.append("\r\n")
 
-            self.transport.writeSequence(l)
-
-            # if this is a "HEAD" request, we shouldn't return any data
-            if self.method == "HEAD":
+            # if this is a "HEAD" request, or for certain result codes, we
+            # shouldn't return any data
+            if self.method == "HEAD" or self.code in NO_BODY_CODES:
+                self.transport.writeSequence(l)
                 self.write = lambda data: None
                 return
 
-            # for certain result codes, we should never return any data
-            if self.code in NO_BODY_CODES:
-                self.write = lambda data: None
-                return
+            # Send the first chunk of the body along with the headers.
+            self.sentLength = self.sentLength + len(data)
+            if data:
+                if self.chunked:
+                    l.extend(toChunk(data))
+                else:
+                    l.append(data)
+            self.transport.writeSequence(l)
+            return
 
         self.sentLength = self.sentLength + len(data)
         if data:
@@ -1171,8 +1352,12 @@ class Request:
         Clean up anything which can't be useful anymore.
         """
         self.channel = None
+        self._bodyConsumer = None
         if self.content is not None:
             self.content.close()
+        if self.queued:
+            # Nothing buffered for this response can be sent now.
+            self.transport.stopProducing()
 
 
 
@@ -1389,12 +1574,26 @@ class HTTPChannel(basic.LineReceiver, policies.TimeoutMixin):
     """
     A receiver for HTTP requests.
 
+    The header blocks of requests which arrive whole are parsed in one pass
+    by L{linesReceived}; a block split across reads is parsed line by line
+    by L{lineReceived}.  Set C{linesReceived} to C{None} in a subclass to
+    always parse line by line.
+
+    @ivar maxPipelinedRequests: The number of requests which may be waiting
+        for their response at once.  When a client pipelines more, the
+        channel stops reading from the transport until some of them are
+        done.  C{None} means no limit.
+
     @ivar _transferDecoder: C{None} or an instance of
         L{_ChunkedTransferDecoder} if the request body uses the I{chunked}
         Transfer-Encoding.
+    @ivar _pipelinePaused: Whether the channel stopped reading because there
+        were C{maxPipelinedRequests} requests.
     """
 
     maxHeaders = 500 # max number of headers allowed per request
+    maxPipelinedRequests = 16
+    _pipelinePaused = False
 
     length = 0
     persistent = 1
@@ -1464,6 +1663,115 @@ class HTTPChannel(basic.LineReceiver, policies.TimeoutMixin):
             self.__header = line
 
 
+    def linesReceived(self, lines):
+        """
+        Handle a batch of complete lines.  Whenever they include the whole
+        header block of the next request, it is parsed at once by
+        L{_headerBlockReceived}; other lines go to L{lineReceived}.
+
+        L{_headerBlockReceived} does the work of L{lineReceived} and
+        L{headerReceived} without calling them, so if either of them is
+        overridden every line goes to L{lineReceived} instead.
+
+        @return: The number of lines handled before the channel switched to
+            receiving a request body, or C{None} if all of them were.
+        """
+        batch = (
+            getattr(self.lineReceived, 'im_func', None)
+                is HTTPChannel.lineReceived.im_func and
+            getattr(self.headerReceived, 'im_func', None)
+                is HTTPChannel.headerReceived.im_func)
+        index = 0
+        count = len(lines)
+        while index < count:
+            if batch and self.__first_line and self.persistent:
+                if not lines[index] and self.__first_line == 1:
+                    self.__first_line = 2
+                    index += 1
+                    continue
+                try:
+                    end = lines.index('', index + 1)
+                except ValueError:
+                    end = -1
+                if lines[index] and end != -1:
+                    self._headerBlockReceived(lines, index, end)
+                    index = end + 1
+                else:
+                    self.lineReceived(lines[index])
+                    index += 1
+            else:
+                self.lineReceived(lines[index])
+                index += 1
+            if (not self.line_mode or self.paused
+                or self.transport.disconnecting):
+                return index
+        return None
+
+
+    def _headerBlockReceived(self, lines, start, end):
+        """
+        Parse a request line and its headers, C{lines[start:end]}, and
+        store the headers in the new request's C{requestHeaders}.
+
+        This does the work of L{lineReceived} and L{headerReceived} for a
+        whole header block, without going through them for every line.
+        """
+        self.resetTimeout()
+        request = self.requestFactory(self, len(self.requests))
+        self.requests.append(request)
+        self.__first_line = 0
+
+        parts = lines[start].split()
+        if len(parts) != 3:
+            self.transport.write("HTTP/1.1 400 Bad Request\r\n\r\n")
+            self.transport.loseConnection()
+            return
+        self._command, self._path, self._version = parts
+
+        # Join continuation lines to the header they continue.
+        headerLines = []
+        for line in lines[start + 1:end]:
+            if line[0] in ' \t' and headerLines:
+                headerLines[-1] = headerLines[-1] + '\n' + line
+            else:
+                headerLines.append(line)
+
+        if len(headerLines) > self.maxHeaders:
+            self.transport.write("HTTP/1.1 400 Bad Request\r\n\r\n")
+            self.transport.loseConnection()
+            return
+
+        rawHeaders = {}
+        for line in headerLines:
+            header, data = line.split(':', 1)
+            header = header.lower()
+            data = data.strip()
+            if header == 'content-length':
+                self.length = int(data)
+                self._transferDecoder = _IdentityTransferDecoder(
+                    self.length, request.handleContentChunk,
+                    self._finishRequestBody)
+            elif header == 'transfer-encoding' and data.lower() == 'chunked':
+                self.length = None
+                self._transferDecoder = _ChunkedTransferDecoder(
+                    request.handleContentChunk, self._finishRequestBody)
+            values = rawHeaders.get(header)
+            if values is None:
+                rawHeaders[header] = [data]
+            else:
+                values.append(data)
+
+        requestHeaders = request.requestHeaders
+        for header, values in rawHeaders.iteritems():
+            requestHeaders.setRawHeaders(header, values)
+
+        self.allHeadersReceived()
+        if self.length == 0:
+            self.allContentReceived()
+        else:
+            self.setRawMode()
+
+
     def _finishRequestBody(self, data):
         self.allContentReceived()
         self.setLineMode(data)
@@ -1523,6 +1831,12 @@ class HTTPChannel(basic.LineReceiver, policies.TimeoutMixin):
         req = self.requests[-1]
         req.requestReceived(command, path, version)
 
+        maxRequests = self.maxPipelinedRequests
+        if (maxRequests is not None and len(self.requests) >= maxRequests
+            and not self._pipelinePaused):
+            self._pipelinePaused = True
+            self.pauseProducing()
+
     def rawDataReceived(self, data):
         self.resetTimeout()
         self._transferDecoder.dataReceived(data)
@@ -1532,6 +1846,9 @@ class HTTPChannel(basic.LineReceiver, policies.TimeoutMixin):
         req = self.requests[-1]
         req.parseCookies()
         self.persistent = self.checkPersistence(req, self._version)
+        if self.length != 0:
+            # Whoever consumes the body may want to know where it is going.
+            req._setRequestLine(self._command, self._path, self._version)
         req.gotLength(self.length)
 
 
@@ -1593,6 +1910,10 @@ class HTTPChannel(basic.LineReceiver, policies.TimeoutMixin):
             else:
                 if self._savedTimeOut:
                     self.setTimeout(self._savedTimeOut)
+            if self._pipelinePaused:
+                # There is room for another request again.
+                self._pipelinePaused = False
+                self.resumeProducing()
         else:
             self.transport.loseConnection()
 
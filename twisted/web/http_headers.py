@@ -129,10 +129,18 @@ class Headers(object):
     @cvar _caseMappings: A C{dict} that maps lowercase header names
         to their canonicalized representation.
 
+    @cvar _canonicalNames: A C{dict} remembering the canonicalized
+        representation of up to C{_maxCanonicalNames} lowercase header names
+        which have been looked up, as computing it is relatively costly.
+        Each subclass gets its own, since it may have different
+        C{_caseMappings}.
+
     @ivar _rawHeaders: A C{dict} mapping header names as C{str} to C{lists} of
         header values as C{str}.
     """
     _caseMappings = {'www-authenticate': 'WWW-Authenticate'}
+    _canonicalNames = {}
+    _maxCanonicalNames = 1000
 
     def __init__(self, rawHeaders=None):
         self._rawHeaders = {}
@@ -254,7 +262,18 @@ class Headers(object):
         @rtype: C{str}
         @return: The canonical name of the header.
         """
-        return self._caseMappings.get(name, _dashCapitalize(name))
+        cls = self.__class__
+        canonicalNames = cls.__dict__.get('_canonicalNames')
+        if canonicalNames is None:
+            canonicalNames = cls._canonicalNames = {}
+        canonical = canonicalNames.get(name)
+        if canonical is None:
+            canonical = self._caseMappings.get(name)
+            if canonical is None:
+                canonical = _dashCapitalize(name)
+            if len(canonicalNames) < self._maxCanonicalNames:
+                canonicalNames[name] = canonical
+        return canonical
 
 
 __all__ = ['Headers']
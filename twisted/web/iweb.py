@@ -308,6 +308,129 @@ class IRequest(Interface):
 
 
 
+class IStreamingRequestBody(Interface):
+    """
+    A resource which consumes the bodies of requests for it as they arrive,
+    instead of having them buffered in the request's C{content} first.
+
+    Resources are only asked for a body consumer by a
+    L{twisted.web.server.Site} whose C{streamRequestBodies} is set, as the
+    resource for a request then has to be located before its body arrives.
+    """
+
+    def getBodyConsumer(request):
+        """
+        Called once the headers of C{request} have been received, before its
+        body.
+
+        The consumer's C{registerProducer} is called with a streaming
+        producer which can be paused to stop reading the body from the
+        network.  Each part of the body is passed to its C{write} as it is
+        received, and C{unregisterProducer} is called once all of it has
+        been.  The request is then rendered as usual, with an empty
+        C{content}.  If the connection is lost before the body is complete,
+        the request's C{notifyFinish} L{Deferred} fails instead.
+
+        @param request: The L{IRequest} whose body is about to be received.
+
+        @return: An L{IConsumer} provider for the body, or C{None} to have
+            it buffered as usual.
+        """
+
+
+
+class ISessionStore(Interface):
+    """
+    Where a L{twisted.web.server.Site} keeps its sessions, by their unique
+    IDs.  A store is a mapping, which also takes care of expiring the
+    sessions it holds once they have not been used for their
+    C{sessionTimeout}.
+
+    @since: 9.0
+    """
+
+    def __getitem__(uid):
+        """
+        Return the session with the given unique ID.
+
+        @raise KeyError: If there is no such session.
+        """
+
+
+    def __setitem__(uid, session):
+        """
+        Add a new session.
+        """
+
+
+    def __delitem__(uid):
+        """
+        Remove a session, for example because it expired.
+        """
+
+
+    def __contains__(uid):
+        """
+        Is there a session with the given unique ID?
+        """
+
+
+    def __len__():
+        """
+        Return the number of sessions held.
+        """
+
+
+    def touch(session):
+        """
+        Record that C{session} was just used, which postpones its expiry.
+        Sessions which are not in the store are ignored.
+        """
+
+
+
+class _IRequestEncoder(Interface):
+    """
+    An object encoding the body of the response to one request, for example
+    with gzip.
+    """
+
+    def encode(data):
+        """
+        Encode some of the response body.  The first call happens just before
+        the response headers are sent, so they can still be changed.
+
+        @param data: The next bytes of the body, as written to the request.
+        @type data: C{str}
+
+        @return: The encoded bytes to send in place of C{data}; possibly
+            C{''}.
+        """
+
+
+    def finish():
+        """
+        Called when the response is finished.
+
+        @return: The last encoded bytes of the body.
+        """
+
+
+
+class _IRequestEncoderFactory(Interface):
+    """
+    A factory of L{_IRequestEncoder}s, used by
+    L{twisted.web.resource.EncodingResourceWrapper}.
+    """
+
+    def encoderForRequest(request):
+        """
+        Return an L{_IRequestEncoder} for the response to C{request}, or
+        C{None} if the client did not ask for this encoding.
+        """
+
+
+
 class ICredentialFactory(Interface):
     """
     A credential factory defines a way to generate a particular kind of
@@ -352,4 +475,5 @@ class ICredentialFactory(Interface):
         @return: The credentials represented by the given response.
         """
 
-__all__ = ["IUsernameDigestHash", "ICredentialFactory", "IRequest"]
+__all__ = ["IUsernameDigestHash", "ICredentialFactory", "IRequest",
+           "IStreamingRequestBody", "ISessionStore"]
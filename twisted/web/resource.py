@@ -10,6 +10,7 @@ import warnings
 
 from zope.interface import Attribute, implements, Interface
 
+from twisted.python.components import proxyForInterface
 from twisted.web import http
 
 
@@ -295,6 +296,48 @@ class ForbiddenResource(ErrorPage):
                            message)
 
 
+class EncodingResourceWrapper(proxyForInterface(IResource)):
+    """
+    Wrap an L{IResource} so that the responses to requests for it and its
+    children are encoded, for example with
+    L{twisted.web.server.GzipEncoderFactory}, when the client accepts that
+    encoding::
+
+        root = EncodingResourceWrapper(root, [GzipEncoderFactory()])
+
+    The first factory which returns an encoder for a request is used.  The
+    request passes each part of the response body written to it through
+    the encoder, so responses written in several parts are encoded as they
+    are written.
+
+    @ivar _encoders: The L{twisted.web.iweb._IRequestEncoderFactory}
+        providers to choose from.
+    """
+
+    def __init__(self, original, encoders):
+        self.original = original
+        self._encoders = encoders
+
+
+    def getChildWithDefault(self, path, request):
+        """
+        Return the child of the wrapped resource, wrapped in turn.
+        """
+        return self.__class__(
+            self.original.getChildWithDefault(path, request), self._encoders)
+
+
+    def render(self, request):
+        for factory in self._encoders:
+            encoder = factory.encoderForRequest(request)
+            if encoder is not None:
+                request._encoder = encoder
+                break
+        return self.original.render(request)
+
+
+
 __all__ = [
     'IResource', 'getChildForRequest',
-    'Resource', 'ErrorPage', 'NoResource', 'ForbiddenResource']
+    'Resource', 'ErrorPage', 'NoResource', 'ForbiddenResource',
+    'EncodingResourceWrapper']
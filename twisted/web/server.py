@@ -15,6 +15,10 @@ import string
 import types
 import copy
 import os
+import zlib
+import anydbm
+import cPickle as pickle
+from collections import deque
 from urllib import quote
 
 from zope.interface import implements
@@ -58,6 +62,8 @@ class Request(pb.Copyable, http.Request, components.Componentized):
     site = None
     appRootURL = None
     __pychecker__ = 'unusednames=issuer'
+    _bodyResource = None
+    _encoder = None
 
     def __init__(self, *args, **kw):
         http.Request.__init__(self, *args, **kw)
@@ -119,15 +125,41 @@ class Request(pb.Copyable, http.Request, components.Componentized):
         self.setHeader('content-type', "text/html")
 
         # Resource Identification
-        self.prepath = []
-        self.postpath = map(unquote, string.split(self.path[1:], '/'))
+        resrc = self._bodyResource
         try:
-            resrc = self.site.getResourceFor(self)
+            if resrc is None:
+                self.prepath = []
+                self.postpath = map(unquote, string.split(self.path[1:], '/'))
+                resrc = self.site.getResourceFor(self)
             self.render(resrc)
         except:
             self.processingFailed(failure.Failure())
 
 
+    def getBodyConsumer(self):
+        """
+        If the site streams request bodies, locate the resource for this
+        request before its body arrives, and let the resource consume the
+        body if it provides L{iweb.IStreamingRequestBody}.  The resource is
+        remembered and rendered by L{process} once the body is complete.
+        """
+        site = getattr(self.channel, 'site', None)
+        if site is None or not site.streamRequestBodies:
+            return None
+        self.site = site
+        self.prepath = []
+        self.postpath = map(unquote, string.split(self.path[1:], '/'))
+        try:
+            resrc = site.getResourceFor(self)
+        except:
+            # process will look for it again, and report the failure.
+            return None
+        self._bodyResource = resrc
+        if iweb.IStreamingRequestBody.providedBy(resrc):
+            return resrc.getBodyConsumer(self)
+        return None
+
+
     def render(self, resrc):
         try:
             body = resrc.render(self)
@@ -235,7 +267,21 @@ class Request(pb.Copyable, http.Request, components.Componentized):
             d.errback(reason)
         self.notifications = []
 
+    def write(self, data):
+        """
+        Write some of the response body, encoded by the encoder chosen by
+        L{resource.EncodingResourceWrapper} if there is one.
+        """
+        if self._encoder is not None:
+            data = self._encoder.encode(data)
+        http.Request.write(self, data)
+
     def finish(self):
+        if self._encoder is not None:
+            encoder, self._encoder = self._encoder, None
+            data = encoder.finish()
+            if data:
+                http.Request.write(self, data)
         http.Request.finish(self)
         for d in self.notifications:
             d.callback(None)
@@ -353,6 +399,178 @@ class _RemoteProducerWrapper:
         self.stopProducing = remote.remoteMethod("stopProducing")
 
 
+
+def _acceptsEncoding(request, encoding):
+    """
+    Does the I{Accept-Encoding} header of C{request} allow responses in
+    C{encoding}?
+    """
+    header = request.getHeader('accept-encoding')
+    if not header:
+        return False
+    accepted = False
+    for item in header.split(','):
+        parts = item.split(';')
+        name = parts[0].strip().lower()
+        if name.startswith('x-'):
+            name = name[2:]
+        if name not in (encoding, '*'):
+            continue
+        quality = 1.0
+        for param in parts[1:]:
+            key, value = (param.split('=', 1) + [''])[:2]
+            if key.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if name == encoding:
+            return quality > 0
+        accepted = quality > 0
+    return accepted
+
+
+
+class GzipEncoderFactory(object):
+    """
+    Encode responses with gzip for clients which accept it.  Use it with
+    L{resource.EncodingResourceWrapper}.
+
+    Only responses whose I{Content-Type} starts with one of
+    C{compressibleTypes} are compressed, and only if they are not encoded
+    already and not known to be shorter than C{minimumSize}.  Responses to
+    I{HEAD} requests and partial responses are left alone.
+
+    A response written in one part whose length is given by its
+    I{Content-Length} is compressed at once, and keeps a I{Content-Length};
+    otherwise the compressed body is sent as it is produced, with chunked
+    transfer encoding for HTTP/1.1 clients.
+
+    @ivar compressLevel: The zlib compression level, from 1 to 9.
+    @ivar minimumSize: Responses with a I{Content-Length} below this are sent
+        uncompressed.
+    @ivar compressibleTypes: A sequence of prefixes of the content types
+        worth compressing.
+    """
+    implements(iweb._IRequestEncoderFactory)
+
+    encoding = 'gzip'
+    compressibleTypes = (
+        'text/', 'application/json', 'application/javascript',
+        'application/x-javascript', 'application/xml',
+        'application/xhtml+xml', 'application/rss+xml', 'image/svg+xml')
+
+    def __init__(self, compressLevel=6, minimumSize=1024):
+        self.compressLevel = compressLevel
+        self.minimumSize = minimumSize
+
+
+    def encoderForRequest(self, request):
+        """
+        Return a L{_GzipEncoder} if C{request} accepts gzip.
+        """
+        if _acceptsEncoding(request, self.encoding):
+            return _GzipEncoder(self, request)
+        return None
+
+
+    def shouldCompress(self, contentType, size):
+        """
+        Is a response with the given I{Content-Type}, of C{size} bytes if
+        that is known, worth compressing?
+        """
+        if contentType is None:
+            return False
+        contentType = contentType.split(';', 1)[0].strip().lower()
+        for prefix in self.compressibleTypes:
+            if contentType.startswith(prefix):
+                break
+        else:
+            return False
+        return size is None or size >= self.minimumSize
+
+
+    def compress(self, data):
+        """
+        Return all of C{data}, compressed in the gzip format.
+        """
+        compressor = zlib.compressobj(
+            self.compressLevel, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return compressor.compress(data) + compressor.flush()
+
+
+
+class _GzipEncoder(object):
+    """
+    Compress the response to one request with gzip, if
+    L{GzipEncoderFactory.shouldCompress} allows it.
+
+    @ivar _compressor: The zlib compression object, or C{None} if the
+        response is not compressed or was compressed at once.
+    @ivar _started: Whether the response headers were looked at.
+    """
+    implements(iweb._IRequestEncoder)
+
+    _compressor = None
+    _started = False
+
+    def __init__(self, factory, request):
+        self.factory = factory
+        self.request = request
+
+
+    def _start(self, data):
+        """
+        Decide whether to compress the response, seeing its headers and the
+        first part of its body.
+        """
+        self._started = True
+        request = self.request
+        headers = request.responseHeaders
+        if (request.method == 'HEAD' or request.code in http.NO_BODY_CODES
+            or request.code == http.PARTIAL_CONTENT
+            or headers.hasHeader('content-encoding')):
+            return data
+        contentType = headers.getRawHeaders('content-type', [None])[0]
+        length = headers.getRawHeaders('content-length', [None])[0]
+        if length is not None:
+            try:
+                length = int(length)
+            except ValueError:
+                return data
+        if not self.factory.shouldCompress(contentType, length):
+            return data
+
+        headers.addRawHeader('vary', 'Accept-Encoding')
+        headers.setRawHeaders('content-encoding', [self.factory.encoding])
+        if length == len(data):
+            # The whole body is here, so its compressed length can be given.
+            data = self.factory.compress(data)
+            headers.setRawHeaders('content-length', [str(len(data))])
+            return data
+        headers.removeHeader('content-length')
+        self._compressor = zlib.compressobj(
+            self.factory.compressLevel, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return self._compressor.compress(data)
+
+
+    def encode(self, data):
+        if not self._started:
+            return self._start(data)
+        if self._compressor is None:
+            return data
+        return self._compressor.compress(data)
+
+
+    def finish(self):
+        if self._compressor is None:
+            return ''
+        data = self._compressor.flush()
+        self._compressor = None
+        return data
+
+
+
 class Session(components.Componentized):
     """
     A user's session with a system.
@@ -432,6 +650,9 @@ class Session(components.Componentized):
         self.lastModified = self._reactor.seconds()
         if self._expireCall is not None:
             self._expireCall.reset(self.sessionTimeout)
+        store = getattr(self.site, 'sessions', None)
+        if iweb.ISessionStore.providedBy(store):
+            store.touch(self)
 
 
     def checkExpired(self):
@@ -444,6 +665,280 @@ class Session(components.Componentized):
             stacklevel=2, category=DeprecationWarning)
 
 
+
+class MemorySessionStore(object):
+    """
+    An L{iweb.ISessionStore} keeping sessions in memory.
+
+    Instead of a timer for each session, sessions are kept in the order they
+    were last used, and a single call checks the least recently used ones
+    every C{sweepInterval} seconds, expiring those which have not been used
+    for their C{sessionTimeout}.  A session therefore expires up to
+    C{sweepInterval} seconds late; one with a shorter C{sessionTimeout} than
+    sessions used before it may wait until they expire.
+
+    Use it by setting the C{sessions} attribute of a L{Site}::
+
+        site.sessions = MemorySessionStore()
+
+    @ivar maxSessions: The maximum number of sessions held, or C{None}.  When
+        a new session would exceed it, the least recently used one is
+        expired.
+    @ivar sweepInterval: The number of seconds between checks for expired
+        sessions.
+
+    @ivar _sessions: A C{dict} mapping unique IDs to sessions.
+    @ivar _access: A C{dict} mapping unique IDs to the time each session was
+        last used.
+    @ivar _order: A C{deque} of C{(time, uid)} tuples, least recently used
+        first.  Tuples whose time is not the current one in C{_access} are
+        stale and skipped.
+    @ivar _sweepCall: The pending call to L{sweep}, or C{None} while the
+        store is empty.
+    """
+    implements(iweb.ISessionStore)
+
+    _sweepCall = None
+
+    def __init__(self, reactor=None, maxSessions=None, sweepInterval=60):
+        if reactor is None:
+            from twisted.internet import reactor
+        self._reactor = reactor
+        self.maxSessions = maxSessions
+        self.sweepInterval = sweepInterval
+        self._sessions = {}
+        self._access = {}
+        self._order = deque()
+
+
+    def __getitem__(self, uid):
+        return self._sessions[uid]
+
+
+    def __contains__(self, uid):
+        return uid in self._sessions
+
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+    def __setitem__(self, uid, session):
+        if uid in self._sessions:
+            del self[uid]
+        elif self.maxSessions is not None:
+            while len(self._sessions) >= self.maxSessions:
+                self._oldest().expire()
+        self._add(uid, session, self._reactor.seconds())
+
+
+    def __delitem__(self, uid):
+        del self._sessions[uid]
+        del self._access[uid]
+        if not self._sessions:
+            self._order.clear()
+            if self._sweepCall is not None:
+                self._sweepCall.cancel()
+                self._sweepCall = None
+
+
+    def _add(self, uid, session, when):
+        """
+        Hold C{session}, last used at C{when}.
+        """
+        self._sessions[uid] = session
+        self._access[uid] = when
+        self._order.append((when, uid))
+        if self._sweepCall is None:
+            self._sweepCall = self._reactor.callLater(
+                self.sweepInterval, self.sweep)
+
+
+    def _oldest(self):
+        """
+        Return the least recently used session, dropping stale tuples from
+        the head of C{_order}.
+        """
+        order = self._order
+        while True:
+            when, uid = order[0]
+            if self._access.get(uid) == when:
+                return self._sessions[uid]
+            order.popleft()
+
+
+    def touch(self, session):
+        uid = session.uid
+        if self._sessions.get(uid) is not session:
+            return
+        now = self._reactor.seconds()
+        if self._access[uid] == now:
+            return
+        self._access[uid] = now
+        self._order.append((now, uid))
+        if len(self._order) > 2 * len(self._sessions) + 16:
+            # Drop the stale tuples, so sessions used over and over do not
+            # grow the queue without bound.
+            order = [(t, u) for (u, t) in self._access.iteritems()]
+            order.sort()
+            self._order = deque(order)
+
+
+    def sweep(self):
+        """
+        Expire the sessions which have not been used for their
+        C{sessionTimeout}, and schedule the next check.
+        """
+        if self._sweepCall is not None and self._sweepCall.active():
+            # Called directly rather than by the timer.
+            self._sweepCall.cancel()
+        self._sweepCall = None
+        now = self._reactor.seconds()
+        while self._sessions:
+            session = self._oldest()
+            if now - self._access[session.uid] < session.sessionTimeout:
+                break
+            session.expire()
+        if self._sessions and self._sweepCall is None:
+            self._sweepCall = self._reactor.callLater(
+                self.sweepInterval, self.sweep)
+
+
+    def close(self):
+        """
+        Stop checking for expired sessions.  The sessions are kept.
+        """
+        if self._sweepCall is not None:
+            self._sweepCall.cancel()
+            self._sweepCall = None
+
+
+
+class DBMSessionStore(MemorySessionStore):
+    """
+    A L{MemorySessionStore} which also saves its sessions in a database
+    file opened with C{anydbm}, so that they outlive the process.
+
+    When the store is created, the sessions saved in the file which have not
+    expired are recreated with the site's C{sessionFactory}.  A session is
+    saved when it is added, and again by the next L{sweep} after it is used.
+    Call L{close} when the site stops, to save the rest.
+
+    A session is saved with the time it was last used, its
+    C{sessionNamespaces} and its components, which must be picklable;
+    sessions which cannot be pickled are only kept in memory.  Callbacks
+    registered with C{notifyOnExpire} are not saved.  The reactor's
+    C{seconds} must give the time since the epoch for expiry to carry over
+    correctly.
+
+    @ivar site: The L{Site} the sessions belong to.
+    @ivar _db: The C{anydbm} database.
+    @ivar _dirty: The unique IDs of the sessions used since they were last
+        saved.
+    """
+
+    def __init__(self, site, path, reactor=None, maxSessions=None,
+                 sweepInterval=60):
+        MemorySessionStore.__init__(self, reactor, maxSessions, sweepInterval)
+        self.site = site
+        self._db = anydbm.open(path, 'c')
+        self._dirty = set()
+        self._load()
+
+
+    def _load(self):
+        """
+        Recreate the sessions saved in C{_db} which have not expired, and
+        remove the others.
+        """
+        now = self._reactor.seconds()
+        saved = []
+        for uid in self._db.keys():
+            try:
+                when, namespaces, components = pickle.loads(self._db[uid])
+            except Exception:
+                log.err(None, "Discarding unreadable session %r" % (uid,))
+                del self._db[uid]
+                continue
+            session = self.site.sessionFactory(self.site, uid, self._reactor)
+            if now - when >= session.sessionTimeout:
+                del self._db[uid]
+                continue
+            session.lastModified = when
+            session.sessionNamespaces = namespaces
+            session._adapterCache.update(components)
+            saved.append((when, uid, session))
+        saved.sort()
+        for when, uid, session in saved:
+            self._add(uid, session, when)
+
+
+    def _save(self, uid):
+        """
+        Write the session with unique ID C{uid} to C{_db}.
+        """
+        session = self._sessions[uid]
+        try:
+            data = pickle.dumps(
+                (self._access[uid], session.sessionNamespaces,
+                 session._adapterCache), pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError):
+            log.err(None, "Cannot save session %r" % (uid,))
+            return
+        self._db[uid] = data
+
+
+    def _flush(self):
+        """
+        Save the sessions used since they were last saved.
+        """
+        for uid in self._dirty:
+            if uid in self._sessions:
+                self._save(uid)
+        self._dirty.clear()
+        sync = getattr(self._db, 'sync', None)
+        if sync is not None:
+            sync()
+
+
+    def __setitem__(self, uid, session):
+        MemorySessionStore.__setitem__(self, uid, session)
+        self._save(uid)
+
+
+    def __delitem__(self, uid):
+        MemorySessionStore.__delitem__(self, uid)
+        self._dirty.discard(uid)
+        if self._db.has_key(uid):
+            del self._db[uid]
+
+
+    def touch(self, session):
+        MemorySessionStore.touch(self, session)
+        if self._sessions.get(session.uid) is session:
+            self._dirty.add(session.uid)
+
+
+    def sweep(self):
+        """
+        Expire the sessions which have not been used for their
+        C{sessionTimeout}, and save those which were used.
+        """
+        MemorySessionStore.sweep(self)
+        self._flush()
+
+
+    def close(self):
+        """
+        Save the sessions used since the last L{sweep}, stop checking for
+        expired sessions and close the database.
+        """
+        MemorySessionStore.close(self)
+        self._flush()
+        self._db.close()
+
+
+
 version = "TwistedWeb/%s" % copyright.version
 
 
@@ -457,11 +952,23 @@ class Site(http.HTTPFactory):
     @ivar displayTracebacks: if set, Twisted internal errors are displayed on
         rendered pages. Default to C{True}.
     @ivar sessionFactory: factory for sessions objects. Default to L{Session}.
+    @ivar sessions: The sessions of this site, by unique ID.  A C{dict} by
+        default, in which case each session expires by a timer of its own;
+        set it to an L{iweb.ISessionStore} provider such as
+        L{MemorySessionStore} or L{DBMSessionStore} to have the store
+        expire them.
     @ivar sessionCheckTime: Deprecated.  See L{Session.sessionTimeout} instead.
+    @ivar streamRequestBodies: If set, the resource for a request with a
+        body is located as soon as the request's headers have been received,
+        so that resources providing L{iweb.IStreamingRequestBody} can
+        consume the body as it arrives.  Default to C{False}, as resources
+        are then located before C{request.args} includes the arguments
+        from a form in the body.
     """
     counter = 0
     requestFactory = Request
     displayTracebacks = True
+    streamRequestBodies = False
     sessionFactory = Session
     sessionCheckTime = 1800
 
@@ -497,7 +1004,8 @@ class Site(http.HTTPFactory):
         """
         uid = self._mkuid()
         session = self.sessions[uid] = self.sessionFactory(self, uid)
-        session.startCheckingExpiration()
+        if not iweb.ISessionStore.providedBy(self.sessions):
+            session.startCheckingExpiration()
         return session
 
     def getSession(self, uid):
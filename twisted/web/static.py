@@ -12,11 +12,15 @@ import urllib
 import itertools
 import cgi
 import time
+import stat
+from collections import deque
+from cStringIO import StringIO
 
 from zope.interface import implements
 
 from twisted.web import server
 from twisted.web import resource
+from twisted.web import iweb
 from twisted.web import http
 from twisted.web.util import redirectTo
 
@@ -146,6 +150,222 @@ def getTypeAndEncoding(filename, types, encodings, defaultType):
 
 
 
+class _CachedFile(object):
+    """
+    The contents of a file held by L{FileCache}, with what is needed to
+    respond with them.
+
+    @ivar content: The bytes of the file.
+    @ivar type: The I{Content-Type} of the file.
+    @ivar encoding: The I{Content-Encoding} of the file, or C{None}.
+    @ivar mtime: The modification time of the file when it was read.
+    @ivar etag: An entity tag derived from C{mtime} and the size.
+    @ivar compressed: C{content} compressed with gzip, once a client asked
+        for it, or C{None}.
+    @ivar precompressed: The path of the I{.gz} copy of the file served in
+        its place to clients accepting gzip, or C{None} if there is none.
+        Only meaningful if C{precompressedChecked} is true.
+    @ivar precompressedChecked: Whether C{precompressed} was looked up since
+        the file was last compared with the filesystem.
+    @ivar checked: When the file was last compared with the filesystem.
+    @ivar serial: Orders the entries of the cache by last use.
+    """
+    compressed = None
+    precompressed = None
+    precompressedChecked = False
+
+    def __init__(self, content, type, encoding, mtime, checked):
+        self.content = content
+        self.type = type
+        self.encoding = encoding
+        self.mtime = mtime
+        self.etag = '"%x-%x"' % (int(mtime), len(content))
+        self.checked = checked
+        self.serial = None
+
+
+    def size(self):
+        """
+        Return the number of bytes held for this file.
+        """
+        if self.compressed is None:
+            return len(self.content)
+        return len(self.content) + len(self.compressed)
+
+
+
+class FileCache(object):
+    """
+    L{FileCache} keeps the contents of small files served by L{File} in
+    memory, so that they are sent without opening and reading the file again.
+
+    Give a L{File} one by setting its C{cache} attribute; the L{File}s
+    created for its children share it::
+
+        root = File('/var/www')
+        root.cache = FileCache()
+
+    A cached file is only compared with the filesystem again once
+    C{recheckInterval} seconds have passed; until then, changes to it are
+    not noticed.
+
+    When the L{File} is wrapped in a L{resource.EncodingResourceWrapper}
+    using L{server.GzipEncoderFactory}, the compressed contents of cached
+    files are kept as well, and count towards C{maxBytes}.
+
+    @ivar maxBytes: The maximum total size of the cached files.  When it is
+        reached the least recently used files are discarded.
+    @ivar maxFileSize: Files larger than this are never cached.
+    @ivar recheckInterval: The number of seconds a cached file is served
+        before checking that its size and modification time did not change.
+
+    @ivar hits: The number of times a file was served from the cache.
+    @ivar misses: The number of times a file was looked up and not found in
+        the cache, or found to have changed.
+    @ivar currentBytes: The total size of the cached files.
+
+    @ivar _cache: A C{dict} mapping paths to L{_CachedFile} instances.
+    @ivar _order: A C{deque} of C{(serial, path)} tuples, least recently used
+        first.  Tuples for paths which were used again or removed since are
+        skipped on eviction.
+    @ivar _reactor: An L{IReactorTime} provider used to tell when cached files
+        should be checked again.
+    """
+
+    def __init__(self, maxBytes=2 ** 24, maxFileSize=2 ** 16,
+                 recheckInterval=1, reactor=None):
+        self.maxBytes = maxBytes
+        self.maxFileSize = maxFileSize
+        self.recheckInterval = recheckInterval
+        if reactor is None:
+            from twisted.internet import reactor
+        self._reactor = reactor
+        self.hits = self.misses = self.currentBytes = 0
+        self._cache = {}
+        self._order = deque()
+        self._serial = 0
+
+
+    def _use(self, path, entry):
+        """
+        Mark C{entry}, cached for C{path}, as the most recently used.
+        """
+        self._serial += 1
+        entry.serial = self._serial
+        self._order.append((self._serial, path))
+        if len(self._order) > 2 * len(self._cache) + 16:
+            order = [(e.serial, p) for (p, e) in self._cache.iteritems()]
+            order.sort()
+            self._order = deque(order)
+
+
+    def _remove(self, path):
+        entry = self._cache.pop(path, None)
+        if entry is not None:
+            self.currentBytes -= entry.size()
+
+
+    def _shrink(self, size):
+        """
+        Discard the least recently used files until C{size} more bytes fit.
+        """
+        while self.currentBytes + size > self.maxBytes and self._order:
+            serial, oldPath = self._order.popleft()
+            old = self._cache.get(oldPath)
+            if old is not None and old.serial == serial:
+                self._remove(oldPath)
+
+
+    def _store(self, path, entry):
+        """
+        Cache C{entry} for C{path}, making room for it first.
+        """
+        size = entry.size()
+        self._shrink(size)
+        self._cache[path] = entry
+        self.currentBytes += size
+        self._use(path, entry)
+
+
+    def compressed(self, path, entry, factory):
+        """
+        Return the contents of C{entry}, cached for C{path}, compressed by
+        the L{server.GzipEncoderFactory} C{factory}.  They are compressed
+        the first time they are asked for, and kept.
+        """
+        if entry.compressed is None:
+            entry.compressed = factory.compress(entry.content)
+            if self._cache.get(path) is entry:
+                size = len(entry.compressed)
+                self._shrink(size)
+                self.currentBytes += size
+        return entry.compressed
+
+
+    def _load(self, file, mtime, now):
+        """
+        Read C{file} into a new L{_CachedFile}, or return C{None} if it
+        cannot be read.
+        """
+        try:
+            fileObject = file.openForReading()
+        except IOError:
+            return None
+        try:
+            content = fileObject.read(self.maxFileSize + 1)
+        finally:
+            fileObject.close()
+        if len(content) > self.maxFileSize:
+            return None
+        if file.type is None:
+            type, encoding = getTypeAndEncoding(
+                file.basename(), file.contentTypes, file.contentEncodings,
+                file.defaultType)
+        else:
+            type, encoding = file.type, file.encoding
+        return _CachedFile(content, type, encoding, mtime, now)
+
+
+    def get(self, file):
+        """
+        Return the cached contents of the L{File} C{file}, reading it into
+        the cache if it is a small enough regular file.
+
+        @return: A L{_CachedFile}, or C{None} if C{file} is not cached.
+        """
+        path = file.path
+        now = self._reactor.seconds()
+        entry = self._cache.get(path)
+        if entry is not None and now - entry.checked < self.recheckInterval:
+            self.hits += 1
+            self._use(path, entry)
+            return entry
+
+        try:
+            st = os.stat(path)
+        except OSError:
+            self._remove(path)
+            self.misses += 1
+            return None
+        if entry is not None:
+            if st.st_mtime == entry.mtime and st.st_size == len(entry.content):
+                self.hits += 1
+                entry.checked = now
+                entry.precompressedChecked = False
+                self._use(path, entry)
+                return entry
+            self._remove(path)
+        self.misses += 1
+        if (not stat.S_ISREG(st.st_mode) or st.st_size > self.maxFileSize
+            or st.st_size > self.maxBytes):
+            return None
+        entry = self._load(file, st.st_mtime, now)
+        if entry is not None:
+            self._store(path, entry)
+        return entry
+
+
+
 class File(resource.Resource, styles.Versioned, filepath.FilePath):
     """
     File is a resource that represents a plain non-interpreted file
@@ -164,6 +384,13 @@ class File(resource.Resource, styles.Versioned, filepath.FilePath):
     return the contents of /tmp/foo/bar.html .
 
     @cvar childNotFound: L{Resource} used to render 404 Not Found error pages.
+
+    @ivar cache: A L{FileCache} to serve small files from, or C{None}.
+        Files served from it also get an I{ETag}.
+
+    @ivar _cachedSize: The size of the cached contents a range request is
+        being answered from, which L{getFileSize} returns instead of the size
+        on disk while it is not C{None}.
     """
 
     contentTypes = loadMimeTypes()
@@ -179,6 +406,9 @@ class File(resource.Resource, styles.Versioned, filepath.FilePath):
 
     type = None
 
+    cache = None
+    _cachedSize = None
+
     ### Versioning
 
     persistenceVersion = 6
@@ -320,6 +550,8 @@ class File(resource.Resource, styles.Versioned, filepath.FilePath):
 
     def getFileSize(self):
         """Return file size."""
+        if self._cachedSize is not None:
+            return self._cachedSize
         return self.getsize()
 
 
@@ -592,6 +824,19 @@ class File(resource.Resource, styles.Versioned, filepath.FilePath):
         Begin sending the contents of this L{File} (or a subset of the
         contents, based on the 'range' header) to the given request.
         """
+        factory = self._gzipFactory(request)
+        cached = None
+        if self.cache is not None:
+            cached = self.cache.get(self)
+        if factory is not None and request.getHeader('range') is None:
+            compressed = self._precompressedSibling(cached)
+            if compressed is not None:
+                request.setHeader('vary', 'Accept-Encoding')
+                return compressed.render(request)
+
+        if cached is not None:
+            return self._renderCached(request, cached, factory)
+
         self.restat(False)
 
         if self.type is None:
@@ -631,6 +876,107 @@ class File(resource.Resource, styles.Versioned, filepath.FilePath):
         return server.NOT_DONE_YET
 
 
+    def _gzipFactory(self, request):
+        """
+        Return the factory of the gzip encoder chosen for the response to
+        C{request} by L{resource.EncodingResourceWrapper}, or C{None} if the
+        response will not be compressed with gzip.
+        """
+        encoder = getattr(request, '_encoder', None)
+        if not iweb._IRequestEncoder.providedBy(encoder):
+            return None
+        factory = getattr(encoder, 'factory', None)
+        if getattr(factory, 'encoding', None) != 'gzip':
+            return None
+        return factory
+
+
+    def _precompressedPath(self):
+        """
+        Return the path of a copy of this file compressed with gzip, named
+        like it with C{.gz} appended, if there is one which was modified no
+        earlier than this file, or C{None}.
+        """
+        if self.splitext()[1].lower() in self.contentEncodings:
+            return None
+        sibling = self.siblingExtension('.gz')
+        try:
+            compressedStat = os.stat(sibling.path)
+            originalStat = os.stat(self.path)
+        except OSError:
+            return None
+        if (not stat.S_ISREG(compressedStat.st_mode)
+            or compressedStat.st_mtime < originalStat.st_mtime):
+            return None
+        return sibling.path
+
+
+    def _precompressedSibling(self, cached=None):
+        """
+        Return a L{File} for the copy of this file compressed with gzip found
+        by L{_precompressedPath}, or C{None}.
+
+        @param cached: The L{_CachedFile} for this file, if it is cached.  The
+            copy is then only looked for again once the cache compares this
+            file with the filesystem.
+        """
+        if cached is None:
+            path = self._precompressedPath()
+        else:
+            if not cached.precompressedChecked:
+                cached.precompressed = self._precompressedPath()
+                cached.precompressedChecked = True
+            path = cached.precompressed
+        if path is None:
+            return None
+        return self.createSimilarFile(path)
+
+
+    def _renderCached(self, request, cached, factory=None):
+        """
+        Respond to C{request} with the contents of this file held by
+        L{FileCache}.
+
+        @param cached: The L{_CachedFile} for this file.
+        @param factory: The L{server.GzipEncoderFactory} of the encoder chosen
+            for C{request}, if the response may be compressed.
+        """
+        self.type, self.encoding = cached.type, cached.encoding
+        request.setHeader('accept-ranges', 'bytes')
+        if (factory is not None and cached.encoding is None
+            and request.getHeader('range') is None
+            and factory.shouldCompress(cached.type, len(cached.content))):
+            content = self.cache.compressed(self.path, cached, factory)
+            request.setHeader('vary', 'Accept-Encoding')
+            request.setHeader('content-encoding', factory.encoding)
+            etag = cached.etag[:-1] + '-' + factory.encoding + '"'
+        else:
+            content = cached.content
+            etag = cached.etag
+        if (request.setETag(etag) is http.CACHED or
+            request.setLastModified(cached.mtime) is http.CACHED):
+            return ''
+
+        if request.getHeader('range') is not None:
+            # The ranges are taken from the cached contents, which need not
+            # be the size this file had when it was last stat()ed.
+            self._cachedSize = len(cached.content)
+            try:
+                producer = self.makeProducer(request, StringIO(cached.content))
+            finally:
+                self._cachedSize = None
+            if request.method == 'HEAD':
+                return ''
+            producer.start()
+            return server.NOT_DONE_YET
+
+        self._setContentHeaders(request, len(content))
+        request.setResponseCode(http.OK)
+        if request.method == 'HEAD':
+            return ''
+        return content
+
+
     def redirect(self, request):
         return redirectTo(addSlash(request), request)
 
@@ -674,6 +1020,7 @@ class File(resource.Resource, styles.Versioned, filepath.FilePath):
         f.processors = self.processors
         f.indexNames = self.indexNames[:]
         f.childNotFound = self.childNotFound
+        f.cache = self.cache
         return f
 
 
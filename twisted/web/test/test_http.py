@@ -6,7 +6,7 @@ Test HTTP support.
 """
 
 from urlparse import urlparse, urlunsplit, clear_cache
-import random, urllib, cgi
+import random, urllib, cgi, time
 
 from twisted.python.compat import set
 from twisted.python.failure import Failure
@@ -34,6 +34,31 @@ class DateTimeTest(unittest.TestCase):
             self.assertEquals(time, time2)
 
 
+    def test_currentTimeCached(self):
+        """
+        L{http.datetimeToString} called without a time formats the current
+        time only once per second.
+        """
+        now = [1000000000.25]
+        formatted = []
+        class FakeTime:
+            def time(self):
+                return now[0]
+            def gmtime(self, when):
+                formatted.append(when)
+                return time.gmtime(when)
+        self.patch(http, 'time', FakeTime())
+        self.patch(http, '_currentDateTime', (None, None))
+
+        first = http.datetimeToString()
+        now[0] = 1000000000.75
+        self.assertIdentical(http.datetimeToString(), first)
+        now[0] = 1000000001.0
+        self.assertEqual(
+            http.datetimeToString(), "Sun, 09 Sep 2001 01:46:41 GMT")
+        self.assertEqual(formatted, [1000000000.25, 1000000001.0])
+
+
 class DummyHTTPHandler(http.Request):
 
     def process(self):
@@ -304,6 +329,167 @@ class PersistenceTestCase(unittest.TestCase):
 
 
 
+class PipeliningTests(unittest.TestCase):
+    """
+    Tests for the limit on pipelined requests and the buffering of their
+    responses.
+    """
+    def setUp(self):
+        self.requests = []
+        testcase = self
+        class HoldingRequest(http.Request):
+            def process(self):
+                testcase.requests.append(self)
+        self.transport = StringTransport()
+        self.channel = http.HTTPChannel()
+        self.channel.requestFactory = HoldingRequest
+        self.channel.makeConnection(self.transport)
+
+
+    def test_pauseAtLimit(self):
+        """
+        L{http.HTTPChannel} stops reading from its transport when
+        C{maxPipelinedRequests} requests are waiting for their responses,
+        and resumes once one of them is finished.  Requests already received
+        but not yet parsed are handled after that.
+        """
+        self.channel.maxPipelinedRequests = 2
+        self.channel.dataReceived("GET /a HTTP/1.1\r\n\r\n" * 3)
+        self.assertEqual(len(self.requests), 2)
+        self.assertEqual(self.transport.producerState, 'paused')
+
+        self.requests[0].finish()
+        self.assertEqual(len(self.requests), 3)
+        self.assertEqual(self.transport.producerState, 'paused')
+
+        self.requests[1].finish()
+        self.assertEqual(self.transport.producerState, 'producing')
+
+
+    def test_noLimit(self):
+        """
+        If C{maxPipelinedRequests} is C{None}, the channel never pauses.
+        """
+        self.channel.maxPipelinedRequests = None
+        self.channel.dataReceived("GET /a HTTP/1.1\r\n\r\n" * 50)
+        self.assertEqual(len(self.requests), 50)
+        self.assertEqual(self.transport.producerState, 'producing')
+
+
+    def test_spooledResponse(self):
+        """
+        A queued response larger than C{queuedMemoryLimit} is written to a
+        file, and sent after the responses before it.
+        """
+        self.channel.dataReceived("GET /a HTTP/1.1\r\n\r\n" * 2)
+        first, second = self.requests
+        second.queuedMemoryLimit = 10
+        second.transport.memoryLimit = 10
+        second.write('x' * 100)
+        self.assertNotIdentical(second.transport.file, None)
+        self.assertEqual(self.transport.value(), '')
+
+        first.write('first')
+        first.finish()
+        second.write('y' * 10)
+        second.finish()
+        value = self.transport.value()
+        self.assertTrue(
+            value.index('first') < value.index('x' * 100)
+            < value.index('y' * 10))
+        self.assertIdentical(self.transport.producer, None)
+
+
+
+class QueuedResponseTests(unittest.TestCase):
+    """
+    Tests for L{http._QueuedResponse}.
+    """
+    def test_inMemory(self):
+        """
+        A response up to the memory limit is kept in memory.
+        """
+        response = http._QueuedResponse(10)
+        response.write('hello')
+        response.writeSequence(['wor', 'ld'])
+        self.assertIdentical(response.file, None)
+        self.assertEqual(response.getvalue(), 'helloworld')
+
+
+    def test_drain(self):
+        """
+        L{http._QueuedResponse.drain} writes a spooled response to the
+        consumer as a streaming producer, stops while it is paused, and calls
+        the callback when everything was written.
+        """
+        response = http._QueuedResponse(4)
+        response.chunkSize = 3
+        response.write('hello')
+        response.write('world')
+        consumer = StringTransport()
+        done = []
+        write = consumer.write
+        def pausingWrite(data):
+            write(data)
+            response.pauseProducing()
+        consumer.write = pausingWrite
+        response.drain(consumer, lambda: done.append(True))
+        self.assertEqual(consumer.value(), 'hel')
+        self.assertIdentical(consumer.producer, response)
+        self.assertEqual(done, [])
+
+        consumer.write = write
+        response.write('!')
+        self.assertEqual(consumer.value(), 'hel')
+        response.resumeProducing()
+        self.assertEqual(consumer.value(), 'helloworld!')
+        self.assertEqual(done, [True])
+        self.assertIdentical(consumer.producer, None)
+        self.assertTrue(response.file.closed)
+
+
+    def test_writeAfterStopProducing(self):
+        """
+        Once L{http._QueuedResponse.stopProducing} has been called, as it is
+        when the connection is lost while a spooled response is being sent,
+        its file is closed and anything written to it is discarded.
+        """
+        response = http._QueuedResponse(4)
+        response.chunkSize = 3
+        response.write('hello')
+        consumer = StringTransport()
+        write = consumer.write
+        def pausingWrite(data):
+            write(data)
+            response.pauseProducing()
+        consumer.write = pausingWrite
+        done = []
+        response.drain(consumer, lambda: done.append(True))
+        response.stopProducing()
+        self.assertTrue(response.file.closed)
+        response.write('world')
+        response.resumeProducing()
+        self.assertEqual(consumer.value(), 'hel')
+        self.assertEqual(done, [])
+
+
+    def test_queuedRequestConnectionLost(self):
+        """
+        When the connection is lost, a request which is still queued stops its
+        buffered response, closing the file it was spooled to, and can still
+        write and finish without error.
+        """
+        request = http.Request(DummyChannel(), 1)
+        request.transport = response = http._QueuedResponse(4)
+        request.write('hello')
+        self.assertFalse(response.file.closed)
+        request.connectionLost(Failure(ConnectionLost("Finished")))
+        self.assertTrue(response.stopped)
+        self.assertTrue(response.file.closed)
+        request.write('world')
+        request.finish()
+
+
 class IdentityTransferEncodingTests(TestCase):
     """
     Tests for L{_IdentityTransferDecoder}.
@@ -576,6 +762,136 @@ class ChunkedTransferEncodingTests(unittest.TestCase):
 
 
 
+class BodyCollector(object):
+    """
+    A consumer for request bodies which records what is done to it.
+
+    @ivar events: A C{list} of C{('register', producer, streaming)},
+        C{('write', data)} and C{('unregister',)} tuples.
+    @ivar pauseOnWrite: If true, pause the producer after each write.
+    """
+    pauseOnWrite = False
+
+    def __init__(self):
+        self.events = []
+        self.producer = None
+
+
+    def registerProducer(self, producer, streaming):
+        self.producer = producer
+        self.events.append(('register', producer, streaming))
+
+
+    def write(self, data):
+        self.events.append(('write', data))
+        if self.pauseOnWrite:
+            self.producer.pauseProducing()
+
+
+    def unregisterProducer(self):
+        self.producer = None
+        self.events.append(('unregister',))
+
+
+
+class StreamingBodyTests(unittest.TestCase):
+    """
+    Tests for L{http.Request.getBodyConsumer}.
+    """
+    def setUp(self):
+        self.collector = BodyCollector()
+        self.processed = []
+        self.requestLines = []
+        testcase = self
+        class StreamingRequest(http.Request):
+            def getBodyConsumer(self):
+                testcase.requestLines.append(
+                    (self.method, self.path, self.args))
+                return testcase.collector
+            def process(self):
+                testcase.processed.append(
+                    (self.content.read(), list(testcase.collector.events)))
+                self.finish()
+        self.channel = http.HTTPChannel()
+        self.channel.requestFactory = StreamingRequest
+        self.channel.makeConnection(StringTransport())
+
+
+    def test_identityBody(self):
+        """
+        A body with a I{Content-Length} is written to the consumer returned
+        by L{http.Request.getBodyConsumer} as it arrives.  The channel is
+        registered as a streaming producer for it, and unregistered before
+        the request is processed with an empty C{content}.
+        """
+        self.channel.dataReceived(
+            "POST /upload?x=1 HTTP/1.1\r\n"
+            "Content-Length: 10\r\n"
+            "\r\n"
+            "hello")
+        self.assertEqual(self.requestLines, [('POST', '/upload', {'x': ['1']})])
+        self.assertEqual(
+            self.collector.events,
+            [('register', self.channel, True), ('write', 'hello')])
+        self.assertEqual(self.processed, [])
+
+        self.channel.dataReceived("world")
+        self.assertEqual(
+            self.processed,
+            [('', [('register', self.channel, True), ('write', 'hello'),
+                   ('write', 'world'), ('unregister',)])])
+
+
+    def test_chunkedBody(self):
+        """
+        The decoded chunks of a chunked body are written to the consumer.
+        """
+        self.channel.dataReceived(
+            "POST / HTTP/1.1\r\n"
+            "Transfer-Encoding: chunked\r\n"
+            "\r\n"
+            "5\r\nhello\r\n5\r\nworld\r\n0\r\n\r\n")
+        [(content, events)] = self.processed
+        self.assertEqual(content, '')
+        self.assertEqual(
+            [data for (kind, data) in events[1:-1]], ['hello', 'world'])
+        self.assertEqual(events[-1], ('unregister',))
+
+
+    def test_pause(self):
+        """
+        While the consumer has paused the channel, no more of the body is
+        written to it; it gets the rest when it resumes the channel.
+        """
+        self.collector.pauseOnWrite = True
+        self.channel.dataReceived(
+            "POST / HTTP/1.1\r\n"
+            "Content-Length: 10\r\n"
+            "\r\n"
+            "hello")
+        self.channel.dataReceived("world")
+        self.assertEqual(
+            self.collector.events[1:], [('write', 'hello')])
+
+        self.collector.pauseOnWrite = False
+        self.channel.resumeProducing()
+        self.assertEqual(
+            self.collector.events[1:],
+            [('write', 'hello'), ('write', 'world'), ('unregister',)])
+        self.assertEqual(len(self.processed), 1)
+
+
+    def test_noBody(self):
+        """
+        L{http.Request.getBodyConsumer} is not called for requests without a
+        body.
+        """
+        self.channel.dataReceived("GET / HTTP/1.1\r\n\r\n")
+        self.assertEqual(self.requestLines, [])
+        self.assertEqual(self.processed, [('', [])])
+
+
+
 class ChunkingTestCase(unittest.TestCase):
 
     strings = ["abcv", "", "fdfsd423", "Ffasfas\r\n",
@@ -734,6 +1050,166 @@ class ParsingTestCase(unittest.TestCase):
             '\r\n')
 
 
+    def deliverAtOnce(self, data, requestClass):
+        """
+        Give C{data} to a new L{HTTPChannel} in a single C{dataReceived}
+        call, so that whole header blocks are parsed by
+        L{HTTPChannel.linesReceived}.
+
+        @return: The channel.
+        """
+        channel = http.HTTPChannel()
+        channel.requestFactory = requestClass
+        channel.makeConnection(StringTransport())
+        channel.dataReceived(data)
+        return channel
+
+
+    def test_headerBlock(self):
+        """
+        A header block received in one piece is parsed into the request's
+        C{requestHeaders}, with repeated headers kept in order and
+        continuation lines joined to the header they continue.
+        """
+        processed = []
+        class MyRequest(http.Request):
+            def process(self):
+                processed.append(self)
+                self.finish()
+
+        self.deliverAtOnce(
+            "GET /foo HTTP/1.0\r\n"
+            "Foo: bar\r\n"
+            "baz: Quux\r\n"
+            "Long: one\r\n"
+            " two\r\n"
+            "baz: quux\r\n"
+            "\r\n", MyRequest)
+        [request] = processed
+        self.assertEqual(request.method, 'GET')
+        self.assertEqual(request.uri, '/foo')
+        self.assertEqual(request.clientproto, 'HTTP/1.0')
+        self.assertEqual(
+            request.requestHeaders.getRawHeaders('foo'), ['bar'])
+        self.assertEqual(
+            request.requestHeaders.getRawHeaders('baz'), ['Quux', 'quux'])
+        self.assertEqual(
+            request.requestHeaders.getRawHeaders('long'), ['one\n two'])
+
+
+    def test_headerBlockPipelined(self):
+        """
+        Pipelined requests received in one piece, including their bodies,
+        are all handled in order.
+        """
+        processed = []
+        class MyRequest(http.Request):
+            def process(self):
+                processed.append((self.uri, self.content.read()))
+                self.finish()
+
+        channel = self.deliverAtOnce(
+            "POST /a HTTP/1.1\r\n"
+            "Content-Length: 5\r\n"
+            "\r\n"
+            "hello"
+            "GET /b HTTP/1.1\r\n"
+            "\r\n"
+            "POST /c HTTP/1.1\r\n"
+            "Transfer-Encoding: chunked\r\n"
+            "\r\n"
+            "3\r\nbye\r\n0\r\n\r\n", MyRequest)
+        self.assertEqual(
+            processed, [('/a', 'hello'), ('/b', ''), ('/c', 'bye')])
+        self.assertFalse(channel.transport.disconnecting)
+
+
+    def test_headerBlockOverriddenHeaderReceived(self):
+        """
+        If L{HTTPChannel.headerReceived} or L{HTTPChannel.lineReceived} is
+        overridden, header blocks received in one piece are still parsed a
+        line at a time by calling them.
+        """
+        processed = []
+        class MyRequest(http.Request):
+            def process(self):
+                processed.append(self.uri)
+                self.finish()
+
+        received = []
+        class HeaderChannel(http.HTTPChannel):
+            def headerReceived(self, line):
+                received.append(line)
+                http.HTTPChannel.headerReceived(self, line)
+
+        class LineChannel(http.HTTPChannel):
+            def lineReceived(self, line):
+                received.append(line)
+                http.HTTPChannel.lineReceived(self, line)
+
+        data = (
+            "GET /a HTTP/1.1\r\n"
+            "Foo: bar\r\n"
+            "\r\n"
+            "GET /b HTTP/1.1\r\n"
+            "\r\n")
+        for channelClass, lines in [
+            (HeaderChannel, ["Foo: bar"]),
+            (LineChannel, ["GET /a HTTP/1.1", "Foo: bar", "",
+                           "GET /b HTTP/1.1", ""])]:
+            del processed[:], received[:]
+            channel = channelClass()
+            channel.requestFactory = MyRequest
+            channel.makeConnection(StringTransport())
+            channel.dataReceived(data)
+            self.assertEqual(processed, ['/a', '/b'])
+            self.assertEqual(received, lines)
+
+
+    def test_headerBlockTooManyHeaders(self):
+        """
+        The C{maxHeaders} limit also applies to header blocks received in
+        one piece.
+        """
+        processed = []
+        class MyRequest(http.Request):
+            def process(self):
+                processed.append(self)
+
+        self.patch(http.HTTPChannel, 'maxHeaders', 2)
+        channel = self.deliverAtOnce(
+            "GET / HTTP/1.0\r\n"
+            "A: 1\r\n"
+            "B: 2\r\n"
+            "C: 3\r\n"
+            "\r\n", MyRequest)
+        self.assertEqual(processed, [])
+        self.assertEqual(
+            channel.transport.value(), "HTTP/1.1 400 Bad Request\r\n\r\n")
+
+
+    def test_headerBlockSplit(self):
+        """
+        A header block split across reads is parsed just as one received in
+        a single piece.
+        """
+        processed = []
+        class MyRequest(http.Request):
+            def process(self):
+                processed.append(self)
+                self.finish()
+
+        channel = http.HTTPChannel()
+        channel.requestFactory = MyRequest
+        channel.makeConnection(StringTransport())
+        channel.dataReceived("GET / HTTP/1.1\r\nFoo: b")
+        channel.dataReceived("ar\r\nBaz: quux\r\n\r\nGET /x HTTP/1.1\r\n\r\n")
+        [first, second] = processed
+        self.assertEqual(first.getHeader('foo'), 'bar')
+        self.assertEqual(first.getHeader('baz'), 'quux')
+        self.assertEqual(second.uri, '/x')
+
+
     def testCookies(self):
         """
         Test cookies parsing and reading.
@@ -1059,6 +1535,74 @@ class RequestTests(unittest.TestCase, ResponseTestMixin):
         self.assertEquals(req.getHeader("test"), "lemur")
 
 
+    def _recordingRequest(self):
+        """
+        Create a L{http.Request} for an I{HTTP/1.1} GET whose transport
+        records each C{write} and C{writeSequence} call in a C{calls} list.
+        """
+        channel = DummyChannel()
+        calls = channel.transport.calls = []
+        channel.transport.write = lambda data: calls.append(data)
+        channel.transport.writeSequence = lambda data: calls.append(
+            ''.join(data))
+        req = http.Request(channel, None)
+        req.method = 'GET'
+        req.clientproto = 'HTTP/1.1'
+        return req
+
+
+    def test_headersWrittenWithFirstChunk(self):
+        """
+        L{http.Request.write} sends the status line, the headers and the
+        first chunk of the body in a single C{writeSequence} call.
+        """
+        req = self._recordingRequest()
+        req.setHeader('content-length', '6')
+        req.addCookie('foo', 'bar')
+        req.write('abc')
+        req.write('def')
+        self.assertEqual(
+            req.transport.calls,
+            ['HTTP/1.1 200 OK\r\n'
+             'Content-Length: 6\r\n'
+             'Set-Cookie: foo=bar\r\n'
+             '\r\n'
+             'abc',
+             'def'])
+
+
+    def test_chunkedFirstChunk(self):
+        """
+        If the response is chunked, the first chunk of the body written with
+        the headers is encoded as a chunk.
+        """
+        req = self._recordingRequest()
+        req.write('abc')
+        self.assertEqual(
+            req.transport.calls,
+            ['HTTP/1.1 200 OK\r\n'
+             'Transfer-Encoding: chunked\r\n'
+             '\r\n'
+             '3\r\nabc\r\n'])
+
+
+    def test_statusLineMessage(self):
+        """
+        The status line sent by L{http.Request.write} uses the message given
+        to L{http.Request.setResponseCode}, even after a status line for the
+        same code has been sent with another message.
+        """
+        req = self._recordingRequest()
+        req.setResponseCode(404)
+        req.write('')
+        req = self._recordingRequest()
+        req.setResponseCode(404, 'Gone Fishing')
+        req.write('')
+        self.assertEqual(
+            req.transport.calls[0].splitlines()[0],
+            'HTTP/1.1 404 Gone Fishing')
+
+
     def test_getHeaderReceivedMultiples(self):
         """
         When there are multiple values for a single request header,
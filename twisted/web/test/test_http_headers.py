@@ -136,6 +136,37 @@ class HeadersTests(TestCase):
                           "WWW-Authenticate")
 
 
+    def test_canonicalNamesRemembered(self):
+        """
+        L{Headers._canonicalNameCaps} remembers the canonical names it
+        computes, up to C{Headers._maxCanonicalNames} of them.
+        """
+        self.patch(Headers, '_canonicalNames', {})
+        self.patch(Headers, '_maxCanonicalNames', 2)
+        h = Headers()
+        for name in ["first-name", "second-name", "third-name"]:
+            h._canonicalNameCaps(name)
+        self.assertEqual(
+            Headers._canonicalNames,
+            {"first-name": "First-Name", "second-name": "Second-Name"})
+        self.assertEqual(h._canonicalNameCaps("third-name"), "Third-Name")
+
+
+    def test_canonicalNamesPerClass(self):
+        """
+        A subclass of L{Headers} with different C{_caseMappings} does not
+        share the canonical names remembered for L{Headers}.
+        """
+        self.patch(Headers, '_canonicalNames', {})
+        class MappedHeaders(Headers):
+            _caseMappings = {'x-mapped': 'X-MAPPED'}
+        self.assertEqual(Headers()._canonicalNameCaps("x-mapped"), "X-Mapped")
+        self.assertEqual(
+            MappedHeaders()._canonicalNameCaps("x-mapped"), "X-MAPPED")
+        self.assertEqual(Headers()._canonicalNameCaps("x-mapped"), "X-Mapped")
+        self.assertEqual(Headers._canonicalNames, {"x-mapped": "X-Mapped"})
+
+
     def test_getAllRawHeaders(self):
         """
         L{Headers.getAllRawHeaders} returns an iterable of (k, v) pairs, where
@@ -9,6 +9,7 @@ from twisted.trial.unittest import TestCase
 from twisted.web import error
 from twisted.web.http import NOT_FOUND, FORBIDDEN
 from twisted.web.resource import ErrorPage, NoResource, ForbiddenResource
+from twisted.web.resource import Resource, EncodingResourceWrapper
 from twisted.web.test.test_web import DummyRequest
 
 
@@ -142,3 +143,57 @@ class DeprecatedErrorPageTests(ErrorPageTests):
         """
         ErrorPageTests.test_forbiddenResourceRendering(self)
         self._assertWarning('ForbiddenResource', self.forbiddenResource)
+
+
+
+class DummyEncoderFactory(object):
+    """
+    An encoder factory which returns C{encoder} for every request.
+    """
+    def __init__(self, encoder):
+        self.encoder = encoder
+
+
+    def encoderForRequest(self, request):
+        return self.encoder
+
+
+
+class EncodingResourceWrapperTests(TestCase):
+    """
+    Tests for L{EncodingResourceWrapper}.
+    """
+    def setUp(self):
+        self.root = Resource()
+        self.child = Resource()
+        self.child.isLeaf = True
+        self.child.render = lambda request: 'child'
+        self.root.putChild('child', self.child)
+
+
+    def test_render(self):
+        """
+        L{EncodingResourceWrapper.render} gives the request the encoder of
+        the first factory which has one for it, and renders the wrapped
+        resource.
+        """
+        encoder = object()
+        wrapper = EncodingResourceWrapper(
+            self.child, [DummyEncoderFactory(None), DummyEncoderFactory(encoder)])
+        request = DummyRequest([''])
+        self.assertEqual(wrapper.render(request), 'child')
+        self.assertIdentical(request._encoder, encoder)
+
+
+    def test_children(self):
+        """
+        The children of the wrapped resource are wrapped too, with the same
+        encoder factories.
+        """
+        factories = [DummyEncoderFactory(None)]
+        wrapper = EncodingResourceWrapper(self.root, factories)
+        child = wrapper.getChildWithDefault('child', DummyRequest(['child']))
+        self.assertIsInstance(child, EncodingResourceWrapper)
+        self.assertIdentical(child.original, self.child)
+        self.assertIdentical(child._encoders, factories)
+        self.assertTrue(child.isLeaf)
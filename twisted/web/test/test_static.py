@@ -6,17 +6,19 @@
 Tests for L{twisted.web.static}.
 """
 
-import os, re, StringIO
+import os, re, StringIO, zlib
 
+from zope.interface import implements
 from zope.interface.verify import verifyObject
 
 from twisted.internet import abstract, interfaces
+from twisted.internet.task import Clock
 from twisted.python.compat import set
 from twisted.python.runtime import platform
 from twisted.python.filepath import FilePath
 from twisted.python import log
 from twisted.trial.unittest import TestCase
-from twisted.web import static, http, script, resource
+from twisted.web import static, http, script, resource, server, iweb
 from twisted.web.test.test_web import DummyRequest
 from twisted.web.test._util import _render
 
@@ -267,6 +269,377 @@ class StaticFileTests(TestCase):
 
 
 
+class FileCacheTests(TestCase):
+    """
+    Tests for L{static.FileCache} and its use by L{static.File}.
+    """
+    def setUp(self):
+        self.clock = Clock()
+        self.cache = static.FileCache(
+            maxBytes=6, maxFileSize=4, recheckInterval=10, reactor=self.clock)
+        self.base = FilePath(self.mktemp())
+        self.base.makedirs()
+        self.root = static.File(self.base.path)
+        self.root.cache = self.cache
+
+
+    def _get(self, name, headers=None):
+        """
+        Render the child C{name} of C{self.root}, returning the request once
+        the response is complete.
+        """
+        request = DummyRequest([name])
+        if headers is not None:
+            request.headers.update(headers)
+        child = resource.getChildForRequest(self.root, request)
+        d = _render(child, request)
+        d.addCallback(lambda ignored: request)
+        return d
+
+
+    def test_cachedResponse(self):
+        """
+        A small file is read into the cache the first time it is served, and
+        served from memory after that, with its headers.
+        """
+        self.base.child('foo.txt').setContent('baz')
+        d = self._get('foo.txt')
+        def cbFirst(request):
+            self.assertEqual(''.join(request.written), 'baz')
+            self.assertEqual((self.cache.hits, self.cache.misses), (0, 1))
+            self.assertEqual(self.cache.currentBytes, 3)
+            # The cached contents are served while the file is not checked
+            # again.
+            self.base.child('foo.txt').setContent('quux')
+            return self._get('foo.txt')
+        def cbSecond(request):
+            self.assertEqual(''.join(request.written), 'baz')
+            self.assertEqual(request.responseCode, http.OK)
+            self.assertEqual(request.outgoingHeaders['content-length'], '3')
+            self.assertEqual(
+                request.outgoingHeaders['content-type'], 'text/plain')
+            self.assertEqual(
+                request.outgoingHeaders['accept-ranges'], 'bytes')
+            self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+        d.addCallback(cbFirst)
+        d.addCallback(cbSecond)
+        return d
+
+
+    def test_recheck(self):
+        """
+        Once C{recheckInterval} seconds have passed, a cached file which
+        changed on disk is read again.
+        """
+        self.base.child('foo.txt').setContent('baz')
+        d = self._get('foo.txt')
+        def cbFirst(request):
+            self.base.child('foo.txt').setContent('quux')
+            self.clock.advance(10)
+            return self._get('foo.txt')
+        def cbSecond(request):
+            self.assertEqual(''.join(request.written), 'quux')
+            self.assertEqual(self.cache.currentBytes, 4)
+        d.addCallback(cbFirst)
+        d.addCallback(cbSecond)
+        return d
+
+
+    def test_unchanged(self):
+        """
+        A cached file which is checked again and did not change stays cached,
+        and counts as a hit.
+        """
+        self.base.child('foo.txt').setContent('baz')
+        file = self.root.getChild('foo.txt', None)
+        entry = self.cache.get(file)
+        self.clock.advance(10)
+        self.assertIdentical(self.cache.get(file), entry)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+
+    def test_removedFile(self):
+        """
+        A cached file which was removed is dropped from the cache when it is
+        checked again, and a not found response is sent.
+        """
+        self.base.child('foo.txt').setContent('baz')
+        d = self._get('foo.txt')
+        def cbFirst(request):
+            self.clock.advance(10)
+            file = self.root.getChild('foo.txt', None)
+            self.base.child('foo.txt').remove()
+            request = DummyRequest(['foo.txt'])
+            return _render(file, request).addCallback(lambda ign: request)
+        def cbSecond(request):
+            self.assertEqual(request.responseCode, 404)
+            self.assertEqual(self.cache.currentBytes, 0)
+        d.addCallback(cbFirst)
+        d.addCallback(cbSecond)
+        return d
+
+
+    def test_largeFile(self):
+        """
+        Files larger than C{maxFileSize} are served from the filesystem and
+        not cached.
+        """
+        self.base.child('foo.txt').setContent('hello')
+        d = self._get('foo.txt')
+        def cbRendered(request):
+            self.assertEqual(''.join(request.written), 'hello')
+            self.assertEqual(self.cache.currentBytes, 0)
+        d.addCallback(cbRendered)
+        return d
+
+
+    def test_directory(self):
+        """
+        Directories are not cached.
+        """
+        self.assertIdentical(self.cache.get(self.root), None)
+
+
+    def test_leastRecentlyUsed(self):
+        """
+        When the cached files would exceed C{maxBytes}, the least recently
+        used ones are discarded.
+        """
+        files = {}
+        for name in 'abc':
+            self.base.child(name).setContent('xyz')
+            files[name] = self.root.getChild(name, None)
+        self.cache.get(files['a'])
+        self.cache.get(files['b'])
+        self.cache.get(files['a'])
+        self.cache.get(files['c'])
+        self.assertEqual(
+            sorted(self.cache._cache),
+            [files['a'].path, files['c'].path])
+        self.assertEqual(self.cache.currentBytes, 6)
+
+
+    def test_range(self):
+        """
+        Range requests for cached files are served from memory.
+        """
+        self.base.child('foo.txt').setContent('abcd')
+        d = self._get('foo.txt')
+        def cbFirst(request):
+            self.base.child('foo.txt').setContent('wxyz')
+            return self._get('foo.txt', {'range': 'bytes=1-2'})
+        def cbSecond(request):
+            self.assertEqual(''.join(request.written), 'bc')
+            self.assertEqual(request.responseCode, http.PARTIAL_CONTENT)
+            self.assertEqual(
+                request.outgoingHeaders['content-range'], 'bytes 1-2/4')
+        d.addCallback(cbFirst)
+        d.addCallback(cbSecond)
+        return d
+
+
+    def test_rangeOfChangedFile(self):
+        """
+        Range requests for a cached file whose size on disk has changed since
+        it was cached are answered from the size of the cached contents.
+        """
+        self.base.child('foo.txt').setContent('abc')
+        d = self._get('foo.txt')
+        def cbFirst(request):
+            self.base.child('foo.txt').setContent('wxyz')
+            return self._get('foo.txt', {'range': 'bytes=1-'})
+        def cbSecond(request):
+            self.assertEqual(''.join(request.written), 'bc')
+            self.assertEqual(request.responseCode, http.PARTIAL_CONTENT)
+            self.assertEqual(
+                request.outgoingHeaders['content-range'], 'bytes 1-2/3')
+            self.assertEqual(request.outgoingHeaders['content-length'], '2')
+        d.addCallback(cbFirst)
+        d.addCallback(cbSecond)
+        return d
+
+
+    def test_etag(self):
+        """
+        The entity tag of a cached file is derived from its modification time
+        and size.
+        """
+        self.base.child('foo.txt').setContent('baz')
+        file = self.root.getChild('foo.txt', None)
+        entry = self.cache.get(file)
+        self.assertEqual(
+            entry.etag, '"%x-3"' % (int(self.base.child('foo.txt').getmtime()),))
+
+
+
+class CompressedFileTests(TestCase):
+    """
+    Tests for L{static.File} responding to requests which may be compressed
+    by L{server.GzipEncoderFactory}.
+    """
+    text = 'body { margin: 0 }\n' * 100
+
+    def setUp(self):
+        self.factory = server.GzipEncoderFactory()
+        self.base = FilePath(self.mktemp())
+        self.base.makedirs()
+        self.base.child('style.css').setContent(self.text)
+        self.root = static.File(self.base.path)
+
+
+    def _get(self, name, headers=None):
+        """
+        Render the child C{name} of C{self.root} for a request accepting
+        gzip, returning the request once the response is complete.
+        """
+        request = DummyRequest([name])
+        if headers is not None:
+            request.headers.update(headers)
+        request._encoder = server._GzipEncoder(self.factory, request)
+        child = resource.getChildForRequest(self.root, request)
+        d = _render(child, request)
+        d.addCallback(lambda ignored: request)
+        return d
+
+
+    def test_precompressedSibling(self):
+        """
+        A I{.gz} file next to the requested one, which is at least as recent,
+        is served instead of it with a I{Content-Encoding}.
+        """
+        compressed = self.base.child('style.css.gz')
+        compressed.setContent('compressed')
+        os.utime(self.base.child('style.css').path, (1000, 1000))
+        os.utime(compressed.path, (1000, 1000))
+        d = self._get('style.css')
+        def cbRendered(request):
+            self.assertEqual(''.join(request.written), 'compressed')
+            self.assertEqual(
+                request.outgoingHeaders['content-type'], 'text/css')
+            self.assertEqual(
+                request.outgoingHeaders['content-encoding'], 'gzip')
+            self.assertEqual(
+                request.outgoingHeaders['vary'], 'Accept-Encoding')
+        d.addCallback(cbRendered)
+        return d
+
+
+    def test_stalePrecompressedSibling(self):
+        """
+        A I{.gz} file older than the requested one is ignored.
+        """
+        compressed = self.base.child('style.css.gz')
+        compressed.setContent('compressed')
+        os.utime(compressed.path, (0, 0))
+        d = self._get('style.css')
+        def cbRendered(request):
+            self.assertEqual(''.join(request.written), self.text)
+        d.addCallback(cbRendered)
+        return d
+
+
+    def test_rangeNotPrecompressed(self):
+        """
+        Range requests are answered from the uncompressed file.
+        """
+        self.base.child('style.css.gz').setContent('compressed')
+        d = self._get('style.css', {'range': 'bytes=0-3'})
+        def cbRendered(request):
+            self.assertEqual(''.join(request.written), 'body')
+        d.addCallback(cbRendered)
+        return d
+
+
+    def test_cachedCompressed(self):
+        """
+        The compressed contents of a cached file are kept in the cache, and
+        served with their length and an entity tag of their own.
+        """
+        cache = static.FileCache()
+        self.root.cache = cache
+        d = self._get('style.css')
+        def cbRendered(request):
+            body = ''.join(request.written)
+            self.assertEqual(zlib.decompress(body, 16 + zlib.MAX_WBITS),
+                             self.text)
+            self.assertEqual(
+                request.outgoingHeaders['content-encoding'], 'gzip')
+            self.assertEqual(
+                request.outgoingHeaders['content-length'], str(len(body)))
+            [entry] = cache._cache.values()
+            self.assertEqual(entry.compressed, body)
+            self.assertEqual(cache.currentBytes, len(self.text) + len(body))
+        d.addCallback(cbRendered)
+        return d
+
+
+    def test_cachedPrecompressedLookup(self):
+        """
+        For a cached file, the I{.gz} file next to it is only looked for again
+        once the cache compares the file with the filesystem.
+        """
+        clock = Clock()
+        self.root.cache = static.FileCache(reactor=clock)
+        os.utime(self.base.child('style.css').path, (1000, 1000))
+        d = self._get('style.css')
+        def cbFirst(request):
+            self.assertEqual(
+                zlib.decompress(''.join(request.written), 16 + zlib.MAX_WBITS),
+                self.text)
+            self.base.child('style.css.gz').setContent('compressed')
+            return self._get('style.css')
+        def cbSecond(request):
+            self.assertNotEqual(''.join(request.written), 'compressed')
+            clock.advance(self.root.cache.recheckInterval)
+            return self._get('style.css')
+        def cbRechecked(request):
+            self.assertEqual(''.join(request.written), 'compressed')
+        d.addCallback(cbFirst)
+        d.addCallback(cbSecond)
+        d.addCallback(cbRechecked)
+        return d
+
+
+    def test_encoderInterface(self):
+        """
+        Any L{iweb._IRequestEncoder} whose factory compresses with gzip gets
+        the I{.gz} file next to the requested one.
+        """
+        class Encoder(object):
+            implements(iweb._IRequestEncoder)
+            def __init__(self, factory):
+                self.factory = factory
+            def encode(self, data):
+                return data
+            def finish(self):
+                return ''
+        self.base.child('style.css.gz').setContent('compressed')
+        request = DummyRequest(['style.css'])
+        request._encoder = Encoder(self.factory)
+        child = resource.getChildForRequest(self.root, request)
+        d = _render(child, request)
+        def cbRendered(ignored):
+            self.assertEqual(''.join(request.written), 'compressed')
+        d.addCallback(cbRendered)
+        return d
+
+
+    def test_cachedIncompressible(self):
+        """
+        Cached files of types which are not worth compressing are served as
+        they are.
+        """
+        self.base.child('image.png').setContent(self.text)
+        self.root.cache = static.FileCache()
+        d = self._get('image.png')
+        def cbRendered(request):
+            self.assertEqual(''.join(request.written), self.text)
+            self.assertNotIn('content-encoding', request.outgoingHeaders)
+        d.addCallback(cbRendered)
+        return d
+
+
+
 class StaticMakeProducerTests(TestCase):
     """
     Tests for L{File.makeProducer}.
@@ -5,6 +5,7 @@
 Tests for various parts of L{twisted.web}.
 """
 
+import zlib
 from cStringIO import StringIO
 
 from zope.interface import implements
@@ -18,6 +19,7 @@ from twisted.web import server, resource, util
 from twisted.internet import defer, interfaces, error, task
 from twisted.web import iweb, http, http_headers
 from twisted.python import log
+from twisted.test.proto_helpers import StringTransport
 
 
 class DummyRequest:
@@ -368,6 +370,211 @@ class SessionTest(unittest.TestCase):
         self.assertEqual(len(warnings), 1)
 
 
+class MemorySessionStoreTests(unittest.TestCase):
+    """
+    Tests for L{server.MemorySessionStore}.
+    """
+    def setUp(self):
+        self.clock = task.Clock()
+        self.site = server.Site(resource.Resource())
+        self.store = self.createStore()
+        self.site.sessions = self.store
+        self.site.sessionFactory = self.sessionFactory
+
+
+    def createStore(self, **kw):
+        return server.MemorySessionStore(self.clock, **kw)
+
+
+    def sessionFactory(self, site, uid, reactor=None):
+        return server.Session(site, uid, self.clock)
+
+
+    def test_interface(self):
+        """
+        L{server.MemorySessionStore} provides L{iweb.ISessionStore}.
+        """
+        self.assertTrue(verifyObject(iweb.ISessionStore, self.store))
+
+
+    def test_makeSession(self):
+        """
+        L{server.Site.makeSession} adds the new session to the store, and
+        leaves expiring it to the store: there is one timer, however many
+        sessions there are.
+        """
+        sessions = [self.site.makeSession() for i in range(10)]
+        self.assertEqual(len(self.store), 10)
+        for session in sessions:
+            self.assertIn(session.uid, self.store)
+            self.assertIdentical(self.site.getSession(session.uid), session)
+            self.assertIdentical(session._expireCall, None)
+        self.assertEqual(len(self.clock.calls), 1)
+        self.assertRaises(KeyError, self.site.getSession, 'unknown')
+
+
+    def test_expiry(self):
+        """
+        Sessions which were not used for their C{sessionTimeout} are expired
+        by the next sweep, and the expiry callbacks are called.  Once the
+        store is empty, no call is left pending.
+        """
+        expired = []
+        session = self.site.makeSession()
+        session.notifyOnExpire(lambda: expired.append(session.uid))
+        self.clock.advance(session.sessionTimeout - 1)
+        self.store.sweep()
+        self.assertIn(session.uid, self.store)
+
+        self.clock.advance(1)
+        self.store.sweep()
+        self.assertNotIn(session.uid, self.store)
+        self.assertEqual(expired, [session.uid])
+        self.assertEqual(self.clock.calls, [])
+
+
+    def test_periodicSweep(self):
+        """
+        The store checks for expired sessions every C{sweepInterval}
+        seconds.
+        """
+        self.store.sweepInterval = 100
+        session = self.site.makeSession()
+        for i in range(session.sessionTimeout // 100):
+            self.clock.advance(100)
+        self.assertNotIn(session.uid, self.store)
+
+
+    def test_touch(self):
+        """
+        A session used after it was created expires C{sessionTimeout}
+        seconds after its last use.
+        """
+        old = self.site.makeSession()
+        session = self.site.makeSession()
+        self.clock.advance(session.sessionTimeout - 1)
+        session.touch()
+        self.clock.advance(1)
+        self.store.sweep()
+        self.assertNotIn(old.uid, self.store)
+        self.assertIn(session.uid, self.store)
+        self.clock.advance(session.sessionTimeout - 1)
+        self.store.sweep()
+        self.assertNotIn(session.uid, self.store)
+
+
+    def test_touchCompactsOrder(self):
+        """
+        Using a session many times does not grow the store's index without
+        bound.
+        """
+        session = self.site.makeSession()
+        for i in range(100):
+            self.clock.advance(1)
+            session.touch()
+        self.assertTrue(len(self.store._order) <= 2 * 1 + 16)
+
+
+    def test_maxSessions(self):
+        """
+        When a new session would exceed C{maxSessions}, the least recently
+        used session is expired.
+        """
+        self.store.maxSessions = 2
+        first = self.site.makeSession()
+        self.clock.advance(1)
+        second = self.site.makeSession()
+        self.clock.advance(1)
+        first.touch()
+        third = self.site.makeSession()
+        self.assertEqual(
+            sorted([first.uid, third.uid]),
+            sorted([uid for uid in first.uid, second.uid, third.uid
+                    if uid in self.store]))
+
+
+    def test_close(self):
+        """
+        L{server.MemorySessionStore.close} cancels the pending sweep.
+        """
+        self.site.makeSession()
+        self.store.close()
+        self.assertEqual(self.clock.calls, [])
+
+
+
+class DBMSessionStoreTests(MemorySessionStoreTests):
+    """
+    Tests for L{server.DBMSessionStore}.
+    """
+    def setUp(self):
+        self.path = self.mktemp()
+        MemorySessionStoreTests.setUp(self)
+        self.addCleanup(self.store._db.close)
+
+
+    def createStore(self, **kw):
+        return server.DBMSessionStore(self.site, self.path, self.clock, **kw)
+
+
+    def reopen(self):
+        """
+        Close the store and open a new one on the same file.
+        """
+        self.store.close()
+        self.store = self.createStore()
+        self.site.sessions = self.store
+        self.addCleanup(self.store.close)
+
+
+    def test_interface(self):
+        """
+        L{server.DBMSessionStore} provides L{iweb.ISessionStore}.
+        """
+        self.assertTrue(verifyObject(iweb.ISessionStore, self.store))
+
+
+    def test_reopen(self):
+        """
+        Sessions are recreated, with their data and last use time, by a store
+        opened on the same file.
+        """
+        session = self.site.makeSession()
+        session.sessionNamespaces['cart'] = ['book']
+        self.clock.advance(10)
+        session.touch()
+        self.reopen()
+        restored = self.site.getSession(session.uid)
+        self.assertNotIdentical(restored, session)
+        self.assertEqual(restored.sessionNamespaces, {'cart': ['book']})
+        self.assertEqual(restored.lastModified, 10)
+        self.assertEqual(self.store._access[session.uid], 10)
+
+
+    def test_expiredNotRestored(self):
+        """
+        Sessions which expired while the store was closed are removed from
+        the file instead of being restored.
+        """
+        session = self.site.makeSession()
+        self.store.close()
+        self.clock.advance(session.sessionTimeout)
+        self.store = self.createStore()
+        self.addCleanup(self.store.close)
+        self.assertNotIn(session.uid, self.store)
+        self.assertFalse(self.store._db.has_key(session.uid))
+
+
+    def test_expiredRemoved(self):
+        """
+        Expired sessions are removed from the file.
+        """
+        session = self.site.makeSession()
+        self.clock.advance(session.sessionTimeout)
+        self.store.sweep()
+        self.assertFalse(self.store._db.has_key(session.uid))
+
+
 # Conditional requests:
 # If-None-Match, If-Modified-Since
 
@@ -647,6 +854,251 @@ class RequestTests(unittest.TestCase):
 
 
 
+class StreamingResource(resource.Resource):
+    """
+    A resource which consumes request bodies as they arrive, by collecting
+    them in a list.
+    """
+    implements(iweb.IStreamingRequestBody)
+    isLeaf = True
+
+    def __init__(self):
+        resource.Resource.__init__(self)
+        self.chunks = []
+        self.rendered = []
+        self.contents = []
+
+
+    def getBodyConsumer(self, request):
+        self.request = request
+        return self
+
+
+    def registerProducer(self, producer, streaming):
+        pass
+
+
+    def write(self, data):
+        self.chunks.append(data)
+
+
+    def unregisterProducer(self):
+        pass
+
+
+    def render_POST(self, request):
+        self.rendered.append(request)
+        self.contents.append(request.content.read())
+        return ''.join(self.chunks)
+
+
+
+class StreamingRequestBodyTests(unittest.TestCase):
+    """
+    Tests for L{server.Site.streamRequestBodies} and
+    L{iweb.IStreamingRequestBody}.
+    """
+    def setUp(self):
+        self.root = resource.Resource()
+        self.upload = StreamingResource()
+        self.root.putChild('upload', self.upload)
+        self.site = server.Site(self.root)
+        self.lookups = []
+        original = self.site.getResourceFor
+        def getResourceFor(request):
+            self.lookups.append(request)
+            return original(request)
+        self.site.getResourceFor = getResourceFor
+
+
+    def post(self, body):
+        """
+        Send a POST request for I{/upload} with the given body to a new
+        channel of the site, and return its transport.
+        """
+        channel = self.site.buildProtocol(None)
+        transport = StringTransport()
+        channel.makeConnection(transport)
+        channel.dataReceived(
+            "POST /upload HTTP/1.0\r\n"
+            "Content-Length: %d\r\n"
+            "\r\n" % (len(body),))
+        channel.dataReceived(body)
+        channel.connectionLost(None)
+        return transport
+
+
+    def test_streamRequestBodies(self):
+        """
+        When the site streams request bodies, a resource providing
+        L{iweb.IStreamingRequestBody} is found once, before the body
+        arrives, and the body is written to the consumer it returns.
+        """
+        self.site.streamRequestBodies = True
+        transport = self.post('some data')
+        self.assertEqual(self.upload.chunks, ['some data'])
+        [request] = self.lookups
+        self.assertEqual(self.upload.rendered, [request])
+        self.assertIdentical(self.upload.request, request)
+        self.assertEqual(self.upload.contents, [''])
+        self.assertTrue(transport.value().endswith('\r\n\r\nsome data'))
+
+
+    def test_bufferedByDefault(self):
+        """
+        Sites do not stream request bodies unless asked to, so the body is
+        buffered in the request's C{content} as usual.
+        """
+        self.post('some data')
+        self.assertEqual(self.upload.chunks, [])
+        self.assertEqual(self.upload.contents, ['some data'])
+
+
+
+class TextResource(resource.Resource):
+    """
+    A resource responding with some text, either at once or written in
+    several parts.
+    """
+    isLeaf = True
+
+    def __init__(self, text, parts=1, contentType='text/plain'):
+        resource.Resource.__init__(self)
+        self.text = text
+        self.parts = parts
+        self.contentType = contentType
+
+
+    def render_GET(self, request):
+        request.setHeader('content-type', self.contentType)
+        if self.parts == 1:
+            return self.text
+        size = len(self.text) // self.parts + 1
+        for i in range(0, len(self.text), size):
+            request.write(self.text[i:i + size])
+        request.finish()
+        return server.NOT_DONE_YET
+
+
+
+class GzipEncoderTests(unittest.TestCase):
+    """
+    Tests for L{server.GzipEncoderFactory} used with
+    L{resource.EncodingResourceWrapper}.
+    """
+    text = 'The quick brown fox jumps over the lazy dog.\n' * 100
+
+    def setUp(self):
+        self.factory = server.GzipEncoderFactory()
+        self.resource = TextResource(self.text)
+
+
+    def get(self, acceptEncoding=None, version='HTTP/1.0', method='GET'):
+        """
+        Request the wrapped C{self.resource} from a site, and return the
+        response headers as a C{dict} and the body.
+        """
+        site = server.Site(resource.EncodingResourceWrapper(
+            self.resource, [self.factory]))
+        channel = site.buildProtocol(None)
+        transport = StringTransport()
+        channel.makeConnection(transport)
+        request = "%s / %s\r\n" % (method, version)
+        if acceptEncoding is not None:
+            request += "Accept-Encoding: %s\r\n" % (acceptEncoding,)
+        channel.dataReceived(request + "\r\n")
+        channel.connectionLost(None)
+        head, body = transport.value().split('\r\n\r\n', 1)
+        headers = {}
+        for line in head.split('\r\n')[1:]:
+            name, value = line.split(': ', 1)
+            headers[name.lower()] = value
+        return headers, body
+
+
+    def test_compressed(self):
+        """
+        A response returned at once is compressed with gzip when the client
+        accepts it, and given the compressed length.
+        """
+        headers, body = self.get('gzip, deflate')
+        self.assertEqual(headers['content-encoding'], 'gzip')
+        self.assertEqual(headers['vary'], 'Accept-Encoding')
+        self.assertEqual(headers['content-length'], str(len(body)))
+        self.assertEqual(zlib.decompress(body, 16 + zlib.MAX_WBITS), self.text)
+
+
+    def test_streamed(self):
+        """
+        A response written in several parts is compressed as it is written,
+        and sent with chunked transfer encoding to HTTP/1.1 clients.
+        """
+        self.resource.parts = 5
+        headers, body = self.get('gzip', 'HTTP/1.1')
+        self.assertEqual(headers['content-encoding'], 'gzip')
+        self.assertEqual(headers['transfer-encoding'], 'chunked')
+        self.assertNotIn('content-length', headers)
+        chunks = []
+        decoder = http._ChunkedTransferDecoder(chunks.append, lambda rest: None)
+        decoder.dataReceived(body)
+        self.assertEqual(
+            zlib.decompress(''.join(chunks), 16 + zlib.MAX_WBITS), self.text)
+
+
+    def test_notAccepted(self):
+        """
+        Responses to clients which do not accept gzip are not compressed.
+        """
+        for acceptEncoding in None, 'deflate', 'gzip;q=0', 'identity':
+            headers, body = self.get(acceptEncoding)
+            self.assertNotIn('content-encoding', headers)
+            self.assertEqual(body, self.text)
+
+
+    def test_acceptedByWildcard(self):
+        """
+        C{*} in I{Accept-Encoding} accepts gzip, unless gzip is refused
+        explicitly.
+        """
+        headers, body = self.get('*')
+        self.assertEqual(headers['content-encoding'], 'gzip')
+        headers, body = self.get('*, gzip;q=0')
+        self.assertNotIn('content-encoding', headers)
+
+
+    def test_minimumSize(self):
+        """
+        Responses shorter than C{minimumSize} are not compressed.
+        """
+        self.factory.minimumSize = len(self.text) + 1
+        headers, body = self.get('gzip')
+        self.assertNotIn('content-encoding', headers)
+        self.assertEqual(body, self.text)
+
+
+    def test_contentType(self):
+        """
+        Responses whose content type is not in C{compressibleTypes} are not
+        compressed.
+        """
+        self.resource.contentType = 'image/png'
+        headers, body = self.get('gzip')
+        self.assertNotIn('content-encoding', headers)
+        self.assertEqual(body, self.text)
+
+
+    def test_head(self):
+        """
+        Responses to I{HEAD} requests are not compressed, so they keep the
+        length of the uncompressed body.
+        """
+        headers, body = self.get('gzip', method='HEAD')
+        self.assertNotIn('content-encoding', headers)
+        self.assertEqual(headers['content-length'], str(len(self.text)))
+        self.assertEqual(body, '')
+
+
+
 class RootResource(resource.Resource):
     isLeaf=0
     def getChildWithDefault(self, name, request):